@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Author: Filip Stefanak <f.stefanak@rare-technologies.com>
+# Copyright (C) 2017 Rare Technologies
+#
+# This code is distributed under the terms and conditions
+# from the MIT License (MIT).
+
+"""
+Measure the throughput of CountMinSketch.update_buffer depending on the window of the batch update engine.
+
+The keys of a window are hashed and their cells prefetched before any of them is updated, so that the cache misses
+of different keys overlap. The effect is visible on tables much larger than the L3 cache of the CPU:
+
+    python benchmarks/bench_update_window.py --size-mb 1024 --keys 2000000
+"""
+
+import argparse
+import random
+import time
+from array import array
+
+from bounter import CountMinSketch
+
+WINDOWS = [1, 2, 4, 8, 16, 32, 64, 128]
+
+
+def make_keys(count, distinct):
+    """Random keys in the layout of an Arrow string array"""
+    rnd = random.Random(42)
+    encoded = [str(rnd.randrange(distinct)).encode('utf-8') for _ in range(count)]
+    offsets = array('q', [0])
+    for key in encoded:
+        offsets.append(offsets[-1] + len(key))
+    return b''.join(encoded), offsets
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=int, default=1024, help="size of the table in MB")
+    parser.add_argument('--keys', type=int, default=2000000, help="number of keys counted per measurement")
+    parser.add_argument('--log-counting', type=int, default=None, choices=[None, 8, 1024])
+    parser.add_argument('--repeat', type=int, default=3, help="best of this many runs is reported")
+    args = parser.parse_args()
+
+    data, offsets = make_keys(args.keys, args.keys)
+    cms = CountMinSketch(args.size_mb, log_counting=args.log_counting)
+    # touch the whole table, so that page faults are not measured
+    cms.update_buffer(data, offsets)
+
+    print("table: %d MB, width %d, depth %d, %d keys" % (cms.size() // 2 ** 20, cms.width, cms.depth, args.keys))
+    print("%8s %14s %8s" % ("window", "keys/s", "speedup"))
+    baseline = None
+    for window in WINDOWS:
+        best = None
+        for _ in range(args.repeat):
+            start = time.time()
+            cms.update_buffer(data, offsets, window=window)
+            elapsed = time.time() - start
+            best = elapsed if best is None else min(best, elapsed)
+        rate = args.keys / best
+        baseline = baseline or rate
+        print("%8d %14.0f %7.2fx" % (window, rate, rate / baseline))
+
+
+if __name__ == '__main__':
+    main()
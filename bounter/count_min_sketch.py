@@ -8,6 +8,9 @@
 # from the MIT License (MIT).
 
 import enum
+import mmap
+import struct
+
 import bounter_cmsc as cmsc
 
 
@@ -16,6 +19,42 @@ class CellSize(enum.Enum):
     BITS_64 = 64
 
 
+class HashMode(enum.Enum):
+    PER_ROW = 0
+    DOUBLE = 1
+    WIDE = 2
+
+
+class Layout(enum.Enum):
+    ROWS = 0
+    BLOCKED = 1
+
+
+# File of a CountMinSketch created by `CountMinSketch.create`: a header of FILE_HEADER_SIZE bytes describing the
+# structure, followed by the storage of the table: the total (int64) in the first cache line, the rows and the
+# HLL registers. All values are in native byte order.
+FILE_MAGIC = b'BOUNTCMS'
+FILE_VERSION = 2
+FILE_HEADER = struct.Struct('<8sIQIHHBB')  # magic, version, width, depth, cell size bits, log_counting, hash mode, layout
+FILE_HEADER_V1 = struct.Struct('<8sIIIHHBB')  # the same with a 32-bit width
+FILE_HEADER_SIZE = 4096
+FILE_MODES = {'r': mmap.ACCESS_READ, 'r+': mmap.ACCESS_WRITE, 'c': mmap.ACCESS_COPY}
+STORAGE_OVERHEAD = 64 + 2 ** 16  # total and HLL registers
+BLOCK_BYTES = 64  # the blocked layout keeps all cells of a key in a single cache line
+
+# Snapshot of a CountMinSketch written by `save`: a header describing the structure, followed by the table with
+# the HLL registers encoded as runs of zero and literal bytes (possibly compressed), and the heavy hitters,
+# each a key length (uint32) and count (int64) followed by the UTF-8 key. All values are little-endian
+# except for the cells and registers, which are in native byte order.
+SNAPSHOT_MAGIC = b'BOUNTSNP'
+SNAPSHOT_VERSION = 1
+# magic, version, width, depth, cell size bits, log_counting, hash mode, layout, epochs, top_k, compression,
+# total, length of the encoded table, number of heavy hitters
+SNAPSHOT_HEADER = struct.Struct('<8sIQIHHBBIIBqQI')
+SNAPSHOT_ENTRY = struct.Struct('<Iq')
+SNAPSHOT_COMPRESSION = {None: 0, 'zlib': 1, 'lzma': 2}
+
+
 class CountMinSketch(object):
     """
     Data structure used to estimate frequencies of elements in massive data sets with fixed memory footprint.
@@ -60,6 +99,12 @@ class CountMinSketch(object):
         depth=None,
         log_counting=None,
         cell_size=CellSize.BITS_32,
+        hash_mode=HashMode.PER_ROW,
+        layout=Layout.ROWS,
+        seed=None,
+        concurrent=False,
+        top_k=0,
+        epochs=1,
     ):
         """
         Initialize the Count-Min Sketch structure with the given parameters
@@ -81,51 +126,113 @@ class CountMinSketch(object):
                 - 1024: 2B, value approximation error ~2% for values larger than 2048
                 - 8: 1B, value approximation error ~30% for values larger than 16
             cell_size (CellSize): Size of the cells when `log_counting` is None.
+            hash_mode (HashMode): How the bucket of a key is selected in each row:
+                - PER_ROW (default): each row hashes the key separately with its own seed
+                - DOUBLE: the key is hashed only once and the buckets of all rows are derived from that
+                  hash (double hashing), which is several times faster for deep tables
+                - WIDE: like DOUBLE, but the buckets are derived from 64 bits of the hash and so are the
+                  registers of the cardinality estimator. Required for widths above 2^32, and keeps `cardinality`
+                  accurate beyond billions of distinct keys, where 32-bit hashes start to collide.
+            layout (Layout): Memory layout of the table:
+                - ROWS (default): each row is a separate array of `width` cells
+                - BLOCKED: the table is split into 64-byte blocks and all `depth` cells of a key are distinct
+                  cells of a single block selected by one hash, so an update touches a single cache line.
+                  This makes very large tables much faster at the cost of slightly higher collision bias,
+                  which grows as the depth approaches the cells of a block: the depth can not exceed them
+                  (16 cells of 32 bits) and defaults to at most half of them.
+                  The blocked layout always hashes the key once and ignores `hash_mode` (except for WIDE).
+            seed (int): Seed of the random number generator used by log counting to decide increments and merges.
+                Sketches with the same seed updated in the same order hold the same values. Random by default.
+            concurrent (bool): Update the table with atomic operations, so that several threads can increment
+                the sketch at once (all of them release the GIL while counting, and free-threaded Python builds
+                run them in parallel). Slightly slower for a single thread. Merging or unpickling into the sketch
+                must still not overlap with other updates.
+            top_k (int): Number of heavy hitters to track, see `most_common`. Every increment then offers the key
+                with its new estimate to a bounded min-heap of candidates, which keeps a copy of each of its keys.
+                Not tracked by default.
+            epochs (int): Number of epochs kept in a ring, for frequencies over a sliding window of recent epochs.
+                Each epoch has its own table of `width` x `depth` cells (`size_mb` applies to a single epoch).
+                Increments go to the current epoch, `advance` starts a new one in place of the oldest, and queries
+                sum the key's cells over all epochs (or over the last few, see `get_recent`) with a single hash
+                computation. `total` and `cardinality` cover everything counted since the sketch was created.
+                Several epochs can not be combined with `top_k`.
         """
 
-        cell_bytes = CountMinSketch.cell_size(cell_size, log_counting)
-        self.cell_size_v = cell_bytes
+        self.cell_size_v = CountMinSketch.cell_size(cell_size, log_counting)
+        self.width, self.depth = CountMinSketch._dimensions(size_mb, width, depth, self.cell_size_v, layout)
+        self.epochs = epochs
+        cms_type = CountMinSketch._cms_type(log_counting, cell_size, hash_mode, layout)
+        self.cms = cms_type(width=self.width, depth=self.depth, hash_mode=hash_mode.value, layout=layout.value,
+                            seed=seed, concurrent=concurrent, top_k=top_k, epochs=epochs)
+
+        # optimize calls by directly binding to C implementation
+        self.increment = self.cms.increment
+
+    _file = None
+    _mmap = None
+    _storage = None
+    _mode = None
+    _shared = None
+    epochs = 1
 
+    @staticmethod
+    def _dimensions(size_mb, width, depth, cell_bytes, layout=Layout.ROWS):
         if size_mb is None or not isinstance(size_mb, int):
             raise ValueError(
                 "size_mb must be an integer representing the maximum size of the structure in MB"
             )
 
+        # the cells of a key in the blocked layout take at most half of a block by default
+        max_depth = BLOCK_BYTES // (2 * cell_bytes) if layout == Layout.BLOCKED else None
         if width is None and depth is None:
-            self.width = 1 << (size_mb * (2**20) // (cell_bytes * 8 * 2)).bit_length()
-            self.depth = (size_mb * (2**20)) // (self.width * cell_bytes)
+            width = 1 << (size_mb * (2**20) // (cell_bytes * 8 * 2)).bit_length()
+            depth = (size_mb * (2**20)) // (width * cell_bytes)
+            if max_depth and depth > max_depth:
+                depth = max_depth
+                width = 1 << (((size_mb * (2**20)) // (depth * cell_bytes)).bit_length() - 1)
         elif width is None:
-            self.depth = depth
             avail_width = (size_mb * (2**20)) // (depth * cell_bytes)
-            self.width = 1 << (avail_width.bit_length() - 1)
-            if not self.width:
+            width = 1 << (avail_width.bit_length() - 1)
+            if not width:
                 raise ValueError(
                     "Requested depth is too large for maximum memory size."
                 )
         elif depth is None:
             if width != 1 << (width.bit_length() - 1):
                 raise ValueError("Requested width must be a power of 2.")
-            self.width = width
-            self.depth = (size_mb * (2**20)) // (width * cell_bytes)
-            if not self.depth:
+            depth = (size_mb * (2**20)) // (width * cell_bytes)
+            if not depth:
                 raise ValueError(
                     "Requested width is too large for maximum memory size."
                 )
+            if max_depth:
+                depth = min(depth, max_depth)
         else:
             if width != 1 << (width.bit_length() - 1):
                 raise ValueError("Requested width must be a power of 2.")
-            self.width = width
-            self.depth = depth
+        return width, depth
+
+    @staticmethod
+    def _cms_type(log_counting, cell_size, hash_mode, layout):
+        if not isinstance(hash_mode, HashMode):
+            raise ValueError(
+                "Unsupported parameter hash_mode=%s. Use HashMode.PER_ROW, HashMode.DOUBLE or HashMode.WIDE."
+                % (hash_mode)
+            )
+        if not isinstance(layout, Layout):
+            raise ValueError(
+                "Unsupported parameter layout=%s. Use Layout.ROWS or Layout.BLOCKED." % (layout)
+            )
 
         if log_counting == 8:
-            self.cms = cmsc.CMS_Log8(width=self.width, depth=self.depth)
+            return cmsc.CMS_Log8
         elif log_counting == 1024:
-            self.cms = cmsc.CMS_Log1024(width=self.width, depth=self.depth)
+            return cmsc.CMS_Log1024
         elif log_counting is None:
             if cell_size == CellSize.BITS_32:
-                self.cms = cmsc.CMS_Conservative(width=self.width, depth=self.depth)
+                return cmsc.CMS_Conservative
             elif cell_size == CellSize.BITS_64:
-                self.cms = cmsc.CMS64_Conservative(width=self.width, depth=self.depth)
+                return cmsc.CMS64_Conservative
             else:
                 raise ValueError(
                     "Unsupported parameter cell_size=%s. Use CellSize.BITS_32 or CellSize.BITS_64."
@@ -137,8 +244,337 @@ class CountMinSketch(object):
                 % (log_counting)
             )
 
-        # optimize calls by directly binding to C implementation
+    @classmethod
+    def create(
+        cls,
+        path,
+        size_mb=64,
+        width=None,
+        depth=None,
+        log_counting=None,
+        cell_size=CellSize.BITS_32,
+        hash_mode=HashMode.PER_ROW,
+        layout=Layout.ROWS,
+        seed=None,
+        concurrent=False,
+    ):
+        """
+        Create an empty Count-Min Sketch stored in a memory-mapped file, which is overwritten if it exists.
+        The file is created sparse, so its pages are only allocated once they are updated.
+        The parameters are the same as for the constructor.
+
+        Returns the sketch opened in the 'r+' mode, see `open`.
+        """
+        header, length = cls._header(size_mb, width, depth, log_counting, cell_size, hash_mode, layout)
+        with open(path, 'wb') as f:
+            f.write(header)
+            f.truncate(length)
+        return cls.open(path, 'r+', seed=seed, concurrent=concurrent)
+
+    @classmethod
+    def _header(cls, size_mb, width, depth, log_counting, cell_size, hash_mode, layout):
+        """
+        Return the header describing a sketch with the given parameters and the length of the header and its storage.
+        """
+        cell_bytes = cls.cell_size(cell_size, log_counting)
+        width, depth = cls._dimensions(size_mb, width, depth, cell_bytes, layout)
+        cls._cms_type(log_counting, cell_size, hash_mode, layout)
+
+        header = FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION, width, depth, cell_bytes * 8, log_counting or 0,
+                                  hash_mode.value, layout.value)
+        return header, FILE_HEADER_SIZE + width * depth * cell_bytes + STORAGE_OVERHEAD
+
+    @classmethod
+    def _parse_header(cls, header, source):
+        """
+        Return the dimensions, cell size in bits, parameters and the C type of the sketch described by a header.
+        """
+        if len(header) < FILE_HEADER.size or header[:len(FILE_MAGIC)] != FILE_MAGIC:
+            raise ValueError("%s is not a CountMinSketch file." % (source))
+        _, version = struct.unpack_from('<8sI', header)
+        if version == FILE_VERSION:
+            fields = FILE_HEADER.unpack_from(header)
+        elif version == 1:
+            fields = FILE_HEADER_V1.unpack_from(header)
+        else:
+            raise ValueError("Unsupported CountMinSketch file version %d." % (version))
+        _, _, width, depth, cell_bits, log_counting, hash_mode, layout = fields
+
+        cell_size = CellSize(cell_bits) if not log_counting else CellSize.BITS_32
+        cms_type = cls._cms_type(log_counting or None, cell_size, HashMode(hash_mode), Layout(layout))
+        return width, depth, cell_bits, hash_mode, layout, cms_type
+
+    @classmethod
+    def open(cls, path, mode='r', seed=None, concurrent=False):
+        """
+        Open a Count-Min Sketch stored in a file by `create`. Opening takes constant time, the table is mapped
+        into memory and its pages are loaded lazily once they are accessed.
+
+        Args:
+            path (str): Path to the file.
+            mode (str): One of
+                - 'r' (default): read-only, updating the sketch raises TypeError
+                - 'r+': updates are written to the file, call `flush` to make sure they reach the disk
+                - 'c': copy-on-write, updates are only kept in memory and never written to the file
+            seed (int): Seed of the random number generator of log counting, see the constructor.
+            concurrent (bool): Update the table with atomic operations, see the constructor.
+
+        Close the sketch with `close` or use it as a context manager.
+        """
+        if mode not in FILE_MODES:
+            raise ValueError("Unsupported parameter mode=%s. Use 'r', 'r+' or 'c'." % (mode))
+
+        f = open(path, 'r+b' if mode == 'r+' else 'rb')
+        try:
+            header = f.read(FILE_HEADER.size)
+            width, depth, cell_bits, hash_mode, layout, cms_type = cls._parse_header(header, path)
+            file_map = mmap.mmap(f.fileno(), 0, access=FILE_MODES[mode])
+        except Exception:
+            f.close()
+            raise
+
+        self = cls.__new__(cls)
+        self._file = f
+        self._mode = mode
+        self._mmap = file_map
+        self._storage = memoryview(file_map)[FILE_HEADER_SIZE:]
+        self.width, self.depth, self.cell_size_v = width, depth, cell_bits // 8
+        try:
+            self.cms = cms_type(width=width, depth=depth, hash_mode=hash_mode, layout=layout, storage=self._storage,
+                                seed=seed, concurrent=concurrent)
+        except Exception:
+            self.close()
+            raise
+        self.increment = self.cms.increment
+        return self
+
+    @classmethod
+    def create_shared(
+        cls,
+        name=None,
+        size_mb=64,
+        width=None,
+        depth=None,
+        log_counting=None,
+        cell_size=CellSize.BITS_32,
+        hash_mode=HashMode.PER_ROW,
+        layout=Layout.ROWS,
+        seed=None,
+    ):
+        """
+        Create an empty Count-Min Sketch in a new `multiprocessing.shared_memory` segment (Python 3.8+).
+        Other processes attach the same table by its name with `attach`, or simply receive the sketch pickled
+        (for example as an argument of a `multiprocessing.Pool` task), which pickles only the name of the segment.
+        The table is updated with atomic operations (see `concurrent` in the constructor), so all processes
+        can count into it at once and no merge is needed at the end.
+
+        Args:
+            name (str): Name of the segment, a unique name is chosen if None.
+            Other parameters are the same as for the constructor.
+
+        Close the sketch with `close` in every process. The creator must also call `unlink` to free the segment
+        once all processes are done with it.
+        """
+        from multiprocessing import shared_memory
+
+        header, length = cls._header(size_mb, width, depth, log_counting, cell_size, hash_mode, layout)
+        segment = shared_memory.SharedMemory(name=name, create=True, size=length)
+        try:
+            segment.buf[:len(header)] = header
+            return cls._attach_segment(segment, seed)
+        except Exception:
+            segment.close()
+            segment.unlink()
+            raise
+
+    @classmethod
+    def attach(cls, name, seed=None):
+        """
+        Attach a Count-Min Sketch created by `create_shared` in another process, by the name of its segment.
+
+        Args:
+            name (str): Name of the shared memory segment, see `shared_name`.
+            seed (int): Seed of the random number generator of log counting, see the constructor.
+        """
+        from multiprocessing import shared_memory
+
+        try:
+            # the segment belongs to its creator, it must not be unlinked when this process exits
+            segment = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:  # Python < 3.13
+            segment = shared_memory.SharedMemory(name=name)
+        try:
+            return cls._attach_segment(segment, seed)
+        except Exception:
+            segment.close()
+            raise
+
+    @classmethod
+    def _attach_segment(cls, segment, seed):
+        width, depth, cell_bits, hash_mode, layout, cms_type = cls._parse_header(bytes(segment.buf[:FILE_HEADER.size]),
+                                                                                 segment.name)
+        self = cls.__new__(cls)
+        self.width, self.depth, self.cell_size_v = width, depth, cell_bits // 8
+        self._storage = segment.buf[FILE_HEADER_SIZE:]
+        try:
+            self.cms = cms_type(width=width, depth=depth, hash_mode=hash_mode, layout=layout, storage=self._storage,
+                                seed=seed, concurrent=True)
+        except Exception:
+            self._storage.release()
+            raise
         self.increment = self.cms.increment
+        # set last, so that the table releases the segment before it is closed on garbage collection
+        self._shared = segment
+        return self
+
+    @property
+    def shared_name(self):
+        """
+        Name of the shared memory segment of a sketch created by `create_shared` or `attach`, None otherwise.
+        """
+        return self._shared.name if self._shared is not None else None
+
+    def unlink(self):
+        """
+        Free the shared memory segment of a sketch created by `create_shared`. The memory is released once all
+        processes close the sketch, and the segment can no longer be attached.
+        """
+        if self._shared is None:
+            raise ValueError("Only a sketch in shared memory can be unlinked.")
+        self._shared.unlink()
+
+    def flush(self):
+        """
+        Write the changes of a sketch opened in the 'r+' mode to its file. Does nothing for other sketches.
+        """
+        if self._mode == 'r+':
+            self._mmap.flush()
+
+    def close(self):
+        """
+        Flush and close the file of a sketch opened by `open` or `create`, or detach a sketch in shared memory.
+        The sketch can not be used afterwards. Does nothing for sketches kept in memory.
+        """
+        if self._shared is not None:
+            self.cms = self.increment = None
+            self._storage.release()
+            self._shared.close()
+            self._storage = self._shared = None
+            return
+        if self._mmap is None:
+            return
+        self.flush()
+        # the table must release the storage before it is unmapped
+        self.cms = self.increment = None
+        self._storage.release()
+        self._mmap.close()
+        self._file.close()
+        self._file = self._mmap = self._storage = self._mode = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def save(self, path, compression='zlib'):
+        """
+        Save a compact snapshot of the sketch to a file, to be loaded by `load`.
+        Only the non-zero parts of the table are written, so the snapshot of a sparsely filled sketch
+        is much smaller than its table (or its pickle).
+
+        Args:
+            path (str): Path to the file, which is overwritten if it exists.
+            compression (str): Compression of the encoded table by the standard library:
+                - 'zlib' (default): fast, a good fit for most tables
+                - 'lzma': smaller and several times slower
+                - None: uncompressed, the table is then loaded directly from a memory-mapped file
+        """
+        if compression not in SNAPSHOT_COMPRESSION:
+            raise ValueError("Unsupported parameter compression=%s. Use 'zlib', 'lzma' or None." % (compression,))
+
+        encoded = self.cms.encode_sparse()
+        if compression == 'zlib':
+            import zlib
+            encoded = zlib.compress(encoded)
+        elif compression == 'lzma':
+            import lzma
+            encoded = lzma.compress(encoded)
+        top = self.cms.most_common(-1) if self.cms.top_k else []
+        log_counting = {1: 8, 2: 1024}.get(self.cell_size_v, 0)
+
+        with open(path, 'wb') as f:
+            f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, self.width, self.depth, self.cell_size_v * 8,
+                                         log_counting, self.cms.hash_mode, self.cms.layout, self.epochs,
+                                         self.cms.top_k, SNAPSHOT_COMPRESSION[compression], self.cms.total(),
+                                         len(encoded), len(top)))
+            f.write(encoded)
+            for key, count in top:
+                if not isinstance(key, bytes):
+                    key = key.encode('utf-8')
+                f.write(SNAPSHOT_ENTRY.pack(len(key), count))
+                f.write(key)
+
+    @classmethod
+    def load(cls, path, seed=None, concurrent=False):
+        """
+        Load a sketch from a snapshot written by `save`. The table is decoded directly into the rows
+        of the new sketch, which is kept in memory.
+
+        Args:
+            path (str): Path to the file.
+            seed (int): Seed of the random number generator of log counting, see the constructor.
+            concurrent (bool): Update the table with atomic operations, see the constructor.
+        """
+        with open(path, 'rb') as f:
+            header = f.read(SNAPSHOT_HEADER.size)
+            if len(header) < SNAPSHOT_HEADER.size or header[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+                raise ValueError("%s is not a CountMinSketch snapshot." % (path))
+            (_, version, width, depth, cell_bits, log_counting, hash_mode, layout, epochs, top_k, compression,
+             total, length, top_count) = SNAPSHOT_HEADER.unpack(header)
+            if version != SNAPSHOT_VERSION:
+                raise ValueError("Unsupported CountMinSketch snapshot version %d." % (version))
+            if compression not in SNAPSHOT_COMPRESSION.values():
+                raise ValueError("Unsupported compression of the CountMinSketch snapshot %s." % (path))
+
+            self = cls.__new__(cls)
+            CountMinSketch.__init__(self, width=width, depth=depth, log_counting=log_counting or None,
+                                    cell_size=CellSize(cell_bits) if not log_counting else CellSize.BITS_32,
+                                    hash_mode=HashMode(hash_mode), layout=Layout(layout), seed=seed,
+                                    concurrent=concurrent, top_k=top_k, epochs=epochs)
+
+            file_map = None
+            if compression == SNAPSHOT_COMPRESSION[None] and length:
+                # decode the table straight from the page cache
+                file_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                encoded = memoryview(file_map)[SNAPSHOT_HEADER.size:SNAPSHOT_HEADER.size + length]
+                f.seek(SNAPSHOT_HEADER.size + length)
+            else:
+                encoded = f.read(length)
+            try:
+                if len(encoded) < length:
+                    raise ValueError("CountMinSketch snapshot %s is truncated." % (path))
+                if compression == SNAPSHOT_COMPRESSION['zlib']:
+                    import zlib
+                    encoded = zlib.decompress(encoded)
+                elif compression == SNAPSHOT_COMPRESSION['lzma']:
+                    import lzma
+                    encoded = lzma.decompress(encoded)
+
+                top = []
+                for _ in range(top_count):
+                    entry = f.read(SNAPSHOT_ENTRY.size)
+                    if len(entry) < SNAPSHOT_ENTRY.size:
+                        raise ValueError("CountMinSketch snapshot %s is truncated." % (path))
+                    key_length, count = SNAPSHOT_ENTRY.unpack(entry)
+                    top.append((f.read(key_length), count))
+
+                self.cms.decode_sparse(encoded, total, top)
+            finally:
+                if file_map is not None:
+                    encoded.release()
+                    file_map.close()
+        return self
 
     @staticmethod
     def cell_size(cell_size, log_counting=None):
@@ -166,6 +602,35 @@ class CountMinSketch(object):
     def __getitem__(self, key):
         return self.cms.get(key)
 
+    def get_recent(self, key, epochs=None):
+        """
+        Return an estimate for the frequency of a key over the last `epochs` epochs, including the current one
+        (all epochs of the ring by default). See `epochs` in the constructor.
+        """
+        return self.cms.get(key, epochs or 0)
+
+    def advance(self):
+        """
+        Start a new epoch of the ring in place of the oldest one, whose counters are cleared and reused.
+        Keys counted into the oldest epoch no longer contribute to the estimates.
+        Raises ValueError if the sketch was created with a single epoch.
+        """
+        self.cms.advance()
+
+    def get_many(self, keys, offsets=None, epochs=None):
+        """
+        Return estimates for the frequencies of a batch of keys as an `array.array` of 64-bit integers.
+
+        The keys are looked up without holding the GIL. Use `numpy.frombuffer(result, dtype=numpy.int64)`
+        to view the result as a NumPy array without copying.
+
+        Args:
+            keys: A list or tuple of keys, or any batch of keys accepted by `update_buffer`.
+            offsets: Offsets delimiting keys in the `keys` buffer, see `update_buffer`.
+            epochs (int): Estimate frequencies over the last `epochs` epochs only, see `get_recent`.
+        """
+        return self.cms.get_many(keys, offsets, epochs or 0)
+
     def __contains__(self, item):
         return self.cms.get(item)
 
@@ -184,28 +649,156 @@ class CountMinSketch(object):
         """
         return self.cms.total()
 
-    def merge(self, other):
+    def merge(self, other, threads=1, saturate=False):
         """
         Merge another Count-min sketch structure into this one. The other structure must be initialized
-        with the same width, depth and algorithm, and remains unaffected by this operation.
+        with the same width, depth, algorithm, hash mode and layout, and remains unaffected by this operation.
 
         Please note that merging two halves is always less accurate than counting the whole set with a single counter,
         because the merging algorithm can not leverage the conservative update optimization.
+
+        Args:
+            other (CountMinSketch): The structure to merge.
+            threads (int): Number of native threads sharing the work, each of them merges a part of the table.
+            saturate (bool): Clamp the sums of 32-bit and 64-bit cells at their largest value instead of letting them
+                wrap around. Cells of log counting algorithms never overflow.
         """
-        self.cms.merge(other.cms)
+        self.cms.merge(other.cms, threads, saturate)
 
-    def update(self, iterable):
+    def merge_many(self, sketches, threads=1, saturate=False):
+        """
+        Merge several Count-min sketch structures into this one in a single pass over the memory.
+        This is faster than merging them one by one, and more accurate with log counting, because the sum of all
+        values is rounded only once.
+
+        Args:
+            sketches (iterable of CountMinSketch): The structures to merge, see `merge` for their requirements.
+                This structure itself can not be one of them.
+            threads (int): Number of native threads sharing the work, each of them merges a part of the table.
+            saturate (bool): Clamp the sums of cells at their largest value, see `merge`.
+        """
+        tables = []
+        for other in sketches:
+            if not isinstance(other, CountMinSketch):
+                raise TypeError("Object to merge must be an instance of CountMinSketch.")
+            tables.append(other.cms)
+        self.cms.merge_many(tables, threads, saturate)
+
+    def update(self, iterable, threads=1):
+        """
+        Increment the counters of all elements of an iterable or a dictionary of counts, or merge another
+        Count-min sketch structure into this one using `threads` native threads (see `merge`).
+        """
         if isinstance(iterable, CountMinSketch):
-            self.merge(iterable)
+            self.merge(iterable, threads)
         else:
             self.cms.update(iterable)
 
+    def update_buffer(self, data, offsets=None, window=16):
+        """
+        Increment all keys of a batch stored in contiguous buffers, without creating a Python object per key.
+        The keys are counted without holding the GIL.
+
+        Args:
+            data: One of
+                - a buffer of UTF-8 encoded keys delimited by `offsets`
+                - a fixed-width string array whose keys are padded with zeros, such as a NumPy array of dtype `S`
+                  or `U`, or a two-dimensional array of bytes with one key per row
+                - a list or tuple of keys
+            offsets: Array of int32 or int64 offsets into `data` (Arrow string array layout),
+                key `i` spans `data[offsets[i]:offsets[i + 1]]`.
+            window: Number of keys hashed (and their cells prefetched) ahead of updating the table, in the range
+                1-1024. A larger window hides more memory latency of tables which do not fit in the CPU cache.
+        """
+        self.cms.update_buffer(data, offsets, window)
+
+    def increment_hashes(self, hashes, counts=None):
+        """
+        Increment keys given by 64-bit hashes computed elsewhere, e.g. by Spark or Arrow, without turning them back
+        into strings. The cells of every row and the cardinality estimator are derived from the supplied hash
+        (the hash is mixed and the rows use double hashing, regardless of `hash_mode`), and the whole array is
+        processed without holding the GIL.
+
+        Keys given by hashes are distinct from string keys: query them with `get_hashes`. Heavy hitters can not be
+        tracked for them.
+
+        Args:
+            hashes: One-dimensional array of 64-bit integers (signed or unsigned), such as `array.array('Q')`
+                or a NumPy `uint64` array.
+            counts: Optional array of 64-bit integers of the same length, the increment of each hash (1 by default).
+        """
+        self.cms.increment_hashes(hashes, counts)
+
+    def get_hashes(self, hashes, epochs=None):
+        """
+        Return estimates of the frequencies of keys given by 64-bit hashes (see `increment_hashes`),
+        as an `array.array` of 64-bit integers. With `epochs`, only the last `epochs` epochs are counted.
+        """
+        return self.cms.get_hashes(hashes, epochs or 0)
+
+    def update_ngrams(self, tokens, n, sep=" ", offsets=None):
+        """
+        Increment all n-grams of a sequence of tokens, each counted as the key `sep.join(tokens[i:i + n])`.
+        The n-grams are joined in a reused native buffer without creating a Python object per n-gram,
+        and counted without holding the GIL.
+
+        Args:
+            tokens: A list or tuple of unicode or bytes tokens, or any batch of keys accepted by `update_buffer`.
+            n (int): Number of consecutive tokens in an n-gram. Sequences shorter than `n` add nothing.
+            sep: Unicode or bytes separator placed between the tokens of an n-gram.
+            offsets: Offsets delimiting the tokens in a buffer `tokens`, see `update_buffer`.
+        """
+        self.cms.update_ngrams(tokens, n, sep, offsets)
+
+    def update_from_file(self, path_or_fd, tokenizer="whitespace", ngram=1, encoding="utf-8"):
+        """
+        Increment all tokens of a text file, read, tokenized and counted natively without holding the GIL.
+        The file is read in large blocks of complete lines. Gzip compressed files are decompressed transparently
+        if bounter was built with zlib (see `bounter_cmsc.ZLIB`).
+
+        Args:
+            path_or_fd: Path of the file, or a file descriptor (or an object with `fileno()`) read from its current
+                position. The descriptor stays open.
+            tokenizer (str): "whitespace" to count tokens separated by ASCII whitespace,
+                "line" to count every non-empty line as a single key.
+            ngram (int): Count n-grams of consecutive tokens of a line, joined by a single space,
+                instead of single tokens. Only supported with the "whitespace" tokenizer.
+            encoding (str): Encoding of the file. Keys are counted as the bytes they are stored in,
+                so only UTF-8 (or ASCII) is supported.
+        """
+        self.cms.update_from_file(path_or_fd, tokenizer, ngram, encoding)
+
+    def most_common(self, n=None):
+        """
+        Return the `n` heavy hitters with the highest estimated frequencies (all tracked ones by default),
+        as a list of (key, frequency) pairs ordered from the most common. Requires a sketch created with `top_k`.
+
+        Keys are tracked only once they are incremented, and their estimates are refreshed on every increment
+        and merge. A key which fell out of the candidates and came back later only has its current estimate,
+        so the list is exact only as long as the estimates are. Keys are returned as unicode strings, or as bytes
+        if they are not valid UTF-8.
+        """
+        return self.cms.most_common(-1 if n is None else n)
+
+    def count_nonzero(self):
+        """
+        Return the number of cells of the table with a non-zero value.
+        Together with the table dimensions, this shows how loaded the sketch is.
+        """
+        return self.cms.count_nonzero()
+
+    def count_saturated(self):
+        """
+        Return the number of cells of the table which reached the largest value they can hold.
+        """
+        return self.cms.count_saturated()
+
     def size(self):
         """
         Return current size of the Count-min Sketch table in bytes.
         Does *not* include additional constant overhead used by parameter variables and HLL table, totalling less than 65KB.
         """
-        return self.width * self.depth * self.cell_size_v
+        return self.width * self.depth * self.epochs * self.cell_size_v
 
     def quality(self):
         """
@@ -217,11 +810,19 @@ class CountMinSketch(object):
         """
         return float(self.cardinality()) / self.width
 
+    def __reduce_ex__(self, protocol):
+        if self._shared is not None:
+            # other processes attach the same table
+            return CountMinSketch.attach, (self._shared.name,)
+        return super(CountMinSketch, self).__reduce_ex__(protocol)
+
     def __getstate__(self):
-        return self.width, self.depth, self.cell_size_v, self.cms
+        return self.width, self.depth, self.cell_size_v, self.cms, self.epochs
 
     def __setstate__(self, state):
-        self.width, self.depth, self.cell_size_v, self.cms = state
+        self.width, self.depth, self.cell_size_v, self.cms = state[:4]
+        # sketches pickled before epochs were introduced have a single one
+        self.epochs = state[4] if len(state) > 4 else 1
         self.increment = self.cms.increment
 
 
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Author: Filip Stefanak <f.stefanak@rare-technologies.com>
+# Copyright (C) 2017 Rare Technologies
+#
+# This code is distributed under the terms and conditions
+# from the MIT License (MIT).
+
+import pickle
+import threading
+import unittest
+
+from bounter import CountMinSketch
+from bounter.count_min_sketch import CellSize, Layout
+
+
+class CountMinSketchConcurrentCommonTest(unittest.TestCase):
+    """
+    Functional tests for CountMinSketch updated by several threads at once
+    """
+
+    def __init__(self, methodName='runTest', log_counting=None, cell_size=CellSize.BITS_32):
+        self.log_counting = log_counting
+        self.cell_size = cell_size
+        super(CountMinSketchConcurrentCommonTest, self).__init__(methodName=methodName)
+
+    def new_cms(self, **kwargs):
+        return CountMinSketch(4, log_counting=self.log_counting, cell_size=self.cell_size, concurrent=True, **kwargs)
+
+    def run_threads(self, target, count=4):
+        threads = [threading.Thread(target=target) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def test_increment_and_get(self):
+        cms = self.new_cms()
+        cms.update(['foo', 'bar', 'foo'])
+        cms.increment('baz', 3)
+
+        self.assertEqual(cms['foo'], 2)
+        self.assertEqual(cms['bar'], 1)
+        self.assertEqual(cms['baz'], 3)
+        self.assertEqual(cms.total(), 6)
+        self.assertEqual(cms.cardinality(), 3)
+
+    def test_threads_increment(self):
+        cms = self.new_cms()
+
+        def work():
+            for _ in range(10):
+                for i in range(100):
+                    cms.increment(str(i))
+
+        self.run_threads(work)
+        self.assertEqual(cms.total(), 4000)
+        self.assertAlmostEqual(cms.cardinality(), 100, delta=2)
+        self.check_counts([cms[str(i)] for i in range(100)], 40)
+
+    def test_threads_update_buffer(self):
+        cms = self.new_cms()
+        keys = [str(i) for i in range(100)] * 10
+
+        def work():
+            for _ in range(10):
+                cms.update_buffer(keys, window=8)
+
+        self.run_threads(work)
+        self.assertEqual(cms.total(), 40000)
+        self.check_counts([cms[str(i)] for i in range(100)], 400)
+
+    def test_blocked_layout(self):
+        cms = self.new_cms(layout=Layout.BLOCKED)
+        for i in range(1000):
+            cms.increment(str(i), 1 + i % 5)
+
+        exact = 0
+        for i in range(1000):
+            expected = 1 + i % 5
+            self.assertGreaterEqual(cms[str(i)], expected - self.tolerance(expected))
+            exact += abs(cms[str(i)] - expected) <= self.tolerance(expected)
+        self.assertGreaterEqual(exact, 990)
+
+    def test_pickle_keeps_concurrent(self):
+        cms = self.new_cms()
+        cms.update(['foo', 'bar', 'foo'])
+
+        reloaded = pickle.loads(pickle.dumps(cms))
+        self.assertEqual(reloaded['foo'], 2)
+
+        def work():
+            for _ in range(100):
+                reloaded.increment('foo')
+
+        self.run_threads(work)
+        self.assertEqual(reloaded.total(), 403)
+
+    def tolerance(self, value):
+        return 0
+
+    def check_counts(self, counts, expected):
+        for count in counts:
+            self.assertAlmostEqual(count, expected, delta=self.tolerance(expected))
+
+
+class CountMinSketchConcurrentConservativeTest(CountMinSketchConcurrentCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchConcurrentConservativeTest, self).__init__(methodName=methodName, log_counting=None)
+
+    def test_same_as_sequential(self):
+        """
+        Test that the atomic update gives the same values as the plain one
+        """
+        cms = self.new_cms(layout=Layout.BLOCKED)
+        sequential = CountMinSketch(4, log_counting=self.log_counting, cell_size=self.cell_size, layout=Layout.BLOCKED)
+        for i in range(20000):
+            cms.increment(str(i % 7919), 1 + i % 3)
+            sequential.increment(str(i % 7919), 1 + i % 3)
+
+        for i in range(7919):
+            self.assertEqual(cms[str(i)], sequential[str(i)])
+
+
+class CountMinSketchConcurrent64Test(CountMinSketchConcurrentCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchConcurrent64Test, self).__init__(methodName=methodName, cell_size=CellSize.BITS_64)
+
+
+class CountMinSketchConcurrentLog1024Test(CountMinSketchConcurrentCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchConcurrentLog1024Test, self).__init__(methodName=methodName, log_counting=1024)
+
+    def tolerance(self, value):
+        return max(value // 10, 0)
+
+
+class CountMinSketchConcurrentLog8Test(CountMinSketchConcurrentCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchConcurrentLog8Test, self).__init__(methodName=methodName, log_counting=8)
+
+    def tolerance(self, value):
+        return value // 10
+
+    def check_counts(self, counts, expected):
+        # 8-bit log counting has a wide spread for single keys, their mean is accurate
+        self.assertAlmostEqual(sum(counts) / float(len(counts)), expected, delta=self.tolerance(expected))
+
+
+def load_tests(loader, tests, pattern):
+    test_cases = unittest.TestSuite()
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchConcurrentConservativeTest))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchConcurrent64Test))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchConcurrentLog1024Test))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchConcurrentLog8Test))
+    return test_cases
+
+
+if __name__ == '__main__':
+    unittest.main()
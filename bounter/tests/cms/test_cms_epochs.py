@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Author: Filip Stefanak <f.stefanak@rare-technologies.com>
+# Copyright (C) 2017 Rare Technologies
+#
+# This code is distributed under the terms and conditions
+# from the MIT License (MIT).
+
+import pickle
+import unittest
+
+from bounter import CountMinSketch
+from bounter.count_min_sketch import CellSize, Layout
+
+
+class CountMinSketchEpochsCommonTest(unittest.TestCase):
+    """
+    Functional tests for CountMinSketch with a ring of epochs
+    """
+
+    def __init__(self, methodName='runTest', log_counting=None, cell_size=CellSize.BITS_32):
+        self.log_counting = log_counting
+        self.cell_size = cell_size
+        super(CountMinSketchEpochsCommonTest, self).__init__(methodName=methodName)
+
+    def new_cms(self, epochs=3, **kwargs):
+        return CountMinSketch(1, log_counting=self.log_counting, cell_size=self.cell_size, epochs=epochs, **kwargs)
+
+    def setUp(self):
+        self.cms = self.new_cms()
+        # 3 epochs ago (dropped), 2 epochs ago, previous, current
+        for counts in ({'a': 8}, {'a': 1, 'b': 2}, {'a': 2}, {'a': 4, 'c': 1}):
+            self.cms.advance()
+            self.cms.update(counts)
+
+    def test_window(self):
+        self.assertEqual(self.cms['a'], 7)
+        self.assertEqual(self.cms['b'], 2)
+        self.assertEqual(self.cms['c'], 1)
+        self.assertEqual(self.cms['d'], 0)
+
+    def test_get_recent(self):
+        self.assertEqual(self.cms.get_recent('a', 1), 4)
+        self.assertEqual(self.cms.get_recent('a', 2), 6)
+        self.assertEqual(self.cms.get_recent('a', 3), 7)
+        self.assertEqual(self.cms.get_recent('a'), 7)
+        self.assertEqual(self.cms.get_recent('b', 2), 0)
+
+    def test_get_many(self):
+        self.assertEqual(list(self.cms.get_many(['a', 'b', 'c'])), [7, 2, 1])
+        self.assertEqual(list(self.cms.get_many(['a', 'b', 'c'], epochs=2)), [6, 0, 1])
+
+    def test_advance_clears_oldest(self):
+        self.cms.advance()
+        self.assertEqual(self.cms['a'], 6)
+        self.assertEqual(self.cms['b'], 0)
+        self.assertEqual(self.cms.get_recent('a', 1), 0)
+
+        for _ in range(3):
+            self.cms.advance()
+        self.assertEqual(self.cms['a'], 0)
+        self.assertEqual(self.cms.count_nonzero(), 0)
+
+    def test_total_since_creation(self):
+        self.assertEqual(self.cms.total(), 18)
+        self.assertEqual(self.cms.cardinality(), 3)
+
+    def test_size(self):
+        single = CountMinSketch(1, log_counting=self.log_counting, cell_size=self.cell_size)
+        self.assertEqual(self.cms.size(), 3 * single.size())
+
+    def test_blocked_layout(self):
+        cms = self.new_cms(layout=Layout.BLOCKED)
+        cms.update(['foo', 'foo', 'bar'])
+        cms.advance()
+        cms.increment('foo')
+        self.assertEqual(cms['foo'], 3)
+        self.assertEqual(cms.get_recent('foo', 1), 1)
+        self.assertEqual(cms['bar'], 1)
+
+    def test_merge_aligns_epochs(self):
+        other = self.new_cms()
+        other.increment('a', 10)
+        other.advance()
+        other.increment('a', 20)
+
+        self.cms.merge(other)
+        self.assertEqual(self.cms.get_recent('a', 1), 24)
+        self.assertEqual(self.cms.get_recent('a', 2), 36)
+        self.assertEqual(self.cms['a'], 37)
+
+    def test_merge_different_epochs(self):
+        """
+        Negative test: sketches with a different number of epochs can not be merged
+        """
+        with self.assertRaises(ValueError):
+            self.cms.merge(self.new_cms(epochs=2))
+
+    def test_pickle(self):
+        reloaded = pickle.loads(pickle.dumps(self.cms))
+        self.assertEqual(reloaded.epochs, 3)
+        self.assertEqual(reloaded.size(), self.cms.size())
+        for epochs in (1, 2, 3):
+            self.assertEqual(reloaded.get_recent('a', epochs), self.cms.get_recent('a', epochs))
+
+        reloaded.advance()
+        self.assertEqual(reloaded['a'], 6)
+        self.assertEqual(reloaded['b'], 0)
+
+    def test_invalid_epochs(self):
+        """
+        Negative test: queries can not span more epochs than the ring holds
+        """
+        with self.assertRaises(ValueError):
+            self.cms.get_recent('a', 4)
+        with self.assertRaises(ValueError):
+            self.new_cms(epochs=0)
+        with self.assertRaises(ValueError):
+            self.new_cms(top_k=10)
+
+    def test_single_epoch(self):
+        """
+        Negative test: a sketch with a single epoch can not advance, that would only clear it
+        """
+        cms = self.new_cms(epochs=1)
+        cms.update(['foo', 'foo'])
+        self.assertEqual(cms.get_recent('foo'), 2)
+        with self.assertRaises(ValueError):
+            cms.advance()
+        self.assertEqual(cms['foo'], 2)
+
+
+class CountMinSketchEpochsConservativeTest(CountMinSketchEpochsCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchEpochsConservativeTest, self).__init__(methodName=methodName, log_counting=None)
+
+
+class CountMinSketchEpochs64Test(CountMinSketchEpochsCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchEpochs64Test, self).__init__(methodName=methodName, cell_size=CellSize.BITS_64)
+
+
+class CountMinSketchEpochsLog1024Test(CountMinSketchEpochsCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchEpochsLog1024Test, self).__init__(methodName=methodName, log_counting=1024)
+
+
+class CountMinSketchEpochsLog8Test(CountMinSketchEpochsCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchEpochsLog8Test, self).__init__(methodName=methodName, log_counting=8)
+
+    def test_merge_aligns_epochs(self):
+        other = self.new_cms()
+        other.increment('a', 3)
+        other.advance()
+        other.increment('a', 5)
+
+        self.cms.merge(other)
+        self.assertEqual(self.cms.get_recent('a', 1), 9)
+        self.assertEqual(self.cms.get_recent('a', 2), 14)
+
+
+def load_tests(loader, tests, pattern):
+    test_cases = unittest.TestSuite()
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchEpochsConservativeTest))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchEpochs64Test))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchEpochsLog1024Test))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchEpochsLog8Test))
+    return test_cases
+
+
+if __name__ == '__main__':
+    unittest.main()
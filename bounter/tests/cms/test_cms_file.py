@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Author: Filip Stefanak <f.stefanak@rare-technologies.com>
+# Copyright (C) 2017 Rare Technologies
+#
+# This code is distributed under the terms and conditions
+# from the MIT License (MIT).
+
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+from bounter import CountMinSketch
+from bounter.count_min_sketch import CellSize, HashMode, Layout, FILE_HEADER, FILE_HEADER_V1
+
+
+class CountMinSketchFileCommonTest(unittest.TestCase):
+    """
+    Functional tests for CountMinSketch stored in a memory-mapped file
+    """
+
+    def __init__(self, methodName='runTest', log_counting=None, cell_size=CellSize.BITS_32):
+        self.log_counting = log_counting
+        self.cell_size = cell_size
+        super(CountMinSketchFileCommonTest, self).__init__(methodName=methodName)
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'sketch.cms')
+        self.cms = CountMinSketch.create(self.path, 1, log_counting=self.log_counting, cell_size=self.cell_size)
+
+    def tearDown(self):
+        self.cms.close()
+        shutil.rmtree(self.dir)
+
+    def test_create(self):
+        expected = CountMinSketch(1, log_counting=self.log_counting, cell_size=self.cell_size)
+        self.assertEqual(self.cms.width, expected.width)
+        self.assertEqual(self.cms.depth, expected.depth)
+        self.assertEqual(self.cms.size(), expected.size())
+        self.assertEqual(self.cms.total(), 0)
+        self.assertEqual(self.cms['foo'], 0)
+
+    def test_reopen(self):
+        self.cms.update(['foo', 'bar', 'foo'])
+        self.cms.increment('baz', 3)
+        self.cms.close()
+
+        with CountMinSketch.open(self.path) as reopened:
+            self.assertEqual(reopened['foo'], 2)
+            self.assertEqual(reopened['bar'], 1)
+            self.assertEqual(reopened['baz'], 3)
+            self.assertEqual(reopened.total(), 6)
+            self.assertEqual(reopened.cardinality(), 3)
+            self.assertEqual(reopened.width, self.cms.width)
+            self.assertEqual(reopened.depth, self.cms.depth)
+
+    def test_read_write(self):
+        self.cms.increment('foo')
+        self.cms.flush()
+
+        with CountMinSketch.open(self.path, 'r+') as reopened:
+            self.assertEqual(reopened['foo'], 1)
+            reopened.increment('foo')
+            reopened.update_buffer(['bar'])
+
+        with CountMinSketch.open(self.path) as reopened:
+            self.assertEqual(reopened['foo'], 2)
+            self.assertEqual(reopened['bar'], 1)
+            self.assertEqual(reopened.total(), 3)
+
+    def test_read_only(self):
+        """
+        Negative test: a sketch opened for reading can not be updated
+        """
+        self.cms.increment('foo')
+        self.cms.flush()
+
+        with CountMinSketch.open(self.path, 'r') as reopened:
+            with self.assertRaises(TypeError):
+                reopened.increment('foo')
+            with self.assertRaises(TypeError):
+                reopened.update(['foo'])
+            with self.assertRaises(TypeError):
+                reopened.update_buffer(['foo'])
+            with self.assertRaises(TypeError):
+                reopened.merge(self.cms)
+            self.assertEqual(reopened['foo'], 1)
+
+    def test_copy_on_write(self):
+        self.cms.increment('foo')
+        self.cms.flush()
+
+        with CountMinSketch.open(self.path, 'c') as copy:
+            copy.increment('foo')
+            self.assertEqual(copy['foo'], 2)
+
+        with CountMinSketch.open(self.path) as reopened:
+            self.assertEqual(reopened['foo'], 1)
+
+    def test_merge(self):
+        other = CountMinSketch(1, log_counting=self.log_counting, cell_size=self.cell_size)
+        other.update({'a': 2, 'b': 1})
+        self.cms.increment('a')
+
+        self.cms.merge(other)
+        self.assertEqual(self.cms['a'], 3)
+        self.assertEqual(self.cms['b'], 1)
+        self.assertEqual(self.cms.total(), 4)
+
+    def test_pickle(self):
+        """
+        Pickled sketch is loaded into memory
+        """
+        self.cms.update(['foo', 'bar', 'foo'])
+
+        loaded = pickle.loads(pickle.dumps(self.cms))
+        loaded.increment('foo')
+        self.assertEqual(loaded['foo'], 3)
+        self.assertEqual(self.cms['foo'], 2)
+        self.assertEqual(loaded.total(), 4)
+
+    def test_blocked_layout(self):
+        path = os.path.join(self.dir, 'blocked.cms')
+        with CountMinSketch.create(path, width=2 ** 12, depth=4, log_counting=self.log_counting,
+                                   cell_size=self.cell_size, layout=Layout.BLOCKED) as cms:
+            cms.update(['foo', 'bar', 'foo'])
+
+        with CountMinSketch.open(path) as reopened:
+            self.assertEqual(reopened['foo'], 2)
+            self.assertEqual(reopened['bar'], 1)
+
+    def test_wide_hash_mode(self):
+        path = os.path.join(self.dir, 'wide.cms')
+        with CountMinSketch.create(path, 1, log_counting=self.log_counting, cell_size=self.cell_size,
+                                   hash_mode=HashMode.WIDE) as cms:
+            cms.update(['foo', 'bar', 'foo'])
+
+        with CountMinSketch.open(path) as reopened:
+            self.assertEqual(reopened['foo'], 2)
+            self.assertEqual(reopened['bar'], 1)
+            self.assertEqual(reopened.cardinality(), 2)
+
+    def test_version_1(self):
+        """
+        Files written with the 32-bit width of the first version of the header can still be opened
+        """
+        self.cms.update(['foo', 'bar', 'foo'])
+        self.cms.close()
+        with open(self.path, 'r+b') as f:
+            fields = list(FILE_HEADER.unpack(f.read(FILE_HEADER.size)))
+            fields[1] = 1
+            f.seek(0)
+            f.write(FILE_HEADER_V1.pack(*fields) + b'\0' * (FILE_HEADER.size - FILE_HEADER_V1.size))
+
+        with CountMinSketch.open(self.path) as reopened:
+            self.assertEqual(reopened.width, self.cms.width)
+            self.assertEqual(reopened['foo'], 2)
+
+    def test_invalid_file(self):
+        """
+        Negative test: only files created by CountMinSketch.create can be opened
+        """
+        path = os.path.join(self.dir, 'invalid.cms')
+        with open(path, 'wb') as f:
+            f.write(b'foo' * 1000)
+        with self.assertRaises(ValueError):
+            CountMinSketch.open(path)
+
+        with self.assertRaises(ValueError):
+            CountMinSketch.open(self.path, 'w')
+
+    def test_truncated_file(self):
+        """
+        Negative test: file shorter than its table yields ValueError
+        """
+        self.cms.close()
+        with open(self.path, 'r+b') as f:
+            f.truncate(os.path.getsize(self.path) - 1)
+        with self.assertRaises(ValueError):
+            CountMinSketch.open(self.path)
+
+
+class CountMinSketchFileConservativeTest(CountMinSketchFileCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchFileConservativeTest, self).__init__(methodName=methodName, log_counting=None)
+
+
+class CountMinSketchFile64Test(CountMinSketchFileCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchFile64Test, self).__init__(methodName=methodName, cell_size=CellSize.BITS_64)
+
+
+class CountMinSketchFileLog1024Test(CountMinSketchFileCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchFileLog1024Test, self).__init__(methodName=methodName, log_counting=1024)
+
+
+class CountMinSketchFileLog8Test(CountMinSketchFileCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchFileLog8Test, self).__init__(methodName=methodName, log_counting=8)
+
+
+def load_tests(loader, tests, pattern):
+    test_cases = unittest.TestSuite()
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchFileConservativeTest))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchFile64Test))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchFileLog1024Test))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchFileLog8Test))
+    return test_cases
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Author: Filip Stefanak <f.stefanak@rare-technologies.com>
+# Copyright (C) 2017 Rare Technologies
+#
+# This code is distributed under the terms and conditions
+# from the MIT License (MIT).
+
+import unittest
+from array import array
+
+from bounter import CountMinSketch
+
+
+class CountMinSketchGetManyCommonTest(unittest.TestCase):
+    """
+    Functional tests for CountMinSketch.get_many method, which retrieves estimates of a batch of keys
+    """
+
+    def __init__(self, methodName='runTest', log_counting=None):
+        self.log_counting = log_counting
+        super(CountMinSketchGetManyCommonTest, self).__init__(methodName=methodName)
+
+    def setUp(self):
+        self.cms = CountMinSketch(1, log_counting=self.log_counting)
+        self.cms.update({'foo': 3, 'bar': 1, u'čučoriedka': 7})
+
+    def test_get_many_list(self):
+        result = self.cms.get_many(['foo', b'bar', 'unknown', u'čučoriedka', 'foo'])
+
+        self.assertEqual(result.itemsize, 8)
+        self.assertEqual(list(result), [3, 1, 0, 7, 3])
+
+    def test_get_many_tuple(self):
+        self.assertEqual(list(self.cms.get_many(('foo', 'bar'))), [3, 1])
+
+    def test_get_many_empty(self):
+        self.assertEqual(list(self.cms.get_many([])), [])
+
+    def test_get_many_offsets(self):
+        result = self.cms.get_many(b'foobarbaz', array('i', [0, 3, 6, 9]))
+        self.assertEqual(list(result), [3, 1, 0])
+
+    def test_get_many_byte_matrix(self):
+        data = memoryview(b'foo\0bar\0baz\0').cast('B', shape=[3, 4])
+        self.assertEqual(list(self.cms.get_many(data)), [3, 1, 0])
+
+    def test_get_many_matches_get(self):
+        keys = [str(i) for i in range(300)]
+        self.cms.update(keys * 2)
+        self.assertEqual(list(self.cms.get_many(keys)), [self.cms[key] for key in keys])
+
+    def test_get_many_invalid_key(self):
+        """
+        Negative test: keys which are not strings or bytes yield TypeError
+        """
+        with self.assertRaises(TypeError):
+            self.cms.get_many(['foo', 1])
+
+
+class CountMinSketchGetManyConservativeTest(CountMinSketchGetManyCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchGetManyConservativeTest, self).__init__(methodName=methodName, log_counting=None)
+
+
+class CountMinSketchGetManyLog1024Test(CountMinSketchGetManyCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchGetManyLog1024Test, self).__init__(methodName=methodName, log_counting=1024)
+
+
+class CountMinSketchGetManyLog8Test(CountMinSketchGetManyCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchGetManyLog8Test, self).__init__(methodName=methodName, log_counting=8)
+
+
+def load_tests(loader, tests, pattern):
+    test_cases = unittest.TestSuite()
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchGetManyConservativeTest))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchGetManyLog1024Test))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchGetManyLog8Test))
+    return test_cases
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Author: Filip Stefanak <f.stefanak@rare-technologies.com>
+# Copyright (C) 2017 Rare Technologies
+#
+# This code is distributed under the terms and conditions
+# from the MIT License (MIT).
+
+import pickle
+import unittest
+
+from bounter import CountMinSketch
+from bounter.count_min_sketch import HashMode
+
+
+class CountMinSketchHashModeCommonTest(unittest.TestCase):
+    """
+    Functional tests for the double hashing mode of CountMinSketch
+    """
+
+    def __init__(self, methodName='runTest', log_counting=None):
+        self.log_counting = log_counting
+        super(CountMinSketchHashModeCommonTest, self).__init__(methodName=methodName)
+
+    def setUp(self):
+        self.cms = CountMinSketch(1, log_counting=self.log_counting, hash_mode=HashMode.DOUBLE)
+
+    def test_increment_and_get(self):
+        self.cms.update(['foo', 'bar', 'foo', b'foo'])
+        self.cms.increment('baz', 5)
+
+        self.assertEqual(self.cms['foo'], 3)
+        self.assertEqual(self.cms['bar'], 1)
+        self.assertEqual(self.cms['baz'], 5)
+        self.assertEqual(self.cms['unknown'], 0)
+        self.assertEqual(self.cms.total(), 9)
+        self.assertEqual(self.cms.cardinality(), 3)
+
+    def test_quality(self):
+        for i in range(self.cms.width // 2):
+            self.cms.increment(str(i))
+
+        self.assertGreaterEqual(self.cms.quality(), 0.45)
+        self.assertLessEqual(self.cms.quality(), 0.55)
+
+    def test_pickle_keeps_hash_mode(self):
+        self.cms.update(['foo', 'bar', 'foo'])
+
+        reloaded = pickle.loads(pickle.dumps(self.cms))
+        self.assertEqual(reloaded['foo'], 2)
+        self.assertEqual(reloaded['bar'], 1)
+
+        reloaded.increment('foo')
+        self.assertEqual(reloaded['foo'], 3)
+
+    def test_merge(self):
+        other = CountMinSketch(1, log_counting=self.log_counting, hash_mode=HashMode.DOUBLE)
+        self.cms.update({'a': 1, 'b': 3})
+        other.update({'a': 2, 'c': 4})
+
+        self.cms.merge(other)
+        self.assertEqual(self.cms['a'], 3)
+        self.assertEqual(self.cms['b'], 3)
+        self.assertEqual(self.cms['c'], 4)
+
+    def test_merge_different_hash_mode(self):
+        """
+        Negative test: sketches with a different hash mode can not be merged
+        """
+        other = CountMinSketch(1, log_counting=self.log_counting, hash_mode=HashMode.PER_ROW)
+        with self.assertRaises(ValueError):
+            self.cms.merge(other)
+
+    def test_invalid_hash_mode(self):
+        with self.assertRaises(ValueError):
+            CountMinSketch(1, log_counting=self.log_counting, hash_mode=1)
+
+
+class CountMinSketchHashModeConservativeTest(CountMinSketchHashModeCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchHashModeConservativeTest, self).__init__(methodName=methodName, log_counting=None)
+
+
+class CountMinSketchHashModeLog1024Test(CountMinSketchHashModeCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchHashModeLog1024Test, self).__init__(methodName=methodName, log_counting=1024)
+
+
+class CountMinSketchHashModeLog8Test(CountMinSketchHashModeCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchHashModeLog8Test, self).__init__(methodName=methodName, log_counting=8)
+
+
+def load_tests(loader, tests, pattern):
+    test_cases = unittest.TestSuite()
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchHashModeConservativeTest))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchHashModeLog1024Test))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchHashModeLog8Test))
+    return test_cases
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Author: Filip Stefanak <f.stefanak@rare-technologies.com>
+# Copyright (C) 2017 Rare Technologies
+#
+# This code is distributed under the terms and conditions
+# from the MIT License (MIT).
+
+import unittest
+from array import array
+
+from bounter import CountMinSketch
+from bounter.count_min_sketch import CellSize, Layout
+
+
+class CountMinSketchHashesCommonTest(unittest.TestCase):
+    """
+    Functional tests for CountMinSketch keyed by 64-bit hashes computed by the caller
+    """
+
+    def __init__(self, methodName='runTest', log_counting=None, cell_size=CellSize.BITS_32):
+        self.log_counting = log_counting
+        self.cell_size = cell_size
+        super(CountMinSketchHashesCommonTest, self).__init__(methodName=methodName)
+
+    def new_cms(self, **kwargs):
+        return CountMinSketch(1, log_counting=self.log_counting, cell_size=self.cell_size, seed=1, **kwargs)
+
+    def setUp(self):
+        self.cms = self.new_cms()
+
+    def test_increment_and_get(self):
+        self.cms.increment_hashes(array('Q', [1, 2 ** 64 - 1, 1, 0]))
+
+        self.assertEqual(list(self.cms.get_hashes(array('Q', [1, 2 ** 64 - 1, 0, 2]))), [2, 1, 1, 0])
+        self.assertEqual(self.cms.total(), 4)
+        self.assertEqual(self.cms.cardinality(), 3)
+
+    def test_counts(self):
+        self.cms.increment_hashes(array('q', [10, -3, 10]), counts=array('q', [3, 5, 0]))
+
+        self.assertEqual(list(self.cms.get_hashes(array('q', [10, -3]))), [3, 5])
+        self.assertEqual(list(self.cms.get_hashes(array('Q', [2 ** 64 - 3]))), [5])
+        self.assertEqual(self.cms.total(), 8)
+
+    def test_raw_buffer(self):
+        hashes = array('Q', [7, 8, 7])
+        self.cms.increment_hashes(hashes.tobytes())
+        self.assertEqual(list(self.cms.get_hashes(hashes)), [2, 1, 2])
+
+    def test_many_hashes(self):
+        hashes = array('Q', ((i * 0x9E3779B97F4A7C15) & (2 ** 64 - 1) for i in range(1000)))
+        counts = array('q', (1 + i % 5 for i in range(1000)))
+        self.cms.increment_hashes(hashes, counts)
+
+        estimates = self.cms.get_hashes(hashes)
+        exact = 0
+        for estimate, count in zip(estimates, counts):
+            if self.log_counting is None:
+                self.assertGreaterEqual(estimate, count)
+            exact += estimate == count
+        self.assertGreaterEqual(exact, 900)
+        self.assertEqual(self.cms.total(), sum(counts))
+
+    def test_blocked_layout(self):
+        cms = self.new_cms(layout=Layout.BLOCKED)
+        cms.increment_hashes(array('Q', [3, 3, 4]))
+        self.assertEqual(list(cms.get_hashes(array('Q', [3, 4, 5]))), [2, 1, 0])
+
+    def test_epochs(self):
+        cms = self.new_cms(epochs=2)
+        cms.increment_hashes(array('Q', [3, 3]))
+        cms.advance()
+        cms.increment_hashes(array('Q', [3]))
+        self.assertEqual(list(cms.get_hashes(array('Q', [3]))), [3])
+        self.assertEqual(list(cms.get_hashes(array('Q', [3]), epochs=1)), [1])
+
+    def test_invalid_arrays(self):
+        with self.assertRaises(TypeError):
+            self.cms.increment_hashes(array('i', [1, 2]))
+        with self.assertRaises(TypeError):
+            self.cms.get_hashes([1, 2])
+        with self.assertRaises(ValueError):
+            self.cms.increment_hashes(array('Q', [1, 2]), counts=array('q', [1]))
+        with self.assertRaises(ValueError):
+            self.cms.increment_hashes(array('Q', [1, 2]), counts=array('q', [1, -1]))
+        self.assertEqual(self.cms.total(), 0)
+
+    def test_top_k(self):
+        """
+        Negative test: heavy hitters are tracked by their keys, which are not known for hashes
+        """
+        with self.assertRaises(ValueError):
+            self.new_cms(top_k=10).increment_hashes(array('Q', [1]))
+
+
+class CountMinSketchHashesConservativeTest(CountMinSketchHashesCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchHashesConservativeTest, self).__init__(methodName=methodName, log_counting=None)
+
+
+class CountMinSketchHashes64Test(CountMinSketchHashesCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchHashes64Test, self).__init__(methodName=methodName, cell_size=CellSize.BITS_64)
+
+
+class CountMinSketchHashesLog1024Test(CountMinSketchHashesCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchHashesLog1024Test, self).__init__(methodName=methodName, log_counting=1024)
+
+
+class CountMinSketchHashesLog8Test(CountMinSketchHashesCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchHashesLog8Test, self).__init__(methodName=methodName, log_counting=8)
+
+
+def load_tests(loader, tests, pattern):
+    test_cases = unittest.TestSuite()
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchHashesConservativeTest))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchHashes64Test))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchHashesLog1024Test))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchHashesLog8Test))
+    return test_cases
+
+
+if __name__ == '__main__':
+    unittest.main()
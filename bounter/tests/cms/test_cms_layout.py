@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Author: Filip Stefanak <f.stefanak@rare-technologies.com>
+# Copyright (C) 2017 Rare Technologies
+#
+# This code is distributed under the terms and conditions
+# from the MIT License (MIT).
+
+import pickle
+import unittest
+from collections import Counter
+from itertools import combinations
+
+from bounter import CountMinSketch
+from bounter.count_min_sketch import CellSize, Layout
+
+
+class CountMinSketchBlockedLayoutCommonTest(unittest.TestCase):
+    """
+    Functional tests for CountMinSketch with cache-line-blocked table layout
+    """
+
+    def __init__(self, methodName='runTest', log_counting=None, cell_size=CellSize.BITS_32):
+        self.log_counting = log_counting
+        self.cell_size = cell_size
+        self.block_cells = 64 // CountMinSketch.cell_size(cell_size, log_counting)
+        super(CountMinSketchBlockedLayoutCommonTest, self).__init__(methodName=methodName)
+
+    def new_cms(self, **kwargs):
+        return CountMinSketch(1, log_counting=self.log_counting, cell_size=self.cell_size, layout=Layout.BLOCKED,
+                              **kwargs)
+
+    def setUp(self):
+        self.cms = self.new_cms()
+
+    def test_increment_and_get(self):
+        self.cms.update(['foo', 'bar', 'foo', b'foo'])
+        self.cms.increment('baz', 5)
+
+        self.assertEqual(self.cms['foo'], 3)
+        self.assertEqual(self.cms['bar'], 1)
+        self.assertEqual(self.cms['baz'], 5)
+        self.assertEqual(self.cms['unknown'], 0)
+        self.assertEqual(self.cms.total(), 9)
+        self.assertEqual(self.cms.cardinality(), 3)
+
+    def test_many_keys(self):
+        for i in range(1000):
+            self.cms.increment(str(i), 1 + (i % 7))
+
+        exact = 0
+        for i in range(1000):
+            self.assertGreaterEqual(self.cms[str(i)], 1 + (i % 7))
+            exact += self.cms[str(i)] == 1 + (i % 7)
+        self.assertGreaterEqual(exact, 990)
+
+    def test_pickle_keeps_layout(self):
+        self.cms.update(['foo', 'bar', 'foo'])
+
+        reloaded = pickle.loads(pickle.dumps(self.cms))
+        self.assertEqual(reloaded['foo'], 2)
+        self.assertEqual(reloaded['bar'], 1)
+
+        reloaded.increment('foo')
+        self.assertEqual(reloaded['foo'], 3)
+
+    def test_merge(self):
+        other = self.new_cms()
+        self.cms.update({'a': 1, 'b': 3})
+        other.update({'a': 2, 'c': 4})
+
+        self.cms.merge(other)
+        self.assertEqual(self.cms['a'], 3)
+        self.assertEqual(self.cms['b'], 3)
+        self.assertEqual(self.cms['c'], 4)
+
+    def test_merge_different_layout(self):
+        """
+        Negative test: sketches with a different layout can not be merged
+        """
+        other = CountMinSketch(1, log_counting=self.log_counting, cell_size=self.cell_size, layout=Layout.ROWS)
+        with self.assertRaises(ValueError):
+            self.cms.merge(other)
+
+    def key_slots(self, depth, key):
+        """Cells of the block taken by a key counted alone into a table of a single block per row"""
+        cms = self.new_cms(width=self.block_cells, depth=depth)
+        cms.increment(key)
+        rows = cms.cms.__reduce__()[2][:depth]
+        cell_bytes = len(rows[0]) // self.block_cells
+        table = b''.join(bytes(row) for row in rows)
+        return set(i // cell_bytes % self.block_cells for i in range(0, len(table), cell_bytes)
+                   if table[i:i + cell_bytes].strip(b'\0'))
+
+    def test_distinct_cells(self):
+        """
+        Every row of a key takes its own cell of the block
+        """
+        for depth in (1, self.block_cells // 2, min(self.block_cells, 32)):
+            for i in range(20):
+                self.assertEqual(len(self.key_slots(depth, 'key %d' % i)), depth)
+
+    def test_uncorrelated_rows(self):
+        """
+        The cells taken by the rows of deep tables are spread evenly, every pair of cells is taken as often
+        """
+        depth = self.block_cells // 2
+        keys = 2000
+        pairs = Counter()
+        for i in range(keys):
+            pairs.update(combinations(sorted(self.key_slots(depth, 'key %d' % i)), 2))
+        expected = keys * depth * (depth - 1) / float(self.block_cells * (self.block_cells - 1))
+        for pair in combinations(range(self.block_cells), 2):
+            self.assertAlmostEqual(pairs[pair], expected, delta=expected * 0.3)
+
+    def test_accuracy(self):
+        """
+        At the largest default depth, half a block, the blocked table of a heavily loaded sketch overestimates
+        the keys by at most two more on average than the default layout
+        """
+        self.assertLessEqual(self.cms.depth, self.block_cells // 2)
+
+        def overestimate(layout):
+            cms = CountMinSketch(width=2 ** 10, depth=self.block_cells // 2, log_counting=self.log_counting,
+                                 cell_size=self.cell_size, layout=layout)
+            for i in range(5000):
+                cms.increment(str(i), 1 + i % 5)
+            return sum(cms[str(i)] - (1 + i % 5) for i in range(5000)) / 5000.0
+
+        rows = overestimate(Layout.ROWS)
+        blocked = overestimate(Layout.BLOCKED)
+        self.assertLess(blocked, rows + 2)
+
+    def test_too_deep(self):
+        """
+        Negative test: the rows can not outnumber the cells of a block
+        """
+        if self.block_cells < 32:
+            with self.assertRaises(ValueError):
+                self.new_cms(width=2 ** 10, depth=self.block_cells + 1)
+
+    def test_table_smaller_than_block(self):
+        """
+        Negative test: every row must span at least one cache line
+        """
+        with self.assertRaises(ValueError):
+            CountMinSketch(width=2, depth=3, log_counting=self.log_counting, cell_size=self.cell_size,
+                           layout=Layout.BLOCKED)
+
+
+class CountMinSketchBlockedLayoutConservativeTest(CountMinSketchBlockedLayoutCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchBlockedLayoutConservativeTest, self).__init__(methodName=methodName, log_counting=None)
+
+
+class CountMinSketchBlockedLayout64Test(CountMinSketchBlockedLayoutCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchBlockedLayout64Test, self).__init__(methodName=methodName, cell_size=CellSize.BITS_64)
+
+
+class CountMinSketchBlockedLayoutLog1024Test(CountMinSketchBlockedLayoutCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchBlockedLayoutLog1024Test, self).__init__(methodName=methodName, log_counting=1024)
+
+
+class CountMinSketchBlockedLayoutLog8Test(CountMinSketchBlockedLayoutCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchBlockedLayoutLog8Test, self).__init__(methodName=methodName, log_counting=8)
+
+
+def load_tests(loader, tests, pattern):
+    test_cases = unittest.TestSuite()
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchBlockedLayoutConservativeTest))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchBlockedLayout64Test))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchBlockedLayoutLog1024Test))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchBlockedLayoutLog8Test))
+    return test_cases
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Author: Filip Stefanak <f.stefanak@rare-technologies.com>
+# Copyright (C) 2017 Rare Technologies
+#
+# This code is distributed under the terms and conditions
+# from the MIT License (MIT).
+
+import pickle
+import unittest
+from collections import Counter
+
+from bounter import CountMinSketch
+from bounter.count_min_sketch import CellSize
+
+
+class CountMinSketchMergeCommonTest(unittest.TestCase):
+    """
+    Functional tests for merging CountMinSketch structures using multiple threads and in a single pass
+    """
+
+    def __init__(self, methodName='runTest', log_counting=None, cell_size=CellSize.BITS_32):
+        self.log_counting = log_counting
+        self.cell_size = cell_size
+        super(CountMinSketchMergeCommonTest, self).__init__(methodName=methodName)
+
+    def new_cms(self, data=None):
+        cms = CountMinSketch(2, log_counting=self.log_counting, cell_size=self.cell_size)
+        if data:
+            cms.update(data)
+        return cms
+
+    def setUp(self):
+        self.parts = [{str(i): 1 + (i + part) % 5 for i in range(part, 300, 3)} for part in range(3)]
+        self.expected = Counter()
+        for part in self.parts:
+            self.expected.update(part)
+
+    def check_cms(self, cms, expected):
+        for key, value in expected.items():
+            self.assertEqual(cms[key], value)
+        self.assertEqual(cms.total(), sum(expected.values()))
+
+    def test_merge_threads(self):
+        cms = self.new_cms(self.parts[0])
+        single = pickle.loads(pickle.dumps(cms))
+
+        cms.merge(self.new_cms(self.parts[1]), threads=4)
+        single.merge(self.new_cms(self.parts[1]))
+
+        self.check_cms(cms, Counter(self.parts[0]) + Counter(self.parts[1]))
+        for i in range(400):
+            self.assertEqual(cms[str(i)], single[str(i)])
+
+    def test_update_threads(self):
+        cms = self.new_cms(self.parts[0])
+        cms.update(self.new_cms(self.parts[1]), threads=3)
+        self.check_cms(cms, Counter(self.parts[0]) + Counter(self.parts[1]))
+
+    def test_merge_many(self):
+        cms = self.new_cms(self.parts[0])
+        cms.merge_many([self.new_cms(self.parts[1]), self.new_cms(self.parts[2])])
+
+        self.check_cms(cms, self.expected)
+        self.assertEqual(cms['unknown'], 0)
+        self.assertAlmostEqual(cms.cardinality(), len(self.expected), delta=3)
+
+    def test_merge_many_threads(self):
+        cms = self.new_cms()
+        cms.merge_many((self.new_cms(part) for part in self.parts), threads=8)
+        self.check_cms(cms, self.expected)
+
+    def test_merge_many_empty(self):
+        cms = self.new_cms(self.parts[0])
+        cms.merge_many([])
+        self.check_cms(cms, self.parts[0])
+
+    def test_merge_many_keeps_others(self):
+        others = [self.new_cms(part) for part in self.parts]
+        cms = self.new_cms()
+        cms.merge_many(others)
+
+        for other, part in zip(others, self.parts):
+            self.check_cms(other, part)
+
+    def test_merge_many_invalid(self):
+        """
+        Negative test: only compatible sketches can be merged, using a positive number of threads
+        """
+        cms = self.new_cms(self.parts[0])
+        with self.assertRaises(ValueError):
+            cms.merge_many([self.new_cms(), CountMinSketch(width=2 ** 10, depth=4, log_counting=self.log_counting,
+                                                           cell_size=self.cell_size)])
+        with self.assertRaises(TypeError):
+            cms.merge_many([self.new_cms(), 'foo'])
+        with self.assertRaises(ValueError):
+            cms.merge_many([self.new_cms()], threads=0)
+        with self.assertRaises(ValueError):
+            cms.merge(self.new_cms(), threads=-1)
+
+        self.check_cms(cms, self.parts[0])
+
+
+class CountMinSketchMergeConservativeTest(CountMinSketchMergeCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchMergeConservativeTest, self).__init__(methodName=methodName, log_counting=None)
+
+
+class CountMinSketchMerge64Test(CountMinSketchMergeCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchMerge64Test, self).__init__(methodName=methodName, cell_size=CellSize.BITS_64)
+
+
+class CountMinSketchMergeLog1024Test(CountMinSketchMergeCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchMergeLog1024Test, self).__init__(methodName=methodName, log_counting=1024)
+
+
+class CountMinSketchMergeLog8Test(CountMinSketchMergeCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchMergeLog8Test, self).__init__(methodName=methodName, log_counting=8)
+
+
+def load_tests(loader, tests, pattern):
+    test_cases = unittest.TestSuite()
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchMergeConservativeTest))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchMerge64Test))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchMergeLog1024Test))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchMergeLog8Test))
+    return test_cases
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -9,6 +9,7 @@
 
 import os
 import pickle
+import sys
 import unittest
 from collections import Counter
 
@@ -89,6 +90,79 @@ class CountMinSketchPickleCommonTest(unittest.TestCase):
         expected['3'] += 3
         self.check_cms(reloaded, expected)
 
+    @unittest.skipIf(sys.version_info < (3, 8), "pickle protocol 5 requires python 3.8")
+    def test_pickle_protocol_5(self):
+        expected = Counter()
+        for structure in [self.cms, expected]:
+            structure.update("pickling")
+
+        reloaded = pickle.loads(pickle.dumps(self.cms, protocol=5))
+        self.check_cms(reloaded, expected)
+
+    @unittest.skipIf(sys.version_info < (3, 8), "pickle protocol 5 requires python 3.8")
+    def test_pickle_out_of_band(self):
+        """
+        With protocol 5, the rows of the table are passed as out-of-band buffers, which are used in place when loaded
+        """
+        expected = Counter()
+        for structure in [self.cms, expected]:
+            structure.update("pickling")
+
+        buffers = []
+        data = pickle.dumps(self.cms, protocol=5, buffer_callback=buffers.append)
+        self.assertEqual(len(buffers), self.cms.depth)
+        self.assertLess(len(data), self.cms.size() // 2)
+
+        rows = [bytearray(buffer) for buffer in buffers]
+        reloaded = pickle.loads(data, buffers=rows)
+        self.check_cms(reloaded, expected)
+
+        before = [bytes(row) for row in rows]
+        reloaded.increment('x')
+        self.assertEqual(reloaded['x'], 1)
+        self.assertTrue(all(bytes(row) != row_before for row, row_before in zip(rows, before)))
+        self.check_cms(self.cms, expected)
+
+    @unittest.skipIf(sys.version_info < (3, 8), "pickle protocol 5 requires python 3.8")
+    def test_pickle_out_of_band_independent(self):
+        """
+        The exported rows are copied when loaded in the same process, so the sketches do not share their counters
+        """
+        expected = Counter()
+        for structure in [self.cms, expected]:
+            structure.update("pickling")
+
+        buffers = []
+        data = pickle.dumps(self.cms, protocol=5, buffer_callback=buffers.append)
+        reloaded = pickle.loads(data, buffers=buffers)
+        self.check_cms(reloaded, expected)
+
+        reloaded.update(['x', 'x'])
+        self.cms.increment('y')
+        self.assertEqual(reloaded['x'], 2)
+        self.assertEqual(reloaded['y'], 0)
+        self.assertEqual(self.cms['x'], 0)
+        self.assertEqual(self.cms['y'], 1)
+        self.assertEqual(reloaded['p'], expected['p'])
+        self.assertEqual(self.cms['p'], expected['p'])
+
+    @unittest.skipIf(sys.version_info < (3, 8), "pickle protocol 5 requires python 3.8")
+    def test_pickle_out_of_band_read_only(self):
+        """
+        Read-only out-of-band buffers are copied when loaded
+        """
+        self.cms.update("pickling")
+
+        buffers = []
+        data = pickle.dumps(self.cms, protocol=5, buffer_callback=buffers.append)
+        rows = [bytes(buffer) for buffer in buffers]
+        reloaded = pickle.loads(data, buffers=rows)
+
+        reloaded.increment('i')
+        self.assertEqual(reloaded['i'], 3)
+        self.assertEqual(self.cms['i'], 2)
+
+
 class CountMinSketchPickleConservativeTest(CountMinSketchPickleCommonTest):
     def __init__(self, methodName='runTest'):
         super(CountMinSketchPickleConservativeTest, self).__init__(methodName=methodName, log_counting=None)
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Author: Filip Stefanak <f.stefanak@rare-technologies.com>
+# Copyright (C) 2017 Rare Technologies
+#
+# This code is distributed under the terms and conditions
+# from the MIT License (MIT).
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from bounter import CountMinSketch
+from bounter.count_min_sketch import CellSize, HashMode, Layout
+
+
+class CountMinSketchSaveCommonTest(unittest.TestCase):
+    """
+    Functional tests for compact snapshots of CountMinSketch written by save and read by load
+    """
+
+    def __init__(self, methodName='runTest', log_counting=None, cell_size=CellSize.BITS_32):
+        self.log_counting = log_counting
+        self.cell_size = cell_size
+        super(CountMinSketchSaveCommonTest, self).__init__(methodName=methodName)
+
+    def new_cms(self, size_mb=1, **kwargs):
+        return CountMinSketch(size_mb, log_counting=self.log_counting, cell_size=self.cell_size, **kwargs)
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'sketch.snapshot')
+        self.cms = self.new_cms()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def assertSameTable(self, loaded, cms, keys):
+        self.assertEqual((loaded.width, loaded.depth, loaded.size()), (cms.width, cms.depth, cms.size()))
+        self.assertEqual(list(loaded.get_many(keys)), list(cms.get_many(keys)))
+        self.assertEqual(loaded.total(), cms.total())
+        self.assertEqual(loaded.cardinality(), cms.cardinality())
+        self.assertEqual(loaded.count_nonzero(), cms.count_nonzero())
+
+    def test_sparse(self):
+        self.cms.update(['foo', 'bar', 'foo'])
+        self.cms.increment('baz', 3)
+
+        for compression in ('zlib', 'lzma', None):
+            self.cms.save(self.path, compression=compression)
+            self.assertLess(os.path.getsize(self.path), 2048)
+
+            loaded = CountMinSketch.load(self.path)
+            self.assertSameTable(loaded, self.cms, ['foo', 'bar', 'baz', 'unknown'])
+            self.assertEqual(loaded['foo'], 2)
+
+    def test_dense(self):
+        keys = [str(i) for i in range(self.cms.width * 2)]
+        self.cms.update_buffer(keys)
+
+        for compression in ('zlib', None):
+            self.cms.save(self.path, compression=compression)
+            self.assertSameTable(CountMinSketch.load(self.path), self.cms, keys)
+
+    def test_empty(self):
+        self.cms.save(self.path, compression=None)
+        loaded = CountMinSketch.load(self.path)
+
+        self.assertEqual(loaded.total(), 0)
+        self.assertEqual(loaded.count_nonzero(), 0)
+        self.assertEqual(loaded['foo'], 0)
+
+    def test_update_loaded(self):
+        self.cms.update(['foo', 'bar', 'foo'])
+        self.cms.save(self.path)
+
+        loaded = CountMinSketch.load(self.path)
+        loaded.update(['foo', 'qux'])
+        self.assertEqual(loaded['foo'], 3)
+        self.assertEqual(loaded['qux'], 1)
+        self.assertEqual(loaded.total(), 5)
+        self.assertEqual(self.cms['foo'], 2)
+
+    def test_parameters(self):
+        cms = self.new_cms(width=2 ** 12, depth=4, hash_mode=HashMode.WIDE, layout=Layout.BLOCKED)
+        cms.update(['foo', 'bar', 'foo'])
+        cms.save(self.path)
+
+        loaded = CountMinSketch.load(self.path)
+        self.assertEqual(loaded.cms.hash_mode, HashMode.WIDE.value)
+        self.assertEqual(loaded.cms.layout, Layout.BLOCKED.value)
+        self.assertSameTable(loaded, cms, ['foo', 'bar'])
+
+    def test_epochs(self):
+        cms = self.new_cms(epochs=3)
+        cms.update(['foo', 'bar'])
+        cms.advance()
+        cms.update(['foo'])
+        cms.advance()
+        cms.advance()
+        cms.update(['foo', 'baz'])
+        cms.save(self.path)
+
+        loaded = CountMinSketch.load(self.path)
+        self.assertEqual(loaded.epochs, 3)
+        for epochs in (1, 2, 3):
+            self.assertEqual([loaded.get_recent(key, epochs) for key in ('foo', 'bar', 'baz')],
+                             [cms.get_recent(key, epochs) for key in ('foo', 'bar', 'baz')])
+        # the ring continues from the same epoch
+        loaded.advance()
+        cms.advance()
+        self.assertEqual(loaded['foo'], cms['foo'])
+        self.assertEqual(loaded['bar'], 0)
+
+    def test_heavy_hitters(self):
+        cms = self.new_cms(top_k=2)
+        cms.update(['foo'] * 5 + ['bar'] * 3 + [u'č'] * 4)
+        cms.save(self.path)
+
+        loaded = CountMinSketch.load(self.path)
+        self.assertEqual(loaded.most_common(), cms.most_common())
+        loaded.increment('bar', 3)
+        self.assertEqual(loaded.most_common(), [('bar', 6), ('foo', 5)])
+
+    def test_invalid_compression(self):
+        with self.assertRaises(ValueError):
+            self.cms.save(self.path, compression='gzip')
+
+    def test_invalid_file(self):
+        """
+        Negative test: only snapshots written by save can be loaded
+        """
+        with open(self.path, 'wb') as f:
+            f.write(b'foo' * 1000)
+        with self.assertRaises(ValueError):
+            CountMinSketch.load(self.path)
+
+    def test_truncated_file(self):
+        """
+        Negative test: snapshot shorter than its encoded table yields ValueError
+        """
+        self.cms.update(['foo', 'bar', 'foo'])
+        for compression in ('zlib', None):
+            self.cms.save(self.path, compression=compression)
+            with open(self.path, 'r+b') as f:
+                f.truncate(os.path.getsize(self.path) - 3)
+            with self.assertRaises(Exception):
+                CountMinSketch.load(self.path)
+
+    def test_mismatched_table(self):
+        """
+        Negative test: a table decoded into a smaller sketch yields ValueError
+        """
+        self.cms.update(['foo', 'bar', 'foo'])
+        encoded = self.cms.cms.encode_sparse()
+        with self.assertRaises(ValueError):
+            self.new_cms(width=16, depth=1).cms.decode_sparse(encoded, 3)
+
+
+class CountMinSketchSaveConservativeTest(CountMinSketchSaveCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchSaveConservativeTest, self).__init__(methodName=methodName, log_counting=None)
+
+
+class CountMinSketchSave64Test(CountMinSketchSaveCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchSave64Test, self).__init__(methodName=methodName, cell_size=CellSize.BITS_64)
+
+
+class CountMinSketchSaveLog1024Test(CountMinSketchSaveCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchSaveLog1024Test, self).__init__(methodName=methodName, log_counting=1024)
+
+
+class CountMinSketchSaveLog8Test(CountMinSketchSaveCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchSaveLog8Test, self).__init__(methodName=methodName, log_counting=8)
+
+
+def load_tests(loader, tests, pattern):
+    test_cases = unittest.TestSuite()
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchSaveConservativeTest))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchSave64Test))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchSaveLog1024Test))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchSaveLog8Test))
+    return test_cases
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Author: Filip Stefanak <f.stefanak@rare-technologies.com>
+# Copyright (C) 2017 Rare Technologies
+#
+# This code is distributed under the terms and conditions
+# from the MIT License (MIT).
+
+import unittest
+
+from bounter import CountMinSketch
+
+
+class CountMinSketchSeedCommonTest(unittest.TestCase):
+    """
+    Functional tests for reproducibility of log counting with a seeded random number generator
+    """
+
+    def __init__(self, methodName='runTest', log_counting=8):
+        self.log_counting = log_counting
+        super(CountMinSketchSeedCommonTest, self).__init__(methodName=methodName)
+
+    def fill(self, seed):
+        cms = CountMinSketch(1, log_counting=self.log_counting, seed=seed)
+        for i in range(50):
+            cms.increment(str(i), 1000 * i)
+        cms.update(str(i % 7) for i in range(20000))
+
+        other = CountMinSketch(1, log_counting=self.log_counting, seed=seed + 1)
+        other.update({str(i): 777 * i for i in range(50)})
+        cms.merge(other)
+        return [cms[str(i)] for i in range(50)]
+
+    def test_same_seed(self):
+        self.assertEqual(self.fill(42), self.fill(42))
+
+    def test_different_seed(self):
+        self.assertNotEqual(self.fill(42), self.fill(43))
+
+    def test_estimates(self):
+        values = self.fill(1)
+        expected = [1777 * i + 20000 // 7 + (i < 20000 % 7) if i < 7 else 1777 * i for i in range(50)]
+        for value, expected_value in zip(values, expected):
+            self.assertAlmostEqual(value, expected_value, delta=max(expected_value * 0.5, 16))
+
+    def test_invalid_seed(self):
+        with self.assertRaises(TypeError):
+            CountMinSketch(1, log_counting=self.log_counting, seed='foo')
+
+
+class CountMinSketchSeedLog1024Test(CountMinSketchSeedCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchSeedLog1024Test, self).__init__(methodName=methodName, log_counting=1024)
+
+
+class CountMinSketchSeedLog8Test(CountMinSketchSeedCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchSeedLog8Test, self).__init__(methodName=methodName, log_counting=8)
+
+
+def load_tests(loader, tests, pattern):
+    test_cases = unittest.TestSuite()
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchSeedLog1024Test))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchSeedLog8Test))
+    return test_cases
+
+
+if __name__ == '__main__':
+    unittest.main()
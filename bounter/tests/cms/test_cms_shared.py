@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Author: Filip Stefanak <f.stefanak@rare-technologies.com>
+# Copyright (C) 2017 Rare Technologies
+#
+# This code is distributed under the terms and conditions
+# from the MIT License (MIT).
+
+import multiprocessing
+import pickle
+import unittest
+
+from bounter import CountMinSketch
+from bounter.count_min_sketch import CellSize
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python < 3.8
+    shared_memory = None
+
+
+def count_keys(args):
+    cms, keys = args
+    cms.update_buffer(keys)
+    cms.close()
+
+
+@unittest.skipIf(shared_memory is None, "multiprocessing.shared_memory requires Python 3.8+")
+class CountMinSketchSharedCommonTest(unittest.TestCase):
+    """
+    Functional tests for CountMinSketch in shared memory
+    """
+
+    def __init__(self, methodName='runTest', log_counting=None, cell_size=CellSize.BITS_32):
+        self.log_counting = log_counting
+        self.cell_size = cell_size
+        super(CountMinSketchSharedCommonTest, self).__init__(methodName=methodName)
+
+    def setUp(self):
+        self.cms = CountMinSketch.create_shared(size_mb=1, log_counting=self.log_counting, cell_size=self.cell_size)
+
+    def tearDown(self):
+        self.cms.unlink()
+        self.cms.close()
+
+    def test_create(self):
+        expected = CountMinSketch(1, log_counting=self.log_counting, cell_size=self.cell_size)
+        self.assertEqual(self.cms.width, expected.width)
+        self.assertEqual(self.cms.depth, expected.depth)
+        self.assertEqual(self.cms.total(), 0)
+        self.assertEqual(self.cms['foo'], 0)
+        self.assertIsNotNone(self.cms.shared_name)
+
+    def test_attach(self):
+        self.cms.update(['foo', 'bar', 'foo'])
+
+        attached = CountMinSketch.attach(self.cms.shared_name)
+        self.assertEqual(attached['foo'], 2)
+        attached.increment('baz', 3)
+        self.assertEqual(self.cms['baz'], 3)
+        self.assertEqual(self.cms.total(), 6)
+        self.assertEqual(self.cms.cardinality(), 3)
+        attached.close()
+
+    def test_pickle_attaches(self):
+        self.cms.increment('foo')
+
+        attached = pickle.loads(pickle.dumps(self.cms))
+        self.assertEqual(attached.shared_name, self.cms.shared_name)
+        attached.increment('foo')
+        self.assertEqual(self.cms['foo'], 2)
+        attached.close()
+
+    def test_processes(self):
+        keys = [str(i) for i in range(50)] * 2
+        context = multiprocessing.get_context('spawn')
+        pool = context.Pool(2)
+        try:
+            pool.map(count_keys, [(self.cms, keys)] * 4)
+        finally:
+            pool.close()
+            pool.join()
+
+        self.assertEqual(self.cms.total(), 400)
+        self.assertAlmostEqual(self.cms.cardinality(), 50, delta=1)
+        for i in range(50):
+            self.assertAlmostEqual(self.cms[str(i)], 8, delta=0 if self.log_counting is None else 4)
+
+    def test_unlink(self):
+        other = CountMinSketch.create_shared(size_mb=1, log_counting=self.log_counting, cell_size=self.cell_size)
+        name = other.shared_name
+        other.unlink()
+        other.close()
+        with self.assertRaises(FileNotFoundError):
+            CountMinSketch.attach(name)
+
+    def test_attach_invalid(self):
+        """
+        Negative test: only segments created by CountMinSketch.create_shared can be attached
+        """
+        segment = shared_memory.SharedMemory(create=True, size=10000)
+        try:
+            with self.assertRaises(ValueError):
+                CountMinSketch.attach(segment.name)
+        finally:
+            segment.close()
+            segment.unlink()
+
+    def test_unlink_in_memory(self):
+        """
+        Negative test: sketches kept in private memory can not be unlinked
+        """
+        with self.assertRaises(ValueError):
+            CountMinSketch(1).unlink()
+
+
+class CountMinSketchSharedConservativeTest(CountMinSketchSharedCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchSharedConservativeTest, self).__init__(methodName=methodName, log_counting=None)
+
+
+class CountMinSketchShared64Test(CountMinSketchSharedCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchShared64Test, self).__init__(methodName=methodName, cell_size=CellSize.BITS_64)
+
+
+class CountMinSketchSharedLog1024Test(CountMinSketchSharedCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchSharedLog1024Test, self).__init__(methodName=methodName, log_counting=1024)
+
+
+class CountMinSketchSharedLog8Test(CountMinSketchSharedCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchSharedLog8Test, self).__init__(methodName=methodName, log_counting=8)
+
+
+def load_tests(loader, tests, pattern):
+    test_cases = unittest.TestSuite()
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchSharedConservativeTest))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchShared64Test))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchSharedLog1024Test))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchSharedLog8Test))
+    return test_cases
+
+
+if __name__ == '__main__':
+    unittest.main()
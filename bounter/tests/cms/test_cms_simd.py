@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Author: Filip Stefanak <f.stefanak@rare-technologies.com>
+# Copyright (C) 2017 Rare Technologies
+#
+# This code is distributed under the terms and conditions
+# from the MIT License (MIT).
+
+import os
+import subprocess
+import sys
+import unittest
+
+from bounter import CountMinSketch
+from bounter.count_min_sketch import CellSize
+
+SCRIPT = """
+from bounter import CountMinSketch
+from bounter.count_min_sketch import CellSize
+a = CountMinSketch(width=1024, depth=4, log_counting={log_counting}, cell_size={cell_size}, seed=1)
+b = CountMinSketch(width=1024, depth=4, log_counting={log_counting}, cell_size={cell_size}, seed=1)
+c = CountMinSketch(width=1024, depth=4, log_counting={log_counting}, cell_size={cell_size}, seed=1)
+a.update(str(i) for i in range(300))
+b.update({{str(i): i % 9 for i in range(200, 700)}})
+c.update(str(i % 50) for i in range(1000))
+a.merge_many([b, c])
+print(a.count_nonzero(), a.count_saturated(), a.total(), a.cardinality(), [a[str(i)] for i in range(0, 700, 7)])
+"""
+
+
+class CountMinSketchSimdCommonTest(unittest.TestCase):
+    """
+    Functional tests for the vectorized merge and scan kernels
+    """
+
+    def __init__(self, methodName='runTest', log_counting=None, cell_size=CellSize.BITS_32):
+        self.log_counting = log_counting
+        self.cell_size = cell_size
+        super(CountMinSketchSimdCommonTest, self).__init__(methodName=methodName)
+
+    def new_cms(self, width=1024, depth=4):
+        return CountMinSketch(width=width, depth=depth, log_counting=self.log_counting, cell_size=self.cell_size)
+
+    def test_count_nonzero(self):
+        cms = self.new_cms()
+        self.assertEqual(cms.count_nonzero(), 0)
+
+        cms.increment('foo')
+        self.assertEqual(cms.count_nonzero(), 4)
+
+        cms.update(str(i) for i in range(200))
+        self.assertGreater(cms.count_nonzero(), 4 * 180)
+        self.assertLessEqual(cms.count_nonzero(), 4 * 201)
+
+    def test_count_saturated_empty(self):
+        cms = self.new_cms()
+        cms.update(str(i) for i in range(200))
+        self.assertEqual(cms.count_saturated(), 0)
+
+    def test_merge_uneven_width(self):
+        """
+        Test that merging covers the cells which do not fill a whole vector
+        """
+        for width in (1, 2, 4, 8, 16, 1024):
+            cms = self.new_cms(width=width, depth=2)
+            other = self.new_cms(width=width, depth=2)
+            other.update(str(i) for i in range(width * 3))
+            cms.merge(other)
+            self.assertEqual(cms.count_nonzero(), other.count_nonzero())
+            for i in range(width * 3):
+                self.assertEqual(cms[str(i)], other[str(i)])
+
+    def test_merge_keeps_cardinality(self):
+        cms = self.new_cms()
+        other = self.new_cms()
+        cms.update(str(i) for i in range(500))
+        other.update(str(i) for i in range(250, 1000))
+        cms.merge(other)
+        self.assertAlmostEqual(cms.cardinality(), 1000, delta=20)
+
+    def test_merge_many_itself(self):
+        """
+        Negative test: a sketch can not be one of the sketches merged into it by merge_many
+        """
+        cms = self.new_cms()
+        with self.assertRaises(ValueError):
+            cms.merge_many([self.new_cms(), cms])
+
+    def test_instruction_sets_agree(self):
+        """
+        Test that every instruction set gives the same results as plain C
+        """
+        script = SCRIPT.format(log_counting=self.log_counting, cell_size=self.cell_size)
+        results = []
+        for level in ('scalar', 'sse2', 'avx2'):
+            env = dict(os.environ, BOUNTER_SIMD=level)
+            results.append(subprocess.check_output([sys.executable, '-c', script], env=env))
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(results[0], results[2])
+
+
+class CountMinSketchSimdConservativeTest(CountMinSketchSimdCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchSimdConservativeTest, self).__init__(methodName=methodName, log_counting=None)
+
+    def test_merge_saturate(self):
+        cms = self.new_cms()
+        other = self.new_cms()
+        cms.increment('foo', 2 ** 32 - 10)
+        other.increment('foo', 20)
+
+        cms.merge(other, saturate=True)
+        self.assertEqual(cms['foo'], 2 ** 32 - 1)
+        self.assertEqual(cms.count_saturated(), 4)
+
+    def test_merge_wrap_around(self):
+        cms = self.new_cms()
+        other = self.new_cms()
+        cms.increment('foo', 2 ** 32 - 10)
+        other.increment('foo', 20)
+
+        cms.merge(other)
+        self.assertEqual(cms['foo'], 10)
+        self.assertEqual(cms.count_saturated(), 0)
+
+    def test_merge_many_saturate(self):
+        cms = self.new_cms()
+        others = [self.new_cms() for _ in range(3)]
+        for other in others:
+            other.increment('foo', 2 ** 31)
+        cms.increment('bar', 7)
+
+        cms.merge_many(others, saturate=True)
+        self.assertEqual(cms['foo'], 2 ** 32 - 1)
+        self.assertEqual(cms['bar'], 7)
+
+
+class CountMinSketchSimd64Test(CountMinSketchSimdCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchSimd64Test, self).__init__(methodName=methodName, cell_size=CellSize.BITS_64)
+
+    def test_merge_beyond_32_bits(self):
+        cms = self.new_cms()
+        other = self.new_cms()
+        cms.increment('foo', 2 ** 32 - 10)
+        other.increment('foo', 20)
+
+        cms.merge(other, saturate=True)
+        self.assertEqual(cms['foo'], 2 ** 32 + 10)
+        self.assertEqual(cms.count_saturated(), 0)
+
+
+class CountMinSketchSimdLog1024Test(CountMinSketchSimdCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchSimdLog1024Test, self).__init__(methodName=methodName, log_counting=1024)
+
+
+class CountMinSketchSimdLog8Test(CountMinSketchSimdCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchSimdLog8Test, self).__init__(methodName=methodName, log_counting=8)
+
+
+def load_tests(loader, tests, pattern):
+    test_cases = unittest.TestSuite()
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchSimdConservativeTest))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchSimd64Test))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchSimdLog1024Test))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchSimdLog8Test))
+    return test_cases
+
+
+if __name__ == '__main__':
+    unittest.main()
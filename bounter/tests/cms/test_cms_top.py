@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Author: Filip Stefanak <f.stefanak@rare-technologies.com>
+# Copyright (C) 2017 Rare Technologies
+#
+# This code is distributed under the terms and conditions
+# from the MIT License (MIT).
+
+import pickle
+import random
+import threading
+import unittest
+from collections import Counter
+
+from bounter import CountMinSketch
+from bounter.count_min_sketch import CellSize
+
+
+class CountMinSketchTopCommonTest(unittest.TestCase):
+    """
+    Functional tests for the heavy hitters tracked by CountMinSketch
+    """
+
+    def __init__(self, methodName='runTest', log_counting=None, cell_size=CellSize.BITS_32):
+        self.log_counting = log_counting
+        self.cell_size = cell_size
+        super(CountMinSketchTopCommonTest, self).__init__(methodName=methodName)
+
+    def new_cms(self, top_k=10, **kwargs):
+        # log counters round randomly, a fixed seed keeps the estimates reproducible
+        return CountMinSketch(1, log_counting=self.log_counting, cell_size=self.cell_size, top_k=top_k, seed=1,
+                              **kwargs)
+
+    def stream(self, seed=0, length=20000):
+        generator = random.Random(seed)
+        return ['key%d' % int(generator.paretovariate(1.0)) for _ in range(length)]
+
+    def assertTopKeys(self, cms, counter, k):
+        """
+        The heaviest keys are found, with frequencies not below the true ones
+        """
+        expected = [key for key, _ in counter.most_common(k // 2)]
+        found = dict(cms.most_common())
+        for key in expected:
+            self.assertIn(key, found)
+            self.assertEqual(found[key], cms[key])
+            self.assertGreaterEqual(found[key], counter[key] * (0.5 if self.log_counting else 1))
+
+    def test_most_common(self):
+        cms = self.new_cms()
+        cms.update({'a': 5, 'b': 3, 'c': 10})
+        cms.increment('d')
+
+        self.assertEqual(cms.most_common(), [('c', 10), ('a', 5), ('b', 3), ('d', 1)])
+        self.assertEqual(cms.most_common(2), [('c', 10), ('a', 5)])
+        self.assertEqual(cms.most_common(0), [])
+
+    def test_eviction(self):
+        cms = self.new_cms(top_k=3)
+        for i in range(100):
+            cms.increment('small%d' % i)
+        cms.increment('big', 7)
+        cms.increment('medium', 4)
+
+        top = cms.most_common()
+        self.assertEqual(len(top), 3)
+        self.assertEqual(top[0], ('big', 7))
+        self.assertEqual(top[1], ('medium', 4))
+
+    def test_stream(self):
+        stream = self.stream()
+        cms = self.new_cms(top_k=20)
+        cms.update(stream[:10000])
+        cms.update_buffer(stream[10000:])
+
+        self.assertTopKeys(cms, Counter(stream), 20)
+
+    def test_bytes_keys(self):
+        cms = self.new_cms()
+        cms.increment(b'foo', 2)
+        cms.increment(u'foo')
+        cms.increment(b'\xff\xfe')
+
+        self.assertEqual(cms.most_common(), [(u'foo', 3), (b'\xff\xfe', 1)])
+
+    def test_merge(self):
+        first, second = self.stream(1, 10000), self.stream(2, 10000)
+        cms = self.new_cms(top_k=20)
+        other = self.new_cms(top_k=20)
+        cms.update(first)
+        other.update(second)
+        other.increment('only_other', 100000)
+
+        cms.merge(other)
+        self.assertEqual(cms.most_common(1)[0][0], 'only_other')
+        self.assertTopKeys(cms, Counter(first) + Counter(second), 20)
+
+    def test_merge_many(self):
+        sketches = [self.new_cms() for _ in range(3)]
+        for i, other in enumerate(sketches):
+            other.increment('key%d' % i, 100 + i)
+        cms = self.new_cms()
+        cms.increment('key0', 50)
+
+        cms.merge_many(sketches)
+        self.assertEqual([key for key, _ in cms.most_common()], ['key0', 'key2', 'key1'])
+
+    def test_pickle(self):
+        cms = self.new_cms(top_k=5)
+        cms.update({'a': 5, 'b': 3, 'c': 10})
+
+        reloaded = pickle.loads(pickle.dumps(cms))
+        self.assertEqual(reloaded.most_common(), cms.most_common())
+        reloaded.increment('b', 10)
+        self.assertEqual(reloaded.most_common(1)[0][0], 'b')
+
+    def test_concurrent(self):
+        cms = self.new_cms(concurrent=True)
+        cms.update({'a': 5, 'b': 3})
+        self.assertEqual(cms.most_common(), [('a', 5), ('b', 3)])
+
+    def test_threads(self):
+        """
+        Updates release the GIL, the heavy hitters stay consistent when several threads update and read them
+        """
+        stream = self.stream(length=5000)
+        cms = self.new_cms(top_k=20)
+        done = threading.Event()
+
+        def write():
+            for start in range(0, len(stream), 500):
+                cms.update(stream[start:start + 500])
+                cms.increment('heavy', 1000)
+
+        def read():
+            while not done.is_set():
+                top = cms.most_common()
+                self.assertLessEqual(len(top), 20)
+                self.assertEqual(len(set(key for key, _ in top)), len(top))
+                pickle.loads(pickle.dumps(cms))
+
+        writers = [threading.Thread(target=write) for _ in range(4)]
+        reader = threading.Thread(target=read)
+        reader.start()
+        for thread in writers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        done.set()
+        reader.join()
+
+        self.assertEqual(cms.most_common(1)[0][0], 'heavy')
+        self.assertEqual(len(cms.most_common()), 20)
+
+    def test_not_tracked(self):
+        """
+        Negative test: heavy hitters are only available with top_k
+        """
+        cms = CountMinSketch(1, log_counting=self.log_counting, cell_size=self.cell_size)
+        with self.assertRaises(ValueError):
+            cms.most_common()
+
+
+class CountMinSketchTopConservativeTest(CountMinSketchTopCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchTopConservativeTest, self).__init__(methodName=methodName, log_counting=None)
+
+
+class CountMinSketchTop64Test(CountMinSketchTopCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchTop64Test, self).__init__(methodName=methodName, cell_size=CellSize.BITS_64)
+
+
+class CountMinSketchTopLog1024Test(CountMinSketchTopCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchTopLog1024Test, self).__init__(methodName=methodName, log_counting=1024)
+
+
+class CountMinSketchTopLog8Test(CountMinSketchTopCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchTopLog8Test, self).__init__(methodName=methodName, log_counting=8)
+
+    def test_most_common(self):
+        cms = self.new_cms()
+        cms.update({'a': 5, 'b': 3, 'c': 10})
+
+        self.assertEqual([key for key, _ in cms.most_common()], ['c', 'a', 'b'])
+
+    def test_eviction(self):
+        cms = self.new_cms(top_k=3)
+        for i in range(100):
+            cms.increment('small%d' % i)
+        cms.increment('big', 7)
+
+        self.assertEqual(cms.most_common(1)[0][0], 'big')
+
+    def test_merge_many(self):
+        sketches = [self.new_cms() for _ in range(3)]
+        for i, other in enumerate(sketches):
+            other.increment('key%d' % i, 100)
+        cms = self.new_cms()
+
+        cms.merge_many(sketches)
+        self.assertEqual(sorted(key for key, _ in cms.most_common()), ['key0', 'key1', 'key2'])
+
+    def test_concurrent(self):
+        cms = self.new_cms(concurrent=True)
+        cms.update({'a': 5, 'b': 3})
+        self.assertEqual([key for key, _ in cms.most_common()], ['a', 'b'])
+
+
+def load_tests(loader, tests, pattern):
+    test_cases = unittest.TestSuite()
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchTopConservativeTest))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchTop64Test))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchTopLog1024Test))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchTopLog8Test))
+    return test_cases
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -112,6 +112,39 @@ class CountMinSketchUpdateCommonTest(unittest.TestCase):
 
         self.assertEqual(set(result_set), set(expected.items()))
 
+    def test_update_many_keys(self):
+        """
+        Keys are counted in windows, the last one of which is incomplete
+        """
+        keys = [str(i % 7) for i in range(50)]
+        self.cms.update(keys)
+        self.cms.update((key, 2) for key in keys[:3])
+
+        self.assertEqual(self.cms['0'], 10)
+        self.assertEqual(self.cms['3'], 7)
+        self.assertEqual(self.cms.total(), 56)
+
+    def test_update_invalid_key(self):
+        """
+        Negative test: keys preceding an invalid key are counted before TypeError is raised
+        """
+        with self.assertRaises(TypeError):
+            self.cms.update(['foo', 'bar', 1, 'baz'])
+
+        self.assertEqual(self.cms['foo'], 1)
+        self.assertEqual(self.cms['bar'], 1)
+        self.assertEqual(self.cms['baz'], 0)
+
+    def test_update_failing_iterator(self):
+        def keys():
+            yield 'foo'
+            raise KeyError('bar')
+
+        with self.assertRaises(KeyError):
+            self.cms.update(keys())
+        self.assertEqual(self.cms['foo'], 1)
+
+
 class CountMinSketchUpdateConservativeTest(CountMinSketchUpdateCommonTest):
     def __init__(self, methodName='runTest'):
         super(CountMinSketchUpdateConservativeTest, self).__init__(methodName=methodName, log_counting=None)
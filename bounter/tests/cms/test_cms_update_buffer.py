@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Author: Filip Stefanak <f.stefanak@rare-technologies.com>
+# Copyright (C) 2017 Rare Technologies
+#
+# This code is distributed under the terms and conditions
+# from the MIT License (MIT).
+
+import ctypes
+import unittest
+from array import array
+
+from bounter import CountMinSketch
+
+
+def arrow_buffers(keys, typecode='q'):
+    """Encode keys into a values buffer and offsets in the layout of an Arrow string array"""
+    encoded = [key.encode('utf-8') for key in keys]
+    offsets = array(typecode, [0])
+    for key in encoded:
+        offsets.append(offsets[-1] + len(key))
+    return b''.join(encoded), offsets
+
+
+class CountMinSketchUpdateBufferCommonTest(unittest.TestCase):
+    """
+    Functional tests for CountMinSketch.update_buffer method, which adds keys from contiguous buffers
+    """
+
+    def __init__(self, methodName='runTest', log_counting=None):
+        self.log_counting = log_counting
+        super(CountMinSketchUpdateBufferCommonTest, self).__init__(methodName=methodName)
+
+    def setUp(self):
+        self.cms = CountMinSketch(1, log_counting=self.log_counting)
+
+    def test_update_offsets_int64(self):
+        data, offsets = arrow_buffers(['foo', 'bar', 'foo', u'čučoriedka', ''])
+        self.cms.update_buffer(data, offsets)
+
+        self.assertEqual(self.cms['foo'], 2)
+        self.assertEqual(self.cms['bar'], 1)
+        self.assertEqual(self.cms[u'čučoriedka'], 1)
+        self.assertEqual(self.cms[''], 1)
+        self.assertEqual(self.cms.total(), 5)
+        self.assertEqual(self.cms.cardinality(), 4)
+
+    def test_update_offsets_int32(self):
+        data, offsets = arrow_buffers(['foo', 'bar', 'foo'], typecode='i')
+        self.cms.update_buffer(data, offsets=offsets)
+
+        self.assertEqual(self.cms['foo'], 2)
+        self.assertEqual(self.cms['bar'], 1)
+
+    def test_update_offsets_slice(self):
+        """
+        Offsets do not have to start at the beginning of the buffer
+        """
+        self.cms.update_buffer(b'xxfoobarfoo', array('q', [2, 5, 8, 11]))
+
+        self.assertEqual(self.cms['foo'], 2)
+        self.assertEqual(self.cms['bar'], 1)
+        self.assertEqual(self.cms['xxf'], 0)
+
+    def test_update_matches_update(self):
+        keys = [str(i % 37) for i in range(500)]
+        other = CountMinSketch(1, log_counting=self.log_counting)
+        other.update(keys)
+        self.cms.update_buffer(*arrow_buffers(keys))
+
+        for key in set(keys):
+            self.assertEqual(self.cms[key], other[key])
+        self.assertEqual(self.cms.total(), other.total())
+
+    def test_update_window(self):
+        keys = [u'čučoriedka %d' % (i % 37) for i in range(300)]
+        other = CountMinSketch(1, log_counting=self.log_counting)
+        other.update_buffer(keys, window=1)
+        self.cms.update_buffer(*arrow_buffers(keys), window=1024)
+
+        for key in set(keys):
+            self.assertEqual(self.cms[key], other[key])
+        self.assertEqual(self.cms.total(), other.total())
+
+    def test_update_invalid_window(self):
+        with self.assertRaises(ValueError):
+            self.cms.update_buffer(['foo'], window=0)
+
+        with self.assertRaises(ValueError):
+            self.cms.update_buffer(['foo'], window=1025)
+
+    def test_update_list(self):
+        self.cms.update_buffer(['foo', b'bar', u'foo'])
+
+        self.assertEqual(self.cms['foo'], 2)
+        self.assertEqual(self.cms['bar'], 1)
+
+    def test_update_byte_matrix(self):
+        data = memoryview(b'foo\0\0bar\0\0foo\0\0hello').cast('B', shape=[4, 5])
+        self.cms.update_buffer(data)
+
+        self.assertEqual(self.cms['foo'], 2)
+        self.assertEqual(self.cms['bar'], 1)
+        self.assertEqual(self.cms['hello'], 1)
+
+    def test_update_ucs4_matrix(self):
+        if ctypes.sizeof(ctypes.c_wchar) != 4:
+            self.skipTest("wchar_t is not UCS4 on this platform")
+        data = (ctypes.c_wchar * 4 * 3)()
+        for i, key in enumerate([u'foo', u'平仮名', u'foo']):
+            data[i].value = key
+
+        self.cms.update_buffer(data)
+
+        self.assertEqual(self.cms[u'foo'], 2)
+        self.assertEqual(self.cms[u'平仮名'], 1)
+
+    def test_update_invalid_offsets(self):
+        """
+        Negative test: offsets out of bounds or decreasing yield ValueError, unsupported buffers yield TypeError
+        """
+        with self.assertRaises(ValueError):
+            self.cms.update_buffer(b'foobar', array('q', [0, 3, 7]))
+
+        with self.assertRaises(ValueError):
+            self.cms.update_buffer(b'foobar', array('q', [0, 3, 2]))
+
+        with self.assertRaises(TypeError):
+            self.cms.update_buffer(b'foobar', array('d', [0, 3, 6]))
+
+        with self.assertRaises(TypeError):
+            self.cms.update_buffer(b'foobar')
+
+        self.assertEqual(self.cms.total(), 0)
+
+
+class CountMinSketchUpdateBufferConservativeTest(CountMinSketchUpdateBufferCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchUpdateBufferConservativeTest, self).__init__(methodName=methodName, log_counting=None)
+
+
+class CountMinSketchUpdateBufferLog1024Test(CountMinSketchUpdateBufferCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchUpdateBufferLog1024Test, self).__init__(methodName=methodName, log_counting=1024)
+
+
+class CountMinSketchUpdateBufferLog8Test(CountMinSketchUpdateBufferCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchUpdateBufferLog8Test, self).__init__(methodName=methodName, log_counting=8)
+
+
+def load_tests(loader, tests, pattern):
+    test_cases = unittest.TestSuite()
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchUpdateBufferConservativeTest))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchUpdateBufferLog1024Test))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchUpdateBufferLog8Test))
+    return test_cases
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Author: Filip Stefanak <f.stefanak@rare-technologies.com>
+# Copyright (C) 2017 Rare Technologies
+#
+# This code is distributed under the terms and conditions
+# from the MIT License (MIT).
+
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+import bounter_cmsc
+from bounter import CountMinSketch
+from bounter.count_min_sketch import CellSize
+
+TEXT = u"a rose is a rose\n\tis  a rose\r\n\nčučoriedka a rose"
+
+
+class CountMinSketchUpdateFromFileCommonTest(unittest.TestCase):
+    """
+    Functional tests for CountMinSketch.update_from_file method, which counts tokens of a file natively
+    """
+
+    def __init__(self, methodName='runTest', log_counting=None, cell_size=CellSize.BITS_32):
+        self.log_counting = log_counting
+        self.cell_size = cell_size
+        super(CountMinSketchUpdateFromFileCommonTest, self).__init__(methodName=methodName)
+
+    def new_cms(self):
+        return CountMinSketch(1, log_counting=self.log_counting, cell_size=self.cell_size, seed=1)
+
+    def setUp(self):
+        self.cms = self.new_cms()
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'text.txt')
+        with open(self.path, 'wb') as text:
+            text.write(TEXT.encode('utf-8'))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_whitespace(self):
+        self.cms.update_from_file(self.path)
+
+        self.assertEqual(self.cms['a'], 4)
+        self.assertEqual(self.cms['rose'], 4)
+        self.assertEqual(self.cms['is'], 2)
+        self.assertEqual(self.cms[u'čučoriedka'], 1)
+        self.assertEqual(self.cms.total(), 11)
+        self.assertEqual(self.cms.cardinality(), 4)
+
+    def test_ngrams_within_lines(self):
+        self.cms.update_from_file(self.path, ngram=2)
+
+        self.assertEqual(self.cms['a rose'], 4)
+        self.assertEqual(self.cms['rose is'], 1)
+        self.assertEqual(self.cms['is a'], 2)
+        self.assertEqual(self.cms[u'čučoriedka a'], 1)
+        self.assertEqual(self.cms['rose čučoriedka'], 0)
+        self.assertEqual(self.cms.total(), 8)
+
+    def test_lines(self):
+        self.cms.update_from_file(self.path, tokenizer='line')
+
+        self.assertEqual(self.cms['a rose is a rose'], 1)
+        self.assertEqual(self.cms['\tis  a rose'], 1)
+        self.assertEqual(self.cms[u'čučoriedka a rose'], 1)
+        self.assertEqual(self.cms.total(), 3)
+
+    def test_file_descriptor(self):
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            os.lseek(fd, len(u'a rose is a rose\n'), os.SEEK_SET)
+            self.cms.update_from_file(fd)
+            os.fstat(fd)  # still open
+        finally:
+            os.close(fd)
+        self.assertEqual(self.cms['rose'], 2)
+        self.assertEqual(self.cms.total(), 6)
+
+        cms = self.new_cms()
+        with open(self.path, 'rb') as text:
+            cms.update_from_file(text)
+            self.assertFalse(text.closed)
+        self.assertEqual(cms['rose'], 4)
+
+    def test_matches_update(self):
+        lines = [' '.join(str((i * j) % 101) for j in range(i % 17)) for i in range(2000)]
+        with open(self.path, 'w') as text:
+            text.write('\n'.join(lines))
+        expected = self.new_cms()
+        for line in lines:
+            tokens = line.split()
+            expected.update(' '.join(tokens[i:i + 3]) for i in range(len(tokens) - 2))
+
+        self.cms.update_from_file(self.path, ngram=3)
+        self.assertEqual(self.cms.total(), expected.total())
+        for key in ('0 0 0', '1 2 3', '5 10 15', '7 14 21'):
+            self.assertEqual(self.cms[key], expected[key])
+
+    def test_long_lines(self):
+        """
+        Lines longer than a block of the reader
+        """
+        with open(self.path, 'w') as text:
+            text.write(('x' * 3000000 + ' ') * 2 + 'y\n' + 'y' * 1500000)
+        self.cms.update_from_file(self.path)
+
+        self.assertEqual(self.cms['x' * 3000000], 2)
+        self.assertEqual(self.cms['y' * 1500000], 1)
+        self.assertEqual(self.cms['y'], 1)
+
+    @unittest.skipUnless(bounter_cmsc.ZLIB, "bounter was built without zlib")
+    def test_gzip(self):
+        compressed = os.path.join(self.dir, 'text.txt.gz')
+        with gzip.open(compressed, 'wb') as text, open(self.path, 'wb') as plain:
+            for _ in range(20000):
+                text.write(TEXT.encode('utf-8') + b'\n')
+                plain.write(TEXT.encode('utf-8') + b'\n')
+        self.cms.update_from_file(compressed)
+        expected = self.new_cms()
+        expected.update_from_file(self.path)
+
+        self.assertEqual(self.cms.total(), 220000)
+        for key in ('a', 'rose', 'is', u'čučoriedka'):
+            self.assertEqual(self.cms[key], expected[key])
+
+    @unittest.skipUnless(bounter_cmsc.ZLIB, "bounter was built without zlib")
+    def test_corrupted_gzip(self):
+        compressed = os.path.join(self.dir, 'text.txt.gz')
+        with gzip.open(compressed, 'wb') as text:
+            text.write(os.urandom(100000))
+        with open(compressed, 'r+b') as text:
+            text.seek(1000)
+            text.write(b'\0' * 1000)
+        with self.assertRaises(IOError):
+            self.cms.update_from_file(compressed)
+
+    @unittest.skipIf(bounter_cmsc.ZLIB, "bounter was built with zlib")
+    def test_gzip_without_zlib(self):
+        compressed = os.path.join(self.dir, 'text.txt.gz')
+        with gzip.open(compressed, 'wb') as text:
+            text.write(TEXT.encode('utf-8'))
+        with self.assertRaises(ValueError):
+            self.cms.update_from_file(compressed)
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            self.cms.update_from_file(self.path, tokenizer='words')
+        with self.assertRaises(ValueError):
+            self.cms.update_from_file(self.path, ngram=0)
+        with self.assertRaises(ValueError):
+            self.cms.update_from_file(self.path, tokenizer='line', ngram=2)
+        with self.assertRaises(ValueError):
+            self.cms.update_from_file(self.path, encoding='latin-1')
+        with self.assertRaises(LookupError):
+            self.cms.update_from_file(self.path, encoding='no-such-encoding')
+        with self.assertRaises(IOError):
+            self.cms.update_from_file(os.path.join(self.dir, 'missing.txt'))
+        self.assertEqual(self.cms.total(), 0)
+
+
+class CountMinSketchUpdateFromFileConservativeTest(CountMinSketchUpdateFromFileCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchUpdateFromFileConservativeTest, self).__init__(methodName=methodName, log_counting=None)
+
+
+class CountMinSketchUpdateFromFile64Test(CountMinSketchUpdateFromFileCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchUpdateFromFile64Test, self).__init__(methodName=methodName, cell_size=CellSize.BITS_64)
+
+
+class CountMinSketchUpdateFromFileLog1024Test(CountMinSketchUpdateFromFileCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchUpdateFromFileLog1024Test, self).__init__(methodName=methodName, log_counting=1024)
+
+
+class CountMinSketchUpdateFromFileLog8Test(CountMinSketchUpdateFromFileCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchUpdateFromFileLog8Test, self).__init__(methodName=methodName, log_counting=8)
+
+
+def load_tests(loader, tests, pattern):
+    test_cases = unittest.TestSuite()
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchUpdateFromFileConservativeTest))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchUpdateFromFile64Test))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchUpdateFromFileLog1024Test))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchUpdateFromFileLog8Test))
+    return test_cases
+
+
+if __name__ == '__main__':
+    unittest.main()
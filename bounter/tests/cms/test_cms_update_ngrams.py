@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Author: Filip Stefanak <f.stefanak@rare-technologies.com>
+# Copyright (C) 2017 Rare Technologies
+#
+# This code is distributed under the terms and conditions
+# from the MIT License (MIT).
+
+import unittest
+from array import array
+
+from bounter import CountMinSketch
+from bounter.count_min_sketch import CellSize
+
+
+def ngrams(tokens, n, sep=' '):
+    return [sep.join(tokens[i:i + n]) for i in range(len(tokens) - n + 1)]
+
+
+class CountMinSketchUpdateNgramsCommonTest(unittest.TestCase):
+    """
+    Functional tests for CountMinSketch.update_ngrams method, which counts n-grams of token sequences
+    """
+
+    def __init__(self, methodName='runTest', log_counting=None, cell_size=CellSize.BITS_32):
+        self.log_counting = log_counting
+        self.cell_size = cell_size
+        super(CountMinSketchUpdateNgramsCommonTest, self).__init__(methodName=methodName)
+
+    def new_cms(self, **kwargs):
+        return CountMinSketch(1, log_counting=self.log_counting, cell_size=self.cell_size, seed=1, **kwargs)
+
+    def setUp(self):
+        self.cms = self.new_cms()
+
+    def test_bigrams(self):
+        self.cms.update_ngrams(['a', 'rose', 'is', 'a', 'rose'], 2)
+
+        self.assertEqual(self.cms['a rose'], 2)
+        self.assertEqual(self.cms['rose is'], 1)
+        self.assertEqual(self.cms['is a'], 1)
+        self.assertEqual(self.cms['rose'], 0)
+        self.assertEqual(self.cms.total(), 4)
+        self.assertEqual(self.cms.cardinality(), 3)
+
+    def test_matches_update(self):
+        tokens = [str(i % 13) for i in range(300)]
+        for n in (1, 2, 3, 5):
+            expected = self.new_cms()
+            expected.update(ngrams(tokens, n, '_'))
+            cms = self.new_cms()
+            cms.update_ngrams(tokens, n, sep='_')
+
+            self.assertEqual(cms.total(), expected.total())
+            for key in set(ngrams(tokens, n, '_')):
+                self.assertEqual(cms[key], expected[key])
+
+    def test_short_sequence(self):
+        self.cms.update_ngrams(['a', 'b'], 3)
+        self.cms.update_ngrams([], 2)
+        self.assertEqual(self.cms.total(), 0)
+
+    def test_separators(self):
+        self.cms.update_ngrams([u'čučoriedka', b'jam'], 2, sep=u' → ')
+        self.cms.update_ngrams(['x', 'y', 'z'], 3, sep=b'')
+        self.assertEqual(self.cms[u'čučoriedka → jam'], 1)
+        self.assertEqual(self.cms['xyz'], 1)
+
+    def test_offsets(self):
+        tokens = ['to', 'be', 'or', 'not', 'to', 'be']
+        offsets = array('q', [0])
+        for token in tokens:
+            offsets.append(offsets[-1] + len(token))
+        self.cms.update_ngrams(''.join(tokens).encode('utf-8'), 2, offsets=offsets)
+
+        self.assertEqual(self.cms['to be'], 2)
+        self.assertEqual(self.cms['not to'], 1)
+        self.assertEqual(self.cms.total(), 5)
+
+    def test_top_k(self):
+        cms = self.new_cms(top_k=2)
+        cms.update_ngrams(['a', 'b', 'c', 'a', 'b', 'a', 'b'], 2)
+        self.assertEqual(cms.most_common(1), [('a b', 3)])
+
+    def test_invalid_n(self):
+        with self.assertRaises(ValueError):
+            self.cms.update_ngrams(['a', 'b'], 0)
+
+    def test_invalid_token(self):
+        with self.assertRaises(TypeError):
+            self.cms.update_ngrams(['a', 1], 2)
+
+
+class CountMinSketchUpdateNgramsConservativeTest(CountMinSketchUpdateNgramsCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchUpdateNgramsConservativeTest, self).__init__(methodName=methodName, log_counting=None)
+
+
+class CountMinSketchUpdateNgrams64Test(CountMinSketchUpdateNgramsCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchUpdateNgrams64Test, self).__init__(methodName=methodName, cell_size=CellSize.BITS_64)
+
+
+class CountMinSketchUpdateNgramsLog1024Test(CountMinSketchUpdateNgramsCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchUpdateNgramsLog1024Test, self).__init__(methodName=methodName, log_counting=1024)
+
+
+class CountMinSketchUpdateNgramsLog8Test(CountMinSketchUpdateNgramsCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchUpdateNgramsLog8Test, self).__init__(methodName=methodName, log_counting=8)
+
+
+def load_tests(loader, tests, pattern):
+    test_cases = unittest.TestSuite()
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchUpdateNgramsConservativeTest))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchUpdateNgrams64Test))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchUpdateNgramsLog1024Test))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchUpdateNgramsLog8Test))
+    return test_cases
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Author: Filip Stefanak <f.stefanak@rare-technologies.com>
+# Copyright (C) 2017 Rare Technologies
+#
+# This code is distributed under the terms and conditions
+# from the MIT License (MIT).
+
+import pickle
+import unittest
+
+from bounter import CountMinSketch
+from bounter.count_min_sketch import HashMode, Layout
+
+
+class CountMinSketchWideCommonTest(unittest.TestCase):
+    """
+    Functional tests for the wide (64-bit) hash mode of CountMinSketch
+    """
+
+    def __init__(self, methodName='runTest', log_counting=None):
+        self.log_counting = log_counting
+        super(CountMinSketchWideCommonTest, self).__init__(methodName=methodName)
+
+    def setUp(self):
+        self.cms = CountMinSketch(1, log_counting=self.log_counting, hash_mode=HashMode.WIDE)
+
+    def test_increment_and_get(self):
+        self.cms.update(['foo', 'bar', 'foo', b'foo'])
+        self.cms.increment('baz', 5)
+
+        self.assertEqual(self.cms['foo'], 3)
+        self.assertEqual(self.cms['bar'], 1)
+        self.assertEqual(self.cms['baz'], 5)
+        self.assertEqual(self.cms['unknown'], 0)
+        self.assertEqual(self.cms.total(), 9)
+        self.assertEqual(self.cms.cardinality(), 3)
+
+    def test_quality(self):
+        for i in range(self.cms.width // 2):
+            self.cms.increment(str(i))
+
+        self.assertGreaterEqual(self.cms.quality(), 0.45)
+        self.assertLessEqual(self.cms.quality(), 0.55)
+
+    def test_cardinality(self):
+        self.cms.update_buffer([str(i) for i in range(200000)])
+
+        self.assertAlmostEqual(self.cms.cardinality() / 200000.0, 1, delta=0.03)
+
+    def test_blocked_layout(self):
+        cms = CountMinSketch(width=2 ** 12, depth=4, log_counting=self.log_counting, hash_mode=HashMode.WIDE,
+                             layout=Layout.BLOCKED)
+        cms.update(['foo', 'bar', 'foo'])
+
+        self.assertEqual(cms['foo'], 2)
+        self.assertEqual(cms['bar'], 1)
+        self.assertEqual(cms.cardinality(), 2)
+
+    def test_pickle_keeps_hash_mode(self):
+        self.cms.update(['foo', 'bar', 'foo'])
+
+        reloaded = pickle.loads(pickle.dumps(self.cms))
+        self.assertEqual(reloaded['foo'], 2)
+        self.assertEqual(reloaded.cardinality(), 2)
+
+        reloaded.increment('foo')
+        self.assertEqual(reloaded['foo'], 3)
+
+    def test_merge(self):
+        other = CountMinSketch(1, log_counting=self.log_counting, hash_mode=HashMode.WIDE)
+        self.cms.update({'a': 1, 'b': 3})
+        other.update({'a': 2, 'c': 4})
+
+        self.cms.merge(other)
+        self.assertEqual(self.cms['a'], 3)
+        self.assertEqual(self.cms['c'], 4)
+        self.assertEqual(self.cms.cardinality(), 3)
+
+    def test_merge_different_hash_mode(self):
+        """
+        Negative test: the buckets and cardinality estimators of the wide mode differ from the double hashing
+        """
+        other = CountMinSketch(1, log_counting=self.log_counting, hash_mode=HashMode.DOUBLE)
+        with self.assertRaises(ValueError):
+            self.cms.merge(other)
+
+    def test_width_above_32_bits(self):
+        """
+        Negative test: widths above 2^32 can not be addressed by 32-bit hashes
+        """
+        for hash_mode in (HashMode.PER_ROW, HashMode.DOUBLE):
+            with self.assertRaises(ValueError):
+                CountMinSketch(width=2 ** 33, depth=1, log_counting=self.log_counting, hash_mode=hash_mode)
+
+
+class CountMinSketchWideConservativeTest(CountMinSketchWideCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchWideConservativeTest, self).__init__(methodName=methodName, log_counting=None)
+
+
+class CountMinSketchWideLog1024Test(CountMinSketchWideCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchWideLog1024Test, self).__init__(methodName=methodName, log_counting=1024)
+
+
+class CountMinSketchWideLog8Test(CountMinSketchWideCommonTest):
+    def __init__(self, methodName='runTest'):
+        super(CountMinSketchWideLog8Test, self).__init__(methodName=methodName, log_counting=8)
+
+
+def load_tests(loader, tests, pattern):
+    test_cases = unittest.TestSuite()
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchWideConservativeTest))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchWideLog1024Test))
+    test_cases.addTests(loader.loadTestsFromTestCase(CountMinSketchWideLog8Test))
+    return test_cases
+
+
+if __name__ == '__main__':
+    unittest.main()
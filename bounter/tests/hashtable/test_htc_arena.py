@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Author: Filip Stefanak <f.stefanak@rare-technologies.com>
+# Copyright (C) 2017 Rare Technologies
+#
+# This code is distributed under the terms and conditions
+# from the MIT License (MIT).
+
+import pickle
+import unittest
+
+from bounter import HashTable
+
+
+class HashTableArenaTest(unittest.TestCase):
+    """
+    Long keys live in arena blocks, which are compacted once pruning leaves enough of them unused
+    """
+
+    def setUp(self):
+        self.ht = HashTable(buckets=4096)
+
+    @staticmethod
+    def key(i):
+        return 'a rather long key number %d' % i
+
+    def test_prune_cycles(self):
+        survivors = {}
+        mems = []
+        for cycle in range(20):
+            # every cycle adds a new generation of keys, of which only one per hundred survives pruning
+            counts = {self.key(cycle * 2000 + i): (2 if i % 100 == 0 else 1) for i in range(2000)}
+            self.ht.update(counts)
+            self.ht.prune(1)
+            survivors.update({key: count for key, count in counts.items() if count > 1})
+            mems.append(self.ht._mem())
+
+            self.assertEqual(dict(self.ht.items()), survivors)
+
+        # the space of the pruned keys is reused rather than accumulated
+        self.assertLess(mems[-1], mems[0] * 2)
+
+    def test_keys_survive_compaction(self):
+        self.ht.update({self.key(i): i % 10 + 1 for i in range(3000)})
+        self.ht.update(['short', u'žluťoučký kůň'])
+        self.ht.prune(9)
+
+        expected = {self.key(i): 10 for i in range(3000) if i % 10 == 9}
+        self.assertEqual(dict(self.ht.items()), expected)
+
+        self.ht.update([self.key(9), self.key(10), 'short'])
+        self.assertEqual(self.ht[self.key(9)], 11)
+        self.assertEqual(self.ht[self.key(10)], 1)
+        self.assertEqual(self.ht['short'], 1)
+
+    def test_pickle(self):
+        counts = {self.key(i): i + 1 for i in range(1000)}
+        counts.update({'a': 5, 'abcdefg': 6})
+        self.ht.update(counts)
+        self.ht.prune(500)
+        counts = {key: count for key, count in counts.items() if count > 500}
+
+        for protocol in (2, pickle.HIGHEST_PROTOCOL):
+            reloaded = pickle.loads(pickle.dumps(self.ht, protocol))
+            self.assertEqual(dict(reloaded.items()), counts)
+
+            # the reloaded keys can be pruned and compacted in turn
+            reloaded.prune(900)
+            reloaded.update([self.key(999), 'new key which is long enough'])
+            self.assertEqual(reloaded[self.key(999)], 1001)
+            self.assertEqual(reloaded['new key which is long enough'], 1)
+            self.assertEqual(len(reloaded), 101)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Author: Filip Stefanak <f.stefanak@rare-technologies.com>
+# Copyright (C) 2017 Rare Technologies
+#
+# This code is distributed under the terms and conditions
+# from the MIT License (MIT).
+
+import pickle
+import unittest
+
+from bounter import HashTable
+
+
+class HashTableCollisionsTest(unittest.TestCase):
+    """
+    Exact counts of a heavily loaded table, where many keys share their buckets and some their whole 32-bit hashes
+    """
+
+    def setUp(self):
+        # with over 10^5 keys, a few pairs of them are expected to share the fingerprint
+        self.keys = ['key%d' % i for i in range(180000)]
+        self.counts = {key: 1 + i % 7 for i, key in enumerate(self.keys)}
+        self.ht = HashTable(buckets=2 ** 18)
+        self.ht.update(self.counts)
+
+    def test_counts(self):
+        self.assertEqual(len(self.ht), len(self.keys))
+        self.assertEqual(list(self.ht.get_many(self.keys)), [self.counts[key] for key in self.keys])
+        self.assertEqual(dict(self.ht.items()), self.counts)
+        self.assertEqual(self.ht['key-missing'], 0)
+
+    def test_pickle(self):
+        reloaded = pickle.loads(pickle.dumps(self.ht))
+        self.assertEqual(list(reloaded.get_many(self.keys)), [self.counts[key] for key in self.keys])
+
+        reloaded.update(self.keys[:1000])
+        self.assertEqual(reloaded[self.keys[0]], self.counts[self.keys[0]] + 1)
+        self.assertEqual(len(reloaded), len(self.keys))
+
+    def test_prune(self):
+        self.ht.prune(3)
+
+        expected = {key: count for key, count in self.counts.items() if count > 3}
+        self.assertEqual(dict(self.ht.items()), expected)
+        self.assertEqual(list(self.ht.get_many(self.keys)), [expected.get(key, 0) for key in self.keys])
+
+        self.ht.update(self.keys)
+        self.assertEqual(self.ht[self.keys[0]], 1)
+        self.assertEqual(self.ht[self.keys[6]], 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Author: Filip Stefanak <f.stefanak@rare-technologies.com>
+# Copyright (C) 2017 Rare Technologies
+#
+# This code is distributed under the terms and conditions
+# from the MIT License (MIT).
+
+import pickle
+import unittest
+
+from bounter import HashTable
+
+
+class HashTableDecayTest(unittest.TestCase):
+
+    def test_decay(self):
+        ht = HashTable(buckets=64)
+        ht.update({'a': 10, 'b': 3, 'c': 1})
+
+        ht.decay(0.5)
+        self.assertEqual(set(ht.items()), set({'a': 5, 'b': 1}.items()))
+        self.assertEqual(len(ht), 2)
+        self.assertEqual(ht.total(), 6)
+
+        ht.decay(1)
+        self.assertEqual(set(ht.items()), set({'a': 5, 'b': 1}.items()))
+
+    def test_decay_frees_buckets(self):
+        """
+        Entries removed by decay make room for new ones without pruning the remaining entries
+        """
+        ht = HashTable(buckets=8)
+        ht.update({'a': 3, 'b': 1, 'c': 1, 'd': 1, 'e': 1, 'f': 1})
+        ht.decay(0.6)
+        ht.update(['x', 'y', 'z', 'w'])
+        self.assertEqual(set(ht.items()), set({'a': 1, 'x': 1, 'y': 1, 'z': 1, 'w': 1}.items()))
+
+    def test_decay_invalid_factor(self):
+        ht = HashTable(buckets=64)
+        for factor in (0, -0.5, 1.5):
+            with self.assertRaises(ValueError):
+                ht.decay(factor)
+
+    def test_half_life(self):
+        ht = HashTable(buckets=64, half_life=64)
+        self.assertEqual(ht.half_life, 64)
+
+        # a single increment of half-life sweeps the whole table once
+        ht.increment('a', 64)
+        self.assertEqual(ht['a'], 32)
+        self.assertEqual(ht.total(), 32)
+
+        ht.increment('b', 128)
+        self.assertEqual(ht['a'], 8)
+        self.assertEqual(ht['b'], 32)
+        self.assertEqual(ht.total(), 40)
+
+        # small increments decay one slice of the table at a time
+        for _ in range(64):
+            ht.increment('c')
+        self.assertEqual(ht['a'], 4)
+        self.assertEqual(ht['b'], 16)
+
+    def test_half_life_update_buffer(self):
+        ht = HashTable(buckets=64, half_life=64)
+        ht.increment('a', 80)
+        ht.update_buffer([u'x'] * 64)
+        self.assertEqual(ht['a'], 20)
+
+    def test_half_life_removes_zero_counts(self):
+        ht = HashTable(buckets=16, half_life=16)
+        for i in range(200):
+            ht.increment(str(i))
+        self.assertLessEqual(len(ht), 12)
+        self.assertLess(ht.total(), 200)
+
+    def test_negative_half_life(self):
+        with self.assertRaises(ValueError):
+            HashTable(buckets=64, half_life=-1)
+
+    def test_pickle(self):
+        ht = HashTable(buckets=64, half_life=100)
+        ht.increment('a', 150)
+        ht.increment('b', 30)
+
+        reloaded = pickle.loads(pickle.dumps(ht))
+        self.assertEqual(reloaded.half_life, 100)
+        self.assertEqual(set(reloaded.items()), set(ht.items()))
+
+        ht.increment('c', 70)
+        reloaded.increment('c', 70)
+        self.assertEqual(set(reloaded.items()), set(ht.items()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Author: Filip Stefanak <f.stefanak@rare-technologies.com>
+# Copyright (C) 2017 Rare Technologies
+#
+# This code is distributed under the terms and conditions
+# from the MIT License (MIT).
+
+import unittest
+from array import array
+
+from bounter import HashTable
+
+
+class HashTableGetManyTest(unittest.TestCase):
+    """
+    Functional tests for HashTable.get_many method, which retrieves counts of a batch of keys
+    """
+
+    def setUp(self):
+        self.ht = HashTable(buckets=64)
+        self.ht.update({'foo': 3, 'bar': 1, u'čučoriedka': 7})
+
+    def test_get_many_list(self):
+        result = self.ht.get_many(['foo', b'bar', 'unknown', u'čučoriedka', 'foo'])
+
+        self.assertEqual(result.itemsize, 8)
+        self.assertEqual(list(result), [3, 1, 0, 7, 3])
+
+    def test_get_many_empty(self):
+        self.assertEqual(list(self.ht.get_many([])), [])
+
+    def test_get_many_offsets(self):
+        result = self.ht.get_many(b'foobarbaz', array('q', [0, 3, 6, 9]))
+        self.assertEqual(list(result), [3, 1, 0])
+
+    def test_get_many_deleted(self):
+        del self.ht['foo']
+        self.assertEqual(list(self.ht.get_many(['foo', 'bar'])), [0, 1])
+
+    def test_get_many_invalid_key(self):
+        """
+        Negative test: keys which are not strings or bytes yield TypeError, keys with null bytes yield ValueError
+        """
+        with self.assertRaises(TypeError):
+            self.ht.get_many(['foo', 1])
+
+        with self.assertRaises(ValueError):
+            self.ht.get_many(['foo', 'f\0o'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Author: Filip Stefanak <f.stefanak@rare-technologies.com>
+# Copyright (C) 2017 Rare Technologies
+#
+# This code is distributed under the terms and conditions
+# from the MIT License (MIT).
+
+import pickle
+import unittest
+from array import array
+
+from bounter import HashTable
+
+
+class HashTableHashesTest(unittest.TestCase):
+    """
+    Functional tests for HashTable keyed by 64-bit hashes computed by the caller
+    """
+
+    def setUp(self):
+        self.ht = HashTable(buckets=64, hashed=True)
+
+    def test_increment_and_get(self):
+        self.ht.increment_hashes(array('Q', [1, 2 ** 64 - 1, 1]))
+        self.ht.increment_hashes(array('q', [-1, 5]), counts=array('q', [2, 0]))
+
+        self.assertTrue(self.ht.hashed)
+        self.assertEqual(list(self.ht.get_hashes(array('Q', [1, 2 ** 64 - 1, 5]))), [2, 3, 0])
+        self.assertEqual(set(self.ht.items()), {(1, 2), (2 ** 64 - 1, 3)})
+        self.assertEqual(self.ht.total(), 5)
+        self.assertEqual(len(self.ht), 2)
+
+    def test_integer_keys(self):
+        self.ht.increment(42, 3)
+        self.ht[7] = 5
+        self.ht.update([42, 8])
+        self.ht.update({9: 2})
+        del self.ht[7]
+
+        self.assertEqual(self.ht[42], 4)
+        self.assertEqual(self.ht[-1], 0)
+        self.assertEqual(list(self.ht.get_hashes(array('Q', [42, 8, 9]))), [4, 1, 2])
+        self.assertEqual(sorted(self.ht.keys()), [8, 9, 42])
+
+    def test_with_pruning(self):
+        self.ht.increment_hashes(array('Q', range(1000)))
+        self.ht.increment_hashes(array('Q', [999] * 10))
+
+        self.assertLessEqual(len(self.ht), 48)
+        self.assertEqual(self.ht[999], 11)
+
+    def test_pickle(self):
+        self.ht.increment_hashes(array('Q', [3, 3, 2 ** 63]))
+
+        reloaded = pickle.loads(pickle.dumps(self.ht))
+        self.assertTrue(reloaded.hashed)
+        self.assertEqual(set(reloaded.items()), {(3, 2), (2 ** 63, 1)})
+
+    def test_pickle_out_of_band(self):
+        self.ht.increment_hashes(array('Q', [0, 0, 1, 2 ** 64 - 1]))
+
+        for protocol in (2, pickle.HIGHEST_PROTOCOL):
+            reloaded = pickle.loads(pickle.dumps(self.ht, protocol))
+            self.assertEqual(set(reloaded.items()), {(0, 2), (1, 1), (2 ** 64 - 1, 1)})
+            self.assertEqual(reloaded.cardinality(), self.ht.cardinality())
+            reloaded.increment_hashes(array('Q', [0, 2]))
+            self.assertEqual(list(reloaded.get_hashes(array('Q', [0, 1, 2]))), [3, 1, 1])
+
+    def test_sequential_hashes(self):
+        """
+        Hashes are spread over the buckets and the cardinality estimator even if they are not random
+        """
+        ht = HashTable(buckets=2 ** 15, hashed=True)
+        ht.increment_hashes(array('Q', range(20000)))
+        ht.increment_hashes(array('Q', range(0, 20000, 2)))
+
+        self.assertEqual(len(ht), 20000)
+        self.assertEqual(list(ht.get_hashes(array('Q', [0, 1, 19998, 19999, 20000]))), [2, 1, 2, 1, 0])
+        self.assertAlmostEqual(ht.cardinality(), 20000, delta=20000 * 0.02)
+
+    def test_memory(self):
+        """
+        The hashes are kept within the table, so the memory does not grow with the number of keys
+        """
+        ht = HashTable(buckets=4096, hashed=True)
+        mem = ht._mem()
+        ht.increment_hashes(array('Q', range(3000)))
+        ht.prune(0)
+        self.assertEqual(ht._mem(), mem)
+
+    def test_string_keys(self):
+        """
+        Negative test: a table keyed by hashes does not take strings, and vice versa
+        """
+        with self.assertRaises(TypeError):
+            self.ht.increment('foo')
+        with self.assertRaises(TypeError):
+            self.ht.update_buffer(['foo'])
+        with self.assertRaises(TypeError):
+            self.ht.update_ngrams(['foo', 'bar'], 2)
+        with self.assertRaises(TypeError):
+            HashTable(buckets=64).increment_hashes(array('Q', [1]))
+        with self.assertRaises(TypeError):
+            HashTable(buckets=64).get_hashes(array('Q', [1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Author: Filip Stefanak <f.stefanak@rare-technologies.com>
+# Copyright (C) 2017 Rare Technologies
+#
+# This code is distributed under the terms and conditions
+# from the MIT License (MIT).
+
+import pickle
+import unittest
+
+from bounter import HashTable
+
+
+class HashTableInlineKeysTest(unittest.TestCase):
+    """
+    Short keys are stored inside the cells, longer ones on the heap, and both behave alike
+    """
+
+    def setUp(self):
+        self.ht = HashTable(buckets=1024)
+        # lengths around the inline limit of 7 bytes, with multi-byte characters and prefixes of each other
+        self.counts = {'': 1, 'a': 2, 'ab': 3, 'abcdefg': 4, 'abcdefgh': 5, 'abcdefghijklmnop': 6, u'čaj': 7,
+                       u'čajovna': 8, u'žluťoučký kůň': 9, '\x7f': 10}
+        self.ht.update(self.counts)
+
+    def test_get(self):
+        for key, count in self.counts.items():
+            self.assertEqual(self.ht[key], count)
+            self.assertEqual(self.ht[key.encode('utf-8')], count)
+        for key in ('abc', 'abcdef', 'abcdefgi', 'b', u'čajovn'):
+            self.assertEqual(self.ht[key], 0)
+        self.assertEqual(list(self.ht.get_many(list(self.counts))), list(self.counts.values()))
+
+    def test_iteration(self):
+        self.assertEqual(dict(self.ht.items()), self.counts)
+
+        ht = HashTable(buckets=64, use_unicode=False)
+        ht.update([b'\xff\xfe', b'\xff\xfe\xfd\xfc\xfb\xfa\xf9\xf8', b'\xff\xfe'])
+        self.assertEqual(dict(ht.items()), {b'\xff\xfe': 2, b'\xff\xfe\xfd\xfc\xfb\xfa\xf9\xf8': 1})
+
+    def test_pickle(self):
+        for protocol in (2, pickle.HIGHEST_PROTOCOL):
+            reloaded = pickle.loads(pickle.dumps(self.ht, protocol))
+            self.assertEqual(dict(reloaded.items()), self.counts)
+
+            reloaded.update(['a', 'abcdefgh'])
+            self.assertEqual(reloaded['a'], 3)
+            self.assertEqual(reloaded['abcdefgh'], 6)
+            self.assertEqual(len(reloaded), len(self.counts))
+
+    def test_prune(self):
+        self.ht.prune(5)
+        self.assertEqual(dict(self.ht.items()), {key: count for key, count in self.counts.items() if count > 5})
+
+        self.ht.update(['a', 'abcdefgh'])
+        self.assertEqual(self.ht['a'], 1)
+        self.assertEqual(self.ht['abcdefgh'], 1)
+        self.assertEqual(self.ht[u'čaj'], 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
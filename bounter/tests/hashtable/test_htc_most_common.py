@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Author: Filip Stefanak <f.stefanak@rare-technologies.com>
+# Copyright (C) 2017 Rare Technologies
+#
+# This code is distributed under the terms and conditions
+# from the MIT License (MIT).
+
+import random
+import unittest
+from array import array
+
+from bounter import HashTable
+
+
+class HashTableMostCommonTest(unittest.TestCase):
+    """
+    most_common returns the keys with the highest counts, like collections.Counter
+    """
+
+    def setUp(self):
+        self.ht = HashTable(buckets=4096)
+        rand = random.Random(3)
+        # distinct counts spread over many bins of the histogram, including the large ones
+        counts = rand.sample(range(1, 10 ** 6), 1500) + rand.sample(range(10 ** 9, 10 ** 12), 500)
+        self.counts = {'key number %d' % i: count for i, count in enumerate(counts)}
+        self.ht.update(self.counts)
+        self.expected = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)
+
+    def test_most_common(self):
+        for n in (1, 2, 10, 100, 499, 500, 501, 1999, 2000):
+            self.assertEqual(self.ht.most_common(n), self.expected[:n])
+
+    def test_all(self):
+        self.assertEqual(self.ht.most_common(), self.expected)
+        self.assertEqual(self.ht.most_common(None), self.expected)
+        self.assertEqual(self.ht.most_common(10 ** 6), self.expected)
+        self.assertEqual(self.ht.most_common(0), [])
+
+    def test_negative(self):
+        with self.assertRaises(ValueError):
+            self.ht.most_common(-1)
+        with self.assertRaises(TypeError):
+            self.ht.most_common('a')
+
+    def test_ties(self):
+        ht = HashTable(buckets=64)
+        ht.update({'a': 5, 'b': 5, 'c': 5, 'd': 7, 'e': 1})
+        top = ht.most_common(3)
+        self.assertEqual(top[0], ('d', 7))
+        self.assertEqual([count for key, count in top], [7, 5, 5])
+        self.assertTrue(set(key for key, count in top) < {'a', 'b', 'c', 'd'})
+        self.assertEqual(ht.most_common(3), top)
+
+        ht = HashTable(buckets=4096)
+        ht.update(['key %d' % i for i in range(2000)])
+        top = ht.most_common(10)
+        self.assertEqual(len(top), 10)
+        self.assertEqual(set(count for key, count in top), {1})
+
+    def test_deleted(self):
+        for key, count in self.expected[:10]:
+            del self.ht[key]
+        self.assertEqual(self.ht.most_common(5), self.expected[10:15])
+        self.assertEqual(len(self.ht.most_common()), len(self.expected) - 10)
+
+    def test_key_types(self):
+        ht = HashTable(buckets=64)
+        ht.update({u'čaj': 3, 'short': 2, 'a longer key': 1})
+        self.assertEqual(ht.most_common(), [(u'čaj', 3), ('short', 2), ('a longer key', 1)])
+
+        ht = HashTable(buckets=64, use_unicode=False)
+        ht.update([b'\xff', b'\xff', b'key'])
+        self.assertEqual(ht.most_common(), [(b'\xff', 2), (b'key', 1)])
+
+        ht = HashTable(buckets=64, hashed=True)
+        ht.increment_hashes(array('Q', [2 ** 64 - 1, 5, 5]))
+        self.assertEqual(ht.most_common(), [(5, 2), (2 ** 64 - 1, 1)])
+
+    def test_empty(self):
+        self.assertEqual(HashTable(buckets=64).most_common(), [])
+        self.assertEqual(HashTable(buckets=64).most_common(5), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
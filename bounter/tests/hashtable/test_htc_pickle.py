@@ -9,6 +9,7 @@
 
 import os
 import pickle
+import sys
 import unittest
 
 from bounter import HashTable
@@ -81,6 +82,34 @@ class HashTablePickleTest(unittest.TestCase):
         reloaded = self.store_and_load()
         self.check_hashtable(reloaded)
 
+    @unittest.skipIf(sys.version_info < (3, 8), "pickle protocol 5 requires python 3.8")
+    def test_pickle_protocol_5(self):
+        self.ht.update("boss")
+        self.ht.update("pickling")
+
+        reloaded = pickle.loads(pickle.dumps(self.ht, protocol=5))
+        self.check_hashtable(reloaded)
+
+    @unittest.skipIf(sys.version_info < (3, 8), "pickle protocol 5 requires python 3.8")
+    def test_pickle_out_of_band(self):
+        """
+        With protocol 5, the table is passed as a single out-of-band buffer
+        """
+        self.ht.update("boss")
+        self.ht.update("pickling")
+        del self.ht['g']
+
+        buffers = []
+        data = pickle.dumps(self.ht, protocol=5, buffer_callback=buffers.append)
+        self.assertEqual(len(buffers), 1)
+
+        reloaded = pickle.loads(data, buffers=buffers)
+        self.check_hashtable(reloaded)
+
+        reloaded.increment('boss')
+        self.assertEqual(reloaded['boss'], 1)
+        self.assertEqual(self.ht['boss'], 0)
+        self.assertEqual(self.ht['s'], 2)
 
 
 if __name__ == '__main__':
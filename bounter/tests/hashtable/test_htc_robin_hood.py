@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Author: Filip Stefanak <f.stefanak@rare-technologies.com>
+# Copyright (C) 2017 Rare Technologies
+#
+# This code is distributed under the terms and conditions
+# from the MIT License (MIT).
+
+import random
+import struct
+import unittest
+
+from bounter import HashTable
+
+
+class HashTableRobinHoodTest(unittest.TestCase):
+    """
+    Keys are kept in the order of their home buckets, lookups of absent keys stop early
+    """
+
+    def setUp(self):
+        self.ht = HashTable(buckets=4096)
+        rand = random.Random(7)
+        # close to the limit of 3072 keys, so that the runs of occupied buckets are long
+        self.counts = {'key %d' % i: rand.randint(1, 1000) for i in range(3000)}
+        self.ht.update(self.counts)
+
+    def check(self, ht, counts):
+        for key, count in counts.items():
+            self.assertEqual(ht[key], count)
+        for i in range(3000, 6000):
+            self.assertEqual(ht['key %d' % i], 0)
+        self.assertEqual(dict(ht.items()), counts)
+        self.assertEqual(len(ht), len(counts))
+
+    def test_lookups(self):
+        self.check(self.ht, self.counts)
+
+    def test_delete_and_set(self):
+        for i in range(0, 3000, 3):
+            del self.ht['key %d' % i]
+            del self.counts['key %d' % i]
+        for i in range(6000, 6500):
+            self.ht['key %d' % i] = 0
+        self.assertEqual(dict(self.ht.items()), self.counts)
+
+        self.ht.update({'key %d' % i: 1 for i in range(0, 300, 3)})
+        self.counts.update({'key %d' % i: 1 for i in range(0, 300, 3)})
+        self.check(self.ht, self.counts)
+
+    def test_prune(self):
+        self.ht.prune(500)
+        counts = {key: count for key, count in self.counts.items() if count > 500}
+        self.check(self.ht, counts)
+
+        # the freed buckets are reused by new keys
+        new_counts = {'new key %d' % i: i for i in range(1, 1000)}
+        self.ht.update(new_counts)
+        counts.update(new_counts)
+        self.check(self.ht, counts)
+
+    def test_insertion_ordered_state(self):
+        """
+        Tables pickled with plain linear probing need not keep the runs of buckets ordered by home buckets
+        """
+        cls, args, state = self.ht.__reduce__()
+        cells = [bytes(chunk[i:i + 16]) for chunk in state[4] for i in range(0, len(chunk), 16)]
+        keys = bytes(state[5]).split(b'\0')[:-1]
+
+        # reverse the order of the keys within each run of occupied buckets
+        runs = []
+        run = []
+        for cell in cells:
+            if struct.unpack('<Q', cell[:8])[0]:
+                run.append(cell)
+            else:
+                runs.append(run)
+                runs.append([cell])
+                run = []
+        runs.append(run)
+
+        reordered = []
+        reordered_keys = []
+        key_iter = iter(keys)
+        for run in runs:
+            if len(run) == 1 and not struct.unpack('<Q', run[0][:8])[0]:
+                reordered.extend(run)
+            else:
+                reordered.extend(reversed(run))
+                reordered_keys.extend(reversed([next(key_iter) for _ in run]))
+        self.assertNotEqual(reordered_keys, keys)
+
+        table = bytearray(b''.join(reordered))
+        strings = bytearray(b''.join(key + b'\0' for key in reordered_keys))
+        ht = cls(*args)
+        ht.__setstate__(state[:4] + ([table], strings) + state[6:])
+        self.check(ht, self.counts)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Author: Filip Stefanak <f.stefanak@rare-technologies.com>
+# Copyright (C) 2017 Rare Technologies
+#
+# This code is distributed under the terms and conditions
+# from the MIT License (MIT).
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from array import array
+
+from bounter import HashTable
+
+
+def arrow_buffers(keys):
+    """Encode keys into a values buffer and offsets in the layout of an Arrow string array"""
+    encoded = [key.encode('utf-8') for key in keys]
+    offsets = array('q', [0])
+    for key in encoded:
+        offsets.append(offsets[-1] + len(key))
+    return b''.join(encoded), offsets
+
+
+class HashTableThreadsTest(unittest.TestCase):
+    """
+    Batch updates in one thread while other threads read and prune the table.
+    Batches run without the GIL, holding the lock of the table, so the readers never see it half-way through a change.
+    """
+
+    def setUp(self):
+        # a small table which prunes itself and compacts its keys all the time
+        self.ht = HashTable(buckets=1024)
+        self.switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+
+    def tearDown(self):
+        sys.setswitchinterval(self.switch_interval)
+
+    def run_with_readers(self, update):
+        done = threading.Event()
+        errors = []
+
+        def read():
+            try:
+                while not done.is_set():
+                    for key, count in self.ht.items():
+                        self.assertGreater(count, 0)
+                        self.assertGreaterEqual(self.ht[key], 0)
+                    self.ht.most_common(10)
+                    self.ht.prune(1)
+            except Exception as e:
+                errors.append(e)
+
+        readers = [threading.Thread(target=read) for _ in range(2)]
+        for reader in readers:
+            reader.start()
+        try:
+            update()
+        finally:
+            done.set()
+            for reader in readers:
+                reader.join()
+        self.assertEqual(errors, [])
+
+    def test_update_buffer(self):
+        data, offsets = arrow_buffers(['a rather long key number %d' % i for i in range(5000)])
+
+        def update():
+            for _ in range(50):
+                self.ht.update_buffer(data, offsets)
+
+        self.run_with_readers(update)
+        self.assertLessEqual(len(self.ht), 768)
+
+    def test_update_ngrams(self):
+        tokens = ['token%d' % i for i in range(3000)]
+
+        def update():
+            for _ in range(20):
+                self.ht.update_ngrams(tokens, 3)
+
+        self.run_with_readers(update)
+        self.assertLessEqual(len(self.ht), 768)
+
+    def test_update_from_file(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'tokens.txt')
+        with open(path, 'w') as f:
+            for i in range(2000):
+                f.write('a rather long token %d and another %d\n' % (i, i * 7))
+
+        def update():
+            for _ in range(10):
+                self.ht.update_from_file(path)
+
+        self.run_with_readers(update)
+        self.assertLessEqual(len(self.ht), 768)
+
+    def test_get_many(self):
+        keys = ['a rather long key number %d' % i for i in range(5000)]
+
+        def update():
+            for i in range(50):
+                self.ht.update(keys[i * 100:(i + 1) * 100])
+                self.assertEqual(len(self.ht.get_many(keys)), len(keys))
+
+        self.run_with_readers(update)
+
+    def test_decay(self):
+        keys = ['a rather long key number %d' % i for i in range(5000)]
+
+        def update():
+            for i in range(50):
+                self.ht.update(keys[i * 100:(i + 1) * 100] * 3)
+                self.ht.decay(0.5)
+
+        self.run_with_readers(update)
+        self.assertTrue(all(count > 0 for count in self.ht.values()))
+
+    def test_parallel_batches(self):
+        """
+        Batches of several threads take turns on the table, none of their increments is lost
+        """
+        ht = HashTable(buckets=1 << 16)
+        hashed = HashTable(buckets=1 << 16, hashed=True)
+        data, offsets = arrow_buffers(['key%d' % i for i in range(1000)])
+        hashes = array('q', range(-500, 500))
+
+        def update():
+            for _ in range(20):
+                ht.update_buffer(data, offsets)
+                ht.update_ngrams(['key%d' % i for i in range(10)], 2)
+                ht.increment('single')
+                hashed.increment_hashes(hashes)
+                self.assertEqual(len(hashed.get_hashes(hashes)), len(hashes))
+
+        threads = [threading.Thread(target=update) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(ht.total(), 80 * (1000 + 9 + 1))
+        self.assertEqual(ht['key7'], 80)
+        self.assertEqual(ht['key7 key8'], 80)
+        self.assertEqual(ht['single'], 80)
+        self.assertEqual(hashed.total(), 80 * 1000)
+        self.assertEqual(list(hashed.get_hashes(hashes)), [80] * 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
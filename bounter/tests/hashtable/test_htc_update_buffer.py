@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Author: Filip Stefanak <f.stefanak@rare-technologies.com>
+# Copyright (C) 2017 Rare Technologies
+#
+# This code is distributed under the terms and conditions
+# from the MIT License (MIT).
+
+import ctypes
+import unittest
+from array import array
+
+from bounter import HashTable
+
+
+def arrow_buffers(keys, typecode='q'):
+    """Encode keys into a values buffer and offsets in the layout of an Arrow string array"""
+    encoded = [key.encode('utf-8') for key in keys]
+    offsets = array(typecode, [0])
+    for key in encoded:
+        offsets.append(offsets[-1] + len(key))
+    return b''.join(encoded), offsets
+
+
+class HashTableUpdateBufferTest(unittest.TestCase):
+    """
+    Functional tests for HashTable.update_buffer method, which adds keys from contiguous buffers
+    """
+
+    def setUp(self):
+        self.ht = HashTable(buckets=64)
+
+    def test_update_offsets(self):
+        data, offsets = arrow_buffers(['foo', 'bar', 'foo', u'čučoriedka'])
+        self.ht.update_buffer(data, offsets)
+
+        self.assertEqual(set(self.ht.items()), {('foo', 2), ('bar', 1), (u'čučoriedka', 1)})
+        self.assertEqual(self.ht.total(), 4)
+
+    def test_update_offsets_int32(self):
+        self.ht.update_buffer(*arrow_buffers(['foo', 'bar', 'foo'], typecode='i'))
+        self.assertEqual(self.ht['foo'], 2)
+        self.assertEqual(self.ht['bar'], 1)
+
+    def test_update_matches_update(self):
+        keys = [str(i % 37) for i in range(500)]
+        other = HashTable(buckets=64)
+        other.update(keys)
+        self.ht.update_buffer(*arrow_buffers(keys))
+
+        self.assertEqual(set(self.ht.items()), set(other.items()))
+
+    def test_update_with_pruning(self):
+        keys = [str(i) for i in range(200)] * 2
+        self.ht.update_buffer(*arrow_buffers(keys))
+
+        self.assertEqual(self.ht.total(), 400)
+        self.assertLessEqual(len(self.ht), 48)
+
+    def test_update_list(self):
+        self.ht.update_buffer(['foo', b'bar', u'foo'])
+
+        self.assertEqual(self.ht['foo'], 2)
+        self.assertEqual(self.ht['bar'], 1)
+
+    def test_update_byte_matrix(self):
+        data = memoryview(b'foo\0\0bar\0\0foo\0\0hello').cast('B', shape=[4, 5])
+        self.ht.update_buffer(data)
+
+        self.assertEqual(set(self.ht.items()), {('foo', 2), ('bar', 1), ('hello', 1)})
+
+    def test_update_ucs4_matrix(self):
+        if ctypes.sizeof(ctypes.c_wchar) != 4:
+            self.skipTest("wchar_t is not UCS4 on this platform")
+        data = (ctypes.c_wchar * 4 * 3)()
+        for i, key in enumerate([u'foo', u'平仮名', u'foo']):
+            data[i].value = key
+
+        self.ht.update_buffer(data)
+
+        self.assertEqual(set(self.ht.items()), {(u'foo', 2), (u'平仮名', 1)})
+
+    def test_update_null_byte(self):
+        """
+        Negative test: keys containing null bytes yield ValueError
+        """
+        with self.assertRaises(ValueError):
+            self.ht.update_buffer(b'foob\0r', array('q', [0, 3, 6]))
+
+        self.assertEqual(self.ht['foo'], 1)
+
+    def test_update_invalid_offsets(self):
+        """
+        Negative test: offsets out of bounds or decreasing yield ValueError
+        """
+        with self.assertRaises(ValueError):
+            self.ht.update_buffer(b'foobar', array('q', [0, 3, 7]))
+
+        with self.assertRaises(ValueError):
+            self.ht.update_buffer(b'foobar', array('q', [3, 0, 6]))
+
+        self.assertEqual(self.ht.total(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
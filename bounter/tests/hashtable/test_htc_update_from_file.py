@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Author: Filip Stefanak <f.stefanak@rare-technologies.com>
+# Copyright (C) 2017 Rare Technologies
+#
+# This code is distributed under the terms and conditions
+# from the MIT License (MIT).
+
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+import bounter_htc
+from bounter import HashTable
+
+
+class HashTableUpdateFromFileTest(unittest.TestCase):
+    """
+    Functional tests for HashTable.update_from_file method, which counts tokens of a file natively
+    """
+
+    def setUp(self):
+        self.ht = HashTable(buckets=64)
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'text.txt')
+        with open(self.path, 'wb') as text:
+            text.write(u"to be or\0not to be\r\nčierna  ríbezľa".encode('utf-8'))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_whitespace(self):
+        self.ht.update_from_file(self.path)
+
+        self.assertEqual(set(self.ht.items()), {('to', 2), ('be', 2), ('or', 1), ('not', 1), (u'čierna', 1),
+                                                (u'ríbezľa', 1)})
+        self.assertEqual(self.ht.total(), 8)
+
+    def test_ngrams(self):
+        self.ht.update_from_file(self.path, ngram=2)
+
+        self.assertEqual(set(self.ht.items()), {('to be', 2), ('be or', 1), ('or not', 1), ('not to', 1),
+                                                (u'čierna ríbezľa', 1)})
+
+    def test_lines(self):
+        """
+        Null bytes are treated as line breaks, as the keys of the table can not contain them
+        """
+        self.ht.update_from_file(self.path, tokenizer='line')
+
+        self.assertEqual(set(self.ht.items()), {('to be or', 1), ('not to be', 1), (u'čierna  ríbezľa', 1)})
+
+    def test_with_pruning(self):
+        with open(self.path, 'w') as text:
+            for i in range(1000):
+                text.write('%d %d\n' % (i, i % 10))
+        self.ht.update_from_file(self.path)
+
+        self.assertEqual(self.ht.total(), 2000)
+        self.assertLessEqual(len(self.ht), 48)
+        self.assertEqual(self.ht['7'], 101)
+
+    @unittest.skipUnless(bounter_htc.ZLIB, "bounter was built without zlib")
+    def test_gzip(self):
+        compressed = os.path.join(self.dir, 'text.txt.gz')
+        with gzip.open(compressed, 'wb') as text:
+            text.write(b'to be or not to be\n' * 1000)
+        with open(compressed, 'rb') as text:
+            self.ht.update_from_file(text)
+
+        self.assertEqual(set(self.ht.items()), {('to', 2000), ('be', 2000), ('or', 1000), ('not', 1000)})
+
+    def test_missing_file(self):
+        with self.assertRaises(IOError):
+            self.ht.update_from_file(os.path.join(self.dir, 'missing.txt'))
+
+
+if __name__ == '__main__':
+    unittest.main()
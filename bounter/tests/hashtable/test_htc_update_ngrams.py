@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Author: Filip Stefanak <f.stefanak@rare-technologies.com>
+# Copyright (C) 2017 Rare Technologies
+#
+# This code is distributed under the terms and conditions
+# from the MIT License (MIT).
+
+import unittest
+from array import array
+
+from bounter import HashTable
+
+
+class HashTableUpdateNgramsTest(unittest.TestCase):
+    """
+    Functional tests for HashTable.update_ngrams method, which counts n-grams of token sequences
+    """
+
+    def setUp(self):
+        self.ht = HashTable(buckets=64)
+
+    def test_bigrams(self):
+        self.ht.update_ngrams(['a', 'rose', 'is', 'a', 'rose'], 2)
+
+        self.assertEqual(set(self.ht.items()), {('a rose', 2), ('rose is', 1), ('is a', 1)})
+        self.assertEqual(self.ht.total(), 4)
+
+    def test_matches_update(self):
+        tokens = [str(i % 11) for i in range(300)]
+        for n in (1, 2, 4):
+            other = HashTable(buckets=64)
+            other.update(['-'.join(tokens[i:i + n]) for i in range(len(tokens) - n + 1)])
+            ht = HashTable(buckets=64)
+            ht.update_ngrams(tokens, n, sep='-')
+
+            self.assertEqual(set(ht.items()), set(other.items()))
+
+    def test_offsets(self):
+        tokens = [u'čierna', u'ríbezľa', u'čierna', u'ríbezľa']
+        encoded = [token.encode('utf-8') for token in tokens]
+        offsets = array('i', [0])
+        for token in encoded:
+            offsets.append(offsets[-1] + len(token))
+        self.ht.update_ngrams(b''.join(encoded), 2, sep=b'+', offsets=offsets)
+
+        self.assertEqual(set(self.ht.items()), {(u'čierna+ríbezľa', 2), (u'ríbezľa+čierna', 1)})
+
+    def test_with_pruning(self):
+        tokens = [str(i) for i in range(200)]
+        self.ht.update_ngrams(tokens, 3)
+
+        self.assertEqual(self.ht.total(), 198)
+        self.assertLessEqual(len(self.ht), 48)
+
+    def test_short_sequence(self):
+        self.ht.update_ngrams(['a'], 2)
+        self.assertEqual(len(self.ht), 0)
+
+    def test_null_bytes(self):
+        """
+        Negative test: neither the tokens nor the separator may contain null bytes
+        """
+        with self.assertRaises(ValueError):
+            self.ht.update_ngrams(['a', 'b'], 2, sep='\0')
+        with self.assertRaises(ValueError):
+            self.ht.update_ngrams(['a', b'b\0'], 2)
+        with self.assertRaises(ValueError):
+            self.ht.update_ngrams(['a', 'b'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
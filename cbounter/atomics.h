@@ -0,0 +1,85 @@
+//-----------------------------------------------------------------------------
+// Author: Filip Stefanak <f.stefanak@rare-technologies.com>
+// Copyright (C) 2017 Rare Technologies
+//
+// This code is distributed under the terms and conditions
+// from the MIT License (MIT).
+
+#ifndef ATOMICS_H
+#define ATOMICS_H
+
+#include <stdint.h>
+
+/**
+  * Relaxed atomic operations on plain integers of 1, 2, 4 or 8 bytes, for counters updated by several threads
+  * at once. They work on any memory (including mapped files), so the counters need not be declared _Atomic.
+  *
+  * ATOMIC_LOAD(target) reads the value.
+  * ATOMIC_CAS(target, expected, desired) replaces the value by `desired` if it equals `*expected` and returns 1,
+  *   otherwise it stores the current value into `*expected` and returns 0.
+  * ATOMIC_FETCH_ADD(target, value) adds to an 8-byte integer and returns its previous value.
+  * SPINLOCK_ACQUIRE(lock) and SPINLOCK_RELEASE(lock) guard a few instructions with an int, which is 0 when released.
+  */
+#if defined(_MSC_VER) && !defined(__clang__)
+#include <intrin.h>
+
+static __inline int
+Atomic_cas(volatile void *target, void *expected, uint64_t desired, int size)
+{
+    switch (size)
+    {
+    case 1:
+    {
+        char old = _InterlockedCompareExchange8((volatile char *) target, (char) desired, *(char *) expected);
+        if (old == *(char *) expected)
+            return 1;
+        *(char *) expected = old;
+        return 0;
+    }
+    case 2:
+    {
+        short old = _InterlockedCompareExchange16((volatile short *) target, (short) desired, *(short *) expected);
+        if (old == *(short *) expected)
+            return 1;
+        *(short *) expected = old;
+        return 0;
+    }
+    case 4:
+    {
+        long old = _InterlockedCompareExchange((volatile long *) target, (long) desired, *(long *) expected);
+        if (old == *(long *) expected)
+            return 1;
+        *(long *) expected = old;
+        return 0;
+    }
+    default:
+    {
+        __int64 old = _InterlockedCompareExchange64((volatile __int64 *) target, (__int64) desired,
+                                                    *(__int64 *) expected);
+        if (old == *(__int64 *) expected)
+            return 1;
+        *(__int64 *) expected = old;
+        return 0;
+    }
+    }
+}
+
+// aligned loads of at most 8 bytes are atomic on all platforms supported by MSVC
+#define ATOMIC_LOAD(target) (*(target))
+#define ATOMIC_CAS(target, expected, desired) Atomic_cas((target), (expected), (uint64_t) (desired), sizeof(*(target)))
+#define ATOMIC_FETCH_ADD(target, value) _InterlockedExchangeAdd64((volatile __int64 *) (target), (__int64) (value))
+#define SPINLOCK_ACQUIRE(lock) while (_InterlockedExchange((volatile long *) (lock), 1)) ;
+#define SPINLOCK_RELEASE(lock) _InterlockedExchange((volatile long *) (lock), 0)
+
+#else
+
+#define ATOMIC_LOAD(target) __atomic_load_n((target), __ATOMIC_RELAXED)
+#define ATOMIC_CAS(target, expected, desired) \
+    __atomic_compare_exchange_n((target), (expected), (desired), 0, __ATOMIC_RELAXED, __ATOMIC_RELAXED)
+#define ATOMIC_FETCH_ADD(target, value) __atomic_fetch_add((target), (value), __ATOMIC_RELAXED)
+#define SPINLOCK_ACQUIRE(lock) while (__atomic_exchange_n((lock), 1, __ATOMIC_ACQUIRE)) ;
+#define SPINLOCK_RELEASE(lock) __atomic_store_n((lock), 0, __ATOMIC_RELEASE)
+
+#endif
+
+#endif
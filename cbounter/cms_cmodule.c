@@ -8,21 +8,10 @@
 #include <stdlib.h>
 #include <stdint.h>
 
-
-static inline uint32_t rand_32b()
-{
-    uint32_t r = rand();
-    #if RAND_MAX < 0x8000
-        r += rand() << 15;
-    #endif
-    return r;
-}
-
 #include "cms_conservative.h"
 #include "cms64_conservative.h"
 #include "cms_log8.c"
 #include "cms_log1024.c"
-#include <time.h>
 
 #if PY_MAJOR_VERSION >= 3
 static PyModuleDef CMSC_module = {
@@ -75,20 +64,25 @@ PyMODINIT_FUNC initbounter_cmsc(void)
         return;
         #endif
 
+    #ifdef Py_GIL_DISABLED
+    // sketches created with `concurrent` can be updated from many threads of a free-threaded interpreter
+    PyUnstable_Module_SetGIL(m, Py_MOD_GIL_NOT_USED);
+    #endif
+
     Py_INCREF(&CMS_ConservativeType);
     PyModule_AddObject(m, "CMS_Conservative", (PyObject *)&CMS_ConservativeType);
 
     Py_INCREF(&CMS64_ConservativeType);
     PyModule_AddObject(m, "CMS64_Conservative", (PyObject *)&CMS64_ConservativeType);
 
-    srand(time(NULL));
-
     Py_INCREF(&CMS_Log8Type);
     PyModule_AddObject(m, "CMS_Log8", (PyObject *)&CMS_Log8Type);
 
     Py_INCREF(&CMS_Log1024Type);
     PyModule_AddObject(m, "CMS_Log1024", (PyObject *)&CMS_Log1024Type);
 
+    PyModule_AddStringConstant(m, "SIMD_LEVEL", Simd_level());
+    PyModule_AddIntConstant(m, "ZLIB", FileTokens_zlib());
 
     #if PY_MAJOR_VERSION >= 3
     return m;
@@ -14,32 +14,255 @@
 #include "structmember.h"
 #include "murmur3.h"
 #include "hll.h"
+#include "keybuffer.h"
+#include "filetokens.h"
+#include "segment.h"
+#include "threads.h"
+#include "simd.h"
+#include "atomics.h"
+#include "topk.h"
 #include <math.h>
 #include <stdint.h>
+#include <time.h>
+#include <limits.h>
+
+#ifndef CMS_HASH_MODES
+#define CMS_HASH_MODES
+/* Each row hashes the key with its own seed using MurmurHash3_x86_32. */
+#define HASH_MODE_PER_ROW 0
+/* One MurmurHash3_x64_128 per key, rows derived by double hashing (Kirsch-Mitzenmacher). */
+#define HASH_MODE_DOUBLE 1
+/**
+  * One MurmurHash3_x64_128 per key like HASH_MODE_DOUBLE, but the buckets are derived from all 64 bits of the hash
+  * (allowing widths above 2^32) and the cardinality estimator is fed 64-bit hashes.
+  */
+#define HASH_MODE_WIDE 2
+
+/* Row `i` occupies cells [i * width, (i + 1) * width) of the table. */
+#define LAYOUT_ROWS 0
+/* The table is split into cache lines, all cells of one key are located in a single cache line. */
+#define LAYOUT_BLOCKED 1
+
+#define CMS_CACHE_LINE 64
+
+/* Smallest number of cells worth a thread of its own when merging. */
+#define CMS_MERGE_THREAD_CELLS (1 << 16)
+/* Number of cells of a table summed with all other tables while they stay in the cache. */
+#define CMS_MERGE_CHUNK_CELLS 4096
+
+/* Number of HyperLogLog registers is 2^CMS_HLL_BITS. */
+#define CMS_HLL_BITS 16
+#define CMS_MAX_EPOCHS 65536
+
+/* Number of keys hashed ahead of their updates by the batch update engine. */
+#define CMS_WINDOW 16
+#define CMS_MAX_WINDOW 1024
+
+/* Hints the processor to fetch the cache line of the address for writing. */
+#if defined(__GNUC__) || defined(__clang__)
+#define CMS_PREFETCH(address) __builtin_prefetch((address), 1)
+#elif defined(_MSC_VER) && (defined(_M_X64) || defined(_M_IX86))
+#include <xmmintrin.h>
+#define CMS_PREFETCH(address) _mm_prefetch((const char *) (address), _MM_HINT_T0)
+#else
+#define CMS_PREFETCH(address)
+#endif
+
+/**
+  * Advances the state of a xorshift64* generator and returns its next 32 random bits.
+  * Every sketch owns a generator, so that increments do not contend for a process-wide lock like with rand().
+  */
+static inline uint32_t
+random_next(uint64_t *state)
+{
+    uint64_t x = *state;
+    x ^= x >> 12;
+    x ^= x << 25;
+    x ^= x >> 27;
+    *state = x;
+    return (x * 0x2545F4914F6CDD1DULL) >> 32;
+}
+
+/* Scrambles a seed into a non-zero state of the generator (SplitMix64). */
+static inline uint64_t
+random_seed(uint64_t seed)
+{
+    uint64_t z = seed + 0x9E3779B97F4A7C15ULL;
+    z = (z ^ (z >> 30)) * 0xBF58476D1CE4E5B9ULL;
+    z = (z ^ (z >> 27)) * 0x94D049BB133111EBULL;
+    z ^= z >> 31;
+    return z ? z : 0x9E3779B97F4A7C15ULL;
+}
+
+/* Mixes all bits of a 64-bit hash supplied by the caller (the finalizer of MurmurHash3_x64_128). */
+static inline uint64_t
+hash_mix64(uint64_t h)
+{
+    h ^= h >> 33;
+    h *= 0xFF51AFD7ED558CCDULL;
+    h ^= h >> 33;
+    h *= 0xC4CEB9FE1A85EC53ULL;
+    h ^= h >> 33;
+    return h;
+}
+
+/* Returns the high 64 bits of the 128-bit product of two 64-bit integers. */
+static inline uint64_t
+mul_high64(uint64_t a, uint64_t b)
+{
+#ifdef __SIZEOF_INT128__
+    return (uint64_t) (((unsigned __int128) a * b) >> 64);
+#else
+    uint64_t a_low = a & 0xFFFFFFFF, a_high = a >> 32, b_low = b & 0xFFFFFFFF, b_high = b >> 32;
+    uint64_t carry = a_high * b_low + (a_low * b_low >> 32);
+    uint64_t middle = (carry & 0xFFFFFFFF) + a_low * b_high;
+    return a_high * b_high + (carry >> 32) + (middle >> 32);
+#endif
+}
+
+/* Number of zero bytes which end a literal run of the sparse encoding of a table. */
+#define CMS_SPARSE_MIN_ZEROS 8
+
+/* Writes an unsigned LEB128 varint to `out`, which must have at least 10 bytes left. Returns the end of the varint. */
+static inline unsigned char *
+varint_put(unsigned char *out, uint64_t value)
+{
+    while (value >= 0x80)
+    {
+        *out++ = (unsigned char) (value | 0x80);
+        value >>= 7;
+    }
+    *out++ = (unsigned char) value;
+    return out;
+}
+
+/* Reads an unsigned LEB128 varint from [*in, end) and advances `in` past it. Returns -1 if it is truncated. */
+static inline int
+varint_get(const unsigned char **in, const unsigned char *end, uint64_t *value)
+{
+    uint64_t result = 0;
+    int shift;
+    for (shift = 0; shift < 64 && *in < end; shift += 7)
+    {
+        unsigned char byte = *(*in)++;
+        result |= (uint64_t) (byte & 0x7F) << shift;
+        if (!(byte & 0x80))
+        {
+            *value = result;
+            return 0;
+        }
+    }
+    return -1;
+}
+
+/* Returns the number of zero bytes at the start of `data`. */
+static inline size_t
+sparse_zeros(const unsigned char *data, size_t length)
+{
+    size_t i = 0;
+    uint64_t word;
+    for (; i + 8 <= length; i += 8)
+    {
+        memcpy(&word, data + i, 8);
+        if (word)
+            break;
+    }
+    while (i < length && !data[i])
+        i++;
+    return i;
+}
+
+/* Returns the length of the literal run at the start of `data`: up to a run of CMS_SPARSE_MIN_ZEROS zero bytes. */
+static inline size_t
+sparse_literal(const unsigned char *data, size_t length)
+{
+    size_t i = 0;
+    uint64_t word;
+    while (i < length)
+    {
+        if (i + 8 <= length)
+        {
+            memcpy(&word, data + i, 8);
+            // skip words without a zero byte
+            if (!((word - 0x0101010101010101ULL) & ~word & 0x8080808080808080ULL))
+            {
+                i += 8;
+                continue;
+            }
+        }
+        if (data[i])
+        {
+            i++;
+            continue;
+        }
+        size_t zeros = sparse_zeros(data + i, length - i);
+        if (zeros >= CMS_SPARSE_MIN_ZEROS || i + zeros == length)
+            return i;
+        i += zeros;
+    }
+    return i;
+}
+#endif
+
+#define CMS_BLOCK_CELLS (CMS_CACHE_LINE / sizeof(CMS_CELL_TYPE))
 
 typedef struct {
     PyObject_HEAD
     short int depth;
-    uint32_t width;
-    uint32_t hash_mask;
-    long long total;
-    CMS_CELL_TYPE ** table;
+    char hash_mode;
+    char layout;
+    uint64_t width;
+    uint64_t hash_mask;
+    char width_bits;
+    uint64_t blocks;
+    long long * total; // points to own_total, or into the storage
+    long long own_total;
+    CMS_CELL_TYPE ** table; // rows of the current epoch, aligned to a cache line
+    CMS_CELL_TYPE ** rows; // rows of all epochs, `depth` rows per epoch
+    uint32_t row_count;
+    unsigned int epochs;
+    unsigned int epoch; // index of the current epoch in the ring
+    void ** table_alloc;
+    Py_buffer * adopted; // rows used in place from the buffers of an unpickled state
     HyperLogLog hll;
+    Py_buffer storage; // external memory holding the total, the table and the HLL registers (such as a mmap)
+    char has_storage;
+    char readonly;
+    uint64_t random_state; // generator of the probabilistic increments and merges of log counters
+    char concurrent; // increments use atomic operations, so that several threads can update the table at once
+    TopK topk; // candidate heavy hitters, with zero capacity if they are not tracked
 } CMS_TYPE;
 
+/* Cell at the given position of the table, counting row by row. */
+#define CMS_CELL(self, position) ((self)->table[(position) >> (self)->width_bits][(position) & (self)->hash_mask])
+
 /* Destructor invoked by python. */
 static void
 CMS_VARIANT(_dealloc)(CMS_TYPE* self)
 {
     // free our own tables
-    int i;
-    for (i = 0; i < self->depth; i++)
+    uint32_t i;
+    if (self->table_alloc)
+    {
+        for (i = 0; i < self->row_count; i++)
+            free(self->table_alloc[i]);
+    }
+    if (self->adopted)
     {
-        free(self->table[i]);
+        for (i = 0; i < self->row_count; i++)
+            if (self->adopted[i].obj)
+                PyBuffer_Release(&self->adopted[i]);
     }
-    free(self->table);
+    free(self->adopted);
+    free(self->table_alloc);
+    free(self->rows);
+    if (self->topk.capacity)
+        TopK_dealloc(&self->topk);
     // then deallocate hll
-    HyperLogLog_dealloc(&self->hll);
+    if (self->has_storage)
+        PyBuffer_Release(&self->storage);
+    else if (self->hll.registers)
+        HyperLogLog_dealloc(&self->hll);
     // finally, destroy itself
     #if PY_MAJOR_VERSION >= 3
     Py_TYPE(self)->tp_free((PyObject*) self);
@@ -59,17 +282,82 @@ CMS_VARIANT(_new)(PyTypeObject *type, PyObject *args, PyObject *kwds)
 static int
 CMS_VARIANT(_init)(CMS_TYPE *self, PyObject *args, PyObject *kwds)
 {
-    static char *kwlist[] = {"width", "depth", NULL};
+    static char *kwlist[] = {"width", "depth", "hash_mode", "layout", "storage", "seed", "concurrent", "top_k", "epochs",
+                             NULL};
+    static uint64_t instances = 0;
+
+    unsigned long long w;
+    unsigned int depth;
+    int hash_mode = HASH_MODE_PER_ROW;
+    int layout = LAYOUT_ROWS;
+    PyObject * storage = NULL;
+    PyObject * seed = NULL;
+    int concurrent = 0;
+    unsigned int top_k = 0;
+    unsigned int epochs = 1;
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "KI|iiOOiII", kwlist,
+				      &w, &depth, &hash_mode, &layout, &storage, &seed, &concurrent, &top_k, &epochs)) {
+        return -1;
+    }
+    self->concurrent = concurrent != 0;
+    if (top_k > 0x7FFFFFFF)
+    {
+        char * msg = "Too many heavy hitters to track!";
+        PyErr_SetString(PyExc_ValueError, msg);
+        return -1;
+    }
+    if (top_k && !self->topk.capacity && TopK_init(&self->topk, top_k))
+    {
+        PyErr_NoMemory();
+        return -1;
+    }
+
+    if (seed && seed != Py_None)
+    {
+        unsigned long long seed_value = PyLong_AsUnsignedLongLongMask(seed);
+        if (PyErr_Occurred())
+            return -1;
+        self->random_state = random_seed(seed_value);
+    }
+    else
+    {
+        // distinct sketches created at the same time get distinct generators
+        self->random_state = random_seed(((uint64_t) time(NULL) << 20) ^ (uint64_t) (uintptr_t) self ^ ++instances);
+    }
+
+    if (hash_mode != HASH_MODE_PER_ROW && hash_mode != HASH_MODE_DOUBLE && hash_mode != HASH_MODE_WIDE)
+    {
+        char * msg = "Unsupported hash mode!";
+        PyErr_SetString(PyExc_ValueError, msg);
+        return -1;
+    }
+    if (layout != LAYOUT_ROWS && layout != LAYOUT_BLOCKED)
+    {
+        char * msg = "Unsupported table layout!";
+        PyErr_SetString(PyExc_ValueError, msg);
+        return -1;
+    }
+    self->hash_mode = hash_mode;
+    self->layout = layout;
 
-    uint32_t w;
-    if (!PyArg_ParseTupleAndKeywords(args, kwds, "II", kwlist,
-				      &w, &self->depth)) {
+    if (depth < 1 || depth > 32) {
+        char * msg = "Depth must be in the range 1-32";
+        PyErr_SetString(PyExc_ValueError, msg);
         return -1;
     }
+    self->depth = depth;
 
-    if (self->depth  < 1 || self->depth > 32) {
-        char * msg = "Depth must be in the range 1-16";
+    if (epochs < 1 || epochs > CMS_MAX_EPOCHS)
+    {
+        char * msg = "Number of epochs must be in the range 1-65536";
+        PyErr_SetString(PyExc_ValueError, msg);
+        return -1;
+    }
+    if (epochs > 1 && ((storage && storage != Py_None) || top_k))
+    {
+        char * msg = "A sketch with several epochs can not use a storage or track heavy hitters.";
         PyErr_SetString(PyExc_ValueError, msg);
+        return -1;
     }
 
     short int hash_length = -1;
@@ -77,78 +365,385 @@ CMS_VARIANT(_init)(CMS_TYPE *self, PyObject *args, PyObject *kwds)
         hash_length++, w >>= 1;
     if (hash_length < 0)
         hash_length = 0;
-    self->width = 1 << hash_length;
+    if (hash_length > 32 && hash_mode != HASH_MODE_WIDE)
+    {
+        char * msg = "Widths above 2^32 require the wide hash mode.";
+        PyErr_SetString(PyExc_ValueError, msg);
+        return -1;
+    }
+    self->width = 1ULL << hash_length;
+    self->width_bits = hash_length;
     self->hash_mask = self->width - 1;
 
-    HyperLogLog_init(&self->hll, 16);
+    // every block must lie within a single row
+    self->blocks = ((uint64_t) self->width * self->depth) / CMS_BLOCK_CELLS;
+    if (layout == LAYOUT_BLOCKED && self->depth > (int) CMS_BLOCK_CELLS)
+    {
+        // the rows of a key take distinct cells of its block
+        PyErr_Format(PyExc_ValueError, "With the blocked layout, the depth can not exceed the %d cells of a cache line.",
+                     (int) CMS_BLOCK_CELLS);
+        return -1;
+    }
+    if (layout == LAYOUT_BLOCKED && (self->width < CMS_BLOCK_CELLS
+                                     || (self->blocks > 0xFFFFFFFF && hash_mode != HASH_MODE_WIDE)))
+    {
+        char * msg = "With the blocked layout, a row must span a whole number of cache lines "
+                     "(at most 2^32 in total, unless the hash mode is wide).";
+        PyErr_SetString(PyExc_ValueError, msg);
+        return -1;
+    }
+
+    self->epochs = epochs;
+    self->epoch = 0;
+    self->row_count = self->depth * epochs;
+    self->rows = (CMS_CELL_TYPE **) calloc(self->row_count, sizeof(CMS_CELL_TYPE *));
+    self->table_alloc = (void **) calloc(self->row_count, sizeof(void *));
+    if (!self->rows || !self->table_alloc)
+    {
+        PyErr_NoMemory();
+        return -1;
+    }
+    self->table = self->rows;
 
-    self->table = (CMS_CELL_TYPE **) malloc(self->depth * sizeof(CMS_CELL_TYPE *));
-    int i;
-    for (i = 0; i < self->depth; i++)
+    uint32_t i;
+    size_t row_size = (size_t) self->width * sizeof(CMS_CELL_TYPE);
+    if (storage && storage != Py_None)
+    {
+        /**
+          * The storage holds the total in its first cache line, followed by the rows and the HLL registers.
+          * Read-only storage (such as a mmap opened for reading) can only be queried.
+          */
+        if (PyObject_GetBuffer(storage, &self->storage, PyBUF_WRITABLE))
+        {
+            PyErr_Clear();
+            if (PyObject_GetBuffer(storage, &self->storage, PyBUF_SIMPLE))
+                return -1;
+            self->readonly = 1;
+        }
+        self->has_storage = 1;
+        if ((size_t) self->storage.len < CMS_CACHE_LINE + row_size * self->depth + (1 << CMS_HLL_BITS))
+        {
+            char * msg = "Storage is too small for a table with requested size!";
+            PyErr_SetString(PyExc_ValueError, msg);
+            return -1;
+        }
+        char * buffer = (char *) self->storage.buf;
+        self->total = (long long *) buffer;
+        // a sketch with a storage has a single epoch, `depth` rows
+        for (i = 0; i < self->row_count; i++)
+            self->rows[i] = (CMS_CELL_TYPE *) (buffer + CMS_CACHE_LINE + row_size * i);
+        HyperLogLog_init_buffer(&self->hll, CMS_HLL_BITS, (hll_cell_t *) (buffer + CMS_CACHE_LINE + row_size * self->depth));
+        self->hll.wide = hash_mode == HASH_MODE_WIDE;
+        return 0;
+    }
+
+    // rows are allocated separately so that huge tables do not need a single huge allocation
+    for (i = 0; i < self->row_count; i++)
+    {
+        self->table_alloc[i] = calloc(row_size + CMS_CACHE_LINE, 1);
+        if (!self->table_alloc[i])
+        {
+            char * msg = "Unable to allocate a table with requested size!";
+            PyErr_SetString(PyExc_MemoryError, msg);
+            return -1;
+        }
+        self->rows[i] = (CMS_CELL_TYPE *) (((uintptr_t) self->table_alloc[i] + CMS_CACHE_LINE - 1)
+                                           & ~(uintptr_t) (CMS_CACHE_LINE - 1));
+    }
+
+    self->total = &self->own_total;
+    HyperLogLog_init(&self->hll, CMS_HLL_BITS);
+    if (!self->hll.registers)
     {
-        self->table[i] = (CMS_CELL_TYPE *) calloc(self->width, sizeof(CMS_CELL_TYPE));
+        PyErr_NoMemory();
+        return -1;
     }
+    self->hll.wide = hash_mode == HASH_MODE_WIDE;
     return 0;
 }
 
 static PyMemberDef CMS_VARIANT(_members[]) = {
+    {"hash_mode", T_BYTE, offsetof(CMS_TYPE, hash_mode), READONLY,
+     "How the buckets of a key are selected, one of the HASH_MODE_* constants."},
+    {"layout", T_BYTE, offsetof(CMS_TYPE, layout), READONLY,
+     "Memory layout of the table, one of the LAYOUT_* constants."},
+    {"top_k", T_UINT, offsetof(CMS_TYPE, topk.capacity), READONLY,
+     "Number of heavy hitters tracked, 0 if they are not tracked."},
     {NULL} /* Sentinel */
 };
 
-static inline int CMS_VARIANT(should_inc)(CMS_CELL_TYPE value);
+static inline int CMS_VARIANT(should_inc)(uint64_t *random_state, CMS_CELL_TYPE value);
+static inline long long CMS_VARIANT(decode)(CMS_CELL_TYPE value);
 
-static inline PyObject *
-CMS_VARIANT(_increment_obj)(CMS_TYPE *self, char *data, Py_ssize_t dataLength, long long increment)
+/* Raises TypeError and returns -1 if the table is backed by read-only storage. */
+static inline int
+CMS_VARIANT(_check_writable)(CMS_TYPE *self)
 {
-    uint32_t buckets[32];
-    CMS_CELL_TYPE values[32];
-    uint32_t hash;
-    CMS_CELL_TYPE min_value = -1;
+    if (self->readonly)
+    {
+        char * msg = "The sketch is opened read-only!";
+        PyErr_SetString(PyExc_TypeError, msg);
+        return -1;
+    }
+    return 0;
+}
 
-    if (increment < 0)
+/**
+  * Calculates the position of the key's cell in every row from a 128-bit hash of the key: within a single block
+  * of the blocked layout (where the rows take distinct cells of the block), or by double hashing.
+  * Returns the hash which should be fed to the cardinality estimator.
+  */
+static inline uint64_t
+CMS_VARIANT(_derive_cells)(CMS_TYPE *self, uint64_t *hash, uint64_t *cells)
+{
+    int i;
+    char wide = self->hash_mode == HASH_MODE_WIDE;
+    if (self->layout == LAYOUT_BLOCKED)
     {
-        char * msg = "Increment must be positive!.";
-        PyErr_SetString(PyExc_ValueError, msg);
-        return NULL;
+        // map the low half of the hash (the whole hash if wide) onto [0, blocks) without a division
+        uint64_t block = (wide ? mul_high64(hash[0], self->blocks)
+                               : ((hash[0] & 0xFFFFFFFF) * self->blocks) >> 32) * CMS_BLOCK_CELLS;
+        // the rows draw distinct cells of the block with Floyd's sampling, taking 16 bits of the hash per row;
+        // every 4 rows get fresh bits, mixed from the second half of the hash and the number of the round
+        uint64_t slots = hash[1];
+        uint64_t round = 0;
+        uint64_t taken = 0;
+        uint32_t last = CMS_BLOCK_CELLS - self->depth;
+        for (i = 0; i < self->depth; i++, last++)
+        {
+            if (i && !(i & 3))
+                slots = hash_mix64(hash[1] ^ (++round * 0x9E3779B97F4A7C15ULL));
+            uint32_t slot = (uint32_t) (((slots & 0xFFFF) * (last + 1)) >> 16);
+            if (taken >> slot & 1)
+                slot = last;
+            taken |= 1ULL << slot;
+            cells[i] = block + slot;
+            slots >>= 16;
+        }
+        return wide ? hash[0] : hash[0] >> 32;
     }
-    else if (increment == 0)
+
+    // an odd step visits distinct buckets in every row of a power-of-2 width
+    uint64_t step = hash[1] | 1;
+    if (wide)
     {
-        Py_INCREF(Py_None);
-        return Py_None;
+        for (i = 0; i < self->depth; i++)
+            cells[i] = (uint64_t) i * self->width + ((hash[0] + i * step) & self->hash_mask);
+        return hash[0];
     }
-    Py_BEGIN_ALLOW_THREADS
+    for (i = 0; i < self->depth; i++)
+        cells[i] = (uint64_t) i * self->width + ((uint32_t) (hash[0] + i * step) & self->hash_mask);
+    return hash[0] >> 32;
+}
 
-    self->total += increment;
+/**
+  * Calculates the position of the key's cell in every row of the table.
+  * Returns the hash which should be fed to the cardinality estimator.
+  */
+static inline uint64_t
+CMS_VARIANT(_cells)(CMS_TYPE *self, char *data, Py_ssize_t dataLength, uint64_t *cells)
+{
+    if (self->layout == LAYOUT_BLOCKED || self->hash_mode != HASH_MODE_PER_ROW)
+    {
+        uint64_t hash[2];
+        MurmurHash3_x64_128((void *) data, dataLength, 0, (void *) hash);
+        return CMS_VARIANT(_derive_cells)(self, hash, cells);
+    }
 
     int i;
+    uint32_t hash, first_hash = 0;
     for (i = 0; i < self->depth; i++)
     {
         MurmurHash3_x86_32((void *) data, dataLength, i, (void *) &hash);
-        uint32_t bucket = hash & self->hash_mask;
-        buckets[i] = bucket;
-        CMS_CELL_TYPE value = self->table[i][bucket];
+        cells[i] = (uint64_t) i * self->width + (hash & self->hash_mask);
+        if (i == 0)
+            first_hash = hash;
+    }
+    return first_hash;
+}
+
+/**
+  * Calculates the position of the key's cell in every row from a 64-bit hash of the key computed by the caller.
+  * The hash is mixed into two halves of a 128-bit hash, so the rows are always derived by double hashing
+  * (or from a single block of the blocked layout). Returns the hash which should be fed to the cardinality estimator.
+  */
+static inline uint64_t
+CMS_VARIANT(_hash_cells)(CMS_TYPE *self, uint64_t key_hash, uint64_t *cells)
+{
+    uint64_t hash[2];
+    hash[0] = hash_mix64(key_hash);
+    hash[1] = hash_mix64(key_hash ^ 0x9E3779B97F4A7C15ULL);
+    return CMS_VARIANT(_derive_cells)(self, hash, cells);
+}
+
+/**
+  * Applies the conservative update of the key occupying the given cells with atomic operations.
+  * Cells only ever grow, so when another thread changes a cell before it is raised, the update starts over
+  * from the new minimum and no increment is lost. Returns the new estimate of the key.
+  */
+static CMS_CELL_TYPE
+CMS_VARIANT(_increment_cells_atomic)(CMS_TYPE *self, uint64_t *cells, long long increment)
+{
+    CMS_CELL_TYPE values[32];
+    // every update draws its own generator, as the threads can not share one
+    uint64_t random_state = random_seed(ATOMIC_FETCH_ADD(&self->random_state, 1));
+
+    int i;
+    for (;;)
+    {
+        CMS_CELL_TYPE min_value = -1;
+        for (i = 0; i < self->depth; i++)
+        {
+            values[i] = ATOMIC_LOAD(&CMS_CELL(self, cells[i]));
+            if (values[i] < min_value)
+                min_value = values[i];
+        }
+
+        CMS_CELL_TYPE result = min_value;
+        long long remaining;
+        for (remaining = increment; remaining > 0; remaining--)
+            result += CMS_VARIANT(should_inc)(&random_state, result);
+        if (result == min_value)
+            return result;
+
+        for (i = 0; i < self->depth; i++)
+        {
+            if (values[i] >= result)
+                continue;
+            if (!ATOMIC_CAS(&CMS_CELL(self, cells[i]), &values[i], result))
+                break;
+        }
+        if (i == self->depth)
+            return result;
+    }
+}
+
+/* Applies the conservative update of the key occupying the given cells. Returns the new estimate of the key. */
+static inline CMS_CELL_TYPE
+CMS_VARIANT(_increment_cells)(CMS_TYPE *self, uint64_t *cells, long long increment)
+{
+    CMS_CELL_TYPE values[32];
+    CMS_CELL_TYPE min_value = -1;
+
+    if (self->concurrent)
+        return CMS_VARIANT(_increment_cells_atomic)(self, cells, increment);
+
+    int i;
+    for (i = 0; i < self->depth; i++)
+    {
+        CMS_CELL_TYPE value = CMS_CELL(self, cells[i]);
         if (value < min_value)
             min_value = value;
-        values[i] = self->table[i][bucket];
-
-        if (i == 0)
-            HyperLogLog_add(&self->hll, hash);
+        values[i] = value;
     }
 
     CMS_CELL_TYPE result = min_value;
     for (; increment > 0; increment--) {
-        result += CMS_VARIANT(should_inc)(result);
+        result += CMS_VARIANT(should_inc)(&self->random_state, result);
     }
 
     if (result > min_value)
     {
-        int i;
         for (i = 0; i < self->depth; i++)
             if (values[i] < result)
-                self->table[i][buckets[i]] = result;
+                CMS_CELL(self, cells[i]) = result;
+    }
+    return result;
+}
+
+/**
+  * Offers the key with its new estimate to the heavy hitters, if they are tracked.
+  * Updates of any sketch may run without the GIL, so the heavy hitters are always locked.
+  */
+static inline void
+CMS_VARIANT(_track)(CMS_TYPE *self, char *data, Py_ssize_t dataLength, uint64_t hash, CMS_CELL_TYPE estimate)
+{
+    if (!self->topk.capacity)
+        return;
+    SPINLOCK_ACQUIRE(&self->topk.lock);
+    TopK_offer(&self->topk, data, dataLength, (uint32_t) hash, CMS_VARIANT(decode)(estimate));
+    SPINLOCK_RELEASE(&self->topk.lock);
+}
+
+/* Counts an increment of a key with the given hash into the total and the cardinality estimator. */
+static inline void
+CMS_VARIANT(_add_total)(CMS_TYPE *self, long long increment, uint64_t hash)
+{
+    if (self->concurrent)
+    {
+        ATOMIC_FETCH_ADD(self->total, increment);
+        if (self->hll.wide)
+            HyperLogLog_add64_atomic(&self->hll, hash);
+        else
+            HyperLogLog_add_atomic(&self->hll, (uint32_t) hash);
+    }
+    else
+    {
+        *self->total += increment;
+        if (self->hll.wide)
+            HyperLogLog_add64(&self->hll, hash);
+        else
+            HyperLogLog_add(&self->hll, (uint32_t) hash);
+    }
+}
+
+/* Adds the key to the table. Does not use the Python API, so it can be called without the GIL. */
+static inline void
+CMS_VARIANT(_increment_key)(CMS_TYPE *self, char *data, Py_ssize_t dataLength, long long increment)
+{
+    uint64_t cells[32];
+    uint64_t hash = CMS_VARIANT(_cells)(self, data, dataLength, cells);
+
+    CMS_VARIANT(_add_total)(self, increment, hash);
+    CMS_VARIANT(_track)(self, data, dataLength, hash, CMS_VARIANT(_increment_cells)(self, cells, increment));
+}
+
+/**
+  * Adds a window of keys to the table in two stages, so that the memory accesses of different keys overlap.
+  * The first stage hashes all keys and prefetches their cells, the second one updates the cells.
+  * `cells` must hold `count * depth` positions and `hashes` `count` hashes.
+  * Does not use the Python API, so it can be called without the GIL.
+  */
+static void
+CMS_VARIANT(_increment_window)(CMS_TYPE *self, char **keys, Py_ssize_t *lengths, long long *increments, int count,
+                               uint64_t *cells, uint64_t *hashes)
+{
+    int i, j;
+    for (j = 0; j < count; j++)
+    {
+        uint64_t * key_cells = cells + j * self->depth;
+        hashes[j] = CMS_VARIANT(_cells)(self, keys[j], lengths[j], key_cells);
+        CMS_VARIANT(_add_total)(self, increments[j], hashes[j]);
+        for (i = 0; i < self->depth; i++)
+            CMS_PREFETCH(&CMS_CELL(self, key_cells[i]));
+    }
+
+    for (j = 0; j < count; j++)
+    {
+        CMS_CELL_TYPE estimate = CMS_VARIANT(_increment_cells)(self, cells + j * self->depth, increments[j]);
+        CMS_VARIANT(_track)(self, keys[j], lengths[j], hashes[j], estimate);
+    }
+}
+
+static inline PyObject *
+CMS_VARIANT(_increment_obj)(CMS_TYPE *self, char *data, Py_ssize_t dataLength, long long increment)
+{
+    if (increment < 0)
+    {
+        char * msg = "Increment must be positive!.";
+        PyErr_SetString(PyExc_ValueError, msg);
+        return NULL;
+    }
+    else if (increment == 0)
+    {
+        Py_INCREF(Py_None);
+        return Py_None;
     }
 
+    Py_BEGIN_ALLOW_THREADS
+    CMS_VARIANT(_increment_key)(self, data, dataLength, increment);
     Py_END_ALLOW_THREADS
+
     Py_INCREF(Py_None);
     return Py_None;
 }
@@ -209,6 +804,8 @@ CMS_VARIANT(_increment)(CMS_TYPE *self, PyObject *args)
 
     if (!PyArg_ParseTuple(args, "O|L", &pkey, &increment))
         return NULL;
+    if (CMS_VARIANT(_check_writable)(self))
+        return NULL;
     char * data = CMS_VARIANT(_parse_key)(pkey, &dataLength, &free_after);
     if (!data)
         return NULL;
@@ -218,215 +815,1361 @@ CMS_VARIANT(_increment)(CMS_TYPE *self, PyObject *args)
     return result;
 }
 
-static inline long long CMS_VARIANT(decode)(CMS_CELL_TYPE value);
-
-/* Retrieves estimate for the frequency of a single element. */
-static PyObject *
-CMS_VARIANT(_getitem)(CMS_TYPE *self, PyObject *args)
+/**
+  * Estimates the frequency of the key occupying the given cells over the last `epochs` epochs (including
+  * the current one). Every row sums the cells of the key in those epochs, the estimate is the lowest of the sums.
+  * Does not use the Python API, so it can be called without the GIL.
+  */
+static inline long long
+CMS_VARIANT(_estimate)(CMS_TYPE *self, uint64_t *cells, unsigned int epochs)
 {
-    PyObject * pkey;
-    PyObject * free_after = NULL;
-    Py_ssize_t dataLength = 0;
-
-    if (!PyArg_ParseTuple(args, "O", &pkey))
-        return NULL;
-    char * data = CMS_VARIANT(_parse_key)(pkey, &dataLength, &free_after);
-    if (!data)
-        return NULL;
-
-    uint32_t hash;
-    CMS_CELL_TYPE min_value = -1;
     int i;
-    for (i = 0; i < self->depth; i++)
+    if (self->epochs == 1)
     {
-        MurmurHash3_x86_32((void *) data, dataLength, i, (void *) &hash);
-        uint32_t bucket = hash & self->hash_mask;
-        CMS_CELL_TYPE value = self->table[i][bucket];
-        if (value < min_value)
-            min_value = value;
+        CMS_CELL_TYPE min_value = -1;
+        for (i = 0; i < self->depth; i++)
+        {
+            CMS_CELL_TYPE value = CMS_CELL(self, cells[i]);
+            if (value < min_value)
+                min_value = value;
+        }
+        return CMS_VARIANT(decode)(min_value);
+    }
+
+    long long min_sum = LLONG_MAX;
+    for (i = 0; i < self->depth; i++)
+    {
+        uint32_t row = cells[i] >> self->width_bits;
+        uint64_t column = cells[i] & self->hash_mask;
+        long long sum = 0;
+        unsigned int e;
+        for (e = 0; e < epochs; e++)
+        {
+            unsigned int epoch = (self->epoch + self->epochs - e) % self->epochs;
+            sum += CMS_VARIANT(decode)(self->rows[epoch * self->depth + row][column]);
+        }
+        if (sum < min_sum)
+            min_sum = sum;
     }
+    return min_sum;
+}
+
+/* Estimates the frequency of the key over the last `epochs` epochs. Can be called without the GIL. */
+static inline long long
+CMS_VARIANT(_get_key_recent)(CMS_TYPE *self, char *data, Py_ssize_t dataLength, unsigned int epochs)
+{
+    uint64_t cells[32];
+    CMS_VARIANT(_cells)(self, data, dataLength, cells);
+    return CMS_VARIANT(_estimate)(self, cells, epochs);
+}
 
+/* Estimates the frequency of the key. Does not use the Python API, so it can be called without the GIL. */
+static inline long long
+CMS_VARIANT(_get_key)(CMS_TYPE *self, char *data, Py_ssize_t dataLength)
+{
+    return CMS_VARIANT(_get_key_recent)(self, data, dataLength, self->epochs);
+}
+
+/* Checks the number of recent epochs of a query, 0 standing for all of them. Returns -1 with ValueError if invalid. */
+static int
+CMS_VARIANT(_check_epochs)(CMS_TYPE *self, unsigned int *epochs)
+{
+    if (*epochs > self->epochs)
+    {
+        char * msg = "Number of epochs exceeds the epochs of the sketch!";
+        PyErr_SetString(PyExc_ValueError, msg);
+        return -1;
+    }
+    if (*epochs == 0)
+        *epochs = self->epochs;
+    return 0;
+}
+
+/* Retrieves estimate for the frequency of a single element, optionally over the last `epochs` epochs only. */
+static PyObject *
+CMS_VARIANT(_getitem)(CMS_TYPE *self, PyObject *args)
+{
+    PyObject * pkey;
+    PyObject * free_after = NULL;
+    Py_ssize_t dataLength = 0;
+    unsigned int epochs = 0;
+
+    if (!PyArg_ParseTuple(args, "O|I", &pkey, &epochs))
+        return NULL;
+    if (CMS_VARIANT(_check_epochs)(self, &epochs))
+        return NULL;
+    char * data = CMS_VARIANT(_parse_key)(pkey, &dataLength, &free_after);
+    if (!data)
+        return NULL;
+
+    long long value = epochs == self->epochs ? CMS_VARIANT(_get_key)(self, data, dataLength)
+                                             : CMS_VARIANT(_get_key_recent)(self, data, dataLength, epochs);
     Py_XDECREF(free_after);
-    return Py_BuildValue("L", CMS_VARIANT(decode) (min_value));
+    return Py_BuildValue("L", value);
+}
+
+/* Retrieves estimates for the frequencies of a batch of keys into an array of 64-bit integers. */
+static PyObject *
+CMS_VARIANT(_get_many)(CMS_TYPE *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"keys", "offsets", "epochs", NULL};
+    PyObject * data;
+    PyObject * offsets = NULL;
+    unsigned int epochs = 0;
+    KeyBuffer keys;
+    Py_buffer view;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|OI", kwlist, &data, &offsets, &epochs))
+        return NULL;
+    if (CMS_VARIANT(_check_epochs)(self, &epochs))
+        return NULL;
+    if (KeyBuffer_init(&keys, data, offsets))
+        return NULL;
+
+    char * scratch = malloc(keys.max_length + 1);
+    PyObject * result = scratch ? KeyBuffer_new_results(keys.length, &view) : PyErr_NoMemory();
+    if (!result)
+    {
+        free(scratch);
+        KeyBuffer_release(&keys);
+        return NULL;
+    }
+
+    int error = 0;
+    long long * values = (long long *) view.buf;
+    Py_BEGIN_ALLOW_THREADS
+    Py_ssize_t i;
+    Py_ssize_t length;
+    for (i = 0; i < keys.length; i++)
+    {
+        char * key = KeyBuffer_get(&keys, i, &length, scratch, 0, &error);
+        if (!key)
+            break;
+        values[i] = epochs == self->epochs ? CMS_VARIANT(_get_key)(self, key, length)
+                                           : CMS_VARIANT(_get_key_recent)(self, key, length, epochs);
+    }
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&view);
+    free(scratch);
+    KeyBuffer_release(&keys);
+    if (error)
+    {
+        Py_DECREF(result);
+        KeyBuffer_set_error(error);
+        return NULL;
+    }
+    return result;
+}
+
+/* Retrieves estimate of the set cardinality */
+static PyObject *
+CMS_VARIANT(_cardinality)(CMS_TYPE *self, PyObject *args)
+{
+   double cardinality = HyperLogLog_cardinality(&self->hll);
+   return Py_BuildValue("L", (long long) cardinality);
+}
+
+/* Retrieves the total number of increments */
+static PyObject *
+CMS_VARIANT(_total)(CMS_TYPE *self, PyObject *args)
+{
+   return Py_BuildValue("L", *self->total);
+}
+
+/* Encodes a sum of decoded cell values, rounding randomly (by `merge_seed`) where the cells can not hold it. */
+static inline CMS_CELL_TYPE CMS_VARIANT(_encode_sum)(long long decoded, uint32_t merge_seed);
+
+/* A range of cells merged by one thread. */
+typedef struct {
+    CMS_TYPE * self;
+    CMS_TYPE ** others;
+    Py_ssize_t count;
+    uint64_t start;
+    uint64_t end;
+    uint32_t merge_seed;
+    int saturate;
+    CMS_CELL_TYPE ** other_rows; // scratch for the current row of every other table
+} CMS_VARIANT(_MergeTask);
+
+/* Adds the cells of all other tables to the cells of this table within the range of the task. */
+static void
+CMS_VARIANT(_merge_range)(void *arg)
+{
+    CMS_VARIANT(_MergeTask) * task = (CMS_VARIANT(_MergeTask) *) arg;
+    CMS_TYPE * self = task->self;
+    uint64_t position = task->start;
+    while (position < task->end)
+    {
+        uint32_t i = position >> self->width_bits;
+        uint64_t j = position & self->hash_mask;
+        uint64_t row_end = (uint64_t) (i + 1) << self->width_bits;
+        if (row_end > task->end)
+            row_end = task->end;
+        CMS_CELL_TYPE * row = self->rows[i];
+        // epochs are aligned by their age, the current epochs of the sketches may lie at different indices
+        uint32_t epoch_age = (self->epoch + self->epochs - i / self->depth) % self->epochs;
+        CMS_CELL_TYPE ** other_rows = task->other_rows;
+        Py_ssize_t k;
+        for (k = 0; k < task->count; k++)
+        {
+            CMS_TYPE * other = task->others[k];
+            other_rows[k] = other->rows[(other->epoch + other->epochs - epoch_age) % other->epochs * self->depth
+                                        + i % self->depth];
+        }
+        #ifdef CMS_ADD_CELLS
+        while (position < row_end)
+        {
+            uint64_t chunk = row_end - position < CMS_MERGE_CHUNK_CELLS ? row_end - position : CMS_MERGE_CHUNK_CELLS;
+            for (k = 0; k < task->count; k++)
+                CMS_ADD_CELLS(row + j, other_rows[k] + j, chunk, task->saturate);
+            position += chunk;
+            j += chunk;
+        }
+        #else
+        for (; position < row_end; position++, j++)
+        {
+            long long decoded = CMS_VARIANT(decode)(row[j]);
+            for (k = 0; k < task->count; k++)
+                decoded += CMS_VARIANT(decode)(other_rows[k][j]);
+            row[j] = CMS_VARIANT(_encode_sum)(decoded, task->merge_seed);
+        }
+        #endif
+    }
+}
+
+/* Raises an exception and returns -1 unless the other object is a CMS which can be merged into this one. */
+static int
+CMS_VARIANT(_check_mergeable)(CMS_TYPE *self, PyObject *other_obj)
+{
+    if (!PyObject_TypeCheck(other_obj, Py_TYPE(self)))
+    {
+        char * msg = "Object to merge must be an instance of CMS with the same algorithm.";
+        PyErr_SetString(PyExc_TypeError, msg);
+        return -1;
+    }
+    CMS_TYPE *other = (CMS_TYPE *) other_obj;
+    if (other->width != self->width || other->depth != self->depth)
+    {
+        char * msg = "CMS to merge must use the same width and depth.";
+        PyErr_SetString(PyExc_ValueError, msg);
+        return -1;
+    }
+    if (other->hash_mode != self->hash_mode || other->layout != self->layout)
+    {
+        char * msg = "CMS to merge must use the same hash mode and layout.";
+        PyErr_SetString(PyExc_ValueError, msg);
+        return -1;
+    }
+    if (other->epochs != self->epochs)
+    {
+        char * msg = "CMS to merge must use the same number of epochs.";
+        PyErr_SetString(PyExc_ValueError, msg);
+        return -1;
+    }
+    return 0;
+}
+
+/**
+  * Re-estimates the heavy hitters of this instance and offers those of the merged ones, once the tables are merged.
+  * Does not use the Python API. Returns -1 if memory runs out, 0 otherwise.
+  */
+static int
+CMS_VARIANT(_merge_top)(CMS_TYPE *self, CMS_TYPE **others, Py_ssize_t count)
+{
+    if (!self->topk.capacity)
+        return 0;
+
+    uint32_t i;
+    SPINLOCK_ACQUIRE(&self->topk.lock);
+    for (i = 0; i < self->topk.size; i++)
+    {
+        TopKEntry * entry = &self->topk.heap[i];
+        TopK_set_count(&self->topk, i, CMS_VARIANT(_get_key)(self, entry->key, entry->length));
+    }
+    TopK_heapify(&self->topk);
+    SPINLOCK_RELEASE(&self->topk.lock);
+
+    Py_ssize_t k;
+    for (k = 0; k < count; k++)
+    {
+        if (others[k] == self || !others[k]->topk.capacity)
+            continue;
+        // the heavy hitters of the other sketch are copied under its own lock, so that two locks are never held
+        SPINLOCK_ACQUIRE(&others[k]->topk.lock);
+        uint32_t size = others[k]->topk.size;
+        TopKEntry * entries = TopK_copy_sorted(&others[k]->topk, size);
+        SPINLOCK_RELEASE(&others[k]->topk.lock);
+        if (!entries)
+            return -1;
+
+        SPINLOCK_ACQUIRE(&self->topk.lock);
+        for (i = 0; i < size; i++)
+            TopK_offer(&self->topk, entries[i].key, entries[i].length, entries[i].hash,
+                       CMS_VARIANT(_get_key)(self, entries[i].key, entries[i].length));
+        SPINLOCK_RELEASE(&self->topk.lock);
+        free(entries);
+    }
+    return 0;
+}
+
+/**
+  * Merges other CMS instances into this one in a single pass over the table, split among `threads` native threads.
+  * Requires the GIL only to check the arguments.
+  */
+static PyObject *
+CMS_VARIANT(_merge_tables)(CMS_TYPE *self, CMS_TYPE **others, Py_ssize_t count, int threads, int saturate)
+{
+    if (threads < 1)
+    {
+        char * msg = "The number of threads must be positive!";
+        PyErr_SetString(PyExc_ValueError, msg);
+        return NULL;
+    }
+    if (CMS_VARIANT(_check_writable)(self))
+        return NULL;
+
+    uint64_t cells = (uint64_t) self->width * self->row_count;
+    if ((uint64_t) threads > cells / CMS_MERGE_THREAD_CELLS)
+        threads = cells / CMS_MERGE_THREAD_CELLS ? cells / CMS_MERGE_THREAD_CELLS : 1;
+    CMS_VARIANT(_MergeTask) * tasks = (CMS_VARIANT(_MergeTask) *) malloc(threads * sizeof(CMS_VARIANT(_MergeTask)));
+    CMS_CELL_TYPE ** other_rows = (CMS_CELL_TYPE **) malloc((threads * count + 1) * sizeof(CMS_CELL_TYPE *));
+    if (!tasks || !other_rows)
+    {
+        free(tasks);
+        free(other_rows);
+        return PyErr_NoMemory();
+    }
+
+    int top_status;
+    Py_BEGIN_ALLOW_THREADS
+    uint32_t merge_seed = random_next(&self->random_state);
+    int t;
+    for (t = 0; t < threads; t++)
+    {
+        tasks[t].self = self;
+        tasks[t].others = others;
+        tasks[t].count = count;
+        tasks[t].start = cells * t / threads;
+        tasks[t].end = cells * (t + 1) / threads;
+        tasks[t].merge_seed = merge_seed;
+        tasks[t].saturate = saturate;
+        tasks[t].other_rows = other_rows + t * count;
+    }
+    Threads_run(CMS_VARIANT(_merge_range), tasks, sizeof(CMS_VARIANT(_MergeTask)), threads);
+
+    Py_ssize_t k;
+    for (k = 0; k < count; k++)
+    {
+        *self->total += *others[k]->total;
+        HyperLogLog_merge(&self->hll, &others[k]->hll);
+    }
+    top_status = CMS_VARIANT(_merge_top)(self, others, count);
+    Py_END_ALLOW_THREADS
+
+    free(tasks);
+    free(other_rows);
+    if (top_status)
+        return PyErr_NoMemory();
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+/**
+  * Merges another CMS instance into this one.
+  * This instance is incremented by values of the other instance, which remains unaffected
+  */
+static PyObject *
+CMS_VARIANT(_merge)(CMS_TYPE *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"other", "threads", "saturate", NULL};
+    PyObject *other;
+    int threads = 1;
+    int saturate = 0;
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|ii", kwlist, &other, &threads, &saturate))
+        return NULL;
+    if (CMS_VARIANT(_check_mergeable)(self, other))
+        return NULL;
+
+    return CMS_VARIANT(_merge_tables)(self, (CMS_TYPE **) &other, 1, threads, saturate);
+}
+
+/**
+  * Merges a sequence of CMS instances into this one, reading each cell of all tables only once.
+  * The merged instances remain unaffected.
+  */
+static PyObject *
+CMS_VARIANT(_merge_many)(CMS_TYPE *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"sketches", "threads", "saturate", NULL};
+    PyObject *sketches;
+    int threads = 1;
+    int saturate = 0;
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|ii", kwlist, &sketches, &threads, &saturate))
+        return NULL;
+
+    // the tuple keeps the sketches alive while the GIL is released
+    PyObject *sequence = PySequence_Tuple(sketches);
+    if (!sequence)
+        return NULL;
+    Py_ssize_t k, count = PyTuple_GET_SIZE(sequence);
+    for (k = 0; k < count; k++)
+    {
+        if (CMS_VARIANT(_check_mergeable)(self, PyTuple_GET_ITEM(sequence, k)))
+        {
+            Py_DECREF(sequence);
+            return NULL;
+        }
+        // the cells of this table are updated while the others are read
+        if (PyTuple_GET_ITEM(sequence, k) == (PyObject *) self)
+        {
+            Py_DECREF(sequence);
+            char * msg = "CMS can not be merged into itself with merge_many.";
+            PyErr_SetString(PyExc_ValueError, msg);
+            return NULL;
+        }
+    }
+
+    PyObject *result = CMS_VARIANT(_merge_tables)(self, (CMS_TYPE **) &PyTuple_GET_ITEM(sequence, 0), count, threads,
+                                                  saturate);
+    Py_DECREF(sequence);
+    return result;
+}
+
+/* Counts cells of the table which are zero, or at the largest value they can hold if `ones` is set. */
+static uint64_t
+CMS_VARIANT(_count_equal)(CMS_TYPE *self, int ones)
+{
+    uint64_t result = 0;
+    Py_BEGIN_ALLOW_THREADS
+    uint32_t i;
+    for (i = 0; i < self->row_count; i++)
+        result += Simd_count_equal(self->rows[i], self->width, sizeof(CMS_CELL_TYPE), ones);
+    Py_END_ALLOW_THREADS
+    return result;
+}
+
+/* Starts a new epoch in place of the oldest one, whose rows are cleared and reused. */
+static PyObject *
+CMS_VARIANT(_advance)(CMS_TYPE *self, PyObject *args)
+{
+    if (CMS_VARIANT(_check_writable)(self))
+        return NULL;
+    if (self->epochs == 1)
+    {
+        char * msg = "There is no epoch to advance to, the sketch must be created with epochs > 1.";
+        PyErr_SetString(PyExc_ValueError, msg);
+        return NULL;
+    }
+
+    unsigned int epoch = (self->epoch + 1) % self->epochs;
+    CMS_CELL_TYPE ** table = self->rows + (size_t) epoch * self->depth;
+    // cleared holding the GIL; increments running without it only write into the current epoch, which has other rows
+    int i;
+    for (i = 0; i < self->depth; i++)
+        memset(table[i], 0, (size_t) self->width * sizeof(CMS_CELL_TYPE));
+    self->epoch = epoch;
+    self->table = table;
+
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+/* Retrieves the number of cells with a non-zero value. */
+static PyObject *
+CMS_VARIANT(_count_nonzero)(CMS_TYPE *self, PyObject *args)
+{
+    uint64_t cells = (uint64_t) self->width * self->row_count;
+    return Py_BuildValue("K", (unsigned long long) (cells - CMS_VARIANT(_count_equal)(self, 0)));
+}
+
+/* Retrieves the number of cells at the largest value they can hold. */
+static PyObject *
+CMS_VARIANT(_count_saturated)(CMS_TYPE *self, PyObject *args)
+{
+    return Py_BuildValue("K", (unsigned long long) CMS_VARIANT(_count_equal)(self, 1));
+}
+
+/* Retrieves the `n` tracked keys with the highest estimates (all of them by default) as a list of pairs. */
+static PyObject *
+CMS_VARIANT(_most_common)(CMS_TYPE *self, PyObject *args)
+{
+    Py_ssize_t n = -1;
+    if (!PyArg_ParseTuple(args, "|n", &n))
+        return NULL;
+    if (!self->topk.capacity)
+    {
+        char * msg = "Heavy hitters are not tracked, the sketch must be created with top_k.";
+        PyErr_SetString(PyExc_ValueError, msg);
+        return NULL;
+    }
+
+    // the keys are copied under the lock and decoded once it is released, as updates may run without the GIL
+    SPINLOCK_ACQUIRE(&self->topk.lock);
+    if (n < 0 || n > self->topk.size)
+        n = self->topk.size;
+    TopKEntry * entries = TopK_copy_sorted(&self->topk, (uint32_t) n);
+    SPINLOCK_RELEASE(&self->topk.lock);
+    if (!entries)
+        return PyErr_NoMemory();
+
+    PyObject * result = PyList_New(n);
+    Py_ssize_t i;
+    for (i = 0; result && i < n; i++)
+    {
+        // keys are returned as they were encoded, unicode unless they are not valid UTF-8
+        PyObject * key = PyUnicode_DecodeUTF8(entries[i].key, entries[i].length, NULL);
+        if (!key)
+        {
+            PyErr_Clear();
+            key = PyBytes_FromStringAndSize(entries[i].key, entries[i].length);
+        }
+        PyObject * pair = key ? Py_BuildValue("(NL)", key, entries[i].count) : NULL;
+        if (!pair)
+        {
+            Py_CLEAR(result);
+            break;
+        }
+        PyList_SET_ITEM(result, i, pair);
+    }
+    free(entries);
+    return result;
+}
+
+/* Keys of update() collected for the batch update engine, along with the objects owning their data. */
+typedef struct {
+    int count;
+    char * keys[CMS_WINDOW];
+    Py_ssize_t lengths[CMS_WINDOW];
+    long long increments[CMS_WINDOW];
+    PyObject * owners[CMS_WINDOW];
+    PyObject * free_after[CMS_WINDOW];
+} CMS_VARIANT(_Window);
+
+/* Counts the collected keys without holding the GIL and releases their owners. */
+static void
+CMS_VARIANT(_flush_window)(CMS_TYPE * self, CMS_VARIANT(_Window) * window)
+{
+    uint64_t cells[CMS_WINDOW * 32];
+    uint64_t hashes[CMS_WINDOW];
+
+    Py_BEGIN_ALLOW_THREADS
+    CMS_VARIANT(_increment_window)(self, window->keys, window->lengths, window->increments, window->count, cells,
+                                   hashes);
+    Py_END_ALLOW_THREADS
+
+    int j;
+    for (j = 0; j < window->count; j++)
+    {
+        Py_DECREF(window->owners[j]);
+        Py_XDECREF(window->free_after[j]);
+    }
+    window->count = 0;
+}
+
+/**
+  * Adds an item of update() to the window: either a key, or a tuple of a key and its increment.
+  * Steals the reference to the item. Returns 0 on success, -1 with a Python exception set otherwise.
+  */
+static int
+CMS_VARIANT(_collect_item)(CMS_TYPE * self, CMS_VARIANT(_Window) * window, PyObject * item)
+{
+    PyObject * pkey = item;
+    PyObject * free_after = NULL;
+    Py_ssize_t dataLength;
+    long long increment = 1;
+
+    if (PyTuple_Check(item) && !PyArg_ParseTuple(item, "O|L", &pkey, &increment))
+    {
+        Py_DECREF(item);
+        return -1;
+    }
+    char * data = CMS_VARIANT(_parse_key)(pkey, &dataLength, &free_after);
+    if (!data)
+    {
+        Py_DECREF(item);
+        return -1;
+    }
+    if (increment <= 0)
+    {
+        Py_DECREF(item);
+        Py_XDECREF(free_after);
+        if (increment == 0)
+            return 0;
+        char * msg = "Increment must be positive!.";
+        PyErr_SetString(PyExc_ValueError, msg);
+        return -1;
+    }
+
+    int j = window->count++;
+    window->keys[j] = data;
+    window->lengths[j] = dataLength;
+    window->increments[j] = increment;
+    window->owners[j] = item;
+    window->free_after[j] = free_after;
+    if (window->count == CMS_WINDOW)
+        CMS_VARIANT(_flush_window)(self, window);
+    return 0;
+}
+
+static PyObject *
+CMS_VARIANT(_update)(CMS_TYPE * self, PyObject *args)
+{
+    PyObject * arg;
+    PyObject * should_dealloc = NULL;
+
+    if (!PyArg_ParseTuple(args, "O", &arg))
+        return NULL;
+    if (CMS_VARIANT(_check_writable)(self))
+        return NULL;
+
+    if (PyDict_Check(arg))
+    {
+        arg = PyDict_Items(arg);
+        should_dealloc = arg;
+    }
+    PyObject * iterator = PyObject_GetIter(arg);
+    if (iterator)
+    {
+        PyObject *item;
+        CMS_VARIANT(_Window) window;
+        window.count = 0;
+        while (item = PyIter_Next(iterator))
+        {
+            if (CMS_VARIANT(_collect_item)(self, &window, item))
+            {
+                // keys preceding the invalid one are counted
+                CMS_VARIANT(_flush_window)(self, &window);
+                Py_DECREF(iterator);
+                Py_XDECREF(should_dealloc);
+                return NULL;
+            }
+        }
+        CMS_VARIANT(_flush_window)(self, &window);
+        Py_DECREF(iterator);
+        if (PyErr_Occurred())
+        {
+            Py_XDECREF(should_dealloc);
+            return NULL;
+        }
+    }
+
+    if (should_dealloc)
+        Py_DECREF(should_dealloc);
+
+    if (!iterator)
+    {
+        char * msg = "Unsupported argument type!";
+        PyErr_SetString(PyExc_TypeError, msg);
+        return NULL;
+    }
+
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+/* Adds all keys of a buffer batch to the table without holding the GIL. */
+static PyObject *
+CMS_VARIANT(_update_buffer)(CMS_TYPE * self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"data", "offsets", "window", NULL};
+    PyObject * data;
+    PyObject * offsets = NULL;
+    int window = CMS_WINDOW;
+    KeyBuffer keys;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|Oi", kwlist, &data, &offsets, &window))
+        return NULL;
+    if (window < 1 || window > CMS_MAX_WINDOW)
+    {
+        char * msg = "Window must be in the range 1-1024";
+        PyErr_SetString(PyExc_ValueError, msg);
+        return NULL;
+    }
+    if (CMS_VARIANT(_check_writable)(self))
+        return NULL;
+    if (KeyBuffer_init(&keys, data, offsets))
+        return NULL;
+
+    // every key of a window needs its own scratch space, as the keys are hashed before any of them is updated
+    Py_ssize_t scratch_size = keys.max_length + 1;
+    char * scratch = malloc(scratch_size * window);
+    char ** window_keys = malloc(window * sizeof(char *));
+    Py_ssize_t * lengths = malloc(window * sizeof(Py_ssize_t));
+    long long * increments = malloc(window * sizeof(long long));
+    uint64_t * cells = malloc(window * self->depth * sizeof(uint64_t));
+    uint64_t * hashes = malloc(window * sizeof(uint64_t));
+    if (!scratch || !window_keys || !lengths || !increments || !cells || !hashes)
+    {
+        free(scratch);
+        free(window_keys);
+        free(lengths);
+        free(increments);
+        free(cells);
+        free(hashes);
+        KeyBuffer_release(&keys);
+        return PyErr_NoMemory();
+    }
+
+    int error = 0;
+    Py_BEGIN_ALLOW_THREADS
+    Py_ssize_t i = 0;
+    int count;
+    for (count = 0; count < window; count++)
+        increments[count] = 1;
+    while (i < keys.length && !error)
+    {
+        for (count = 0; count < window && i < keys.length; count++, i++)
+        {
+            window_keys[count] = KeyBuffer_get(&keys, i, &lengths[count], scratch + count * scratch_size, 0, &error);
+            if (!window_keys[count])
+                break;
+        }
+        CMS_VARIANT(_increment_window)(self, window_keys, lengths, increments, count, cells, hashes);
+    }
+    Py_END_ALLOW_THREADS
+
+    free(scratch);
+    free(window_keys);
+    free(lengths);
+    free(increments);
+    free(cells);
+    free(hashes);
+    KeyBuffer_release(&keys);
+    if (error)
+    {
+        KeyBuffer_set_error(error);
+        return NULL;
+    }
+
+    Py_INCREF(Py_None);
+    return Py_None;
 }
 
-/* Retrieves estimate of the set cardinality */
+/**
+  * Adds all n-grams of a batch of tokens to the table without holding the GIL.
+  * Each n-gram is joined into a scratch buffer reused for every window, so that it is counted
+  * as the key `sep.join(tokens[i:i + n])` without creating a Python object for it.
+  */
 static PyObject *
-CMS_VARIANT(_cardinality)(CMS_TYPE *self, PyObject *args)
+CMS_VARIANT(_update_ngrams)(CMS_TYPE * self, PyObject *args, PyObject *kwds)
 {
-   double cardinality = HyperLogLog_cardinality(&self->hll);
-   return Py_BuildValue("L", (long long) cardinality);
-}
+    static char *kwlist[] = {"tokens", "n", "sep", "offsets", NULL};
+    PyObject * data;
+    PyObject * offsets = NULL;
+    int n;
+    const char * sep = " ";
+    Py_ssize_t sep_length = 1;
+    KeyBuffer keys;
+    KeyNGrams ngrams;
 
-/* Retrieves the total number of increments */
-static PyObject *
-CMS_VARIANT(_total)(CMS_TYPE *self, PyObject *args)
-{
-   return Py_BuildValue("L", self->total);
-}
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "Oi|s#O", kwlist, &data, &n, &sep, &sep_length, &offsets))
+        return NULL;
+    if (n < 1)
+    {
+        char * msg = "The n-gram length must be at least 1!";
+        PyErr_SetString(PyExc_ValueError, msg);
+        return NULL;
+    }
+    if (CMS_VARIANT(_check_writable)(self))
+        return NULL;
+    if (KeyBuffer_init(&keys, data, offsets))
+        return NULL;
+    if (KeyNGrams_init(&ngrams, &keys, n, sep, sep_length, 0))
+    {
+        KeyBuffer_release(&keys);
+        return NULL;
+    }
+
+    Py_ssize_t scratch_size = ngrams.max_length + 1;
+    char * scratch = malloc(scratch_size * CMS_WINDOW);
+    if (!scratch)
+    {
+        KeyNGrams_release(&ngrams);
+        KeyBuffer_release(&keys);
+        return PyErr_NoMemory();
+    }
+
+    char * window_keys[CMS_WINDOW];
+    Py_ssize_t lengths[CMS_WINDOW];
+    long long increments[CMS_WINDOW];
+    uint64_t cells[CMS_WINDOW * 32];
+    uint64_t hashes[CMS_WINDOW];
+    int error = 0;
+    int count = CMS_WINDOW;
+
+    Py_BEGIN_ALLOW_THREADS
+    int j;
+    for (j = 0; j < CMS_WINDOW; j++)
+        increments[j] = 1;
+    while (count == CMS_WINDOW)
+    {
+        for (count = 0; count < CMS_WINDOW; count++)
+        {
+            window_keys[count] = KeyNGrams_next(&ngrams, scratch + count * scratch_size, &lengths[count], &error);
+            if (!window_keys[count])
+                break;
+        }
+        CMS_VARIANT(_increment_window)(self, window_keys, lengths, increments, count, cells, hashes);
+    }
+    Py_END_ALLOW_THREADS
+
+    free(scratch);
+    KeyNGrams_release(&ngrams);
+    KeyBuffer_release(&keys);
+    if (error)
+    {
+        KeyBuffer_set_error(error);
+        return NULL;
+    }
 
-static inline CMS_CELL_TYPE CMS_VARIANT(_merge_value) (CMS_CELL_TYPE v1, CMS_CELL_TYPE v2, uint32_t merge_seed);
+    Py_INCREF(Py_None);
+    return Py_None;
+}
 
 /**
-  * Merges another CMS instance into this one.
-  * This instance is incremented by values of the other instance, which remains unaffected
+  * Adds keys given by 64-bit hashes computed by the caller, with optional counts, without holding the GIL.
+  * The cells of a window of keys are prefetched before any of them is updated.
   */
 static PyObject *
-CMS_VARIANT(_merge)(CMS_TYPE *self, PyObject *args)
+CMS_VARIANT(_increment_hashes)(CMS_TYPE * self, PyObject *args, PyObject *kwds)
 {
-    CMS_TYPE *other;
-    if (!PyArg_ParseTuple(args, "O!", ((PyObject *) self)->ob_type, &other))
-    {
-        char * msg = "Object to merge must be an instance of CMS with the same algorithm.";
-        PyErr_SetString(PyExc_TypeError, msg);
+    static char *kwlist[] = {"hashes", "counts", NULL};
+    PyObject * hashes_o;
+    PyObject * counts_o = NULL;
+    Py_buffer hashes_view;
+    Py_buffer counts_view;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|O", kwlist, &hashes_o, &counts_o))
         return NULL;
-    }
-    if (other->width != self->width || other->depth != self->depth)
+    if (CMS_VARIANT(_check_writable)(self))
+        return NULL;
+    if (self->topk.capacity)
     {
-        char * msg = "CMS to merge must use the same width and depth.";
+        char * msg = "Heavy hitters can not be tracked for keys given by their hashes!";
         PyErr_SetString(PyExc_ValueError, msg);
         return NULL;
     }
 
-    Py_BEGIN_ALLOW_THREADS
-    uint32_t i,j;
-    uint32_t merge_seed = rand_32b();
-    for (i = 0; i < self->depth; i++)
+    Py_ssize_t length = KeyBuffer_get_int64(hashes_o, &hashes_view);
+    if (length < 0)
+        return NULL;
+    long long * counts = NULL;
+    if (counts_o && counts_o != Py_None)
     {
-        for (j = 0; j < self->width; j++)
+        Py_ssize_t counts_length = KeyBuffer_get_int64(counts_o, &counts_view);
+        if (counts_length < 0)
+        {
+            PyBuffer_Release(&hashes_view);
+            return NULL;
+        }
+        counts = (long long *) counts_view.buf;
+
+        Py_ssize_t i;
+        char * msg = NULL;
+        if (counts_length != length)
+            msg = "The counts must have the same length as the hashes!";
+        for (i = 0; !msg && i < length; i++)
+        {
+            if (counts[i] < 0)
+                msg = "Increment must be positive!";
+        }
+        if (msg)
         {
-            CMS_CELL_TYPE v1 = self->table[i][j];
-            CMS_CELL_TYPE v2 = other->table[i][j];
-            self->table[i][j] = CMS_VARIANT(_merge_value)(v1, v2, merge_seed);
+            PyBuffer_Release(&counts_view);
+            PyBuffer_Release(&hashes_view);
+            PyErr_SetString(PyExc_ValueError, msg);
+            return NULL;
         }
     }
 
-    self->total += other->total;
-    HyperLogLog_merge(&self->hll, &other->hll);
+    uint64_t * key_hashes = (uint64_t *) hashes_view.buf;
+    uint64_t cells[CMS_WINDOW * 32];
+    long long increments[CMS_WINDOW];
 
+    Py_BEGIN_ALLOW_THREADS
+    Py_ssize_t i = 0;
+    int count, j;
+    while (i < length)
+    {
+        for (count = 0; count < CMS_WINDOW && i < length; i++)
+        {
+            long long increment = counts ? counts[i] : 1;
+            if (!increment)
+                continue;
+            uint64_t * key_cells = cells + count * self->depth;
+            uint64_t hash = CMS_VARIANT(_hash_cells)(self, key_hashes[i], key_cells);
+            CMS_VARIANT(_add_total)(self, increment, hash);
+            for (j = 0; j < self->depth; j++)
+                CMS_PREFETCH(&CMS_CELL(self, key_cells[j]));
+            increments[count++] = increment;
+        }
+        for (j = 0; j < count; j++)
+            CMS_VARIANT(_increment_cells)(self, cells + j * self->depth, increments[j]);
+    }
     Py_END_ALLOW_THREADS
+
+    if (counts)
+        PyBuffer_Release(&counts_view);
+    PyBuffer_Release(&hashes_view);
+
     Py_INCREF(Py_None);
     return Py_None;
 }
 
+/* Retrieves estimates for keys given by 64-bit hashes into an array of 64-bit integers. */
 static PyObject *
-CMS_VARIANT(_update)(CMS_TYPE * self, PyObject *args)
+CMS_VARIANT(_get_hashes)(CMS_TYPE *self, PyObject *args, PyObject *kwds)
 {
-    PyObject * arg;
-    PyObject * should_dealloc = NULL;
+    static char *kwlist[] = {"hashes", "epochs", NULL};
+    PyObject * hashes_o;
+    unsigned int epochs = 0;
+    Py_buffer hashes_view;
+    Py_buffer view;
 
-    if (!PyArg_ParseTuple(args, "O", &arg))
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|I", kwlist, &hashes_o, &epochs))
         return NULL;
+    if (CMS_VARIANT(_check_epochs)(self, &epochs))
+        return NULL;
+    Py_ssize_t length = KeyBuffer_get_int64(hashes_o, &hashes_view);
+    if (length < 0)
+        return NULL;
+    PyObject * result = KeyBuffer_new_results(length, &view);
+    if (!result)
+    {
+        PyBuffer_Release(&hashes_view);
+        return NULL;
+    }
 
-    if (PyDict_Check(arg))
+    uint64_t * key_hashes = (uint64_t *) hashes_view.buf;
+    long long * values = (long long *) view.buf;
+    Py_BEGIN_ALLOW_THREADS
+    uint64_t cells[32];
+    Py_ssize_t i;
+    for (i = 0; i < length; i++)
     {
-        arg = PyDict_Items(arg);
-        should_dealloc = arg;
+        CMS_VARIANT(_hash_cells)(self, key_hashes[i], cells);
+        values[i] = CMS_VARIANT(_estimate)(self, cells, epochs);
     }
-    PyObject * iterator = PyObject_GetIter(arg);
-    if (iterator)
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&view);
+    PyBuffer_Release(&hashes_view);
+    return result;
+}
+
+/* Adds all tokens (or n-grams) of a file to the table, reading and counting them without holding the GIL. */
+static PyObject *
+CMS_VARIANT(_update_from_file)(CMS_TYPE * self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"file", "tokenizer", "ngram", "encoding", NULL};
+    PyObject * file;
+    const char * tokenizer = "whitespace";
+    int ngram = 1;
+    const char * encoding = "utf-8";
+    FileTokens tokens;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|sis", kwlist, &file, &tokenizer, &ngram, &encoding))
+        return NULL;
+    if (CMS_VARIANT(_check_writable)(self))
+        return NULL;
+    if (FileTokens_open(&tokens, file, tokenizer, ngram, encoding))
+        return NULL;
+
+    char * window_keys[CMS_WINDOW];
+    Py_ssize_t lengths[CMS_WINDOW];
+    long long increments[CMS_WINDOW];
+    uint64_t cells[CMS_WINDOW * 32];
+    uint64_t hashes[CMS_WINDOW];
+    int error = 0;
+    int status;
+
+    Py_BEGIN_ALLOW_THREADS
+    int count;
+    for (count = 0; count < CMS_WINDOW; count++)
+        increments[count] = 1;
+    // the keys point into the chunk, so the window is flushed before reading the next one
+    while ((status = FileTokens_read(&tokens, &error)) > 0)
     {
-        PyObject *item;
-        char *data;
-        Py_ssize_t dataLength;
-        while (item = PyIter_Next(iterator))
+        count = 0;
+        while ((window_keys[count] = FileTokens_next(&tokens, &lengths[count])))
         {
-            if (PyTuple_Check(item))
-            {
-                if (!CMS_VARIANT(_increment)(self, item))
-                {
-                    Py_DECREF(item);
-                    Py_DECREF(iterator);
-                    Py_XDECREF(should_dealloc);
-                    return NULL;
-                }
-            }
-            else
+            if (++count == CMS_WINDOW)
             {
-                PyObject * free_after = NULL;
-                data = CMS_VARIANT(_parse_key)(item, &dataLength, &free_after);
-                if (!data
-                    || !CMS_VARIANT(_increment_obj)(self, data, dataLength, 1))
-                {
-                    Py_DECREF(item);
-                    Py_XDECREF(free_after);
-                    Py_DECREF(iterator);
-                    Py_XDECREF(should_dealloc);
-                    return NULL;
-                }
-                Py_XDECREF(free_after);
+                CMS_VARIANT(_increment_window)(self, window_keys, lengths, increments, count, cells, hashes);
+                count = 0;
             }
-            Py_DECREF(item);
         }
-        Py_DECREF(iterator);
+        CMS_VARIANT(_increment_window)(self, window_keys, lengths, increments, count, cells, hashes);
     }
+    Py_END_ALLOW_THREADS
 
-    if (should_dealloc)
-        Py_DECREF(should_dealloc);
-
-    if (!iterator)
-    {
-        char * msg = "Unsupported argument type!";
-        PyErr_SetString(PyExc_TypeError, msg);
+    if (status < 0)
+        FileTokens_set_error(error);
+    FileTokens_close(&tokens);
+    if (status < 0)
         return NULL;
-    }
 
     Py_INCREF(Py_None);
     return Py_None;
 }
 
-/* Serialization function for pickling. */
+/**
+  * Builds the arguments for pickling. With `out_of_band` set, the rows are handed over as pickle.PickleBuffer
+  * objects pointing to the table, so that they are not copied (pickle protocol 5).
+  */
 static PyObject *
-CMS_VARIANT(_reduce)(CMS_TYPE *self)
+CMS_VARIANT(_reduce_rows)(CMS_TYPE *self, int out_of_band)
 {
-    PyObject *args = Py_BuildValue("(II)", self->width, self->depth);
-    PyObject *state_table = PyList_New(self->depth + 2);
-    int i;
-    for (i = 0; i < self->depth; i++)
+    Py_ssize_t rowlen = self->width * sizeof(CMS_CELL_TYPE);
+    PyObject *state_table = PyList_New(self->row_count + (self->topk.capacity ? 3 : 2));
+    if (!state_table)
+        return NULL;
+    uint32_t i;
+    for (i = 0; i < self->row_count; i++)
     {
-        PyObject *row = PyByteArray_FromStringAndSize(self->table[i], self->width * sizeof(CMS_CELL_TYPE));
+        // the rows of the current epoch come first, followed by the next epochs of the ring (the oldest first)
+        CMS_CELL_TYPE * source = self->rows[(self->epoch * self->depth + i) % self->row_count];
+        PyObject *row;
+        #ifdef SEGMENT_PICKLE_BUFFER
+        if (out_of_band)
+            // loading the buffers as they are still copies them, see Segment_get_state_buffer
+            row = Segment_pickle_buffer((PyObject *) self, source, rowlen, self->readonly);
+        else
+        #endif
+            row = PyByteArray_FromStringAndSize((char *) source, rowlen);
         if (!row)
+        {
+            Py_DECREF(state_table);
             return NULL;
-        PyList_SetItem(state_table, i, row);
+        }
+        PyList_SET_ITEM(state_table, i, row);
     }
-    PyObject *hll = PyByteArray_FromStringAndSize(self->hll.registers, self->hll.size);
+    PyObject *hll = PyByteArray_FromStringAndSize((char *) self->hll.registers, self->hll.size);
     if (!hll)
+    {
+        Py_DECREF(state_table);
         return NULL;
-    PyList_SetItem(state_table, self->depth, hll);
-    PyList_SetItem(state_table, self->depth + 1, Py_BuildValue("i", self->total));
+    }
+    PyList_SET_ITEM(state_table, self->row_count, hll);
+    PyList_SET_ITEM(state_table, self->row_count + 1, Py_BuildValue("L", *self->total));
+    if (self->topk.capacity)
+    {
+        SPINLOCK_ACQUIRE(&self->topk.lock);
+        uint32_t size = self->topk.size;
+        TopKEntry * entries = TopK_copy_sorted(&self->topk, size);
+        SPINLOCK_RELEASE(&self->topk.lock);
+        PyObject *top = entries ? PyList_New(size) : PyErr_NoMemory();
+        if (!top)
+        {
+            free(entries);
+            Py_DECREF(state_table);
+            return NULL;
+        }
+        PyList_SET_ITEM(state_table, self->row_count + 2, top);
+        uint32_t j;
+        for (j = 0; j < size; j++)
+        {
+            #if PY_MAJOR_VERSION >= 3
+            PyObject *pair = Py_BuildValue("(y#L)", entries[j].key, (Py_ssize_t) entries[j].length, entries[j].count);
+            #else
+            PyObject *pair = Py_BuildValue("(s#L)", entries[j].key, (Py_ssize_t) entries[j].length, entries[j].count);
+            #endif
+            if (!pair)
+            {
+                free(entries);
+                Py_DECREF(state_table);
+                return NULL;
+            }
+            PyList_SET_ITEM(top, j, pair);
+        }
+        free(entries);
+    }
+    PyObject *args = Py_BuildValue("(KIiiOOiII)", (unsigned long long) self->width, self->depth, self->hash_mode, self->layout, Py_None,
+                                   Py_None, self->concurrent, self->topk.capacity, self->epochs);
     return Py_BuildValue("(ONN)", Py_TYPE(self), args, state_table);
 }
 
-/* De-serialization function for pickling. */
+/* Serialization function for pickling. */
+static PyObject *
+CMS_VARIANT(_reduce)(CMS_TYPE *self)
+{
+    return CMS_VARIANT(_reduce_rows)(self, 0);
+}
+
+/* Serialization function for pickling, handing over the table without copying with protocol 5 and higher. */
+static PyObject *
+CMS_VARIANT(_reduce_ex)(CMS_TYPE *self, PyObject *args)
+{
+    int protocol;
+    if (!PyArg_ParseTuple(args, "i", &protocol))
+        return NULL;
+    return CMS_VARIANT(_reduce_rows)(self, protocol >= 5);
+}
+
+/* Replaces the heavy hitters by a sequence of (key, count) pairs, if they are tracked. Returns -1 on error. */
+static int
+CMS_VARIANT(_set_top)(CMS_TYPE *self, PyObject *top_obj)
+{
+    if (!self->topk.capacity)
+        return 0;
+    PyObject * top = PySequence_Fast(top_obj, "Invalid heavy hitters!");
+    if (!top)
+        return -1;
+    SPINLOCK_ACQUIRE(&self->topk.lock);
+    TopK_clear(&self->topk);
+    SPINLOCK_RELEASE(&self->topk.lock);
+    Py_ssize_t j;
+    for (j = 0; j < PySequence_Fast_GET_SIZE(top); j++)
+    {
+        char * key;
+        Py_ssize_t length;
+        long long count;
+        uint64_t cells[32];
+        if (!PyArg_ParseTuple(PySequence_Fast_GET_ITEM(top, j), "s#L", &key, &length, &count))
+        {
+            Py_DECREF(top);
+            return -1;
+        }
+        uint32_t hash = (uint32_t) CMS_VARIANT(_cells)(self, key, length, cells);
+        SPINLOCK_ACQUIRE(&self->topk.lock);
+        TopK_offer(&self->topk, key, length, hash, count);
+        SPINLOCK_RELEASE(&self->topk.lock);
+    }
+    Py_DECREF(top);
+    return 0;
+}
+
+/**
+  * De-serialization function for pickling.
+  * Writable rows of the state are used in place instead of being copied into the table,
+  * unless they are exported by another live structure.
+  */
 static PyObject *
 CMS_VARIANT(_set_state)(CMS_TYPE * self, PyObject * state)
 {
     PyObject *state_table;
 
-    if (!PyArg_ParseTuple(state, "O:setstate", &state_table))
+    if (!PyArg_ParseTuple(state, "O!:setstate", &PyList_Type, &state_table))
+        return NULL;
+    if (CMS_VARIANT(_check_writable)(self))
         return NULL;
+    Py_ssize_t state_size = PyList_GET_SIZE(state_table);
+    if (state_size != self->row_count + 2 && state_size != self->row_count + 3)
+    {
+        char * msg = "Pickled state does not match the size of the structure!";
+        PyErr_SetString(PyExc_ValueError, msg);
+        return NULL;
+    }
 
     Py_ssize_t rowlen = self->width * sizeof(CMS_CELL_TYPE);
-    CMS_CELL_TYPE *row_buffer;
-    hll_cell_t *hll_buffer;
+    Py_buffer view;
 
-    int i;
-    for (i = 0; i < self->depth; i++)
+    // the pickled rows start with the current epoch
+    self->epoch = 0;
+    self->table = self->rows;
+
+    uint32_t i;
+    for (i = 0; i < self->row_count; i++)
     {
-        PyObject *row = PyList_GetItem(state_table, i);
-        row_buffer = PyByteArray_AsString(row);
-        if (!row_buffer)
+        int in_place = Segment_get_state_buffer(PyList_GET_ITEM(state_table, i), &view, rowlen, sizeof(CMS_CELL_TYPE));
+        if (in_place < 0)
             return NULL;
-        memcpy(self->table[i], row_buffer, rowlen);
+        // a table backed by a storage must stay there
+        if (!in_place || self->has_storage)
+        {
+            memcpy(self->rows[i], view.buf, rowlen);
+            PyBuffer_Release(&view);
+            continue;
+        }
+
+        if (!self->adopted)
+        {
+            self->adopted = (Py_buffer *) calloc(self->row_count, sizeof(Py_buffer));
+            if (!self->adopted)
+            {
+                PyBuffer_Release(&view);
+                return PyErr_NoMemory();
+            }
+        }
+        if (self->adopted[i].obj)
+            PyBuffer_Release(&self->adopted[i]);
+        free(self->table_alloc[i]);
+        self->table_alloc[i] = NULL;
+        self->adopted[i] = view;
+        self->rows[i] = (CMS_CELL_TYPE *) view.buf;
+    }
+
+    if (Segment_get_state_buffer(PyList_GET_ITEM(state_table, self->row_count), &view, self->hll.size, 1) < 0)
+        return NULL;
+    memcpy(self->hll.registers, view.buf, self->hll.size);
+    PyBuffer_Release(&view);
+
+    *self->total = PyLong_AsLongLong(PyList_GET_ITEM(state_table, self->row_count + 1));
+    if (PyErr_Occurred())
+        return NULL;
+
+    if (state_size == self->row_count + 3 && CMS_VARIANT(_set_top)(self, PyList_GET_ITEM(state_table, self->row_count + 2)))
+        return NULL;
+
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+/**
+  * Segment `i` of the sparse encoding of the table: the rows in the order of pickling (the current epoch first),
+  * followed by the HLL registers as the last segment.
+  */
+static inline unsigned char *
+CMS_VARIANT(_sparse_segment)(CMS_TYPE *self, uint32_t i, size_t *length)
+{
+    if (i < self->row_count)
+    {
+        *length = (size_t) self->width * sizeof(CMS_CELL_TYPE);
+        return (unsigned char *) self->rows[(self->epoch * self->depth + i) % self->row_count];
+    }
+    *length = self->hll.size;
+    return (unsigned char *) self->hll.registers;
+}
+
+/**
+  * Encodes the table and the HLL registers as a sequence of runs, each a varint number of zero bytes followed by
+  * a varint length of a literal and the literal bytes. Zero runs span rows, trailing zeros are left out.
+  */
+static PyObject *
+CMS_VARIANT(_encode_sparse)(CMS_TYPE *self, PyObject *args)
+{
+    size_t capacity = 1 << 16;
+    size_t size = 0;
+    unsigned char * out = (unsigned char *) malloc(capacity);
+    if (!out)
+        return PyErr_NoMemory();
+
+    uint64_t pending = 0;
+    uint32_t i;
+    int failed = 0;
+    Py_BEGIN_ALLOW_THREADS
+    for (i = 0; i <= self->row_count && !failed; i++)
+    {
+        size_t length, position = 0;
+        unsigned char * data = CMS_VARIANT(_sparse_segment)(self, i, &length);
+        while (position < length)
+        {
+            size_t zeros = sparse_zeros(data + position, length - position);
+            position += zeros;
+            pending += zeros;
+            if (position == length)
+                break;
+
+            size_t literal = sparse_literal(data + position, length - position);
+            if (size + literal + 20 > capacity)
+            {
+                while (size + literal + 20 > capacity)
+                    capacity *= 2;
+                unsigned char * grown = (unsigned char *) realloc(out, capacity);
+                if (!grown)
+                {
+                    failed = 1;
+                    break;
+                }
+                out = grown;
+            }
+            unsigned char * end = varint_put(varint_put(out + size, pending), literal);
+            memcpy(end, data + position, literal);
+            size = end + literal - out;
+            position += literal;
+            pending = 0;
+        }
     }
+    Py_END_ALLOW_THREADS
+
+    if (failed)
+    {
+        free(out);
+        return PyErr_NoMemory();
+    }
+    PyObject * result = PyBytes_FromStringAndSize((char *) out, size);
+    free(out);
+    return result;
+}
 
-    PyObject *row = PyList_GetItem(state_table, self->depth);
-    hll_buffer = PyByteArray_AsString(row);
-    if (!hll_buffer)
+/**
+  * Decodes a table encoded by _encode_sparse straight into the rows of this table, which must be cleared
+  * (such as a new one), then sets the total and the heavy hitters.
+  */
+static PyObject *
+CMS_VARIANT(_decode_sparse)(CMS_TYPE *self, PyObject *args)
+{
+    PyObject * data;
+    long long total;
+    PyObject * top = Py_None;
+    if (!PyArg_ParseTuple(args, "OL|O", &data, &total, &top))
+        return NULL;
+    if (CMS_VARIANT(_check_writable)(self))
         return NULL;
-    memcpy(self->hll.registers, hll_buffer, self->hll.size);
+    Py_buffer view;
+    if (PyObject_GetBuffer(data, &view, PyBUF_SIMPLE))
+        return NULL;
+
+    // the encoded rows start with the current epoch
+    self->epoch = 0;
+    self->table = self->rows;
+
+    const unsigned char * in = (const unsigned char *) view.buf;
+    const unsigned char * end = in + view.len;
+    uint32_t segment = 0;
+    size_t length, position = 0;
+    unsigned char * target = CMS_VARIANT(_sparse_segment)(self, segment, &length);
+    int corrupted = 0;
+    Py_BEGIN_ALLOW_THREADS
+    while (in < end)
+    {
+        uint64_t zeros, literal;
+        if (varint_get(&in, end, &zeros) || varint_get(&in, end, &literal) || literal > (uint64_t) (end - in))
+        {
+            corrupted = 1;
+            break;
+        }
+        while (segment <= self->row_count && zeros >= length - position)
+        {
+            zeros -= length - position;
+            position = 0;
+            if (++segment <= self->row_count)
+                target = CMS_VARIANT(_sparse_segment)(self, segment, &length);
+        }
+        position += zeros;
+        while (literal && segment <= self->row_count)
+        {
+            size_t chunk = literal < length - position ? literal : length - position;
+            memcpy(target + position, in, chunk);
+            in += chunk;
+            literal -= chunk;
+            position += chunk;
+            if (position == length)
+            {
+                position = 0;
+                if (++segment <= self->row_count)
+                    target = CMS_VARIANT(_sparse_segment)(self, segment, &length);
+            }
+        }
+        if (literal || (segment > self->row_count && zeros))
+        {
+            corrupted = 1;
+            break;
+        }
+    }
+    Py_END_ALLOW_THREADS
+    PyBuffer_Release(&view);
 
-    self->total = PyLong_AsLongLong(PyList_GetItem(state_table, self->depth + 1));
+    if (corrupted)
+    {
+        char * msg = "Encoded table is corrupted or does not match the size of the structure!";
+        PyErr_SetString(PyExc_ValueError, msg);
+        return NULL;
+    }
+    *self->total = total;
+    if (top != Py_None && CMS_VARIANT(_set_top)(self, top))
+        return NULL;
 
     Py_INCREF(Py_None);
     return Py_None;
@@ -439,24 +2182,67 @@ static PyMethodDef CMS_VARIANT(_methods)[] = {
     {"get", (PyCFunction)CMS_VARIANT(_getitem), METH_VARARGS,
     "Retrieves estimate for the frequency of a single element."
     },
+    {"get_many", (PyCFunction)CMS_VARIANT(_get_many), METH_VARARGS | METH_KEYWORDS,
+    "Retrieves estimates for the frequencies of a batch of elements as an array of 64-bit integers."
+    },
     {"cardinality", (PyCFunction)CMS_VARIANT(_cardinality), METH_NOARGS,
     "Retrieves estimate of the set cardinality."
     },
     {"total", (PyCFunction)CMS_VARIANT(_total), METH_NOARGS,
     "Retrieves the total number of increments."
     },
-    {"merge", (PyCFunction)CMS_VARIANT(_merge), METH_VARARGS,
+    {"merge", (PyCFunction)CMS_VARIANT(_merge), METH_VARARGS | METH_KEYWORDS,
     "Merges another CMS instance into this one."
     },
+    {"merge_many", (PyCFunction)CMS_VARIANT(_merge_many), METH_VARARGS | METH_KEYWORDS,
+    "Merges a sequence of CMS instances into this one in a single pass."
+    },
+    {"advance", (PyCFunction)CMS_VARIANT(_advance), METH_NOARGS,
+    "Starts a new epoch in place of the oldest one."
+    },
+    {"most_common", (PyCFunction)CMS_VARIANT(_most_common), METH_VARARGS,
+    "Retrieves the tracked keys with the highest estimates, with their estimates."
+    },
+    {"count_nonzero", (PyCFunction)CMS_VARIANT(_count_nonzero), METH_NOARGS,
+    "Retrieves the number of cells with a non-zero value."
+    },
+    {"count_saturated", (PyCFunction)CMS_VARIANT(_count_saturated), METH_NOARGS,
+    "Retrieves the number of cells at the largest value they can hold."
+    },
     {"update", (PyCFunction)CMS_VARIANT(_update), METH_VARARGS,
     "Updates this CMS with values from another CMS, iterable, or dictionary."
     },
+    {"update_buffer", (PyCFunction)CMS_VARIANT(_update_buffer), METH_VARARGS | METH_KEYWORDS,
+    "Increments all keys of a fixed-width string array, or of a values buffer delimited by offsets.\n"
+    "Keys are hashed and their cells prefetched `window` keys ahead of the updates."
+    },
+    {"increment_hashes", (PyCFunction)CMS_VARIANT(_increment_hashes), METH_VARARGS | METH_KEYWORDS,
+    "Increments keys given by 64-bit hashes, optionally by an array of counts."
+    },
+    {"get_hashes", (PyCFunction)CMS_VARIANT(_get_hashes), METH_VARARGS | METH_KEYWORDS,
+    "Returns estimates of keys given by 64-bit hashes as an array of 64-bit integers."
+    },
+    {"update_from_file", (PyCFunction)CMS_VARIANT(_update_from_file), METH_VARARGS | METH_KEYWORDS,
+    "Increments all tokens or n-grams of a file, optionally gzip compressed, read by a native tokenizer."
+    },
+    {"update_ngrams", (PyCFunction)CMS_VARIANT(_update_ngrams), METH_VARARGS | METH_KEYWORDS,
+    "Increments all n-grams of a batch of tokens, joined by a separator, without creating the joined keys."
+    },
     {"__reduce__", (PyCFunction)CMS_VARIANT(_reduce), METH_NOARGS,
      "Serialization function for pickling."
     },
+    {"__reduce_ex__", (PyCFunction)CMS_VARIANT(_reduce_ex), METH_VARARGS,
+     "Serialization function for pickling, the table is passed out-of-band with protocol 5."
+    },
     {"__setstate__", (PyCFunction)CMS_VARIANT(_set_state), METH_VARARGS,
     "De-serialization function for pickling."
     },
+    {"encode_sparse", (PyCFunction)CMS_VARIANT(_encode_sparse), METH_NOARGS,
+     "Encodes the table with the cardinality estimator as runs of zero and literal bytes."
+    },
+    {"decode_sparse", (PyCFunction)CMS_VARIANT(_decode_sparse), METH_VARARGS,
+     "Decodes a table encoded by encode_sparse into this cleared table, with its total and heavy hitters."
+    },
     {NULL}  /* Sentinel */
 };
 
@@ -12,9 +12,12 @@
 #define CMS_TYPE_STRING "CMS_Conservative"
 #define CMS_CELL_TYPE uint32_t
 
+/* Cells hold plain counts, so tables are merged by vectorized addition. */
+#define CMS_ADD_CELLS Simd_add_u32
+
 #include "cms_common.h"
 
-static inline int CMS_VARIANT(should_inc)(CMS_CELL_TYPE value)
+static inline int CMS_VARIANT(should_inc)(uint64_t *random_state, CMS_CELL_TYPE value)
 {
     return 1;
 }
@@ -24,13 +27,14 @@ static inline long long CMS_VARIANT(decode)(CMS_CELL_TYPE value)
     return value;
 }
 
-static inline CMS_CELL_TYPE CMS_VARIANT(_merge_value)(CMS_CELL_TYPE v1, CMS_CELL_TYPE v2, uint32_t merge_seed)
+static inline CMS_CELL_TYPE CMS_VARIANT(_encode_sum)(long long decoded, uint32_t merge_seed)
 {
-    return v1 + v2;
+    return decoded;
 }
 
 #undef CMS_TYPE
 #undef CMS_TYPE_STRING
 #undef CMS_CELL_TYPE
+#undef CMS_ADD_CELLS
 
 #endif /* _CMS_CONSERVATIE_H_ */
\ No newline at end of file
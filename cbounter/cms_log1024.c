@@ -11,13 +11,13 @@
 
 #include "cms_common.h"
 
-static inline int CMS_VARIANT(should_inc)(CMS_CELL_TYPE value)
+static inline int CMS_VARIANT(should_inc)(uint64_t *random_state, CMS_CELL_TYPE value)
 {
     if (value >= 2048)
     {
         uint8_t shift = 33 - (value >> 10);
         uint32_t mask = 0xFFFFFFFF >> shift;
-        if (mask & rand_32b())
+        if (mask & random_next(random_state))
             return 0;
     }
     return 1;
@@ -31,11 +31,8 @@ static inline long long CMS_VARIANT(decode)(CMS_CELL_TYPE value)
         return (1024 + (value & 1023)) << ((value >> 10) - 1);
 }
 
-static inline CMS_CELL_TYPE CMS_VARIANT(_merge_value)(CMS_CELL_TYPE v1, CMS_CELL_TYPE v2, uint32_t merge_seed)
+static inline CMS_CELL_TYPE CMS_VARIANT(_encode_sum)(long long decoded, uint32_t merge_seed)
 {
-    long long decoded = CMS_VARIANT(decode)(v1);
-    decoded += CMS_VARIANT(decode)(v2);
-
     if (decoded <= 2048)
         return decoded;
 
@@ -11,13 +11,13 @@
 
 #include "cms_common.h"
 
-static inline int CMS_VARIANT(should_inc)(CMS_CELL_TYPE value)
+static inline int CMS_VARIANT(should_inc)(uint64_t *random_state, CMS_CELL_TYPE value)
 {
     if (value >= 16)
     {
         uint8_t shift = 33 - (value >> 3);
         uint32_t mask = 0xFFFFFFFF >> shift;
-        if (mask & rand_32b())
+        if (mask & random_next(random_state))
             return 0;
     }
     return 1;
@@ -33,11 +33,8 @@ static inline long long CMS_VARIANT(decode)(CMS_CELL_TYPE value)
 
 #include <stdio.h>
 
-static inline CMS_CELL_TYPE CMS_VARIANT(_merge_value)(CMS_CELL_TYPE v1, CMS_CELL_TYPE v2, uint32_t merge_seed)
+static inline CMS_CELL_TYPE CMS_VARIANT(_encode_sum)(long long decoded, uint32_t merge_seed)
 {
-    long long decoded = CMS_VARIANT(decode)(v1);
-    decoded += CMS_VARIANT(decode)(v2);
-
     if (decoded <= 16)
         return decoded;
 
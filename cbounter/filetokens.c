@@ -0,0 +1,402 @@
+//-----------------------------------------------------------------------------
+// Author: Filip Stefanak <f.stefanak@rare-technologies.com>
+// Copyright (C) 2017 Rare Technologies
+//
+// This code is distributed under the terms and conditions
+// from the MIT License (MIT).
+
+#include "filetokens.h"
+#include <string.h>
+#include <stdio.h>
+#include <limits.h>
+#ifdef _WIN32
+#include <io.h>
+#define dup _dup
+#define close _close
+#define fdopen _fdopen
+#else
+#include <unistd.h>
+#endif
+#ifdef BOUNTER_ZLIB
+#include <zlib.h>
+#endif
+
+int
+FileTokens_zlib(void)
+{
+    #ifdef BOUNTER_ZLIB
+    return 1;
+    #else
+    return 0;
+    #endif
+}
+
+/* Keys are counted as the bytes they are stored in, so only UTF-8 (and its ASCII subset) is accepted. */
+static int
+FileTokens_check_encoding(const char *encoding)
+{
+    PyObject * module = PyImport_ImportModule("codecs");
+    if (!module)
+        return -1;
+    PyObject * info = PyObject_CallMethod(module, "lookup", "s", encoding);
+    Py_DECREF(module);
+    if (!info)
+        return -1;
+    PyObject * name = PyObject_GetAttrString(info, "name");
+    Py_DECREF(info);
+    if (!name)
+        return -1;
+
+    #if PY_MAJOR_VERSION >= 3
+    int supported = !PyUnicode_CompareWithASCIIString(name, "utf-8")
+                    || !PyUnicode_CompareWithASCIIString(name, "ascii");
+    #else
+    int supported = PyString_Check(name)
+                    && (!strcmp(PyString_AsString(name), "utf-8") || !strcmp(PyString_AsString(name), "ascii"));
+    #endif
+    Py_DECREF(name);
+    if (!supported)
+    {
+        char * msg = "Only UTF-8 encoded files are supported!";
+        PyErr_SetString(PyExc_ValueError, msg);
+        return -1;
+    }
+    return 0;
+}
+
+int
+FileTokens_open(FileTokens *self, PyObject *file, const char *tokenizer, int n, const char *encoding)
+{
+    memset(self, 0, sizeof(FileTokens));
+
+    if (!strcmp(tokenizer, "whitespace"))
+        self->tokenizer = FILE_TOKENS_WHITESPACE;
+    else if (!strcmp(tokenizer, "line"))
+        self->tokenizer = FILE_TOKENS_LINES;
+    else
+    {
+        char * msg = "The tokenizer must be one of 'whitespace' or 'line'!";
+        PyErr_SetString(PyExc_ValueError, msg);
+        return -1;
+    }
+    if (n < 1)
+    {
+        char * msg = "The n-gram length must be at least 1!";
+        PyErr_SetString(PyExc_ValueError, msg);
+        return -1;
+    }
+    if (n > 1 && self->tokenizer == FILE_TOKENS_LINES)
+    {
+        char * msg = "N-grams are only supported with the whitespace tokenizer!";
+        PyErr_SetString(PyExc_ValueError, msg);
+        return -1;
+    }
+    if (FileTokens_check_encoding(encoding))
+        return -1;
+    self->n = n;
+
+    PyObject * path = NULL;
+    int fd = -1;
+    #if PY_MAJOR_VERSION >= 3
+    if (PyLong_Check(file) || PyObject_HasAttrString(file, "fileno"))
+    #else
+    if (PyInt_Check(file) || PyLong_Check(file) || PyObject_HasAttrString(file, "fileno"))
+    #endif
+    {
+        fd = PyObject_AsFileDescriptor(file);
+        if (fd < 0)
+            return -1;
+        // the descriptor belongs to the caller, the duplicate is closed along with the file
+        fd = dup(fd);
+        if (fd < 0)
+        {
+            PyErr_SetFromErrno(PyExc_OSError);
+            return -1;
+        }
+    }
+    #if PY_MAJOR_VERSION >= 3
+    else if (!PyUnicode_FSConverter(file, &path))
+        return -1;
+    #else
+    else if (PyString_Check(file))
+    {
+        path = file;
+        Py_INCREF(path);
+    }
+    else
+    {
+        char * msg = "The file must be a path or a file descriptor!";
+        PyErr_SetString(PyExc_TypeError, msg);
+        return -1;
+    }
+    #endif
+
+    #ifdef BOUNTER_ZLIB
+    self->handle = path ? gzopen(PyBytes_AS_STRING(path), "rb") : gzdopen(fd, "rb");
+    if (self->handle)
+        gzbuffer((gzFile) self->handle, FILE_TOKENS_BLOCK);
+    #else
+    self->handle = path ? fopen(PyBytes_AS_STRING(path), "rb") : fdopen(fd, "rb");
+    #endif
+    if (!self->handle)
+    {
+        if (path)
+            PyErr_SetFromErrnoWithFilename(PyExc_OSError, PyBytes_AS_STRING(path));
+        else
+        {
+            PyErr_SetFromErrno(PyExc_OSError);
+            close(fd);
+        }
+        Py_XDECREF(path);
+        return -1;
+    }
+    Py_XDECREF(path);
+
+    self->capacity = FILE_TOKENS_BLOCK;
+    self->buffer = malloc(self->capacity + 1);
+    self->tokens = malloc(n * sizeof(char *));
+    self->lengths = malloc(n * sizeof(Py_ssize_t));
+    if (!self->buffer || !self->tokens || !self->lengths)
+    {
+        FileTokens_close(self);
+        PyErr_NoMemory();
+        return -1;
+    }
+
+    #ifndef BOUNTER_ZLIB
+    // the magic bytes are kept in the buffer as the beginning of the first chunk
+    self->filled = fread(self->buffer, 1, 2, (FILE *) self->handle);
+    if (self->filled == 2 && (unsigned char) self->buffer[0] == 0x1f && (unsigned char) self->buffer[1] == 0x8b)
+    {
+        FileTokens_close(self);
+        char * msg = "Reading gzip compressed files requires bounter built with zlib!";
+        PyErr_SetString(PyExc_ValueError, msg);
+        return -1;
+    }
+    #endif
+    return 0;
+}
+
+void
+FileTokens_close(FileTokens *self)
+{
+    if (self->handle)
+    {
+        #ifdef BOUNTER_ZLIB
+        gzclose((gzFile) self->handle);
+        #else
+        fclose((FILE *) self->handle);
+        #endif
+    }
+    free(self->buffer);
+    free(self->tokens);
+    free(self->lengths);
+    free(self->ngrams);
+    self->handle = NULL;
+    self->buffer = NULL;
+    self->tokens = NULL;
+    self->lengths = NULL;
+    self->ngrams = NULL;
+}
+
+/* Reads up to `size` bytes into `target`. Returns the number of bytes read, or -1 with `error` set. */
+static Py_ssize_t
+FileTokens_read_block(FileTokens *self, char *target, Py_ssize_t size, int *error)
+{
+    #ifdef BOUNTER_ZLIB
+    int result = gzread((gzFile) self->handle, target, (size > INT_MAX) ? INT_MAX : (unsigned int) size);
+    if (result < 0)
+    {
+        int errnum;
+        gzerror((gzFile) self->handle, &errnum);
+        if (errnum == Z_ERRNO)
+            *error = FILE_ERROR_READ;
+        else if (errnum == Z_MEM_ERROR)
+            *error = FILE_ERROR_MEMORY;
+        else
+            *error = FILE_ERROR_DECOMPRESS;
+        return -1;
+    }
+    return result;
+    #else
+    size_t result = fread(target, 1, size, (FILE *) self->handle);
+    if (result < (size_t) size && ferror((FILE *) self->handle))
+    {
+        *error = FILE_ERROR_READ;
+        return -1;
+    }
+    return result;
+    #endif
+}
+
+int
+FileTokens_read(FileTokens *self, int *error)
+{
+    // the incomplete line following the processed chunk is kept
+    Py_ssize_t rest = self->filled - self->chunk_end;
+    memmove(self->buffer, self->buffer + self->chunk_end, rest);
+    self->filled = rest;
+    self->chunk_end = 0;
+    self->position = 0;
+    self->line_tokens = 0;
+    self->line_break = 0;
+    self->ngrams_used = 0;
+
+    while (!self->chunk_end)
+    {
+        if (self->eof)
+        {
+            if (!self->filled)
+                return 0;
+            // the last line is not followed by a line break
+            self->chunk_end = self->filled;
+            break;
+        }
+        if (self->filled == self->capacity)
+        {
+            // the buffer does not hold a single line
+            char * buffer = realloc(self->buffer, 2 * self->capacity + 1);
+            if (!buffer)
+            {
+                *error = FILE_ERROR_MEMORY;
+                return -1;
+            }
+            self->buffer = buffer;
+            self->capacity *= 2;
+        }
+
+        Py_ssize_t start = self->filled;
+        Py_ssize_t got = FileTokens_read_block(self, self->buffer + start, self->capacity - start, error);
+        if (got < 0)
+            return -1;
+        if (!got)
+        {
+            self->eof = 1;
+            continue;
+        }
+        self->filled += got;
+
+        // the chunk ends after the last line break read
+        Py_ssize_t i = self->filled;
+        while (i > start && self->buffer[i - 1] != '\n')
+            i--;
+        if (i > start)
+            self->chunk_end = i;
+    }
+
+    if (self->n > 1)
+    {
+        // every token followed by a delimiter is joined into at most `n` n-grams
+        Py_ssize_t required = self->n * (self->chunk_end + 1) + 1;
+        if (required > self->ngrams_capacity)
+        {
+            free(self->ngrams);
+            self->ngrams = malloc(required);
+            self->ngrams_capacity = self->ngrams ? required : 0;
+            if (!self->ngrams)
+            {
+                *error = FILE_ERROR_MEMORY;
+                return -1;
+            }
+        }
+    }
+    return 1;
+}
+
+static inline int
+FileTokens_delimiter(FileTokens *self, char c)
+{
+    if (c == '\n' || c == 0)
+        return 1;
+    if (self->tokenizer == FILE_TOKENS_LINES)
+        return 0;
+    return c == ' ' || c == '\t' || c == '\r' || c == '\v' || c == '\f';
+}
+
+char *
+FileTokens_next(FileTokens *self, Py_ssize_t *length)
+{
+    char * buffer = self->buffer;
+    Py_ssize_t end = self->chunk_end;
+    Py_ssize_t i = self->position;
+    Py_ssize_t j;
+
+    while (1)
+    {
+        if (self->line_break)
+        {
+            self->line_tokens = 0;
+            self->line_break = 0;
+        }
+        while (i < end && FileTokens_delimiter(self, buffer[i]))
+        {
+            if (buffer[i] == '\n')
+                self->line_tokens = 0;
+            i++;
+        }
+        if (i >= end)
+        {
+            self->position = i;
+            return NULL;
+        }
+
+        char * token = buffer + i;
+        while (i < end && !FileTokens_delimiter(self, buffer[i]))
+            i++;
+        Py_ssize_t token_length = buffer + i - token;
+        // the delimiter is replaced by the terminating null byte, the line break must be noted first
+        if (i < end)
+        {
+            self->line_break = buffer[i] == '\n';
+            i++;
+        }
+        if (self->tokenizer == FILE_TOKENS_LINES && token[token_length - 1] == '\r')
+            token_length--;
+        token[token_length] = 0;
+        if (!token_length)
+            continue;
+
+        if (self->n == 1)
+        {
+            self->position = i;
+            *length = token_length;
+            return token;
+        }
+
+        Py_ssize_t slot = self->line_tokens % self->n;
+        self->tokens[slot] = token;
+        self->lengths[slot] = token_length;
+        self->line_tokens++;
+        if (self->line_tokens < self->n)
+            continue;
+
+        char * ngram = self->ngrams + self->ngrams_used;
+        char * position = ngram;
+        for (j = self->line_tokens - self->n; j < self->line_tokens; j++)
+        {
+            slot = j % self->n;
+            if (j > self->line_tokens - self->n)
+                *position++ = ' ';
+            memcpy(position, self->tokens[slot], self->lengths[slot]);
+            position += self->lengths[slot];
+        }
+        *position = 0;
+        *length = position - ngram;
+        self->ngrams_used += *length + 1;
+        self->position = i;
+        return ngram;
+    }
+}
+
+void
+FileTokens_set_error(int error)
+{
+    if (error == FILE_ERROR_READ)
+        PyErr_SetFromErrno(PyExc_OSError);
+    else if (error == FILE_ERROR_MEMORY)
+        PyErr_NoMemory();
+    else if (error == FILE_ERROR_DECOMPRESS)
+        PyErr_SetString(PyExc_OSError, "The file is not a valid gzip file!");
+    else
+        PyErr_SetString(PyExc_SystemError, "Unknown file reading error!");
+}
@@ -0,0 +1,83 @@
+//-----------------------------------------------------------------------------
+// Author: Filip Stefanak <f.stefanak@rare-technologies.com>
+// Copyright (C) 2017 Rare Technologies
+//
+// This code is distributed under the terms and conditions
+// from the MIT License (MIT).
+
+#ifndef FILETOKENS_H
+#define FILETOKENS_H
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+
+/* Tokens separated by ASCII whitespace. */
+#define FILE_TOKENS_WHITESPACE 1
+/* Every non-empty line is a single token. */
+#define FILE_TOKENS_LINES 2
+
+/* Size of the blocks read from the file, the buffer grows for longer lines. */
+#define FILE_TOKENS_BLOCK (1 << 20)
+
+/* Errors reported by FileTokens_read */
+#define FILE_ERROR_READ 1
+#define FILE_ERROR_MEMORY 2
+#define FILE_ERROR_DECOMPRESS 3
+
+/**
+  * Tokens, or n-grams of tokens joined by a space, read from a file in large blocks.
+  * The file is read and tokenized in chunks of complete lines and n-grams never span lines.
+  * Gzip compressed files are decompressed transparently if the module is built with zlib.
+  * Once opened, the tokens can be read without holding the GIL.
+  */
+typedef struct {
+    void * handle; // gzFile with zlib, FILE * otherwise
+    char tokenizer;
+    int n;
+    char * buffer;
+    Py_ssize_t capacity;
+    Py_ssize_t filled; // bytes read into the buffer
+    Py_ssize_t chunk_end; // end of the complete lines in the buffer
+    Py_ssize_t position; // position of the tokenizer in the chunk
+    char eof;
+    char line_break; // the last token ended its line
+    Py_ssize_t line_tokens; // number of tokens of the current line read so far
+    char ** tokens; // the last `n` tokens of the current line
+    Py_ssize_t * lengths;
+    char * ngrams; // n-grams joined in the current chunk
+    Py_ssize_t ngrams_capacity;
+    Py_ssize_t ngrams_used;
+} FileTokens;
+
+/* Returns 1 if gzip compressed files are supported, 0 otherwise. */
+int FileTokens_zlib(void);
+
+/**
+  * Opens a file given by a path (str, bytes or os.PathLike) or by a file descriptor (or an object with fileno()).
+  * A descriptor is duplicated, so that it stays open, and read from its current position.
+  * `tokenizer` is one of "whitespace" or "line" and `n` is the number of consecutive tokens counted together.
+  * Returns 0 on success, -1 with a Python exception set otherwise.
+  */
+int FileTokens_open(FileTokens *self, PyObject *file, const char *tokenizer, int n, const char *encoding);
+
+/* Closes the file and releases the buffers. */
+void FileTokens_close(FileTokens *self);
+
+/**
+  * Reads the next chunk of complete lines, invalidating the tokens of the previous one.
+  * Returns 1 if a chunk was read, 0 at the end of the file, -1 with one of FILE_ERROR_* stored into `error`.
+  * Does not require the GIL.
+  */
+int FileTokens_read(FileTokens *self, int *error);
+
+/**
+  * Returns the next null-terminated token or n-gram of the current chunk and stores its length to `length`,
+  * or NULL if the chunk is exhausted. The result is valid until the next chunk is read.
+  * Does not require the GIL.
+  */
+char * FileTokens_next(FileTokens *self, Py_ssize_t *length);
+
+/* Raises a Python exception for an error reported by FileTokens_read. */
+void FileTokens_set_error(int error);
+
+#endif
@@ -16,6 +16,8 @@
 
 #include <stdint.h>
 #include "hll.h"
+#include "simd.h"
+#include "atomics.h"
 #include <math.h>
 #include <stdlib.h>
 
@@ -24,6 +26,15 @@ void HyperLogLog_init(HyperLogLog *self, uint32_t k)
     self->k = k;
     self->size = 1 << self->k;
     self->registers = (hll_cell_t *) calloc(self->size, sizeof(char));
+    self->wide = 0;
+}
+
+void HyperLogLog_init_buffer(HyperLogLog *self, uint32_t k, hll_cell_t *registers)
+{
+    self->k = k;
+    self->size = 1 << self->k;
+    self->registers = registers;
+    self->wide = 0;
 }
 
 void HyperLogLog_dealloc(HyperLogLog* self)
@@ -47,6 +58,50 @@ void HyperLogLog_add(HyperLogLog *self, uint32_t hash)
         self->registers[index] = rank;
 }
 
+/* Adds a hash to the cardinality estimator with atomic operations. */
+void HyperLogLog_add_atomic(HyperLogLog *self, uint32_t hash)
+{
+    uint32_t index = (hash >> (32 - self->k));
+    hll_cell_t rank = leadingZeroCount((hash << self->k) >> self->k) - self->k + 1;
+
+    hll_cell_t current = ATOMIC_LOAD(&self->registers[index]);
+    while (rank > current && !ATOMIC_CAS(&self->registers[index], &current, rank))
+        ;
+}
+
+/* Get the rank of a 64-bit hash: the number of leading zeros of its bits after the first k, plus one. */
+static inline hll_cell_t rank64(uint64_t hash, short int k)
+{
+    uint64_t rest = hash << k;
+    hll_cell_t rank = 1;
+    if (!rest)
+        return 65 - k;
+    while (!(rest & 0x8000000000000000ULL))
+        rest <<= 1, rank++;
+    return rank;
+}
+
+/* Adds a 64-bit hash to the cardinality estimator. */
+void HyperLogLog_add64(HyperLogLog *self, uint64_t hash)
+{
+    uint32_t index = (uint32_t) (hash >> (64 - self->k));
+    hll_cell_t rank = rank64(hash, self->k);
+
+    if (rank > self->registers[index])
+        self->registers[index] = rank;
+}
+
+/* Adds a 64-bit hash to the cardinality estimator with atomic operations. */
+void HyperLogLog_add64_atomic(HyperLogLog *self, uint64_t hash)
+{
+    uint32_t index = (uint32_t) (hash >> (64 - self->k));
+    hll_cell_t rank = rank64(hash, self->k);
+
+    hll_cell_t current = ATOMIC_LOAD(&self->registers[index]);
+    while (rank > current && !ATOMIC_CAS(&self->registers[index], &current, rank))
+        ;
+}
+
 /* Gets a cardinality estimate. */
 double HyperLogLog_cardinality(HyperLogLog *self)
 {
@@ -95,7 +150,8 @@ double HyperLogLog_cardinality(HyperLogLog *self)
         }
     }
 
-    if (estimate > (1.0/30.0) * two_32) {
+    // collisions of 64-bit hashes are negligible, only the 32-bit ones need the large range correction
+    if (!self->wide && estimate > (1.0/30.0) * two_32) {
         estimate = neg_two_32 * log(1.0 - estimate/two_32);
     }
     return estimate;
@@ -106,16 +162,11 @@ double HyperLogLog_cardinality(HyperLogLog *self)
  */
 int HyperLogLog_merge(HyperLogLog *self, HyperLogLog *hll)
 {
-    if (hll->size != self->size) {
+    if (hll->size != self->size || hll->wide != self->wide) {
         return 1;
     }
 
-    uint32_t i;
-    for (i = 0; i < self->size; i++) {
-        if (self->registers[i] < hll->registers[i])
-            self->registers[i] = hll->registers[i];
-    }
-
+    Simd_max_u8(self->registers, hll->registers, self->size);
     return 0;
 }
 
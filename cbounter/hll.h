@@ -27,21 +27,38 @@ typedef struct {
     short int k;      /* size = 2^k */
     uint32_t size;    /* number of registers */
     hll_cell_t * registers; /* ranks */
+    char wide;        /* fed 64-bit hashes, see HyperLogLog_add64 */
 } HyperLogLog;
 
 void HyperLogLog_init(HyperLogLog *self, uint32_t k);
 
+/* Initializes the estimator over 2^k registers owned by the caller, which must not call HyperLogLog_dealloc. */
+void HyperLogLog_init_buffer(HyperLogLog *self, uint32_t k, hll_cell_t *registers);
+
 void HyperLogLog_dealloc(HyperLogLog* self);
 
 /* Adds a hash to the cardinality estimator. */
 void HyperLogLog_add(HyperLogLog *self, uint32_t hash);
 
+/* Adds a hash to the cardinality estimator with atomic operations, so that several threads can add at once. */
+void HyperLogLog_add_atomic(HyperLogLog *self, uint32_t hash);
+
+/**
+ * Adds a 64-bit hash to the cardinality estimator, which must be set `wide` before any hash is added.
+ * The ranks are taken from 64 - k bits, so the estimate needs no correction for hash collisions
+ * up to far beyond 2^32 distinct elements.
+ */
+void HyperLogLog_add64(HyperLogLog *self, uint64_t hash);
+
+/* Adds a 64-bit hash to the cardinality estimator with atomic operations. */
+void HyperLogLog_add64_atomic(HyperLogLog *self, uint64_t hash);
+
 /* Gets a cardinality estimate. */
 double HyperLogLog_cardinality(HyperLogLog *self);
 
 /* Merges another HyperLogLog into the current HyperLogLog. The registers of
  * the other HyperLogLog are unaffected.
- * Returns 0 when successful, 1 otherwise
+ * Returns 0 when successful, 1 otherwise (if they differ in size or width of the hashes)
  */
 int HyperLogLog_merge(HyperLogLog *self, HyperLogLog *hll);
 
@@ -63,6 +63,8 @@ PyMODINIT_FUNC initbounter_htc(void)
     Py_INCREF(&HT_Basic_ITER_TYPE_Type);
     PyModule_AddObject(m, "HT_Basic_iter", (PyObject *)&HT_Basic_ITER_TYPE_Type);
 
+    PyModule_AddIntConstant(m, "ZLIB", FileTokens_zlib());
+
     #if PY_MAJOR_VERSION >= 3
     return m;
     #endif
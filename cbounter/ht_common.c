@@ -10,12 +10,23 @@
 #define HT_VARIANT(suffix) GLUE_I(HT_TYPE, suffix)
 
 #define MAX_PICKLE_CHUNK_SIZE 0x01000000
+/* A table keyed by hashes keeps each hash in the word of its cell, pickles write it as hexadecimal digits. */
+#define HT_HASH_KEY_LENGTH 16
+/* Keys of at most HT_INLINE_LENGTH bytes are stored in place of the key pointer, see _inline_key. */
+#define HT_INLINE_LENGTH 7
+/* Bounds of the size of a new block of the key arena, a longer key gets a block of its own. */
+#define HT_ARENA_MIN_BLOCK 4096
+#define HT_ARENA_MAX_BLOCK (1 << 20)
 
 #define PY_SSIZE_T_CLEAN
 #include <Python.h>
 #include "structmember.h"
+#include "pythread.h"
 #include "murmur3.h"
 #include "hll.h"
+#include "keybuffer.h"
+#include "filetokens.h"
+#include "segment.h"
 #include <string.h>
 #include <math.h>
 #include <stdint.h>
@@ -23,10 +34,33 @@
 #include <limits.h>
 
 typedef struct {
-    char* key;
+    union {
+        char * key; // a null-terminated key allocated on the heap
+        uint64_t word; // the whole field: 0 for an empty cell, a short key stored inline if the lowest bit is set
+    };
     long long count;
 } HT_VARIANT(_cell_t);
 
+#define HT_IS_INLINE(cell) ((cell)->word & 1)
+
+/* Bytes taken in the arena by a key of the given length, the terminating null byte and padding to an even size */
+#define HT_ARENA_SIZE(length) (((length) + 2) & ~(size_t) 1)
+
+/**
+  * Storage of the keys which are not inline: null-terminated strings packed one after another in large blocks.
+  * Keys are never freed one by one, pruning moves the live ones into a fresh arena instead.
+  */
+typedef struct {
+    char ** blocks;
+    uint32_t count; // number of blocks
+    uint32_t capacity; // length of `blocks`
+    char * next; // first free byte of the last block
+    size_t free; // number of free bytes at the end of the last block
+    uint64_t allocated; // bytes of all blocks
+    uint64_t used; // bytes of all keys stored, including those of removed cells
+    uint64_t removed; // bytes of the keys of removed cells
+} HT_VARIANT(_arena_t);
+
 typedef struct {
     PyObject_HEAD
     uint32_t buckets;
@@ -35,10 +69,17 @@ typedef struct {
     long long total;
     uint32_t size; // number of allocated buckets
     HT_VARIANT(_cell_t) * table;
+    uint32_t * fingerprints; // hash of the key of each bucket (see _fingerprint), 0 for an empty bucket
+    HT_VARIANT(_arena_t) arena;
     uint32_t * histo;
     long long max_prune;
     HyperLogLog hll;
     char use_unicode;
+    long long half_life; // number of increments halving all counts, 0 for no decay
+    uint32_t decay_cursor; // next bucket to be decayed
+    double decay_debt; // buckets due for decay, not processed yet
+    char hashed; // keyed by 64-bit hashes instead of strings
+    PyThread_type_lock lock; // held by every access to the table, batches hold it without the GIL
 } HT_TYPE;
 
 #define ITER_RESULT_KEYS 1
@@ -53,28 +94,80 @@ typedef struct {
   char result_type;
 } HT_VARIANT(_ITER_TYPE);
 
+/* Adds a block of at least `size` bytes to the arena. Returns -1 if memory runs out. */
+static int HT_VARIANT(_arena_grow)(HT_VARIANT(_arena_t) * arena, size_t size)
+{
+    // blocks grow with the arena, so that small tables stay small and large ones have few blocks
+    size_t block = arena->allocated / 2;
+    if (block < HT_ARENA_MIN_BLOCK)
+        block = HT_ARENA_MIN_BLOCK;
+    if (block > HT_ARENA_MAX_BLOCK)
+        block = HT_ARENA_MAX_BLOCK;
+    if (block < size)
+        block = size;
+
+    if (arena->count == arena->capacity)
+    {
+        uint32_t capacity = arena->capacity ? arena->capacity * 2 : 16;
+        char ** blocks = (char **) realloc(arena->blocks, capacity * sizeof(char *));
+        if (!blocks)
+            return -1;
+        arena->blocks = blocks;
+        arena->capacity = capacity;
+    }
+    char * memory = (char *) malloc(block);
+    if (!memory)
+        return -1;
+    arena->blocks[arena->count++] = memory;
+    arena->next = memory;
+    arena->free = block;
+    arena->allocated += block;
+    return 0;
+}
+
+/**
+  * Copies a key of `length` bytes into the arena and terminates it. Returns NULL if memory runs out.
+  * Keys start at even addresses, the lowest bit of a pointer tells inline keys apart (see HT_IS_INLINE).
+  */
+static inline char * HT_VARIANT(_arena_store)(HT_VARIANT(_arena_t) * arena, const char * data, size_t length)
+{
+    size_t size = HT_ARENA_SIZE(length);
+    if (size > arena->free && HT_VARIANT(_arena_grow)(arena, size))
+        return NULL;
+    char * key = arena->next;
+    memcpy(key, data, length);
+    key[length] = 0;
+    arena->next += size;
+    arena->free -= size;
+    arena->used += size;
+    return key;
+}
+
+/* Frees all blocks of the arena and leaves it empty. */
+static void HT_VARIANT(_arena_release)(HT_VARIANT(_arena_t) * arena)
+{
+    uint32_t i;
+    for (i = 0; i < arena->count; i++)
+        free(arena->blocks[i]);
+    free(arena->blocks);
+    memset(arena, 0, sizeof(HT_VARIANT(_arena_t)));
+}
+
 /* Destructor invoked by python. */
 static void
 HT_VARIANT(_dealloc)(HT_TYPE* self)
 {
     HT_VARIANT(_cell_t) * table = self->table;
     // free the strings
-    uint32_t i;
-    if (self->table)
-    {
-        for (i = 0; i < self->buckets; i++)
-        {
-            if (table[i].key)
-            {
-                free(table[i].key);
-            }
-        }
-    }
+    HT_VARIANT(_arena_release)(&self->arena);
 
     // free the hashtable and histogram
     free(table);
+    free(self->fingerprints);
     free(self->histo);
     HyperLogLog_dealloc(&self->hll);
+    if (self->lock)
+        PyThread_free_lock(self->lock);
 
     // finally, destroy itself
     #if PY_MAJOR_VERSION >= 3
@@ -95,13 +188,22 @@ HT_VARIANT(_new)(PyTypeObject *type, PyObject *args, PyObject *kwds)
 static int
 HT_VARIANT(_init)(HT_TYPE *self, PyObject *args, PyObject *kwds)
 {
-    static char *kwlist[] = {"size_mb", "buckets", "use_unicode", NULL};
+    static char *kwlist[] = {"size_mb", "buckets", "use_unicode", "half_life", "hashed", NULL};
     uint64_t size_mb = 0;
     long long w = 0;
     int use_unicode = 1;
+    long long half_life = 0;
+    int hashed = 0;
 
-    if (!PyArg_ParseTupleAndKeywords(args, kwds, "|LLi", kwlist,
-				      &size_mb, &w, &use_unicode)) {
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "|LLiLi", kwlist,
+				      &size_mb, &w, &use_unicode, &half_life, &hashed)) {
+        return -1;
+    }
+
+    if (half_life < 0)
+    {
+        char * msg = "The half-life must not be negative!";
+        PyErr_SetString(PyExc_ValueError, msg);
         return -1;
     }
 
@@ -138,9 +240,17 @@ HT_VARIANT(_init)(HT_TYPE *self, PyObject *args, PyObject *kwds)
     self->hash_mask = self->buckets - 1;
 
     self->use_unicode = use_unicode;
+    self->hashed = hashed ? 1 : 0;
+
+    if (!self->lock && !(self->lock = PyThread_allocate_lock()))
+    {
+        PyErr_NoMemory();
+        return -1;
+    }
 
     self->table = (HT_VARIANT(_cell_t) *) calloc(self->buckets, sizeof(HT_VARIANT(_cell_t)));
-    if (!self->table)
+    self->fingerprints = (uint32_t *) calloc(self->buckets, sizeof(uint32_t));
+    if (!self->table || !self->fingerprints)
     {
         char * msg = "Unable to allocate a table with requested size!";
         PyErr_SetString(PyExc_MemoryError, msg);
@@ -151,36 +261,223 @@ HT_VARIANT(_init)(HT_TYPE *self, PyObject *args, PyObject *kwds)
     self->total = 0;
     self->size = 0;
     self->max_prune = 0;
+    self->half_life = half_life;
+    self->decay_cursor = 0;
+    self->decay_debt = 0;
 
     HyperLogLog_init(&self->hll, 16);
+    // the cardinality of a table keyed by hashes is estimated from the 64-bit hashes
+    self->hll.wide = self->hashed;
 
     return 0;
 }
 
 static PyMemberDef HT_VARIANT(_members[]) = {
+    {"half_life", T_LONGLONG, offsetof(HT_TYPE, half_life), READONLY,
+     "Number of increments after which all counts are halved, 0 if the counts do not decay."},
+    {"hashed", T_BOOL, offsetof(HT_TYPE, hashed), READONLY,
+     "Whether the table is keyed by 64-bit hashes instead of strings."},
     {NULL} /* Sentinel */
 };
 
-static inline uint32_t HT_VARIANT(_bucket)(HT_TYPE * self, char * data, Py_ssize_t dataLength, char store)
+/* Mixes all bits of a 64-bit hash supplied by the caller (the finalizer of MurmurHash3_x64_128). */
+static inline uint64_t HT_VARIANT(_mix_hash)(uint64_t h)
 {
-    uint32_t bucket;
-    MurmurHash3_x86_32((void *) data, dataLength, 42, (void *) &bucket);
-    if (store)
-        HyperLogLog_add(&self->hll, bucket);
-    bucket &= self->hash_mask;
-    return bucket;
+    h ^= h >> 33;
+    h *= 0xFF51AFD7ED558CCDULL;
+    h ^= h >> 33;
+    h *= 0xC4CEB9FE1A85EC53ULL;
+    h ^= h >> 33;
+    return h;
 }
 
-static inline HT_VARIANT(_cell_t) * HT_VARIANT(_find_cell)(HT_TYPE * self, char * data, Py_ssize_t dataLength, char store)
+/**
+  * Hashes the key into its fingerprint, whose low bits select the bucket of the key.
+  * The key of a table keyed by hashes is the 64-bit hash itself, which is only mixed, not hashed again;
+  * the cardinality estimator then takes its register from the high bits of the mixed hash.
+  * A zero hash is replaced by its high bits set, since zero marks an empty bucket.
+  */
+static inline uint32_t HT_VARIANT(_fingerprint)(HT_TYPE * self, char * data, Py_ssize_t dataLength, char store)
+{
+    uint32_t hash;
+    if (self->hashed)
+    {
+        uint64_t key_hash;
+        memcpy(&key_hash, data, sizeof(uint64_t));
+        uint64_t mixed = HT_VARIANT(_mix_hash)(key_hash);
+        if (store)
+            HyperLogLog_add64(&self->hll, mixed);
+        hash = (uint32_t) mixed;
+    }
+    else
+    {
+        MurmurHash3_x86_32((void *) data, dataLength, 42, (void *) &hash);
+        if (store)
+            HyperLogLog_add(&self->hll, hash);
+    }
+    return hash ? hash : ~self->hash_mask;
+}
+
+/**
+  * Packs a key of at most HT_INLINE_LENGTH bytes into the word stored in place of a key pointer:
+  * the lowest bit set (heap pointers are aligned), the length in the next 3 bits and the bytes of the key above.
+  */
+static inline uint64_t HT_VARIANT(_inline_key)(const char * data, Py_ssize_t dataLength)
+{
+    uint64_t word = 1 | ((uint64_t) dataLength << 1);
+    Py_ssize_t i;
+    for (i = 0; i < dataLength; i++)
+        word |= (uint64_t) (unsigned char) data[i] << (8 * (i + 1));
+    return word;
+}
+
+/**
+  * Returns the key of an occupied cell as a null-terminated string and stores its length,
+  * unpacking an inline key into `buffer` of HT_INLINE_LENGTH + 1 bytes.
+  */
+static inline char * HT_VARIANT(_cell_key)(const HT_VARIANT(_cell_t) * cell, char * buffer, Py_ssize_t * length)
+{
+    if (!HT_IS_INLINE(cell))
+    {
+        *length = strlen(cell->key);
+        return cell->key;
+    }
+    Py_ssize_t i;
+    *length = (cell->word >> 1) & 7;
+    for (i = 0; i < *length; i++)
+        buffer[i] = (char) (cell->word >> (8 * (i + 1)));
+    buffer[*length] = 0;
+    return buffer;
+}
+
+/* Stores a copy of the key into an empty cell, inline if it is short enough. Returns -1 if memory runs out. */
+static inline int HT_VARIANT(_store_key)(HT_TYPE * self, HT_VARIANT(_cell_t) * cell, const char * data,
+                                         Py_ssize_t dataLength)
+{
+    if (self->hashed)
+    {
+        memcpy(&cell->word, data, sizeof(uint64_t));
+        return 0;
+    }
+    if (dataLength <= HT_INLINE_LENGTH)
+    {
+        cell->word = HT_VARIANT(_inline_key)(data, dataLength);
+        return 0;
+    }
+    char * key = HT_VARIANT(_arena_store)(&self->arena, data, dataLength);
+    if (!key)
+        return -1;
+    cell->word = 0;
+    cell->key = key;
+    return 0;
+}
+
+/* Distance of an occupied bucket from the home bucket of its key, which is given by the fingerprint. */
+#define HT_DISTANCE(self, bucket) (((bucket) - (self)->fingerprints[bucket]) & (self)->hash_mask)
+
+/**
+  * Looks up the key with the given fingerprint using Robin Hood probing: the keys of a run of occupied buckets
+  * are ordered by their home buckets, so the search ends at the first key which is closer to its home bucket
+  * than the searched key would be. Only the keys with the same fingerprint are compared, the others are skipped
+  * without touching them. Short keys and hashes are compared as whole words.
+  * Returns 1 and stores the bucket of the key into `bucket` if it is present. Otherwise returns 0 and stores
+  * the bucket where the key belongs, which is either empty or taken by a key which has to make room for it.
+  */
+static inline int HT_VARIANT(_find_bucket)(HT_TYPE * self, char * data, Py_ssize_t dataLength, uint32_t fingerprint,
+                                           uint32_t * bucket)
 {
-    uint32_t bucket = HT_VARIANT(_bucket)(self, data, dataLength, store);
+    const uint32_t * fingerprints = self->fingerprints;
     const HT_VARIANT(_cell_t) * table = self->table;
+    uint32_t current = fingerprint & self->hash_mask;
+    uint32_t distance = 0;
+    char whole = self->hashed || dataLength <= HT_INLINE_LENGTH;
+    uint64_t word = 0;
+    if (self->hashed)
+        memcpy(&word, data, sizeof(uint64_t));
+    else if (whole)
+        word = HT_VARIANT(_inline_key)(data, dataLength);
+
+    while (fingerprints[current] && HT_DISTANCE(self, current) >= distance)
+    {
+        if (fingerprints[current] == fingerprint
+            && (whole ? table[current].word == word
+                      : !HT_IS_INLINE(&table[current]) && !strcmp(table[current].key, data)))
+        {
+            *bucket = current;
+            return 1;
+        }
+        current = (current + 1) & self->hash_mask;
+        distance++;
+    }
+    *bucket = current;
+    return 0;
+}
+
+/* Returns the cell of the key, or NULL if the key is not present. */
+static inline HT_VARIANT(_cell_t) * HT_VARIANT(_find_cell)(HT_TYPE * self, char * data, Py_ssize_t dataLength, char store)
+{
+    uint32_t fingerprint = HT_VARIANT(_fingerprint)(self, data, dataLength, store);
+    uint32_t bucket;
+    return HT_VARIANT(_find_bucket)(self, data, dataLength, fingerprint, &bucket) ? &self->table[bucket] : NULL;
+}
+
+/* Frees `bucket` by moving the keys from there up to the next empty bucket one bucket further. */
+static inline void HT_VARIANT(_shift_run)(HT_TYPE * self, uint32_t bucket)
+{
+    uint32_t * fingerprints = self->fingerprints;
+    HT_VARIANT(_cell_t) * table = self->table;
+    uint32_t empty = bucket;
+    while (fingerprints[empty])
+        empty = (empty + 1) & self->hash_mask;
+
+    while (empty != bucket)
+    {
+        uint32_t previous = (empty - 1) & self->hash_mask;
+        table[empty] = table[previous];
+        fingerprints[empty] = fingerprints[previous];
+        empty = previous;
+    }
+}
+
+/**
+  * Orders the keys of every run of occupied buckets by their home buckets, as Robin Hood probing requires.
+  * Tables pickled by older versions, which used plain linear probing, keep their keys in the order of insertion.
+  */
+static void HT_VARIANT(_sort_runs)(HT_TYPE * self)
+{
+    uint32_t * fingerprints = self->fingerprints;
+    HT_VARIANT(_cell_t) * table = self->table;
+    uint32_t mask = self->hash_mask;
+    uint32_t start = 0;
+    while (fingerprints[start])
+        start++;
 
-    while (table[bucket].key && strcmp(table[bucket].key, data))
+    // insertion sort of each run by the offset of the home bucket from the empty bucket preceding the run
+    uint32_t run = start;
+    uint32_t i = start;
+    do
     {
-        bucket = (bucket + 1) & self->hash_mask;
+        i = (i + 1) & mask;
+        if (!fingerprints[i])
+        {
+            run = i;
+            continue;
+        }
+
+        HT_VARIANT(_cell_t) cell = table[i];
+        uint32_t fingerprint = fingerprints[i];
+        uint32_t offset = (fingerprint - run) & mask;
+        uint32_t j = i;
+        while (((j - 1) & mask) != run && ((fingerprints[(j - 1) & mask] - run) & mask) > offset)
+        {
+            table[j] = table[(j - 1) & mask];
+            fingerprints[j] = fingerprints[(j - 1) & mask];
+            j = (j - 1) & mask;
+        }
+        table[j] = cell;
+        fingerprints[j] = fingerprint;
     }
-    return &table[bucket];
+    while (i != start);
 }
 
 static inline uint8_t HT_VARIANT(_histo_addr)(long long value)
@@ -202,6 +499,12 @@ static inline uint8_t HT_VARIANT(_histo_addr)(long long value)
     return (log_result << 3) + (h & 7);
 }
 
+/* Smallest count falling into the given bin of the histogram, the inverse of _histo_addr. */
+static inline long long HT_VARIANT(_histo_bound)(long long index)
+{
+    return (index < 16) ? index : (8 + (index & 7)) << ((index >> 3) - 1);
+}
+
 static void HT_VARIANT(_prune_int)(HT_TYPE *self, long long boundary);
 
 static long long HT_VARIANT(_prune_size)(HT_TYPE * self)
@@ -215,38 +518,74 @@ static long long HT_VARIANT(_prune_size)(HT_TYPE * self)
         removing += self->histo[index];
         index++;
     }
-    long long boundary = (index < 16) ? index : (8 + (index & 7)) << ((index >> 3) - 1);
-    return boundary - 1;
+    return HT_VARIANT(_histo_bound)(index) - 1;
 }
 
 
+/* Returns the cell of the key, adding the key with a zero count if it is not present. Returns NULL if memory runs out. */
 static inline HT_VARIANT(_cell_t) * HT_VARIANT(_allocate_cell)(HT_TYPE * self, char * data, Py_ssize_t dataLength)
 {
-    HT_VARIANT(_cell_t) * cell = HT_VARIANT(_find_cell)(self, data, dataLength, 1);
+    uint32_t fingerprint = HT_VARIANT(_fingerprint)(self, data, dataLength, 1);
+    uint32_t bucket;
+    if (HT_VARIANT(_find_bucket)(self, data, dataLength, fingerprint, &bucket))
+        return &self->table[bucket];
 
-    if (!cell->key)
+    if (self->size >= (self->buckets >> 2) * 3)
     {
-        if (self->size >= (self->buckets >> 2) * 3)
-        {
-            HT_VARIANT(_prune_int)(self, HT_VARIANT(_prune_size)(self));
-            // After pruning, we have to look for the ideal spot again, since a better slot might have opened
-            cell = HT_VARIANT(_find_cell)(self, data, dataLength, 0);
-        }
-
-        self->size += 1;
-        self->str_allocated += dataLength + 1;
-        char * key = malloc(dataLength + 1);
-        memcpy(key, data, dataLength + 1);
-        cell->key = key;
-        cell->count = 0;
-        self->histo[0] += 1;
+        HT_VARIANT(_prune_int)(self, HT_VARIANT(_prune_size)(self));
+        // After pruning, we have to look for the ideal spot again, since a better slot might have opened
+        HT_VARIANT(_find_bucket)(self, data, dataLength, fingerprint, &bucket);
     }
+
+    // the key is stored before the table changes, so that there is nothing to undo if memory runs out
+    HT_VARIANT(_cell_t) key_cell;
+    if (HT_VARIANT(_store_key)(self, &key_cell, data, dataLength))
+        return NULL;
+
+    // the keys which are closer to their home buckets move one bucket further
+    HT_VARIANT(_shift_run)(self, bucket);
+    HT_VARIANT(_cell_t) * cell = &self->table[bucket];
+
+    // the length of all keys is counted, inline ones and hashes included, as they are pickled alike
+    self->size += 1;
+    self->str_allocated += (self->hashed ? HT_HASH_KEY_LENGTH : dataLength) + 1;
+    cell->word = key_cell.word;
+    cell->count = 0;
+    self->fingerprints[bucket] = fingerprint;
+    self->histo[0] += 1;
     return cell;
 }
 
+/**
+  * Moves the keys of all occupied cells into a fresh arena, whose first block holds them all, and frees the old one.
+  * Keeps the old arena if memory runs out.
+  */
+static void HT_VARIANT(_compact_keys)(HT_TYPE *self)
+{
+    HT_VARIANT(_arena_t) fresh;
+    memset(&fresh, 0, sizeof(HT_VARIANT(_arena_t)));
+    uint64_t live = self->arena.used - self->arena.removed;
+    if (live && HT_VARIANT(_arena_grow)(&fresh, live))
+    {
+        HT_VARIANT(_arena_release)(&fresh);
+        return;
+    }
+
+    HT_VARIANT(_cell_t) * table = self->table;
+    uint32_t i;
+    for (i = 0; i < self->buckets; i++)
+    {
+        if (self->fingerprints[i] && !self->hashed && !HT_IS_INLINE(&table[i]))
+            table[i].key = HT_VARIANT(_arena_store)(&fresh, table[i].key, strlen(table[i].key));
+    }
+    HT_VARIANT(_arena_release)(&self->arena);
+    self->arena = fresh;
+}
+
 static void HT_VARIANT(_prune_int)(HT_TYPE *self, long long boundary)
 {
     HT_VARIANT(_cell_t) * table = self->table;
+    uint32_t * fingerprints = self->fingerprints;
     uint32_t * histo = self->histo;
     uint32_t size = 0;
     uint32_t start = 0;
@@ -263,7 +602,8 @@ static void HT_VARIANT(_prune_int)(HT_TYPE *self, long long boundary)
     // if we start from an empty row, hashes from all successive allocated buckets
     // are guaranteed to point "after" this row which ensures the invariant that
     // all processed buckets' hashes point to buckets which have already been processed
-    while (table[start].key)
+    // moving the kept keys towards their home buckets in this order keeps the runs ordered for Robin Hood probing
+    while (fingerprints[start])
         start++;
 
     i = start;
@@ -271,28 +611,28 @@ static void HT_VARIANT(_prune_int)(HT_TYPE *self, long long boundary)
     do
     {
         i = (i + 1) & mask;
-        char * current_key = table[i].key;
-        if (current_key)
+        if (fingerprints[i])
         {
-            Py_ssize_t data_length = strlen(current_key);
             long long current_count = table[i].count;
 
             if (current_count > boundary)
             {
-                uint32_t replace = HT_VARIANT(_bucket)(self, current_key, data_length, 0);
+                // the bucket of the key is given by its fingerprint, the key need not be hashed again
+                uint32_t replace = fingerprints[i] & mask;
 
                 if (((i - last_free) & mask) > ((i - replace) & mask))
                     replace = i;
 
-                while (replace != i && table[replace].key)
+                while (replace != i && fingerprints[replace])
                     replace = (replace + 1) & mask;
 
                 if (replace != i)
                 {
-                    table[replace].key = current_key;
-                    table[replace].count = current_count;
-                    table[i].key = NULL;
+                    table[replace] = table[i];
+                    fingerprints[replace] = fingerprints[i];
+                    table[i].word = 0;
                     table[i].count = 0;
+                    fingerprints[i] = 0;
                     last_free = i;
                 }
 
@@ -301,10 +641,19 @@ static void HT_VARIANT(_prune_int)(HT_TYPE *self, long long boundary)
             }
             else
             {
-                self->str_allocated -= data_length + 1;
-                free(current_key);
-                table[i].key = NULL;
+                if (self->hashed)
+                    self->str_allocated -= HT_HASH_KEY_LENGTH + 1;
+                else if (HT_IS_INLINE(&table[i]))
+                    self->str_allocated -= ((table[i].word >> 1) & 7) + 1;
+                else
+                {
+                    size_t length = strlen(table[i].key);
+                    self->str_allocated -= length + 1;
+                    self->arena.removed += HT_ARENA_SIZE(length);
+                }
+                table[i].word = 0;
                 table[i].count = 0;
+                fingerprints[i] = 0;
                 last_free = i;
             }
         }
@@ -317,6 +666,118 @@ static void HT_VARIANT(_prune_int)(HT_TYPE *self, long long boundary)
 
     self->size = size;
 
+    // reclaim the space of removed keys once it makes up a quarter of the arena
+    if (self->arena.removed > self->arena.used / 4)
+        HT_VARIANT(_compact_keys)(self);
+
+}
+
+/**
+  * Scales the counts of `count` buckets starting at `first` (wrapping around) by `factor`, rounding down.
+  * Cells which fall to zero are kept until the next pruning. Does not use the Python API.
+  */
+static void HT_VARIANT(_decay_cells)(HT_TYPE *self, uint32_t first, uint32_t count, double factor)
+{
+    HT_VARIANT(_cell_t) * table = self->table;
+    uint32_t i;
+
+    for (i = 0; i < count; i++)
+    {
+        HT_VARIANT(_cell_t) * cell = &table[(first + i) & self->hash_mask];
+        if (cell->count > 0)
+        {
+            double scaled = cell->count * factor;
+            long long value = (scaled < (double) cell->count) ? (long long) scaled : cell->count;
+            self->histo[HT_VARIANT(_histo_addr)(cell->count)] -= 1;
+            self->histo[HT_VARIANT(_histo_addr)(value)] += 1;
+            self->total -= cell->count - value;
+            cell->count = value;
+        }
+    }
+}
+
+/**
+  * Amortized decay: sweeps the table so that every bucket is halved once per `half_life` increments.
+  * Each call halves the slice of buckets the sweep has fallen behind by.
+  */
+static inline void HT_VARIANT(_decay_step)(HT_TYPE *self, long long increment)
+{
+    self->decay_debt += (double) increment * self->buckets / self->half_life;
+    if (self->decay_debt < 1)
+        return;
+
+    double steps = floor(self->decay_debt);
+    self->decay_debt -= steps;
+
+    // whole sweeps are applied at once, halving the entire table once per sweep
+    double sweeps = floor(steps / self->buckets);
+    if (sweeps > 0)
+    {
+        HT_VARIANT(_decay_cells)(self, 0, self->buckets, ldexp(1.0, (sweeps < 1100) ? -(int) sweeps : -1100));
+        steps -= sweeps * self->buckets;
+    }
+
+    uint32_t slice = (uint32_t) steps;
+    HT_VARIANT(_decay_cells)(self, self->decay_cursor, slice, 0.5);
+    self->decay_cursor = (self->decay_cursor + slice) & self->hash_mask;
+}
+
+/**
+  * Takes the lock of the table, holding the GIL. Batches of other threads hold the lock without the GIL,
+  * so the GIL is released while waiting for them. No Python code may run until the lock is released,
+  * it could call back into the table and wait for the lock forever.
+  */
+static inline void
+HT_VARIANT(_lock)(HT_TYPE *self)
+{
+    if (!PyThread_acquire_lock(self->lock, NOWAIT_LOCK))
+    {
+        Py_BEGIN_ALLOW_THREADS
+        PyThread_acquire_lock(self->lock, WAIT_LOCK);
+        Py_END_ALLOW_THREADS
+    }
+}
+
+static inline void
+HT_VARIANT(_unlock)(HT_TYPE *self)
+{
+    PyThread_release_lock(self->lock);
+}
+
+/**
+  * Adds a string to the counter. Does not use the Python API, the caller must hold the lock of the table.
+  * Returns 0 on success, -1 if the counter would overflow, -2 if memory runs out.
+  */
+static inline int
+HT_VARIANT(_increment_key)(HT_TYPE *self, char *data, Py_ssize_t dataLength, long long increment)
+{
+    HT_VARIANT(_cell_t) * cell = HT_VARIANT(_allocate_cell)(self, data, dataLength);
+
+    if (!cell)
+        return -2;
+    if (cell->count > LLONG_MAX - increment)
+        return -1;
+
+    self->total += increment;
+    self->histo[HT_VARIANT(_histo_addr)(cell->count)] -= 1;
+    cell->count += increment;
+    self->histo[HT_VARIANT(_histo_addr)(cell->count)] += 1;
+
+    if (self->half_life)
+        HT_VARIANT(_decay_step)(self, increment);
+    return 0;
+}
+
+/* Raises the error of a failed _increment_key. */
+static PyObject *
+HT_VARIANT(_increment_error)(int status)
+{
+    if (status == -2)
+        return PyErr_NoMemory();
+
+    char * msg = "Counter overflow!";
+    PyErr_SetString(PyExc_OverflowError, msg);
+    return NULL;
 }
 
 /* Adds a string to the counter. */
@@ -335,26 +796,14 @@ HT_VARIANT(_increment_obj)(HT_TYPE *self, char *data, Py_ssize_t dataLength, lon
         return Py_None;
     }
 
-    HT_VARIANT(_cell_t) * cell = HT_VARIANT(_allocate_cell)(self, data, dataLength);
-
-    if (cell)
-    {
-        if (cell->count > LLONG_MAX - increment)
-        {
-            char * msg = "Counter overflow!";
-            PyErr_SetString(PyExc_OverflowError, msg);
-            return NULL;
-        }
-
-        self->total += increment;
-        self->histo[HT_VARIANT(_histo_addr)(cell->count)] -= 1;
-        cell->count += increment;
-        self->histo[HT_VARIANT(_histo_addr)(cell->count)] += 1;
-        Py_INCREF(Py_None);
-        return Py_None;
-    }
+    HT_VARIANT(_lock)(self);
+    int status = HT_VARIANT(_increment_key)(self, data, dataLength, increment);
+    HT_VARIANT(_unlock)(self);
+    if (status)
+        return HT_VARIANT(_increment_error)(status);
 
-    return NULL;
+    Py_INCREF(Py_None);
+    return Py_None;
 }
 
 
@@ -411,6 +860,60 @@ HT_VARIANT(_parse_key)(PyObject * key, Py_ssize_t * dataLength, PyObject ** free
     return data;
 }
 
+/* Writes a 64-bit hash as the key of a table keyed by hashes, into HT_HASH_KEY_LENGTH + 1 bytes of `key`. */
+static inline void
+HT_VARIANT(_hash_key)(uint64_t hash, char * key)
+{
+    static const char digits[] = "0123456789abcdef";
+    int i;
+    for (i = HT_HASH_KEY_LENGTH - 1; i >= 0; i--)
+    {
+        key[i] = digits[hash & 15];
+        hash >>= 4;
+    }
+    key[HT_HASH_KEY_LENGTH] = 0;
+}
+
+/**
+  * Parses a key of the table: an integer hash stored into `scratch` (8 bytes)
+  * if the table is keyed by hashes, a string otherwise.
+  */
+static char *
+HT_VARIANT(_table_key)(HT_TYPE * self, PyObject * key, Py_ssize_t * dataLength, PyObject ** free_after, char * scratch)
+{
+    if (!self->hashed)
+        return HT_VARIANT(_parse_key)(key, dataLength, free_after);
+
+    PyObject * number = PyIndex_Check(key) ? PyNumber_Index(key) : NULL;
+    if (!number)
+    {
+        char * msg = "The keys of a table keyed by hashes must be integers!";
+        PyErr_SetString(PyExc_TypeError, msg);
+        return NULL;
+    }
+    // negative numbers stand for signed 64-bit hashes
+    uint64_t hash = PyLong_AsUnsignedLongLongMask(number);
+    Py_DECREF(number);
+    if (hash == (uint64_t) -1 && PyErr_Occurred())
+        return NULL;
+    memcpy(scratch, &hash, sizeof(uint64_t));
+    *dataLength = sizeof(uint64_t);
+    return scratch;
+}
+
+/* Raises TypeError and returns -1 if the table is keyed by hashes, so it can not take string keys. */
+static inline int
+HT_VARIANT(_check_string_keys)(HT_TYPE * self)
+{
+    if (self->hashed)
+    {
+        char * msg = "The table is keyed by hashes!";
+        PyErr_SetString(PyExc_TypeError, msg);
+        return -1;
+    }
+    return 0;
+}
+
 /* Adds a string to the counter. */
 static PyObject *
 HT_VARIANT(_increment)(HT_TYPE *self, PyObject *args)
@@ -420,10 +923,11 @@ HT_VARIANT(_increment)(HT_TYPE *self, PyObject *args)
     Py_ssize_t dataLength = 0;
 
     long long increment = 1;
+    char scratch[sizeof(uint64_t)];
 
     if (!PyArg_ParseTuple(args, "O|L", &pkey, &increment))
         return NULL;
-    char * data = HT_VARIANT(_parse_key)(pkey, &dataLength, &free_after);
+    char * data = HT_VARIANT(_table_key)(self, pkey, &dataLength, &free_after, scratch);
     if (!data)
         return NULL;
 
@@ -439,8 +943,9 @@ HT_VARIANT(_setitem)(HT_TYPE *self, PyObject *pKey, PyObject *pValue)
     PyObject * free_after = NULL;
     Py_ssize_t dataLength = 0;
     long long value;
+    char scratch[sizeof(uint64_t)];
 
-    char * data = HT_VARIANT(_parse_key)(pKey, &dataLength, &free_after);
+    char * data = HT_VARIANT(_table_key)(self, pKey, &dataLength, &free_after, scratch);
     if (!data)
         return -1;
 
@@ -459,7 +964,8 @@ HT_VARIANT(_setitem)(HT_TYPE *self, PyObject *pKey, PyObject *pValue)
             return -1;
         }
 
-        // don't bother allocating a new cell when setting 0
+        // don't bother allocating a new cell when setting 0, an absent key already counts 0
+        HT_VARIANT(_lock)(self);
         HT_VARIANT(_cell_t) * cell = value
                 ? HT_VARIANT(_allocate_cell)(self, data, dataLength)
                 : HT_VARIANT(_find_cell)(self, data, dataLength, 0);
@@ -470,12 +976,19 @@ HT_VARIANT(_setitem)(HT_TYPE *self, PyObject *pKey, PyObject *pValue)
             self->histo[HT_VARIANT(_histo_addr)(value)] += 1;
             self->total += value - cell->count;
             cell->count = value;
-            Py_XDECREF(free_after);
-            return 0;
         }
+        HT_VARIANT(_unlock)(self);
+        Py_XDECREF(free_after);
+        if (value && !cell)
+        {
+            PyErr_NoMemory();
+            return -1;
+        }
+        return 0;
     }
     else // delete value
     {
+        HT_VARIANT(_lock)(self);
         HT_VARIANT(_cell_t) * cell = HT_VARIANT(_find_cell)(self, data, dataLength, 0);
         if (cell)
         {
@@ -484,12 +997,10 @@ HT_VARIANT(_setitem)(HT_TYPE *self, PyObject *pKey, PyObject *pValue)
             self->total -= cell->count;
             cell->count = 0;
         }
+        HT_VARIANT(_unlock)(self);
         Py_XDECREF(free_after);
         return 0;
     }
-
-    Py_XDECREF(free_after);
-    return -1;
 }
 
 /* Retrieves count for a single string. */
@@ -498,38 +1009,104 @@ HT_VARIANT(_getitem)(HT_TYPE *self, PyObject *key)
 {
     PyObject * free_after = NULL;
     Py_ssize_t dataLength = 0;
+    char scratch[sizeof(uint64_t)];
 
-    char * data = HT_VARIANT(_parse_key)(key, &dataLength, &free_after);
+    char * data = HT_VARIANT(_table_key)(self, key, &dataLength, &free_after, scratch);
     if (!data)
         return NULL;
 
+    HT_VARIANT(_lock)(self);
     HT_VARIANT(_cell_t) * cell = HT_VARIANT(_find_cell)(self, data, dataLength, 0);
+    long long value = cell ? cell->count : 0;
+    HT_VARIANT(_unlock)(self);
     Py_XDECREF(free_after);
 
-    long long value = cell ? cell->count : 0;
     return Py_BuildValue("L", value);
 }
 
+/* Retrieves counts for a batch of keys into an array of 64-bit integers, without the GIL. */
+static PyObject *
+HT_VARIANT(_get_many)(HT_TYPE *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"keys", "offsets", NULL};
+    PyObject * data;
+    PyObject * offsets = NULL;
+    KeyBuffer keys;
+    Py_buffer view;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|O", kwlist, &data, &offsets))
+        return NULL;
+    if (HT_VARIANT(_check_string_keys)(self))
+        return NULL;
+    if (KeyBuffer_init(&keys, data, offsets))
+        return NULL;
+
+    char * scratch = malloc(keys.max_length + 1);
+    PyObject * result = scratch ? KeyBuffer_new_results(keys.length, &view) : PyErr_NoMemory();
+    if (!result)
+    {
+        free(scratch);
+        KeyBuffer_release(&keys);
+        return NULL;
+    }
+
+    int error = 0;
+    long long * values = (long long *) view.buf;
+    Py_ssize_t i;
+    Py_ssize_t length;
+    Py_BEGIN_ALLOW_THREADS
+    PyThread_acquire_lock(self->lock, WAIT_LOCK);
+    for (i = 0; i < keys.length; i++)
+    {
+        char * key = KeyBuffer_get(&keys, i, &length, scratch, 1, &error);
+        if (!key)
+            break;
+        HT_VARIANT(_cell_t) * cell = HT_VARIANT(_find_cell)(self, key, length, 0);
+        values[i] = cell ? cell->count : 0;
+    }
+    PyThread_release_lock(self->lock);
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&view);
+    free(scratch);
+    KeyBuffer_release(&keys);
+    if (error)
+    {
+        Py_DECREF(result);
+        KeyBuffer_set_error(error);
+        return NULL;
+    }
+    return result;
+}
+
 static PyObject *
 HT_VARIANT(_total)(HT_TYPE *self)
 {
-    return Py_BuildValue("L", self->total);
+    HT_VARIANT(_lock)(self);
+    long long total = self->total;
+    HT_VARIANT(_unlock)(self);
+    return Py_BuildValue("L", total);
 }
 
 static Py_ssize_t
 HT_VARIANT(_size)(HT_TYPE *self)
 {
-    return self->size - self->histo[0];
+    HT_VARIANT(_lock)(self);
+    Py_ssize_t size = self->size - self->histo[0];
+    HT_VARIANT(_unlock)(self);
+    return size;
 }
 
 static PyObject *
 HT_VARIANT(_cardinality)(HT_TYPE *self)
 {
-    if (!self->max_prune)
-        return Py_BuildValue("n", HT_VARIANT(_size)(self));
+    HT_VARIANT(_lock)(self);
+    long long cardinality = (self->max_prune)
+            ? (long long) HyperLogLog_cardinality(&self->hll)
+            : (long long) (self->size - self->histo[0]);
+    HT_VARIANT(_unlock)(self);
 
-    double cardinality = HyperLogLog_cardinality(&self->hll);
-    return Py_BuildValue("L", (long long) cardinality);
+    return Py_BuildValue("L", cardinality);
 }
 
 static PyObject *
@@ -537,69 +1114,136 @@ HT_VARIANT(_quality)(HT_TYPE *self)
 {
     uint32_t limit = (self->buckets >> 2) * 3;
 
+    HT_VARIANT(_lock)(self);
     double size = (self->max_prune)
             ? HyperLogLog_cardinality(&self->hll)
-            : (double) HT_VARIANT(_size)(self);
+            : (double) (self->size - self->histo[0]);
+    HT_VARIANT(_unlock)(self);
 
     double quality = size / (double) limit;
 
     return Py_BuildValue("d", quality);
 }
 
-/* Serialization function for pickling. */
+/**
+  * Builds the arguments for pickling. With `out_of_band` set, the table is handed over as a pickle.PickleBuffer
+  * pointing to the table, so that it is not copied (pickle protocol 5). Otherwise, it is copied in chunks.
+  * The keys are always copied into a single string of null-terminated keys.
+  */
 static PyObject *
-HT_VARIANT(_reduce)(HT_TYPE *self)
+HT_VARIANT(_reduce_table)(HT_TYPE *self, int out_of_band)
 {
     uint64_t size_mb = 2 * self->buckets * sizeof(HT_VARIANT(_cell_t));
     PyObject *args = Py_BuildValue("(KI)", size_mb, self->buckets);
     HT_VARIANT(_cell_t) * table = self->table;
-
+    uint32_t i;
     uint32_t chunk_size = (self->buckets <= MAX_PICKLE_CHUNK_SIZE) ? self->buckets : MAX_PICKLE_CHUNK_SIZE;
     uint32_t chunks = self->buckets / chunk_size;
     uint32_t current_chunk;
-    uint32_t i;
 
-    PyObject * hashtable_list = PyList_New(chunks);
-    for (current_chunk = 0; current_chunk < chunks; current_chunk++)
+    PyObject * hashtable_list;
+    #ifdef SEGMENT_PICKLE_BUFFER
+    // a hash of zero would pass for an empty cell, so tables keyed by hashes mark their cells in the copies below
+    out_of_band = out_of_band && !self->hashed;
+    if (out_of_band)
+        // the keys are only tested for being non-null when loading, so the pointers are passed as they are
+        hashtable_list = Segment_pickle_buffer((PyObject *) self, table, self->buckets * sizeof(HT_VARIANT(_cell_t)), 1);
+    else
+    #endif
     {
-        PyObject * hashtable_row = PyByteArray_FromStringAndSize(&table[current_chunk * chunk_size], chunk_size * sizeof(HT_VARIANT(_cell_t)));
-        if (!hashtable_row)
-            return NULL;
-        PyList_SetItem(hashtable_list, current_chunk, hashtable_row);
+        out_of_band = 0;
+        hashtable_list = PyList_New(chunks);
+    }
+    if (!args || !hashtable_list)
+    {
+        Py_XDECREF(args);
+        Py_XDECREF(hashtable_list);
+        return NULL;
+    }
 
-        // set all keys to one
-        HT_VARIANT(_cell_t) * buffer = PyByteArray_AsString(hashtable_row);
-        for (i = 0; i < chunk_size; i++)
+    // the rows only hold bytearrays, which are created without running any Python code, so the lock may be held
+    HT_VARIANT(_lock)(self);
+    int failed = 0;
+    for (current_chunk = 0; !out_of_band && current_chunk < chunks; current_chunk++)
+    {
+        PyObject * hashtable_row = PyByteArray_FromStringAndSize((char *) &table[current_chunk * chunk_size], chunk_size * sizeof(HT_VARIANT(_cell_t)));
+        if (!hashtable_row)
         {
-            if (buffer[i].key)
-                buffer[i].key = 1;
+            failed = 1;
+            break;
         }
-    }
-
-    PyObject * histo_row = PyByteArray_FromStringAndSize(self->histo, 256 * sizeof(uint32_t));
+        PyList_SET_ITEM(hashtable_list, current_chunk, hashtable_row);
 
-    PyByteArrayObject * strings_row = (PyByteArrayObject *) PyByteArray_FromStringAndSize(NULL, self->str_allocated);
-
-    char * result_index = strings_row->ob_bytes;
+        // set all keys of occupied cells to one
+        HT_VARIANT(_cell_t) * buffer = (HT_VARIANT(_cell_t) *) PyByteArray_AS_STRING(hashtable_row);
+        uint32_t * fingerprints = &self->fingerprints[current_chunk * chunk_size];
+        for (i = 0; i < chunk_size; i++)
+            buffer[i].word = fingerprints[i] ? 1 : 0;
+    }
 
-    for (i = 0; i < self->buckets; i++)
+    PyObject * histo_row = failed ? NULL : PyByteArray_FromStringAndSize((char *) self->histo, 256 * sizeof(uint32_t));
+    PyObject * strings_row = histo_row ? PyByteArray_FromStringAndSize(NULL, self->str_allocated) : NULL;
+    PyObject * hll_row = strings_row ? PyByteArray_FromStringAndSize((char *) self->hll.registers, self->hll.size) : NULL;
+    if (hll_row)
     {
-        char* key = table[i].key;
-        if (key)
+        char * result_index = PyByteArray_AS_STRING(strings_row);
+        char buffer[HT_HASH_KEY_LENGTH + 1];
+        for (i = 0; i < self->buckets; i++)
         {
-            size_t length = strlen(key) + 1;
-            memcpy(result_index, key, length);
-            result_index += length;
+            if (self->fingerprints[i])
+            {
+                Py_ssize_t length = HT_HASH_KEY_LENGTH;
+                char * key = buffer;
+                if (self->hashed)
+                    HT_VARIANT(_hash_key)(table[i].word, buffer);
+                else
+                    key = HT_VARIANT(_cell_key)(&table[i], buffer, &length);
+                memcpy(result_index, key, length + 1);
+                result_index += length + 1;
+            }
         }
     }
+    long long total = self->total;
+    long long str_allocated = self->str_allocated;
+    uint32_t size = self->size;
+    long long max_prune = self->max_prune;
+    long long half_life = self->half_life;
+    uint32_t decay_cursor = self->decay_cursor;
+    double decay_debt = self->decay_debt;
+    char hashed = self->hashed;
+    HT_VARIANT(_unlock)(self);
 
-    PyObject * hll_row = PyByteArray_FromStringAndSize(self->hll.registers, self->hll.size);
-
-    PyObject *state = Py_BuildValue("(LLILNNNN)",
-        self->total, self->str_allocated, self->size, self->max_prune, hashtable_list, strings_row, histo_row, hll_row);
+    if (!hll_row)
+    {
+        Py_DECREF(args);
+        Py_DECREF(hashtable_list);
+        Py_XDECREF(histo_row);
+        Py_XDECREF(strings_row);
+        return NULL;
+    }
+    PyObject *state = Py_BuildValue("(LLILNNNNLIdb)",
+        total, str_allocated, size, max_prune, hashtable_list, strings_row, histo_row, hll_row,
+        half_life, decay_cursor, decay_debt, hashed);
     return Py_BuildValue("(ONN)", Py_TYPE(self), args, state);
 }
 
+/* Serialization function for pickling. */
+static PyObject *
+HT_VARIANT(_reduce)(HT_TYPE *self)
+{
+    return HT_VARIANT(_reduce_table)(self, 0);
+}
+
+/* Serialization function for pickling, handing over the table without copying with protocol 5 and higher. */
+static PyObject *
+HT_VARIANT(_reduce_ex)(HT_TYPE *self, PyObject *args)
+{
+    int protocol;
+    if (!PyArg_ParseTuple(args, "i", &protocol))
+        return NULL;
+    return HT_VARIANT(_reduce_table)(self, protocol >= 5);
+}
+
 /* De-serialization function for pickling. */
 static PyObject *
 HT_VARIANT(_set_state)(HT_TYPE * self, PyObject * args)
@@ -608,56 +1252,141 @@ HT_VARIANT(_set_state)(HT_TYPE * self, PyObject * args)
     PyObject * strings_row_o;
     PyObject * histo_row_o;
     PyObject * hll_row_o;
+    PyObject * state;
+    long long total;
+    uint64_t str_allocated;
+    uint32_t size;
+    long long max_prune;
+    // the decay parameters and the key type are missing in pickles of older versions
+    long long half_life = self->half_life;
+    uint32_t decay_cursor = self->decay_cursor;
+    double decay_debt = self->decay_debt;
+    char hashed = self->hashed;
 
-    if (!PyArg_ParseTuple(args, "(LLILOOOO)",
-            &self->total, &self->str_allocated, &self->size, &self->max_prune,
-            &hashtable_list, &strings_row_o, &histo_row_o, &hll_row_o))
+    if (!PyArg_ParseTuple(args, "O!", &PyTuple_Type, &state))
+        return NULL;
+    if (!PyArg_ParseTuple(state, "LLILOOOO|LIdb",
+            &total, &str_allocated, &size, &max_prune,
+            &hashtable_list, &strings_row_o, &histo_row_o, &hll_row_o,
+            &half_life, &decay_cursor, &decay_debt, &hashed))
         return NULL;
 
-    HT_VARIANT(_cell_t) * table = self->table;
-
+    // all buffers are checked before taking the lock, no Python code may run while it is held
     uint32_t chunk_size = (self->buckets <= MAX_PICKLE_CHUNK_SIZE) ? self->buckets : MAX_PICKLE_CHUNK_SIZE;
     uint32_t chunks = self->buckets / chunk_size;
     uint32_t current_chunk;
-    for (current_chunk = 0; current_chunk < chunks; current_chunk++)
+    int valid = PyByteArray_Check(strings_row_o)
+            && PyByteArray_Check(histo_row_o) && (size_t) PyByteArray_GET_SIZE(histo_row_o) >= 256 * sizeof(uint32_t)
+            && PyByteArray_Check(hll_row_o) && (size_t) PyByteArray_GET_SIZE(hll_row_o) >= (size_t) self->hll.size;
+    Py_buffer view;
+    view.obj = NULL;
+    if (valid && PyList_Check(hashtable_list))
     {
-        PyObject * hashtable_row_o = PyList_GetItem(hashtable_list, current_chunk);
-        char * hashtable_row = PyByteArray_AsString(hashtable_row_o);
-        if (!hashtable_row)
+        valid = PyList_GET_SIZE(hashtable_list) == (Py_ssize_t) chunks;
+        for (current_chunk = 0; valid && current_chunk < chunks; current_chunk++)
+        {
+            PyObject * hashtable_row_o = PyList_GET_ITEM(hashtable_list, current_chunk);
+            valid = PyByteArray_Check(hashtable_row_o)
+                    && (size_t) PyByteArray_GET_SIZE(hashtable_row_o) == chunk_size * sizeof(HT_VARIANT(_cell_t));
+        }
+    }
+    else if (valid)
+    {
+        // a single buffer of the table passed out-of-band (pickle protocol 5)
+        if (Segment_get_state_buffer(hashtable_list, &view, self->buckets * sizeof(HT_VARIANT(_cell_t)), 1) < 0)
             return NULL;
-        memcpy(&table[current_chunk * chunk_size], (HT_VARIANT(_cell_t) *) hashtable_row, chunk_size * sizeof(HT_VARIANT(_cell_t)));
     }
+    if (!valid)
+    {
+        char * msg = "Pickled state does not match the size of the structure!";
+        PyErr_SetString(PyExc_ValueError, msg);
+        return NULL;
+    }
+
+    HT_VARIANT(_lock)(self);
+    self->total = total;
+    self->str_allocated = str_allocated;
+    self->size = size;
+    self->max_prune = max_prune;
+    self->half_life = half_life;
+    self->decay_cursor = decay_cursor;
+    self->decay_debt = decay_debt;
+    self->hashed = hashed;
+    self->hll.wide = self->hashed;
 
-    char * string_row = PyByteArray_AsString(strings_row_o);
-    uint64_t total_length = PyByteArray_Size(strings_row_o);
+    HT_VARIANT(_cell_t) * table = self->table;
+    if (view.obj)
+        memcpy(table, view.buf, view.len);
+    else
+    {
+        for (current_chunk = 0; current_chunk < chunks; current_chunk++)
+        {
+            char * hashtable_row = PyByteArray_AS_STRING(PyList_GET_ITEM(hashtable_list, current_chunk));
+            memcpy(&table[current_chunk * chunk_size], (HT_VARIANT(_cell_t) *) hashtable_row, chunk_size * sizeof(HT_VARIANT(_cell_t)));
+        }
+    }
+
+    char * string_row = PyByteArray_AS_STRING(strings_row_o);
+    uint64_t total_length = PyByteArray_GET_SIZE(strings_row_o);
     char * current_word = string_row;
+
+    // the keys are stored in the order of their buckets, so that they end up next to each other in the arena
+    int status = 0;
+    HT_VARIANT(_arena_release)(&self->arena);
+    // a single block for all keys, whichever of them are not inline
+    if (total_length && HT_VARIANT(_arena_grow)(&self->arena, total_length + self->size))
+        status = -2;
     uint32_t i;
-    for (i = 0; i < self->buckets; i++)
+    for (i = 0; !status && i < self->buckets; i++)
     {
-        if (table[i].key) // the imported key is garbage, we replace it with a real pointer
+        if (table[i].word) // the imported key is garbage, we replace it with a real key
         {
             if (current_word >= string_row + total_length)
             {
-                return NULL; // overflow!
+                status = -1;
+                break;
             }
 
-            size_t current_length = strlen(current_word) + 1;
-            char * current_target = malloc(current_length);
-            table[i].key = current_target;
-            memcpy(current_target, current_word, current_length);
-            current_word += current_length;
+            size_t current_length = strlen(current_word);
+            char * key = current_word;
+            Py_ssize_t key_length = current_length;
+            uint64_t hash;
+            if (self->hashed)
+            {
+                hash = strtoull(current_word, NULL, 16);
+                key = (char *) &hash;
+                key_length = sizeof(uint64_t);
+            }
+            if (HT_VARIANT(_store_key)(self, &table[i], key, key_length))
+            {
+                status = -2;
+                break;
+            }
+            // fingerprints are not pickled, the keys are hashed again
+            self->fingerprints[i] = HT_VARIANT(_fingerprint)(self, key, key_length, 0);
+            current_word += current_length + 1;
         }
+        else
+            self->fingerprints[i] = 0;
     }
+    if (!status)
+    {
+        HT_VARIANT(_sort_runs)(self);
+        memcpy(self->histo, PyByteArray_AS_STRING(histo_row_o), 256 * sizeof(uint32_t));
+        memcpy(self->hll.registers, PyByteArray_AS_STRING(hll_row_o), self->hll.size);
+    }
+    HT_VARIANT(_unlock)(self);
 
-    uint32_t * histo_row = PyByteArray_AsString(histo_row_o);
-    if (!histo_row)
-        return NULL;
-    memcpy(self->histo, histo_row, 256 * sizeof(uint32_t));
-
-    hll_cell_t * hll_row = PyByteArray_AsString(hll_row_o);
-    if (!hll_row)
+    if (view.obj)
+        PyBuffer_Release(&view);
+    if (status == -2)
+        return PyErr_NoMemory();
+    if (status)
+    {
+        char * msg = "Pickled keys do not match the table!";
+        PyErr_SetString(PyExc_ValueError, msg);
         return NULL;
-    memcpy(self->hll.registers, hll_row, self->hll.size);
+    }
 
     Py_INCREF(Py_None);
     return Py_None;
@@ -666,12 +1395,17 @@ HT_VARIANT(_set_state)(HT_TYPE * self, PyObject * args)
 static PyObject *
 HT_VARIANT(_print_histo)(HT_TYPE * self)
 {
+    uint32_t histo[256];
+    HT_VARIANT(_lock)(self);
+    memcpy(histo, self->histo, sizeof(histo));
+    HT_VARIANT(_unlock)(self);
+
     long long i;
     for (i = 0; i < 255; i++)
     {
         long long min = (i < 16) ? i : (8 + (i & 7)) << ((i >> 3) - 1);
         long long max = (i < 16) ? i : ((8 + ((i + 1) & 7)) << (((i + 1) >> 3) - 1)) - 1;
-        printf("%lld - %lld: %d\n", min, max, self->histo[i]);
+        printf("%lld - %lld: %d\n", min, max, histo[i]);
     }
 
     Py_INCREF(Py_None);
@@ -681,8 +1415,10 @@ HT_VARIANT(_print_histo)(HT_TYPE * self)
 static PyObject *
 HT_VARIANT(_print_alloc)(HT_TYPE * self)
 {
-    long long mem = sizeof(HT_VARIANT(_cell_t)) * self->buckets;
-    mem += self->str_allocated;
+    long long mem = (sizeof(HT_VARIANT(_cell_t)) + sizeof(uint32_t)) * self->buckets;
+    HT_VARIANT(_lock)(self);
+    mem += self->arena.allocated;
+    HT_VARIANT(_unlock)(self);
     mem += sizeof(uint32_t) * 256;
 
     return Py_BuildValue("L", mem);
@@ -696,7 +1432,38 @@ HT_VARIANT(_prune)(HT_TYPE * self, PyObject *args)
     if (!PyArg_ParseTuple(args, "L", &boundary))
         return NULL;
 
+    HT_VARIANT(_lock)(self);
     HT_VARIANT(_prune_int)(self, boundary);
+    HT_VARIANT(_unlock)(self);
+
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+/* Scales all counts by a factor in one pass over the table and removes the entries falling to zero. */
+static PyObject *
+HT_VARIANT(_decay)(HT_TYPE * self, PyObject *args)
+{
+    double factor;
+
+    if (!PyArg_ParseTuple(args, "d", &factor))
+        return NULL;
+
+    if (!(factor > 0 && factor <= 1))
+    {
+        char * msg = "The decay factor must be greater than 0 and at most 1!";
+        PyErr_SetString(PyExc_ValueError, msg);
+        return NULL;
+    }
+
+    // pruning moves cells and frees keys other threads might be reading, so the lock is held
+    if (factor < 1)
+    {
+        HT_VARIANT(_lock)(self);
+        HT_VARIANT(_decay_cells)(self, 0, self->buckets, factor);
+        HT_VARIANT(_prune_int)(self, 0);
+        HT_VARIANT(_unlock)(self);
+    }
 
     Py_INCREF(Py_None);
     return Py_None;
@@ -729,6 +1496,7 @@ HT_VARIANT(_update)(HT_TYPE * self, PyObject *args)
         PyObject *item;
         char *data;
         Py_ssize_t dataLength;
+        char scratch[sizeof(uint64_t)];
         while (item = PyIter_Next(iterator))
         {
             if (PyTuple_Check(item))
@@ -745,7 +1513,7 @@ HT_VARIANT(_update)(HT_TYPE * self, PyObject *args)
             else
             {
                 PyObject * free_after = NULL;
-                data = HT_VARIANT(_parse_key)(item, &dataLength, &free_after);
+                data = HT_VARIANT(_table_key)(self, item, &dataLength, &free_after, scratch);
                 if (!data
                     || !HT_VARIANT(_increment_obj)(self, data, dataLength, 1))
                 {
@@ -777,6 +1545,322 @@ HT_VARIANT(_update)(HT_TYPE * self, PyObject *args)
     return Py_None;
 }
 
+/**
+  * Adds all keys of a buffer batch to the counter.
+  * The batch is counted without the GIL, holding the lock of the table, as its cells move and its keys are compacted.
+  */
+static PyObject *
+HT_VARIANT(_update_buffer)(HT_TYPE * self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"data", "offsets", NULL};
+    PyObject * data;
+    PyObject * offsets = NULL;
+    KeyBuffer keys;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|O", kwlist, &data, &offsets))
+        return NULL;
+    if (HT_VARIANT(_check_string_keys)(self))
+        return NULL;
+    if (KeyBuffer_init(&keys, data, offsets))
+        return NULL;
+
+    char * scratch = malloc(keys.max_length + 1);
+    if (!scratch)
+    {
+        KeyBuffer_release(&keys);
+        return PyErr_NoMemory();
+    }
+
+    int error = 0;
+    int overflow = 0;
+    Py_ssize_t i;
+    Py_ssize_t length;
+    Py_BEGIN_ALLOW_THREADS
+    PyThread_acquire_lock(self->lock, WAIT_LOCK);
+    for (i = 0; i < keys.length; i++)
+    {
+        char * key = KeyBuffer_get(&keys, i, &length, scratch, 1, &error);
+        if (!key)
+            break;
+        if ((overflow = HT_VARIANT(_increment_key)(self, key, length, 1)))
+            break;
+    }
+    PyThread_release_lock(self->lock);
+    Py_END_ALLOW_THREADS
+
+    free(scratch);
+    KeyBuffer_release(&keys);
+    if (error)
+    {
+        KeyBuffer_set_error(error);
+        return NULL;
+    }
+    if (overflow)
+        return HT_VARIANT(_increment_error)(overflow);
+
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+/**
+  * Adds all n-grams of a batch of tokens to the counter, without the GIL, holding the lock of the table.
+  * Each n-gram is joined into a scratch buffer reused for every window, the key is only copied
+  * when a new cell is allocated for it.
+  */
+static PyObject *
+HT_VARIANT(_update_ngrams)(HT_TYPE * self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"tokens", "n", "sep", "offsets", NULL};
+    PyObject * data;
+    PyObject * offsets = NULL;
+    int n;
+    const char * sep = " ";
+    Py_ssize_t sep_length = 1;
+    KeyBuffer keys;
+    KeyNGrams ngrams;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "Oi|s#O", kwlist, &data, &n, &sep, &sep_length, &offsets))
+        return NULL;
+    if (n < 1)
+    {
+        char * msg = "The n-gram length must be at least 1!";
+        PyErr_SetString(PyExc_ValueError, msg);
+        return NULL;
+    }
+    if (HT_VARIANT(_check_string_keys)(self))
+        return NULL;
+    if ((Py_ssize_t) strlen(sep) < sep_length)
+    {
+        char * msg = "The separator must not contain null bytes!";
+        PyErr_SetString(PyExc_ValueError, msg);
+        return NULL;
+    }
+    if (KeyBuffer_init(&keys, data, offsets))
+        return NULL;
+    if (KeyNGrams_init(&ngrams, &keys, n, sep, sep_length, 1))
+    {
+        KeyBuffer_release(&keys);
+        return NULL;
+    }
+
+    char * scratch = malloc(ngrams.max_length + 1);
+    if (!scratch)
+    {
+        KeyNGrams_release(&ngrams);
+        KeyBuffer_release(&keys);
+        return PyErr_NoMemory();
+    }
+
+    int error = 0;
+    int overflow = 0;
+    Py_ssize_t length;
+    char * key;
+    Py_BEGIN_ALLOW_THREADS
+    PyThread_acquire_lock(self->lock, WAIT_LOCK);
+    while ((key = KeyNGrams_next(&ngrams, scratch, &length, &error)))
+    {
+        if ((overflow = HT_VARIANT(_increment_key)(self, key, length, 1)))
+            break;
+    }
+    PyThread_release_lock(self->lock);
+    Py_END_ALLOW_THREADS
+
+    free(scratch);
+    KeyNGrams_release(&ngrams);
+    KeyBuffer_release(&keys);
+    if (error)
+    {
+        KeyBuffer_set_error(error);
+        return NULL;
+    }
+    if (overflow)
+        return HT_VARIANT(_increment_error)(overflow);
+
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+/* Raises TypeError and returns -1 if the table is keyed by strings. */
+static inline int
+HT_VARIANT(_check_hash_keys)(HT_TYPE * self)
+{
+    if (!self->hashed)
+    {
+        char * msg = "The table is not keyed by hashes, create it with hashed=True!";
+        PyErr_SetString(PyExc_TypeError, msg);
+        return -1;
+    }
+    return 0;
+}
+
+/* Adds keys given by 64-bit hashes, with optional counts. The keys are counted without the GIL. */
+static PyObject *
+HT_VARIANT(_increment_hashes)(HT_TYPE * self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"hashes", "counts", NULL};
+    PyObject * hashes_o;
+    PyObject * counts_o = NULL;
+    Py_buffer hashes_view;
+    Py_buffer counts_view;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|O", kwlist, &hashes_o, &counts_o))
+        return NULL;
+    if (HT_VARIANT(_check_hash_keys)(self))
+        return NULL;
+
+    Py_ssize_t length = KeyBuffer_get_int64(hashes_o, &hashes_view);
+    if (length < 0)
+        return NULL;
+    long long * counts = NULL;
+    if (counts_o && counts_o != Py_None)
+    {
+        Py_ssize_t counts_length = KeyBuffer_get_int64(counts_o, &counts_view);
+        if (counts_length < 0)
+        {
+            PyBuffer_Release(&hashes_view);
+            return NULL;
+        }
+        counts = (long long *) counts_view.buf;
+
+        Py_ssize_t i;
+        char * msg = NULL;
+        if (counts_length != length)
+            msg = "The counts must have the same length as the hashes!";
+        for (i = 0; !msg && i < length; i++)
+        {
+            if (counts[i] < 0)
+                msg = "Increment must be positive!";
+        }
+        if (msg)
+        {
+            PyBuffer_Release(&counts_view);
+            PyBuffer_Release(&hashes_view);
+            PyErr_SetString(PyExc_ValueError, msg);
+            return NULL;
+        }
+    }
+
+    uint64_t * key_hashes = (uint64_t *) hashes_view.buf;
+    int overflow = 0;
+    Py_ssize_t i;
+    Py_BEGIN_ALLOW_THREADS
+    PyThread_acquire_lock(self->lock, WAIT_LOCK);
+    for (i = 0; i < length; i++)
+    {
+        long long increment = counts ? counts[i] : 1;
+        if (!increment)
+            continue;
+        if ((overflow = HT_VARIANT(_increment_key)(self, (char *) &key_hashes[i], sizeof(uint64_t), increment)))
+            break;
+    }
+    PyThread_release_lock(self->lock);
+    Py_END_ALLOW_THREADS
+
+    if (counts)
+        PyBuffer_Release(&counts_view);
+    PyBuffer_Release(&hashes_view);
+    if (overflow)
+        return HT_VARIANT(_increment_error)(overflow);
+
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+/* Retrieves counts of keys given by 64-bit hashes into an array of 64-bit integers, without the GIL. */
+static PyObject *
+HT_VARIANT(_get_hashes)(HT_TYPE * self, PyObject *args)
+{
+    PyObject * hashes_o;
+    Py_buffer hashes_view;
+    Py_buffer view;
+
+    if (!PyArg_ParseTuple(args, "O", &hashes_o))
+        return NULL;
+    if (HT_VARIANT(_check_hash_keys)(self))
+        return NULL;
+    Py_ssize_t length = KeyBuffer_get_int64(hashes_o, &hashes_view);
+    if (length < 0)
+        return NULL;
+    PyObject * result = KeyBuffer_new_results(length, &view);
+    if (!result)
+    {
+        PyBuffer_Release(&hashes_view);
+        return NULL;
+    }
+
+    uint64_t * key_hashes = (uint64_t *) hashes_view.buf;
+    long long * values = (long long *) view.buf;
+    Py_ssize_t i;
+    Py_BEGIN_ALLOW_THREADS
+    PyThread_acquire_lock(self->lock, WAIT_LOCK);
+    for (i = 0; i < length; i++)
+    {
+        HT_VARIANT(_cell_t) * cell = HT_VARIANT(_find_cell)(self, (char *) &key_hashes[i], sizeof(uint64_t), 0);
+        values[i] = cell ? cell->count : 0;
+    }
+    PyThread_release_lock(self->lock);
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&view);
+    PyBuffer_Release(&hashes_view);
+    return result;
+}
+
+/**
+  * Adds all tokens (or n-grams) of a file to the counter, without holding the GIL. The tokens of each chunk
+  * of the file are counted holding the lock of the table, which is released while the next chunk is read.
+  */
+static PyObject *
+HT_VARIANT(_update_from_file)(HT_TYPE * self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"file", "tokenizer", "ngram", "encoding", NULL};
+    PyObject * file;
+    const char * tokenizer = "whitespace";
+    int ngram = 1;
+    const char * encoding = "utf-8";
+    FileTokens tokens;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|sis", kwlist, &file, &tokenizer, &ngram, &encoding))
+        return NULL;
+    if (HT_VARIANT(_check_string_keys)(self))
+        return NULL;
+    if (FileTokens_open(&tokens, file, tokenizer, ngram, encoding))
+        return NULL;
+
+    int error = 0;
+    int overflow = 0;
+    int status = 0;
+    Py_ssize_t length;
+    char * key;
+    Py_BEGIN_ALLOW_THREADS
+    while (!overflow)
+    {
+        status = FileTokens_read(&tokens, &error);
+        if (status <= 0)
+            break;
+
+        PyThread_acquire_lock(self->lock, WAIT_LOCK);
+        while ((key = FileTokens_next(&tokens, &length)))
+        {
+            if ((overflow = HT_VARIANT(_increment_key)(self, key, length, 1)))
+                break;
+        }
+        PyThread_release_lock(self->lock);
+    }
+    Py_END_ALLOW_THREADS
+
+    if (status < 0)
+        FileTokens_set_error(error);
+    FileTokens_close(&tokens);
+    if (status < 0)
+        return NULL;
+    if (overflow)
+        return HT_VARIANT(_increment_error)(overflow);
+
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
 PyObject* HT_VARIANT(_ITER_iter)(PyObject *self)
 {
   Py_INCREF(self);
@@ -787,44 +1871,115 @@ PyObject* HT_VARIANT(_ITER_iter)(PyObject *self)
 #define ITER_RESULT_VALUES 2
 #define ITER_RESULT_KV_PAIRS 3
 
+/* A key copied out of the table with its count, so that its Python objects are created once the lock is released. */
+typedef struct {
+    char * key; // the copied string, NULL if the table is keyed by hashes
+    Py_ssize_t length;
+    uint64_t word; // the hash of a table keyed by hashes
+    long long count;
+} HT_VARIANT(_entry_t);
+
+/**
+  * Copies the keys and counts of `count` occupied cells into a single allocation, which the caller frees.
+  * Does not use the Python API, the caller must hold the lock of the table. Returns NULL if memory runs out.
+  */
+static HT_VARIANT(_entry_t) *
+HT_VARIANT(_copy_entries)(HT_TYPE * self, HT_VARIANT(_cell_t) * const * cells, Py_ssize_t count)
+{
+    char buffer[HT_INLINE_LENGTH + 1];
+    size_t keys_length = 0;
+    Py_ssize_t length;
+    Py_ssize_t i;
+    for (i = 0; !self->hashed && i < count; i++)
+    {
+        HT_VARIANT(_cell_key)(cells[i], buffer, &length);
+        keys_length += length;
+    }
+
+    HT_VARIANT(_entry_t) * entries = (HT_VARIANT(_entry_t) *) malloc(count * sizeof(HT_VARIANT(_entry_t)) + keys_length + 1);
+    if (!entries)
+        return NULL;
+    char * key = (char *) (entries + count);
+    for (i = 0; i < count; i++)
+    {
+        entries[i].key = NULL;
+        entries[i].length = 0;
+        entries[i].word = cells[i]->word;
+        entries[i].count = cells[i]->count;
+        if (!self->hashed)
+        {
+            char * source = HT_VARIANT(_cell_key)(cells[i], buffer, &length);
+            memcpy(key, source, length);
+            entries[i].key = key;
+            entries[i].length = length;
+            key += length;
+        }
+    }
+    return entries;
+}
+
+/* Creates the Python object of a copied key: an int for hashed tables, unicode or bytes otherwise. */
+static PyObject * HT_VARIANT(_key_object)(const HT_VARIANT(_entry_t) * entry, char use_unicode)
+{
+    if (!entry->key)
+        return PyLong_FromUnsignedLongLong(entry->word);
+
+    return (use_unicode)
+        ? PyUnicode_DecodeUTF8(entry->key, entry->length, NULL)
+        #if PY_MAJOR_VERSION >= 3
+        : PyBytes_FromStringAndSize(entry->key, entry->length);
+        #else
+        : PyString_FromStringAndSize(entry->key, entry->length);
+        #endif
+}
 
 PyObject* HT_VARIANT(_ITER_iternext)(HT_VARIANT(_ITER_TYPE) *self)
 {
-    HT_VARIANT(_cell_t) * table = self->hashtable->table;
-    uint32_t buckets = self->hashtable->buckets;
+    HT_TYPE * hashtable = self->hashtable;
+    HT_VARIANT(_cell_t) * table = hashtable->table;
+    uint32_t buckets = hashtable->buckets;
     uint32_t i = self->i;
+    if (self->result_type != ITER_RESULT_KEYS && self->result_type != ITER_RESULT_VALUES
+            && self->result_type != ITER_RESULT_KV_PAIRS)
+    {
+        char * msg = "Invalid iteration type!";
+        PyErr_SetString(PyExc_SystemError, msg);
+        return NULL;
+    }
+
+    // the key is copied under the lock, the table may change as soon as it is released
+    HT_VARIANT(_entry_t) * entry = NULL;
+    long long count = 0;
+    HT_VARIANT(_lock)(hashtable);
     while (i < buckets && table[i].count == 0)
         i++;
+    if (i < buckets)
+    {
+        HT_VARIANT(_cell_t) * cell = &table[i];
+        count = cell->count;
+        if (self->result_type != ITER_RESULT_VALUES)
+            entry = HT_VARIANT(_copy_entries)(hashtable, &cell, 1);
+    }
+    HT_VARIANT(_unlock)(hashtable);
 
     if (i < buckets)
     {
         if (self->result_type == ITER_RESULT_VALUES)
         {
             self->i = i + 1;
-            return Py_BuildValue("L", table[i].count);
+            return Py_BuildValue("L", count);
         }
+        if (!entry)
+            return PyErr_NoMemory();
 
         PyObject * result;
-        char * current_key = table[i].key;
-        PyObject * pkey;
-        pkey = (self->use_unicode)
-            ? PyUnicode_DecodeUTF8(current_key, strlen(current_key), NULL)
-            #if PY_MAJOR_VERSION >= 3
-            : PyBytes_FromStringAndSize(current_key, strlen(current_key));
-            #else
-            : PyString_FromStringAndSize(current_key, strlen(current_key));
-            #endif
+        PyObject * pkey = HT_VARIANT(_key_object)(entry, self->use_unicode);
+        free(entry);
 
         if (self->result_type == ITER_RESULT_KEYS)
             result = pkey;
-        else if (self->result_type == ITER_RESULT_KV_PAIRS)
-            result = PyTuple_Pack(2, pkey, Py_BuildValue("L", table[i].count));
         else
-        {
-            char * msg = "Invalid iteration type!";
-            PyErr_SetString(PyExc_SystemError, msg);
-            return NULL;
-        }
+            result = pkey ? Py_BuildValue("(NL)", pkey, count) : NULL;
         self->i = i + 1;
         return result;
     }
@@ -928,6 +2083,140 @@ HT_VARIANT(_HT_iter_V)(HT_TYPE *self)
     return HT_VARIANT(_make_iterator)(self, ITER_RESULT_VALUES);
 }
 
+/* Whether cell `a` ranks below cell `b` in most_common: by a lower count, or by a later bucket for the same count. */
+#define HT_RANKS_BELOW(a, b) ((a)->count < (b)->count || ((a)->count == (b)->count && (a) > (b)))
+
+/* Orders cells from the highest rank for qsort. */
+static int HT_VARIANT(_compare_rank)(const void * a, const void * b)
+{
+    const HT_VARIANT(_cell_t) * first = *(HT_VARIANT(_cell_t) * const *) a;
+    const HT_VARIANT(_cell_t) * second = *(HT_VARIANT(_cell_t) * const *) b;
+    if (HT_RANKS_BELOW(first, second))
+        return 1;
+    return HT_RANKS_BELOW(second, first) ? -1 : 0;
+}
+
+/* Moves the cell at `index` of a heap of `size` cells down until no cell below it ranks lower. */
+static void HT_VARIANT(_sift_down)(HT_VARIANT(_cell_t) ** heap, Py_ssize_t size, Py_ssize_t index)
+{
+    HT_VARIANT(_cell_t) * cell = heap[index];
+    Py_ssize_t child;
+    while ((child = 2 * index + 1) < size)
+    {
+        if (child + 1 < size && HT_RANKS_BELOW(heap[child + 1], heap[child]))
+            child++;
+        if (!HT_RANKS_BELOW(heap[child], cell))
+            break;
+        heap[index] = heap[child];
+        index = child;
+    }
+    heap[index] = cell;
+}
+
+/**
+  * Retrieves the `n` keys with the highest counts (all keys by default) as a list of (key, count) pairs.
+  * The histogram of counts gives a lower bound of the n-th highest count, so that a single pass over the table
+  * only offers a few cells to a heap of the n best ones, and only those are converted to Python objects.
+  */
+static PyObject *
+HT_VARIANT(_most_common)(HT_TYPE *self, PyObject *args)
+{
+    PyObject * n_o = Py_None;
+    if (!PyArg_ParseTuple(args, "|O", &n_o))
+        return NULL;
+
+    Py_ssize_t n = -1;
+    if (n_o != Py_None)
+    {
+        n = PyNumber_AsSsize_t(n_o, PyExc_OverflowError);
+        if (n == -1 && PyErr_Occurred())
+            return NULL;
+        if (n < 0)
+        {
+            char * msg = "The number of keys must not be negative!";
+            PyErr_SetString(PyExc_ValueError, msg);
+            return NULL;
+        }
+    }
+
+    // the best cells are copied under the lock, their Python objects are created once it is released
+    HT_VARIANT(_lock)(self);
+    if (n < 0 || n > self->size)
+        n = self->size;
+    if (!n)
+    {
+        HT_VARIANT(_unlock)(self);
+        return PyList_New(0);
+    }
+
+    long long threshold = 1;
+    Py_ssize_t above = 0;
+    long long index;
+    for (index = 255; index > 1; index--)
+    {
+        above += self->histo[index];
+        if (above >= n)
+        {
+            threshold = HT_VARIANT(_histo_bound)(index);
+            break;
+        }
+    }
+
+    HT_VARIANT(_cell_t) ** heap = (HT_VARIANT(_cell_t) **) malloc(n * sizeof(HT_VARIANT(_cell_t) *));
+    if (!heap)
+    {
+        HT_VARIANT(_unlock)(self);
+        return PyErr_NoMemory();
+    }
+
+    // empty cells and cells of deleted keys are skipped along with all counts below the threshold
+    HT_VARIANT(_cell_t) * table = self->table;
+    Py_ssize_t size = 0;
+    uint32_t i;
+    for (i = 0; i < self->buckets; i++)
+    {
+        if (table[i].count < threshold)
+            continue;
+        if (size < n)
+        {
+            heap[size++] = &table[i];
+            if (size == n)
+            {
+                Py_ssize_t j;
+                for (j = n / 2; j-- > 0;)
+                    HT_VARIANT(_sift_down)(heap, n, j);
+            }
+        }
+        else if (table[i].count > heap[0]->count)
+        {
+            heap[0] = &table[i];
+            HT_VARIANT(_sift_down)(heap, n, 0);
+        }
+    }
+    qsort(heap, size, sizeof(HT_VARIANT(_cell_t) *), HT_VARIANT(_compare_rank));
+    HT_VARIANT(_entry_t) * entries = HT_VARIANT(_copy_entries)(self, heap, size);
+    HT_VARIANT(_unlock)(self);
+    free(heap);
+    if (!entries)
+        return PyErr_NoMemory();
+
+    PyObject * result = PyList_New(size);
+    Py_ssize_t k;
+    for (k = 0; result && k < size; k++)
+    {
+        PyObject * key = HT_VARIANT(_key_object)(&entries[k], self->use_unicode);
+        PyObject * pair = key ? Py_BuildValue("(NL)", key, entries[k].count) : NULL;
+        if (!pair)
+        {
+            Py_CLEAR(result);
+            break;
+        }
+        PyList_SET_ITEM(result, k, pair);
+    }
+    free(entries);
+    return result;
+}
+
 static PyMethodDef HT_VARIANT(_methods)[] = {
     {"increment", (PyCFunction)HT_VARIANT(_increment), METH_VARARGS,
      "Add a string to the counter."
@@ -936,7 +2225,7 @@ static PyMethodDef HT_VARIANT(_methods)[] = {
      "Return an estimate for the number of distinct items inserted into the counter. Does not work correctly when values are deleted!"
     },
     {"total", (PyCFunction)HT_VARIANT(_total), METH_NOARGS,
-     "Return a precise total sum of all increments performed on this counter. Does not work correcly with deleting values or setting them directly when pruning kicks in."
+     "Return a precise total sum of all increments performed on this counter. Does not work correcly with deleting values or setting them directly when pruning kicks in. Decay reduces it by the amount taken off the counts."
     },
     {"items", (PyCFunction)HT_VARIANT(_HT_iter_KV), METH_NOARGS,
      "Iterate over all key-value pairs."
@@ -956,9 +2245,30 @@ static PyMethodDef HT_VARIANT(_methods)[] = {
     {"itervalues", (PyCFunction)HT_VARIANT(_HT_iter_V), METH_NOARGS,
      "Iterate over all non-zero counts."
     },
+    {"most_common", (PyCFunction)HT_VARIANT(_most_common), METH_VARARGS,
+     "Return a list of the n keys with the highest counts (all keys by default) and their counts, from the most common."
+    },
     {"update", (PyCFunction)HT_VARIANT(_update), METH_VARARGS,
      "Add all pairs from another counter, or add all items from an iterable."
     },
+    {"get_many", (PyCFunction)HT_VARIANT(_get_many), METH_VARARGS | METH_KEYWORDS,
+     "Return counts of a batch of keys as an array of 64-bit integers."
+    },
+    {"update_buffer", (PyCFunction)HT_VARIANT(_update_buffer), METH_VARARGS | METH_KEYWORDS,
+     "Add all keys of a fixed-width string array, or of a values buffer delimited by offsets."
+    },
+    {"increment_hashes", (PyCFunction)HT_VARIANT(_increment_hashes), METH_VARARGS | METH_KEYWORDS,
+     "Add keys given by 64-bit hashes, optionally by an array of counts. Requires a table created with hashed=True."
+    },
+    {"get_hashes", (PyCFunction)HT_VARIANT(_get_hashes), METH_VARARGS,
+     "Return counts of keys given by 64-bit hashes as an array of 64-bit integers."
+    },
+    {"update_from_file", (PyCFunction)HT_VARIANT(_update_from_file), METH_VARARGS | METH_KEYWORDS,
+     "Add all tokens or n-grams of a file, optionally gzip compressed, read by a native tokenizer."
+    },
+    {"update_ngrams", (PyCFunction)HT_VARIANT(_update_ngrams), METH_VARARGS | METH_KEYWORDS,
+     "Add all n-grams of a list of tokens or of a token buffer delimited by offsets, joined by a separator."
+    },
     {"quality", (PyCFunction)HT_VARIANT(_quality), METH_NOARGS,
      "Return the current estimated overflow rating of the structure, calculated as (cardinality / available buckets)."
     },
@@ -968,6 +2278,9 @@ static PyMethodDef HT_VARIANT(_methods)[] = {
     {"prune", (PyCFunction)HT_VARIANT(_prune), METH_VARARGS,
      "Remove all entries with count X or less."
     },
+    {"decay", (PyCFunction)HT_VARIANT(_decay), METH_VARARGS,
+     "Multiply all counts by a factor from (0, 1], rounding down, and remove the entries which fall to zero."
+    },
     {"buckets", (PyCFunction)HT_VARIANT(_buckets), METH_NOARGS,
      "Return the total number of buckets in the hashtable."
     },
@@ -977,6 +2290,9 @@ static PyMethodDef HT_VARIANT(_methods)[] = {
     {"__reduce__", (PyCFunction)HT_VARIANT(_reduce), METH_NOARGS,
      "Serialization function for pickling."
     },
+    {"__reduce_ex__", (PyCFunction)HT_VARIANT(_reduce_ex), METH_VARARGS,
+     "Serialization function for pickling, the table is passed out-of-band with protocol 5."
+    },
     {"__setstate__", (PyCFunction)HT_VARIANT(_set_state), METH_VARARGS,
     "De-serialization function for pickling."
     },
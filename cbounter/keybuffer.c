@@ -0,0 +1,482 @@
+//-----------------------------------------------------------------------------
+// Author: Filip Stefanak <f.stefanak@rare-technologies.com>
+// Copyright (C) 2017 Rare Technologies
+//
+// This code is distributed under the terms and conditions
+// from the MIT License (MIT).
+
+#include "keybuffer.h"
+#include <string.h>
+#include <stdint.h>
+
+static int
+KeyBuffer_fail(KeyBuffer *self, PyObject *exception, char *msg)
+{
+    PyErr_SetString(exception, msg);
+    KeyBuffer_release(self);
+    return -1;
+}
+
+static inline int
+KeyBuffer_little_endian(void)
+{
+    const uint16_t probe = 1;
+    return *((const char *) &probe);
+}
+
+static inline long long
+KeyBuffer_offset(KeyBuffer *self, Py_ssize_t index)
+{
+    if (self->offset_size == 4)
+        return ((int32_t *) self->offsets.buf)[index];
+    return ((int64_t *) self->offsets.buf)[index];
+}
+
+/* Parses a format of a one-dimensional fixed-width string array such as "10s" or "<10w" */
+static int
+KeyBuffer_parse_format(KeyBuffer *self, const char *format)
+{
+    char byte_order = '@';
+    if (*format == '@' || *format == '=' || *format == '<' || *format == '>' || *format == '!')
+        byte_order = *format++;
+    while (*format >= '0' && *format <= '9')
+        format++;
+
+    if (!strcmp(format, "s"))
+        self->kind = KEYS_FIXED;
+    else if (!strcmp(format, "w"))
+        self->kind = KEYS_UCS4;
+    else
+        return -1;
+
+    if (byte_order == '>' || byte_order == '!')
+        self->swap = KeyBuffer_little_endian();
+    else if (byte_order == '<')
+        self->swap = !KeyBuffer_little_endian();
+    return 0;
+}
+
+/* Collects UTF-8 representations of all keys of a list or tuple. */
+static int
+KeyBuffer_init_sequence(KeyBuffer *self, PyObject *data)
+{
+    self->kind = KEYS_SEQUENCE;
+    // a tuple can not change while the keys are being read without the GIL
+    self->sequence = PySequence_Tuple(data);
+    if (!self->sequence)
+        return -1;
+    self->length = PyTuple_GET_SIZE(self->sequence);
+    self->pointers = (char **) malloc(sizeof(char *) * (self->length + 1));
+    self->lengths = (Py_ssize_t *) malloc(sizeof(Py_ssize_t) * (self->length + 1));
+    self->encoded = PyList_New(0);
+    if (!self->pointers || !self->lengths || !self->encoded)
+    {
+        KeyBuffer_release(self);
+        PyErr_NoMemory();
+        return -1;
+    }
+
+    Py_ssize_t i;
+    for (i = 0; i < self->length; i++)
+    {
+        PyObject * key = PyTuple_GET_ITEM(self->sequence, i);
+        char * key_data = NULL;
+        Py_ssize_t length = 0;
+
+        if (PyUnicode_Check(key))
+        {
+            #if PY_MAJOR_VERSION >= 3
+            key_data = (char *) PyUnicode_AsUTF8AndSize(key, &length);
+            #else
+            key = PyUnicode_AsUTF8String(key);
+            if (key && !PyList_Append(self->encoded, key))
+                PyString_AsStringAndSize(key, &key_data, &length);
+            Py_XDECREF(key);
+            #endif
+            if (!key_data)
+            {
+                KeyBuffer_release(self);
+                return -1;
+            }
+        }
+        else if (PyBytes_Check(key))
+        {
+            PyBytes_AsStringAndSize(key, &key_data, &length);
+        }
+        else
+        {
+            /* read-only bytes-like object whose memory can not move */
+            PyBufferProcs *pb = Py_TYPE(key)->tp_as_buffer;
+            Py_buffer view;
+            if ((pb == NULL || pb->bf_releasebuffer == NULL)
+                && !PyObject_GetBuffer(key, &view, PyBUF_SIMPLE))
+            {
+                key_data = view.buf;
+                length = view.len;
+                PyBuffer_Release(&view);
+            }
+            PyErr_Clear();
+        }
+
+        if (!key_data)
+        {
+            PyErr_SetString(PyExc_TypeError, "The keys must be unicode objects or bytes buffers!");
+            KeyBuffer_release(self);
+            return -1;
+        }
+        self->pointers[i] = key_data;
+        self->lengths[i] = length;
+        if (length > self->max_length)
+            self->max_length = length;
+    }
+    return 0;
+}
+
+int
+KeyBuffer_init(KeyBuffer *self, PyObject *data, PyObject *offsets)
+{
+    memset(self, 0, sizeof(KeyBuffer));
+
+    if ((!offsets || offsets == Py_None) && (PyList_Check(data) || PyTuple_Check(data)))
+        return KeyBuffer_init_sequence(self, data);
+
+    if (PyObject_GetBuffer(data, &self->data, PyBUF_RECORDS_RO))
+        return -1;
+    self->has_data = 1;
+
+    if (!PyBuffer_IsContiguous(&self->data, 'C'))
+        return KeyBuffer_fail(self, PyExc_ValueError, "The key buffer must be C-contiguous!");
+
+    if (offsets && offsets != Py_None)
+    {
+        if (PyObject_GetBuffer(offsets, &self->offsets, PyBUF_RECORDS_RO))
+        {
+            KeyBuffer_release(self);
+            return -1;
+        }
+        self->has_offsets = 1;
+        self->kind = KEYS_OFFSETS;
+
+        const char *format = self->offsets.format ? self->offsets.format : "B";
+        if (*format == '@' || *format == '=' || *format == '<')
+            format++;
+        if (self->offsets.ndim != 1 || !PyBuffer_IsContiguous(&self->offsets, 'C')
+            || strlen(format) != 1 || !strchr("ilq", *format)
+            || (self->offsets.itemsize != 4 && self->offsets.itemsize != 8))
+            return KeyBuffer_fail(self, PyExc_TypeError, "The offsets must be a one-dimensional array of int32 or int64!");
+        self->offset_size = self->offsets.itemsize;
+
+        Py_ssize_t count = self->offsets.len / self->offset_size;
+        if (count < 1)
+            return KeyBuffer_fail(self, PyExc_ValueError, "The offsets must contain at least one element!");
+        self->length = count - 1;
+
+        Py_ssize_t i;
+        long long previous = KeyBuffer_offset(self, 0);
+        if (previous < 0)
+            return KeyBuffer_fail(self, PyExc_ValueError, "The offsets must not be negative!");
+        for (i = 1; i < count; i++)
+        {
+            long long current = KeyBuffer_offset(self, i);
+            if (current < previous)
+                return KeyBuffer_fail(self, PyExc_ValueError, "The offsets must be non-decreasing!");
+            if (current - previous > self->max_length)
+                self->max_length = current - previous;
+            previous = current;
+        }
+        if (previous > self->data.len)
+            return KeyBuffer_fail(self, PyExc_ValueError, "The offsets point beyond the end of the key buffer!");
+        return 0;
+    }
+
+    const char *format = self->data.format ? self->data.format : "B";
+    if (self->data.ndim == 1 && !KeyBuffer_parse_format(self, format))
+    {
+        self->key_size = self->data.itemsize;
+        self->length = self->data.shape[0];
+    }
+    else if (self->data.ndim == 2)
+    {
+        // a matrix of characters, one key per row
+        if (*format == '@' || *format == '=' || *format == '<' || *format == '>' || *format == '!')
+            format++;
+        if (self->data.itemsize == 1 && strlen(format) == 1 && strchr("Bbc", *format))
+            self->kind = KEYS_FIXED;
+        else if (self->data.itemsize == 4 && strlen(format) == 1 && strchr("uw", *format))
+            self->kind = KEYS_UCS4;
+        else
+            return KeyBuffer_fail(self, PyExc_TypeError, "Unsupported element type of the key matrix!");
+        self->key_size = self->data.shape[1] * self->data.itemsize;
+        self->length = self->data.shape[0];
+    }
+    else
+    {
+        return KeyBuffer_fail(self, PyExc_TypeError,
+                              "The keys must be an array of fixed-width strings, or a buffer with offsets!");
+    }
+
+    if (self->kind == KEYS_UCS4 && self->key_size % 4)
+        return KeyBuffer_fail(self, PyExc_ValueError, "Invalid item size of the UCS4 key array!");
+    // a UCS4 code point takes up to 4 bytes in UTF-8
+    self->max_length = self->key_size;
+    return 0;
+}
+
+void
+KeyBuffer_release(KeyBuffer *self)
+{
+    if (self->has_offsets)
+        PyBuffer_Release(&self->offsets);
+    if (self->has_data)
+        PyBuffer_Release(&self->data);
+    self->has_offsets = 0;
+    self->has_data = 0;
+
+    free(self->pointers);
+    free(self->lengths);
+    self->pointers = NULL;
+    self->lengths = NULL;
+    Py_CLEAR(self->encoded);
+    Py_CLEAR(self->sequence);
+}
+
+static inline uint32_t
+KeyBuffer_code_point(KeyBuffer *self, const char *position)
+{
+    uint32_t code_point;
+    memcpy(&code_point, position, 4);
+    if (self->swap)
+        code_point = (code_point >> 24) | ((code_point >> 8) & 0xFF00) | ((code_point << 8) & 0xFF0000) | (code_point << 24);
+    return code_point;
+}
+
+/* Encodes a zero-padded UCS4 key into UTF-8. Returns the length of the result or -1 for an invalid code point. */
+static Py_ssize_t
+KeyBuffer_encode_ucs4(KeyBuffer *self, const char *item, char *target)
+{
+    char *start = target;
+    Py_ssize_t chars = self->key_size / 4;
+    while (chars > 0 && !KeyBuffer_code_point(self, item + (chars - 1) * 4))
+        chars--;
+
+    Py_ssize_t i;
+    for (i = 0; i < chars; i++)
+    {
+        uint32_t c = KeyBuffer_code_point(self, item + i * 4);
+        if (c < 0x80)
+            *target++ = c;
+        else if (c < 0x800)
+        {
+            *target++ = 0xC0 | (c >> 6);
+            *target++ = 0x80 | (c & 0x3F);
+        }
+        else if (c < 0x10000)
+        {
+            if (c >= 0xD800 && c <= 0xDFFF)
+                return -1;
+            *target++ = 0xE0 | (c >> 12);
+            *target++ = 0x80 | ((c >> 6) & 0x3F);
+            *target++ = 0x80 | (c & 0x3F);
+        }
+        else if (c < 0x110000)
+        {
+            *target++ = 0xF0 | (c >> 18);
+            *target++ = 0x80 | ((c >> 12) & 0x3F);
+            *target++ = 0x80 | ((c >> 6) & 0x3F);
+            *target++ = 0x80 | (c & 0x3F);
+        }
+        else
+            return -1;
+    }
+    *target = 0;
+    return target - start;
+}
+
+char *
+KeyBuffer_get(KeyBuffer *self, Py_ssize_t index, Py_ssize_t *length, char *scratch, char terminate, int *error)
+{
+    char *key;
+    if (self->kind == KEYS_UCS4)
+    {
+        *length = KeyBuffer_encode_ucs4(self, (char *) self->data.buf + index * self->key_size, scratch);
+        if (*length < 0)
+        {
+            *error = KEYS_ERROR_CODE_POINT;
+            return NULL;
+        }
+        key = scratch;
+    }
+    else
+    {
+        if (self->kind == KEYS_SEQUENCE)
+        {
+            key = self->pointers[index];
+            *length = self->lengths[index];
+        }
+        else if (self->kind == KEYS_OFFSETS)
+        {
+            long long start = KeyBuffer_offset(self, index);
+            key = (char *) self->data.buf + start;
+            *length = KeyBuffer_offset(self, index + 1) - start;
+        }
+        else
+        {
+            key = (char *) self->data.buf + index * self->key_size;
+            Py_ssize_t key_length = self->key_size;
+            while (key_length > 0 && !key[key_length - 1])
+                key_length--;
+            *length = key_length;
+        }
+
+        if (terminate)
+        {
+            memcpy(scratch, key, *length);
+            scratch[*length] = 0;
+            key = scratch;
+        }
+    }
+
+    if (terminate && memchr(key, 0, *length))
+    {
+        *error = KEYS_ERROR_NULL_BYTE;
+        return NULL;
+    }
+    return key;
+}
+
+void
+KeyBuffer_set_error(int error)
+{
+    if (error == KEYS_ERROR_CODE_POINT)
+        PyErr_SetString(PyExc_ValueError, "The key buffer contains an invalid unicode code point!");
+    else if (error == KEYS_ERROR_NULL_BYTE)
+        PyErr_SetString(PyExc_ValueError, "The key must not contain null bytes!");
+    else
+        PyErr_SetString(PyExc_SystemError, "Unknown key buffer error!");
+}
+
+Py_ssize_t
+KeyBuffer_get_int64(PyObject *obj, Py_buffer *view)
+{
+    if (PyObject_GetBuffer(obj, view, PyBUF_RECORDS_RO))
+        return -1;
+
+    const char *format = view->format ? view->format : "B";
+    if (*format == '@' || *format == '=' || *format == '<')
+        format++;
+    int integers = view->itemsize == 8 && strlen(format) == 1 && strchr("lLqQ", *format);
+    int raw = view->itemsize == 1 && strlen(format) == 1 && strchr("Bbc", *format) && !(view->len % 8);
+    if (view->ndim != 1 || !PyBuffer_IsContiguous(view, 'C') || !(integers || raw))
+    {
+        PyBuffer_Release(view);
+        PyErr_SetString(PyExc_TypeError, "Expected a one-dimensional array of 64-bit integers!");
+        return -1;
+    }
+    if ((uintptr_t) view->buf % 8)
+    {
+        PyBuffer_Release(view);
+        PyErr_SetString(PyExc_ValueError, "The array of 64-bit integers must be aligned to 8 bytes!");
+        return -1;
+    }
+    return view->len / 8;
+}
+
+PyObject *
+KeyBuffer_new_results(Py_ssize_t length, Py_buffer *view)
+{
+    PyObject * module = PyImport_ImportModule("array");
+    if (!module)
+        return NULL;
+
+    #if PY_MAJOR_VERSION >= 3
+    PyObject * zero = PyObject_CallMethod(module, "array", "s(i)", "q", 0);
+    #else
+    PyObject * zero = PyObject_CallMethod(module, "array", "s(i)", "l", 0);
+    #endif
+    Py_DECREF(module);
+    if (!zero)
+        return NULL;
+
+    PyObject * result = PySequence_Repeat(zero, length);
+    Py_DECREF(zero);
+    if (!result)
+        return NULL;
+
+    if (PyObject_GetBuffer(result, view, PyBUF_WRITABLE))
+    {
+        Py_DECREF(result);
+        return NULL;
+    }
+    return result;
+}
+
+int
+KeyNGrams_init(KeyNGrams *self, KeyBuffer *keys, int n, const char *sep, Py_ssize_t sep_length, char terminate)
+{
+    self->keys = keys;
+    self->n = n;
+    self->sep = sep;
+    self->sep_length = sep_length;
+    self->terminate = terminate;
+    self->next = 0;
+    self->slot_size = keys->max_length + 1;
+    self->max_length = n * keys->max_length + (n - 1) * sep_length;
+
+    self->scratch = malloc(n * self->slot_size);
+    self->tokens = malloc(n * sizeof(char *));
+    self->lengths = malloc(n * sizeof(Py_ssize_t));
+    if (!self->scratch || !self->tokens || !self->lengths)
+    {
+        KeyNGrams_release(self);
+        PyErr_NoMemory();
+        return -1;
+    }
+    return 0;
+}
+
+void
+KeyNGrams_release(KeyNGrams *self)
+{
+    free(self->scratch);
+    free(self->tokens);
+    free(self->lengths);
+    self->scratch = NULL;
+    self->tokens = NULL;
+    self->lengths = NULL;
+}
+
+char *
+KeyNGrams_next(KeyNGrams *self, char *target, Py_ssize_t *length, int *error)
+{
+    Py_ssize_t i;
+    while (self->next < self->keys->length)
+    {
+        // the key replaces the oldest one of the window
+        int slot = self->next % self->n;
+        self->tokens[slot] = KeyBuffer_get(self->keys, self->next, &self->lengths[slot],
+                                           self->scratch + slot * self->slot_size, self->terminate, error);
+        if (!self->tokens[slot])
+            return NULL;
+        self->next++;
+        if (self->next < self->n)
+            continue;
+
+        char * position = target;
+        for (i = self->next - self->n; i < self->next; i++)
+        {
+            slot = i % self->n;
+            if (i > self->next - self->n)
+            {
+                memcpy(position, self->sep, self->sep_length);
+                position += self->sep_length;
+            }
+            memcpy(position, self->tokens[slot], self->lengths[slot]);
+            position += self->lengths[slot];
+        }
+        if (self->terminate)
+            *position = 0;
+        *length = position - target;
+        return target;
+    }
+    return NULL;
+}
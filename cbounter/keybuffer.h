@@ -0,0 +1,122 @@
+//-----------------------------------------------------------------------------
+// Author: Filip Stefanak <f.stefanak@rare-technologies.com>
+// Copyright (C) 2017 Rare Technologies
+//
+// This code is distributed under the terms and conditions
+// from the MIT License (MIT).
+
+#ifndef KEYBUFFER_H
+#define KEYBUFFER_H
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+
+/* Variable-length UTF-8 keys in one buffer, delimited by a second buffer of int32 or int64 offsets (Arrow). */
+#define KEYS_OFFSETS 1
+/* Fixed-width keys of bytes padded with zeros (NumPy `S`). */
+#define KEYS_FIXED 2
+/* Fixed-width keys of UCS4 code points padded with zeros (NumPy `U`). */
+#define KEYS_UCS4 3
+/* A list or tuple of unicode or bytes objects. */
+#define KEYS_SEQUENCE 4
+
+/* Errors reported by KeyBuffer_get */
+#define KEYS_ERROR_CODE_POINT 1
+#define KEYS_ERROR_NULL_BYTE 2
+
+/**
+  * A batch of keys read directly out of objects supporting the buffer protocol.
+  * Once initialized, the keys can be read without holding the GIL.
+  */
+typedef struct {
+    char kind;
+    char swap; // fixed-width UCS4 keys in a foreign byte order
+    char offset_size;
+    Py_ssize_t length; // number of keys
+    Py_ssize_t key_size; // fixed width of a key in bytes
+    Py_ssize_t max_length; // upper bound of the length of a key encoded in UTF-8
+    Py_buffer data;
+    Py_buffer offsets;
+    char has_data;
+    char has_offsets;
+    PyObject * sequence; // holds references to the keys of a sequence
+    PyObject * encoded; // keeps alive UTF-8 encodings of the keys which are not cached by the interpreter
+    char ** pointers;
+    Py_ssize_t * lengths;
+} KeyBuffer;
+
+/**
+  * Acquires buffers of a key batch: either a values buffer with offsets, a fixed-width string array,
+  * or a list or tuple of keys (with `offsets` NULL or None).
+  * Returns 0 on success, -1 with a Python exception set otherwise.
+  */
+int KeyBuffer_init(KeyBuffer *self, PyObject *data, PyObject *offsets);
+
+/* Releases the buffers of the batch. Requires the GIL. */
+void KeyBuffer_release(KeyBuffer *self);
+
+/**
+  * Returns the UTF-8 representation of the key at `index` and stores its length to `length`.
+  * The result either points inside the buffer, or into `scratch`, which must hold at least `max_length + 1` bytes.
+  * If `terminate` is set, the result is always followed by a null byte (it is copied into `scratch` if necessary)
+  * and keys containing a null byte are reported as an error.
+  * Returns NULL and stores one of KEYS_ERROR_* into `error` if the key can not be decoded.
+  * Does not require the GIL.
+  */
+char * KeyBuffer_get(KeyBuffer *self, Py_ssize_t index, Py_ssize_t *length, char *scratch, char terminate, int *error);
+
+/* Raises a Python exception for an error reported by KeyBuffer_get. */
+void KeyBuffer_set_error(int error);
+
+/**
+  * Acquires a one-dimensional C-contiguous array of 64-bit integers, signed or unsigned, into `view`,
+  * such as an array.array('Q'), a NumPy int64 or uint64 array, or a raw buffer of a multiple of 8 bytes.
+  * Returns the number of integers on success, -1 with a Python exception set otherwise.
+  * The caller must release the view.
+  */
+Py_ssize_t KeyBuffer_get_int64(PyObject *obj, Py_buffer *view);
+
+/**
+  * Creates a new zeroed array.array of `length` 64-bit integers for the results of a batch
+  * and acquires its buffer into `view`, so that it can be filled without the GIL.
+  * The caller must release the view. Returns NULL with a Python exception set on failure.
+  */
+PyObject * KeyBuffer_new_results(Py_ssize_t length, Py_buffer *view);
+
+/**
+  * Sliding windows of `n` consecutive keys of a batch, joined by a separator.
+  * The last `n` keys are kept decoded, so that every key of the batch is read only once.
+  */
+typedef struct {
+    KeyBuffer * keys;
+    int n;
+    const char * sep;
+    Py_ssize_t sep_length;
+    char terminate;
+    Py_ssize_t next; // index of the next key to be read
+    Py_ssize_t slot_size;
+    char * scratch; // a slot of `slot_size` bytes for each of the last `n` keys
+    char ** tokens;
+    Py_ssize_t * lengths;
+    Py_ssize_t max_length; // upper bound of the length of a joined n-gram
+} KeyNGrams;
+
+/**
+  * Prepares reading n-grams of the keys of an initialized batch, joined by `sep` of `sep_length` bytes,
+  * which must stay valid while reading. With `terminate` set, the keys are read as by KeyBuffer_get.
+  * Returns 0 on success, -1 with a Python exception set otherwise.
+  */
+int KeyNGrams_init(KeyNGrams *self, KeyBuffer *keys, int n, const char *sep, Py_ssize_t sep_length, char terminate);
+
+/* Releases the scratch space of the n-grams, not the batch itself. */
+void KeyNGrams_release(KeyNGrams *self);
+
+/**
+  * Joins the next n-gram into `target`, which must hold at least `max_length + 1` bytes, and stores its length
+  * to `length`. With `terminate` set, the n-gram is followed by a null byte.
+  * Returns NULL when there are no more n-grams, or if a key can not be decoded, with one of KEYS_ERROR_* stored
+  * into `error` in that case. Does not require the GIL.
+  */
+char * KeyNGrams_next(KeyNGrams *self, char *target, Py_ssize_t *length, int *error);
+
+#endif
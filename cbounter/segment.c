@@ -0,0 +1,113 @@
+//-----------------------------------------------------------------------------
+// Author: Filip Stefanak <f.stefanak@rare-technologies.com>
+// Copyright (C) 2017 Rare Technologies
+//
+// This code is distributed under the terms and conditions
+// from the MIT License (MIT).
+
+#include "segment.h"
+#include <stdint.h>
+
+#ifdef SEGMENT_PICKLE_BUFFER
+
+/* A piece of memory of another object exposed through the buffer protocol. */
+typedef struct {
+    PyObject_HEAD
+    PyObject * owner;
+    void * buf;
+    Py_ssize_t length;
+    int readonly;
+} Segment;
+
+static void
+Segment_dealloc(Segment *self)
+{
+    Py_XDECREF(self->owner);
+    Py_TYPE(self)->tp_free((PyObject *) self);
+}
+
+static int
+Segment_getbuffer(Segment *self, Py_buffer *view, int flags)
+{
+    return PyBuffer_FillInfo(view, (PyObject *) self, self->buf, self->length, self->readonly, flags);
+}
+
+static PyBufferProcs Segment_as_buffer = {
+    (getbufferproc) Segment_getbuffer,
+    NULL,
+};
+
+static PyTypeObject SegmentType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "bounter.Segment",               /* tp_name */
+    sizeof(Segment),                 /* tp_basicsize */
+    0,                               /* tp_itemsize */
+    (destructor) Segment_dealloc,    /* tp_dealloc */
+    0,                               /* tp_print */
+    0,                               /* tp_getattr */
+    0,                               /* tp_setattr */
+    0,                               /* tp_compare */
+    0,                               /* tp_repr */
+    0,                               /* tp_as_number */
+    0,                               /* tp_as_sequence */
+    0,                               /* tp_as_mapping */
+    0,                               /* tp_hash */
+    0,                               /* tp_call */
+    0,                               /* tp_str */
+    0,                               /* tp_getattro */
+    0,                               /* tp_setattro */
+    &Segment_as_buffer,              /* tp_as_buffer */
+    Py_TPFLAGS_DEFAULT,              /* tp_flags */
+    "Memory of a bounter structure", /* tp_doc */
+};
+
+PyObject *
+Segment_pickle_buffer(PyObject *owner, void *buf, Py_ssize_t length, int readonly)
+{
+    if (!(SegmentType.tp_flags & Py_TPFLAGS_READY) && PyType_Ready(&SegmentType) < 0)
+        return NULL;
+
+    Segment * segment = PyObject_New(Segment, &SegmentType);
+    if (!segment)
+        return NULL;
+    Py_INCREF(owner);
+    segment->owner = owner;
+    segment->buf = buf;
+    segment->length = length;
+    segment->readonly = readonly;
+
+    PyObject * result = PyPickleBuffer_FromObject((PyObject *) segment);
+    Py_DECREF(segment);
+    return result;
+}
+
+#endif
+
+int
+Segment_get_state_buffer(PyObject *obj, Py_buffer *view, Py_ssize_t length, size_t alignment)
+{
+    int writable = 1;
+    if (PyObject_GetBuffer(obj, view, PyBUF_WRITABLE))
+    {
+        PyErr_Clear();
+        writable = 0;
+        if (PyObject_GetBuffer(obj, view, PyBUF_SIMPLE))
+            return -1;
+    }
+    #ifdef SEGMENT_PICKLE_BUFFER
+    // memory of a structure living in this process, handed over by pickle.loads with the buffers of pickle.dumps
+    PyObject * exporter = view->obj;
+    while (exporter && PyMemoryView_Check(exporter))
+        exporter = PyMemoryView_GET_BUFFER(exporter)->obj;
+    if (exporter && Py_TYPE(exporter) == &SegmentType)
+        writable = 0;
+    #endif
+    if (view->len != length || !PyBuffer_IsContiguous(view, 'C'))
+    {
+        PyBuffer_Release(view);
+        char * msg = "Pickled state does not match the size of the structure!";
+        PyErr_SetString(PyExc_ValueError, msg);
+        return -1;
+    }
+    return writable && ((uintptr_t) view->buf % alignment == 0);
+}
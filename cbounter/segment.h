@@ -0,0 +1,36 @@
+//-----------------------------------------------------------------------------
+// Author: Filip Stefanak <f.stefanak@rare-technologies.com>
+// Copyright (C) 2017 Rare Technologies
+//
+// This code is distributed under the terms and conditions
+// from the MIT License (MIT).
+
+#ifndef SEGMENT_H
+#define SEGMENT_H
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+
+/* pickle.PickleBuffer and out-of-band buffers of pickle protocol 5 are available since Python 3.8 */
+#if PY_VERSION_HEX >= 0x03080000
+#define SEGMENT_PICKLE_BUFFER
+
+/**
+  * Wraps `length` bytes of memory at `buf` into a pickle.PickleBuffer, without copying.
+  * The memory belongs to `owner`, which is kept alive as long as the buffer is referenced.
+  * Returns NULL with a Python exception set on failure.
+  */
+PyObject * Segment_pickle_buffer(PyObject *owner, void *buf, Py_ssize_t length, int readonly);
+#endif
+
+/**
+  * Acquires the buffer of an object from an unpickled state (bytearray, bytes, PickleBuffer...) into `view`.
+  * The buffer must be contiguous and exactly `length` bytes long.
+  * Returns 1 if the buffer is writable and aligned to `alignment` bytes, so that it can be used in place,
+  * 0 if it must be copied, and -1 with a Python exception set on failure. The caller must release the view,
+  * which keeps the exporter of the buffer alive.
+  * Buffers exported by Segment_pickle_buffer are always copied, as they belong to another live structure.
+  */
+int Segment_get_state_buffer(PyObject *obj, Py_buffer *view, Py_ssize_t length, size_t alignment);
+
+#endif
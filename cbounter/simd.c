@@ -0,0 +1,398 @@
+//-----------------------------------------------------------------------------
+// Author: Filip Stefanak <f.stefanak@rare-technologies.com>
+// Copyright (C) 2017 Rare Technologies
+//
+// This code is distributed under the terms and conditions
+// from the MIT License (MIT).
+
+#include "simd.h"
+#include <stdlib.h>
+#include <string.h>
+
+#define SIMD_SCALAR 0
+#define SIMD_SSE2 1
+#define SIMD_AVX2 2
+
+// SSE2 is a part of every x86-64 CPU, AVX2 is detected at runtime
+#if defined(__x86_64__) || defined(_M_X64)
+#define SIMD_HAVE_SSE2
+#include <emmintrin.h>
+#if defined(__GNUC__) || defined(__clang__)
+#define SIMD_HAVE_AVX2
+#include <immintrin.h>
+#define SIMD_TARGET_AVX2 __attribute__((target("avx2")))
+#endif
+#endif
+
+static int simd_level = -1;
+
+static int
+Simd_detect(void)
+{
+    int level = SIMD_SCALAR;
+    #ifdef SIMD_HAVE_SSE2
+    level = SIMD_SSE2;
+    #endif
+    #ifdef SIMD_HAVE_AVX2
+    __builtin_cpu_init();
+    if (__builtin_cpu_supports("avx2"))
+        level = SIMD_AVX2;
+    #endif
+
+    const char * limit = getenv("BOUNTER_SIMD");
+    if (limit && !strcmp(limit, "scalar"))
+        level = SIMD_SCALAR;
+    else if (limit && !strcmp(limit, "sse2") && level > SIMD_SSE2)
+        level = SIMD_SSE2;
+    return level;
+}
+
+static inline int
+Simd_get_level(void)
+{
+    if (simd_level < 0)
+        simd_level = Simd_detect();
+    return simd_level;
+}
+
+const char *
+Simd_level(void)
+{
+    switch (Simd_get_level())
+    {
+        case SIMD_AVX2:
+            return "avx2";
+        case SIMD_SSE2:
+            return "sse2";
+    }
+    return "scalar";
+}
+
+static inline unsigned int
+Simd_popcount(uint32_t x)
+{
+    #if defined(__GNUC__) || defined(__clang__)
+    return __builtin_popcount(x);
+    #else
+    x = x - ((x >> 1) & 0x55555555);
+    x = (x & 0x33333333) + ((x >> 2) & 0x33333333);
+    return (((x + (x >> 4)) & 0x0F0F0F0F) * 0x01010101) >> 24;
+    #endif
+}
+
+/* Scalar kernels, also used for the tails of the vectorized ones. */
+
+static void
+Simd_add_u32_scalar(uint32_t *dst, const uint32_t *src, size_t count, int saturate)
+{
+    size_t i;
+    if (saturate)
+    {
+        for (i = 0; i < count; i++)
+        {
+            uint32_t sum = dst[i] + src[i];
+            dst[i] = sum < src[i] ? UINT32_MAX : sum;
+        }
+    }
+    else
+    {
+        for (i = 0; i < count; i++)
+            dst[i] += src[i];
+    }
+}
+
+static void
+Simd_add_u64_scalar(uint64_t *dst, const uint64_t *src, size_t count, int saturate)
+{
+    size_t i;
+    if (saturate)
+    {
+        for (i = 0; i < count; i++)
+        {
+            uint64_t sum = dst[i] + src[i];
+            dst[i] = sum < src[i] ? UINT64_MAX : sum;
+        }
+    }
+    else
+    {
+        for (i = 0; i < count; i++)
+            dst[i] += src[i];
+    }
+}
+
+static void
+Simd_max_u8_scalar(uint8_t *dst, const uint8_t *src, size_t count)
+{
+    size_t i;
+    for (i = 0; i < count; i++)
+        if (src[i] > dst[i])
+            dst[i] = src[i];
+}
+
+static size_t
+Simd_count_equal_scalar(const void *data, size_t count, int cell_size, int ones)
+{
+    size_t i, result = 0;
+    switch (cell_size)
+    {
+        case 1:
+            for (i = 0; i < count; i++)
+                result += ((const uint8_t *) data)[i] == (ones ? UINT8_MAX : 0);
+            break;
+        case 2:
+            for (i = 0; i < count; i++)
+                result += ((const uint16_t *) data)[i] == (ones ? UINT16_MAX : 0);
+            break;
+        case 4:
+            for (i = 0; i < count; i++)
+                result += ((const uint32_t *) data)[i] == (ones ? UINT32_MAX : 0);
+            break;
+        case 8:
+            for (i = 0; i < count; i++)
+                result += ((const uint64_t *) data)[i] == (ones ? UINT64_MAX : 0);
+            break;
+    }
+    return result;
+}
+
+#ifdef SIMD_HAVE_SSE2
+
+static void
+Simd_add_u32_sse2(uint32_t *dst, const uint32_t *src, size_t count, int saturate)
+{
+    size_t i = 0;
+    // unsigned comparison by comparing with flipped sign bits
+    const __m128i sign = _mm_set1_epi32((int) 0x80000000);
+    for (; i + 4 <= count; i += 4)
+    {
+        __m128i a = _mm_loadu_si128((const __m128i *) (dst + i));
+        __m128i b = _mm_loadu_si128((const __m128i *) (src + i));
+        __m128i sum = _mm_add_epi32(a, b);
+        if (saturate)
+            sum = _mm_or_si128(sum, _mm_cmpgt_epi32(_mm_xor_si128(b, sign), _mm_xor_si128(sum, sign)));
+        _mm_storeu_si128((__m128i *) (dst + i), sum);
+    }
+    Simd_add_u32_scalar(dst + i, src + i, count - i, saturate);
+}
+
+static void
+Simd_add_u64_sse2(uint64_t *dst, const uint64_t *src, size_t count, int saturate)
+{
+    size_t i = 0;
+    // SSE2 can not compare 64-bit integers
+    if (!saturate)
+    {
+        for (; i + 2 <= count; i += 2)
+        {
+            __m128i a = _mm_loadu_si128((const __m128i *) (dst + i));
+            __m128i b = _mm_loadu_si128((const __m128i *) (src + i));
+            _mm_storeu_si128((__m128i *) (dst + i), _mm_add_epi64(a, b));
+        }
+    }
+    Simd_add_u64_scalar(dst + i, src + i, count - i, saturate);
+}
+
+static void
+Simd_max_u8_sse2(uint8_t *dst, const uint8_t *src, size_t count)
+{
+    size_t i = 0;
+    for (; i + 16 <= count; i += 16)
+    {
+        __m128i a = _mm_loadu_si128((const __m128i *) (dst + i));
+        __m128i b = _mm_loadu_si128((const __m128i *) (src + i));
+        _mm_storeu_si128((__m128i *) (dst + i), _mm_max_epu8(a, b));
+    }
+    Simd_max_u8_scalar(dst + i, src + i, count - i);
+}
+
+static size_t
+Simd_count_equal_sse2(const void *data, size_t count, int cell_size, int ones)
+{
+    const char * bytes = (const char *) data;
+    size_t length = count * cell_size;
+    size_t i = 0, equal_bytes = 0;
+    const __m128i target = ones ? _mm_set1_epi32(-1) : _mm_setzero_si128();
+    for (; i + 16 <= length; i += 16)
+    {
+        __m128i v = _mm_loadu_si128((const __m128i *) (bytes + i));
+        __m128i equal;
+        switch (cell_size)
+        {
+            case 1:
+                equal = _mm_cmpeq_epi8(v, target);
+                break;
+            case 2:
+                equal = _mm_cmpeq_epi16(v, target);
+                break;
+            case 4:
+                equal = _mm_cmpeq_epi32(v, target);
+                break;
+            default:
+                // a 64-bit cell is equal when both of its halves are
+                equal = _mm_cmpeq_epi32(v, target);
+                equal = _mm_and_si128(equal, _mm_shuffle_epi32(equal, _MM_SHUFFLE(2, 3, 0, 1)));
+        }
+        equal_bytes += Simd_popcount(_mm_movemask_epi8(equal));
+    }
+    return equal_bytes / cell_size + Simd_count_equal_scalar(bytes + i, (length - i) / cell_size, cell_size, ones);
+}
+
+#endif
+
+#ifdef SIMD_HAVE_AVX2
+
+SIMD_TARGET_AVX2 static void
+Simd_add_u32_avx2(uint32_t *dst, const uint32_t *src, size_t count, int saturate)
+{
+    size_t i = 0;
+    for (; i + 8 <= count; i += 8)
+    {
+        __m256i a = _mm256_loadu_si256((const __m256i *) (dst + i));
+        __m256i b = _mm256_loadu_si256((const __m256i *) (src + i));
+        __m256i sum = _mm256_add_epi32(a, b);
+        if (saturate)
+        {
+            // the sum wrapped around iff it is smaller than the addend
+            __m256i not_wrapped = _mm256_cmpeq_epi32(_mm256_max_epu32(sum, b), sum);
+            sum = _mm256_or_si256(sum, _mm256_xor_si256(not_wrapped, _mm256_set1_epi32(-1)));
+        }
+        _mm256_storeu_si256((__m256i *) (dst + i), sum);
+    }
+    Simd_add_u32_scalar(dst + i, src + i, count - i, saturate);
+}
+
+SIMD_TARGET_AVX2 static void
+Simd_add_u64_avx2(uint64_t *dst, const uint64_t *src, size_t count, int saturate)
+{
+    size_t i = 0;
+    const __m256i sign = _mm256_set1_epi64x((long long) 0x8000000000000000ULL);
+    for (; i + 4 <= count; i += 4)
+    {
+        __m256i a = _mm256_loadu_si256((const __m256i *) (dst + i));
+        __m256i b = _mm256_loadu_si256((const __m256i *) (src + i));
+        __m256i sum = _mm256_add_epi64(a, b);
+        if (saturate)
+            sum = _mm256_or_si256(sum, _mm256_cmpgt_epi64(_mm256_xor_si256(b, sign), _mm256_xor_si256(sum, sign)));
+        _mm256_storeu_si256((__m256i *) (dst + i), sum);
+    }
+    Simd_add_u64_scalar(dst + i, src + i, count - i, saturate);
+}
+
+SIMD_TARGET_AVX2 static void
+Simd_max_u8_avx2(uint8_t *dst, const uint8_t *src, size_t count)
+{
+    size_t i = 0;
+    for (; i + 32 <= count; i += 32)
+    {
+        __m256i a = _mm256_loadu_si256((const __m256i *) (dst + i));
+        __m256i b = _mm256_loadu_si256((const __m256i *) (src + i));
+        _mm256_storeu_si256((__m256i *) (dst + i), _mm256_max_epu8(a, b));
+    }
+    Simd_max_u8_scalar(dst + i, src + i, count - i);
+}
+
+SIMD_TARGET_AVX2 static size_t
+Simd_count_equal_avx2(const void *data, size_t count, int cell_size, int ones)
+{
+    const char * bytes = (const char *) data;
+    size_t length = count * cell_size;
+    size_t i = 0, equal_bytes = 0;
+    const __m256i target = ones ? _mm256_set1_epi32(-1) : _mm256_setzero_si256();
+    for (; i + 32 <= length; i += 32)
+    {
+        __m256i v = _mm256_loadu_si256((const __m256i *) (bytes + i));
+        __m256i equal;
+        switch (cell_size)
+        {
+            case 1:
+                equal = _mm256_cmpeq_epi8(v, target);
+                break;
+            case 2:
+                equal = _mm256_cmpeq_epi16(v, target);
+                break;
+            case 4:
+                equal = _mm256_cmpeq_epi32(v, target);
+                break;
+            default:
+                equal = _mm256_cmpeq_epi64(v, target);
+        }
+        equal_bytes += Simd_popcount((uint32_t) _mm256_movemask_epi8(equal));
+    }
+    return equal_bytes / cell_size + Simd_count_equal_scalar(bytes + i, (length - i) / cell_size, cell_size, ones);
+}
+
+#endif
+
+void
+Simd_add_u32(uint32_t *dst, const uint32_t *src, size_t count, int saturate)
+{
+    switch (Simd_get_level())
+    {
+        #ifdef SIMD_HAVE_AVX2
+        case SIMD_AVX2:
+            Simd_add_u32_avx2(dst, src, count, saturate);
+            return;
+        #endif
+        #ifdef SIMD_HAVE_SSE2
+        case SIMD_SSE2:
+            Simd_add_u32_sse2(dst, src, count, saturate);
+            return;
+        #endif
+    }
+    Simd_add_u32_scalar(dst, src, count, saturate);
+}
+
+void
+Simd_add_u64(uint64_t *dst, const uint64_t *src, size_t count, int saturate)
+{
+    switch (Simd_get_level())
+    {
+        #ifdef SIMD_HAVE_AVX2
+        case SIMD_AVX2:
+            Simd_add_u64_avx2(dst, src, count, saturate);
+            return;
+        #endif
+        #ifdef SIMD_HAVE_SSE2
+        case SIMD_SSE2:
+            Simd_add_u64_sse2(dst, src, count, saturate);
+            return;
+        #endif
+    }
+    Simd_add_u64_scalar(dst, src, count, saturate);
+}
+
+void
+Simd_max_u8(uint8_t *dst, const uint8_t *src, size_t count)
+{
+    switch (Simd_get_level())
+    {
+        #ifdef SIMD_HAVE_AVX2
+        case SIMD_AVX2:
+            Simd_max_u8_avx2(dst, src, count);
+            return;
+        #endif
+        #ifdef SIMD_HAVE_SSE2
+        case SIMD_SSE2:
+            Simd_max_u8_sse2(dst, src, count);
+            return;
+        #endif
+    }
+    Simd_max_u8_scalar(dst, src, count);
+}
+
+size_t
+Simd_count_equal(const void *data, size_t count, int cell_size, int ones)
+{
+    switch (Simd_get_level())
+    {
+        #ifdef SIMD_HAVE_AVX2
+        case SIMD_AVX2:
+            return Simd_count_equal_avx2(data, count, cell_size, ones);
+        #endif
+        #ifdef SIMD_HAVE_SSE2
+        case SIMD_SSE2:
+            return Simd_count_equal_sse2(data, count, cell_size, ones);
+        #endif
+    }
+    return Simd_count_equal_scalar(data, count, cell_size, ones);
+}
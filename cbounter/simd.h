@@ -0,0 +1,35 @@
+//-----------------------------------------------------------------------------
+// Author: Filip Stefanak <f.stefanak@rare-technologies.com>
+// Copyright (C) 2017 Rare Technologies
+//
+// This code is distributed under the terms and conditions
+// from the MIT License (MIT).
+
+#ifndef SIMD_H
+#define SIMD_H
+
+#include <stddef.h>
+#include <stdint.h>
+
+/**
+  * Vectorized kernels over whole tables. The instruction set (AVX2, SSE2 or plain C) is selected at runtime
+  * by the capabilities of the CPU. Setting the environment variable BOUNTER_SIMD to "avx2", "sse2" or "scalar"
+  * before the first call limits the selection.
+  */
+
+/* dst[i] += src[i], clamping the sums at UINT32_MAX if `saturate` is set. */
+void Simd_add_u32(uint32_t *dst, const uint32_t *src, size_t count, int saturate);
+
+/* dst[i] += src[i], clamping the sums at UINT64_MAX if `saturate` is set. */
+void Simd_add_u64(uint64_t *dst, const uint64_t *src, size_t count, int saturate);
+
+/* dst[i] = max(dst[i], src[i]) */
+void Simd_max_u8(uint8_t *dst, const uint8_t *src, size_t count);
+
+/* Counts the cells of `cell_size` bytes (1, 2, 4 or 8) which are zero, or which have all bits set if `ones` is set. */
+size_t Simd_count_equal(const void *data, size_t count, int cell_size, int ones);
+
+/* Name of the selected instruction set. */
+const char * Simd_level(void);
+
+#endif
@@ -0,0 +1,100 @@
+//-----------------------------------------------------------------------------
+// Author: Filip Stefanak <f.stefanak@rare-technologies.com>
+// Copyright (C) 2017 Rare Technologies
+//
+// This code is distributed under the terms and conditions
+// from the MIT License (MIT).
+
+#include "threads.h"
+#include <stdlib.h>
+
+#ifdef _WIN32
+#include <windows.h>
+#include <process.h>
+typedef HANDLE thread_t;
+#else
+#include <pthread.h>
+typedef pthread_t thread_t;
+#endif
+
+typedef struct {
+    ThreadTask task;
+    void * arg;
+} ThreadStart;
+
+#ifdef _WIN32
+static unsigned __stdcall
+Threads_main(void *start)
+{
+    ((ThreadStart *) start)->task(((ThreadStart *) start)->arg);
+    return 0;
+}
+#else
+static void *
+Threads_main(void *start)
+{
+    ((ThreadStart *) start)->task(((ThreadStart *) start)->arg);
+    return NULL;
+}
+#endif
+
+/* Starts a thread, returns 0 on success. */
+static int
+Threads_start(thread_t *thread, ThreadStart *start)
+{
+    #ifdef _WIN32
+    *thread = (HANDLE) _beginthreadex(NULL, 0, Threads_main, start, 0, NULL);
+    return *thread == 0;
+    #else
+    return pthread_create(thread, NULL, Threads_main, start);
+    #endif
+}
+
+static void
+Threads_join(thread_t thread)
+{
+    #ifdef _WIN32
+    WaitForSingleObject(thread, INFINITE);
+    CloseHandle(thread);
+    #else
+    pthread_join(thread, NULL);
+    #endif
+}
+
+void
+Threads_run(ThreadTask task, void *args, size_t arg_size, int count)
+{
+    int i;
+    thread_t * threads = NULL;
+    ThreadStart * starts = NULL;
+    char * started = NULL;
+    if (count > 1)
+    {
+        threads = (thread_t *) malloc(count * sizeof(thread_t));
+        starts = (ThreadStart *) malloc(count * sizeof(ThreadStart));
+        started = (char *) calloc(count, 1);
+    }
+
+    if (threads && starts && started)
+    {
+        for (i = 1; i < count; i++)
+        {
+            starts[i].task = task;
+            starts[i].arg = (char *) args + i * arg_size;
+            started[i] = !Threads_start(&threads[i], &starts[i]);
+        }
+    }
+
+    task(args);
+    for (i = 1; i < count; i++)
+    {
+        if (started && started[i])
+            Threads_join(threads[i]);
+        else
+            task((char *) args + i * arg_size);
+    }
+
+    free(threads);
+    free(starts);
+    free(started);
+}
@@ -0,0 +1,23 @@
+//-----------------------------------------------------------------------------
+// Author: Filip Stefanak <f.stefanak@rare-technologies.com>
+// Copyright (C) 2017 Rare Technologies
+//
+// This code is distributed under the terms and conditions
+// from the MIT License (MIT).
+
+#ifndef THREADS_H
+#define THREADS_H
+
+#include <stddef.h>
+
+typedef void (*ThreadTask)(void *arg);
+
+/**
+  * Runs `task` on each of `count` arguments stored one after another in `args`, every one of them
+  * `arg_size` bytes long, on native threads, and waits until all of them are finished.
+  * The first argument is processed by the calling thread. If a thread can not be started, its argument
+  * is processed by the calling thread as well. Does not use the Python API, so it can be called without the GIL.
+  */
+void Threads_run(ThreadTask task, void *args, size_t arg_size, int count);
+
+#endif
@@ -0,0 +1,250 @@
+//-----------------------------------------------------------------------------
+// Author: Filip Stefanak <f.stefanak@rare-technologies.com>
+// Copyright (C) 2017 Rare Technologies
+//
+// This code is distributed under the terms and conditions
+// from the MIT License (MIT).
+
+#include "topk.h"
+#include <stdlib.h>
+#include <string.h>
+
+int
+TopK_init(TopK *self, uint32_t capacity)
+{
+    uint32_t index_size = 2;
+    while (index_size < 2 * (uint64_t) capacity)
+        index_size <<= 1;
+
+    self->capacity = capacity;
+    self->size = 0;
+    self->lock = 0;
+    self->index_mask = index_size - 1;
+    self->heap = (TopKEntry *) malloc(capacity * sizeof(TopKEntry));
+    self->index = (int32_t *) malloc(index_size * sizeof(int32_t));
+    if (!self->heap || !self->index)
+    {
+        free(self->heap);
+        free(self->index);
+        self->heap = NULL;
+        self->index = NULL;
+        self->capacity = 0;
+        return -1;
+    }
+    memset(self->index, -1, index_size * sizeof(int32_t));
+    return 0;
+}
+
+void
+TopK_dealloc(TopK *self)
+{
+    TopK_clear(self);
+    free(self->heap);
+    free(self->index);
+}
+
+void
+TopK_clear(TopK *self)
+{
+    uint32_t i;
+    for (i = 0; i < self->size; i++)
+        free(self->heap[i].key);
+    self->size = 0;
+    if (self->index)
+        memset(self->index, -1, (self->index_mask + 1) * sizeof(int32_t));
+}
+
+/* Returns the slot of the index holding the key, or the empty slot where it belongs. */
+static uint32_t
+TopK_find(TopK *self, const char *key, size_t length, uint32_t hash)
+{
+    uint32_t slot = hash & self->index_mask;
+    while (self->index[slot] >= 0)
+    {
+        TopKEntry * entry = &self->heap[self->index[slot]];
+        if (entry->hash == hash && entry->length == length && !memcmp(entry->key, key, length))
+            break;
+        slot = (slot + 1) & self->index_mask;
+    }
+    return slot;
+}
+
+/* Removes a slot from the index, shifting back the following slots of the same cluster (linear probing). */
+static void
+TopK_remove_slot(TopK *self, uint32_t slot)
+{
+    uint32_t next = slot;
+    for (;;)
+    {
+        next = (next + 1) & self->index_mask;
+        if (self->index[next] < 0)
+            break;
+        uint32_t home = self->heap[self->index[next]].hash & self->index_mask;
+        // entries whose home lies cyclically within (slot, next] stay in place
+        if (slot <= next ? (slot < home && home <= next) : (slot < home || home <= next))
+            continue;
+        self->index[slot] = self->index[next];
+        self->heap[self->index[slot]].slot = slot;
+        slot = next;
+    }
+    self->index[slot] = -1;
+}
+
+/* Places the entry at heap position `i`, keeping its index slot pointing to it. */
+static inline void
+TopK_place(TopK *self, uint32_t i, TopKEntry *entry)
+{
+    self->heap[i] = *entry;
+    self->index[entry->slot] = i;
+}
+
+static void
+TopK_sift_up(TopK *self, uint32_t i)
+{
+    TopKEntry entry = self->heap[i];
+    while (i > 0)
+    {
+        uint32_t parent = (i - 1) / 2;
+        if (self->heap[parent].count <= entry.count)
+            break;
+        TopK_place(self, i, &self->heap[parent]);
+        i = parent;
+    }
+    TopK_place(self, i, &entry);
+}
+
+static void
+TopK_sift_down(TopK *self, uint32_t i)
+{
+    TopKEntry entry = self->heap[i];
+    for (;;)
+    {
+        uint32_t child = 2 * i + 1;
+        if (child >= self->size)
+            break;
+        if (child + 1 < self->size && self->heap[child + 1].count < self->heap[child].count)
+            child++;
+        if (entry.count <= self->heap[child].count)
+            break;
+        TopK_place(self, i, &self->heap[child]);
+        i = child;
+    }
+    TopK_place(self, i, &entry);
+}
+
+int
+TopK_offer(TopK *self, const char *key, size_t length, uint32_t hash, long long count)
+{
+    if (!self->capacity)
+        return 0;
+
+    uint32_t slot = TopK_find(self, key, length, hash);
+    if (self->index[slot] >= 0)
+    {
+        uint32_t i = self->index[slot];
+        if (count > self->heap[i].count)
+        {
+            self->heap[i].count = count;
+            TopK_sift_down(self, i);
+        }
+        return 0;
+    }
+
+    uint32_t i;
+    if (self->size < self->capacity)
+        i = self->size;
+    else if (count > self->heap[0].count)
+        i = 0;
+    else
+        return 0;
+
+    char * copy = (char *) malloc(length ? length : 1);
+    if (!copy)
+        return -1;
+    memcpy(copy, key, length);
+
+    if (i == 0 && self->size == self->capacity)
+    {
+        // evict the lowest count, which may move the slot of the new key
+        free(self->heap[0].key);
+        TopK_remove_slot(self, self->heap[0].slot);
+        slot = TopK_find(self, key, length, hash);
+    }
+    else
+        self->size++;
+
+    TopKEntry entry = {copy, length, hash, slot, count};
+    TopK_place(self, i, &entry);
+    if (i == 0)
+        TopK_sift_down(self, 0);
+    else
+        TopK_sift_up(self, i);
+    return 0;
+}
+
+void
+TopK_set_count(TopK *self, uint32_t i, long long count)
+{
+    self->heap[i].count = count;
+}
+
+void
+TopK_heapify(TopK *self)
+{
+    uint32_t i;
+    for (i = self->size / 2; i > 0; i--)
+        TopK_sift_down(self, i - 1);
+}
+
+static int
+TopK_compare(const void *a, const void *b)
+{
+    const TopKEntry * first = *(const TopKEntry **) a;
+    const TopKEntry * second = *(const TopKEntry **) b;
+    if (first->count != second->count)
+        return first->count > second->count ? -1 : 1;
+    size_t length = first->length < second->length ? first->length : second->length;
+    int result = memcmp(first->key, second->key, length);
+    if (result)
+        return result;
+    return (first->length > second->length) - (first->length < second->length);
+}
+
+void
+TopK_sorted(TopK *self, TopKEntry **entries)
+{
+    uint32_t i;
+    for (i = 0; i < self->size; i++)
+        entries[i] = &self->heap[i];
+    qsort(entries, self->size, sizeof(TopKEntry *), TopK_compare);
+}
+
+TopKEntry *
+TopK_copy_sorted(TopK *self, uint32_t n)
+{
+    TopKEntry ** entries = (TopKEntry **) malloc((self->size + 1) * sizeof(TopKEntry *));
+    if (!entries)
+        return NULL;
+    TopK_sorted(self, entries);
+    if (n > self->size)
+        n = self->size;
+
+    size_t keys_length = 0;
+    uint32_t i;
+    for (i = 0; i < n; i++)
+        keys_length += entries[i]->length;
+    TopKEntry * copy = (TopKEntry *) malloc(n * sizeof(TopKEntry) + keys_length + 1);
+    if (copy)
+    {
+        char * key = (char *) (copy + n);
+        for (i = 0; i < n; i++)
+        {
+            copy[i] = *entries[i];
+            memcpy(key, entries[i]->key, entries[i]->length);
+            copy[i].key = key;
+            key += entries[i]->length;
+        }
+    }
+    free(entries);
+    return copy;
+}
@@ -0,0 +1,68 @@
+//-----------------------------------------------------------------------------
+// Author: Filip Stefanak <f.stefanak@rare-technologies.com>
+// Copyright (C) 2017 Rare Technologies
+//
+// This code is distributed under the terms and conditions
+// from the MIT License (MIT).
+
+#ifndef TOPK_H
+#define TOPK_H
+
+#include <stddef.h>
+#include <stdint.h>
+
+/* A candidate heavy hitter: a copy of the key with its estimated count. */
+typedef struct {
+    char * key;
+    size_t length;
+    uint32_t hash;
+    uint32_t slot; // position in the index
+    long long count;
+} TopKEntry;
+
+/**
+  * Bounded set of the keys with the highest estimated counts: a min-heap of at most `capacity` entries,
+  * along with an open-addressing index of the keys into the heap.
+  * The structure does not use the Python API, so it can be updated without the GIL.
+  */
+typedef struct {
+    uint32_t capacity;
+    uint32_t size;
+    TopKEntry * heap; // heap[0] holds the lowest count
+    int32_t * index; // heap positions, -1 for an empty slot
+    uint32_t index_mask;
+    int lock; // taken by every access, as updates run without the GIL
+} TopK;
+
+/* Initializes an empty set of at most `capacity` keys. Returns 0 on success, -1 if memory runs out. */
+int TopK_init(TopK *self, uint32_t capacity);
+
+void TopK_dealloc(TopK *self);
+
+/* Removes all keys. */
+void TopK_clear(TopK *self);
+
+/**
+  * Records the current estimated count of a key, whose `hash` must not depend on anything but its content.
+  * The key is added if the set is not full yet or if its count is higher than the lowest count of the set,
+  * whose key is then evicted. Counts of keys already present only ever grow.
+  * Returns -1 if memory runs out (the key is skipped then), 0 otherwise.
+  */
+int TopK_offer(TopK *self, const char *key, size_t length, uint32_t hash, long long count);
+
+/* Replaces the count of the entry at position `i` of the heap. Call TopK_heapify once all counts are replaced. */
+void TopK_set_count(TopK *self, uint32_t i, long long count);
+
+/* Restores the order of the heap after its counts were replaced. */
+void TopK_heapify(TopK *self);
+
+/* Stores pointers to all `size` entries into `entries`, ordered by descending count (and by key for equal counts). */
+void TopK_sorted(TopK *self, TopKEntry **entries);
+
+/**
+  * Copies the (at most) `n` entries with the highest counts, ordered like TopK_sorted, along with their keys
+  * into a single allocation, which the caller frees. Returns NULL if memory runs out.
+  */
+TopKEntry * TopK_copy_sorted(TopK *self, uint32_t n);
+
+#endif
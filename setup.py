@@ -7,7 +7,7 @@
 # This code is distributed under the terms and conditions
 # from the MIT License (MIT).
 
-import sys, os, io
+import sys, os, io, shutil, tempfile
 
 if sys.version_info < (2, 7):
     raise ImportError("bounter requires python >= 2.7")
@@ -23,6 +23,32 @@ def read(fname):
     with io.open(name, encoding='utf-8') as readfile:
         return readfile.read()
 
+
+def zlib_options():
+    """Link the extensions with zlib if it is available, to read gzip compressed files natively."""
+    if os.environ.get('BOUNTER_ZLIB') == '0':
+        return {}
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        from distutils.ccompiler import new_compiler
+        from distutils.sysconfig import customize_compiler
+        compiler = new_compiler()
+        customize_compiler(compiler)
+        source = os.path.join(tmp_dir, 'zlib_check.c')
+        with open(source, 'w') as check:
+            check.write('#include <zlib.h>\nint main(void) { return gzbuffer(gzdopen(0, "rb"), 1 << 20); }\n')
+        objects = compiler.compile([source], output_dir=tmp_dir)
+        compiler.link_executable(objects, 'zlib_check', output_dir=tmp_dir, libraries=['z'])
+        found = True
+    except Exception:
+        found = False
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return {'define_macros': [('BOUNTER_ZLIB', '1')], 'libraries': ['z']} if found else {}
+
+
+zlib = zlib_options()
+
 setup(
     name='bounter',
     version='1.2.0',
@@ -30,10 +56,16 @@ setup(
     long_description=read('README.md'),
     long_description_content_type='text/markdown',
 
-    headers=['cbounter/hll.h', 'cbounter/murmur3.h'],
+    headers=['cbounter/hll.h', 'cbounter/murmur3.h', 'cbounter/keybuffer.h', 'cbounter/segment.h',
+             'cbounter/threads.h', 'cbounter/simd.h', 'cbounter/atomics.h',
+             'cbounter/topk.h', 'cbounter/filetokens.h'],
     ext_modules=[
-        Extension('bounter_cmsc', ['cbounter/cms_cmodule.c', 'cbounter/murmur3.c', 'cbounter/hll.c']),
-        Extension('bounter_htc', ['cbounter/ht_cmodule.c', 'cbounter/murmur3.c', 'cbounter/hll.c'])
+        Extension('bounter_cmsc', ['cbounter/cms_cmodule.c', 'cbounter/murmur3.c', 'cbounter/hll.c',
+                                   'cbounter/keybuffer.c', 'cbounter/segment.c', 'cbounter/threads.c',
+                                   'cbounter/simd.c', 'cbounter/topk.c', 'cbounter/filetokens.c'], **zlib),
+        Extension('bounter_htc', ['cbounter/ht_cmodule.c', 'cbounter/murmur3.c', 'cbounter/hll.c',
+                                  'cbounter/keybuffer.c', 'cbounter/segment.c', 'cbounter/simd.c',
+                                  'cbounter/filetokens.c'], **zlib)
     ],
     packages=find_packages(),
 